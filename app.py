@@ -1,29 +1,119 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, stream_template
+import logging
 import os
 from utils import *
+import async_search
+import json_logging
+import metrics
 
 app = Flask(__name__)
 
 
+# Time every request and the dependency calls it makes (see metrics), and decide whether it is logged
+@app.before_request
+def start_request_timing():
+    metrics.start_request()
+    json_logging.sample_request()
+
+@app.after_request
+def finish_request_timing(response):
+    timings = metrics.current_request()
+    if timings is None:
+        return response
+
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe((request.method, endpoint, str(response.status_code)), timings.elapsed())
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = timings.server_timing()
+    json_logging.log_event(logger, logging.INFO, 'request', f"{request.method} {request.path} {response.status_code}",
+                           method=request.method, endpoint=endpoint, status=response.status_code,
+                           **timings.summary())
+    return response
+
+@app.teardown_request
+def end_request_timing(error=None):
+    metrics.end_request()
+    json_logging.end_request()
+
+# Dependency and request latency histograms and cache counters of this worker, for Prometheus
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return app.response_class(metrics.render(cache_metric_lines()), mimetype='text/plain; version=0.0.4')
+
+
 # Home page that displays the upload and search interface
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', max_dimension=OCR_MAX_DIMENSION)
 
 @app.route('/upload', methods=['POST'])
 def upload_receipt():
     # Get the uploaded file (image of the receipt)
     file = request.files['file']
-    
+
+    # Retried uploads of a receipt get the receipt they already created, without storing or OCRing it again
+    existing_id, match, fingerprint = find_duplicate_upload(file)
+    if existing_id:
+        return jsonify({
+            "message": "Receipt already uploaded.",
+            "receipt_id": existing_id,
+            "duplicate": match,
+            "s3_url": f"https://{BUCKET_NAME}.s3.amazonaws.com/{receipt_image_key(existing_id)}"
+        })
+
     # Generate a unique identifier for the receipt (used for the S3 key)
     receipt_id = os.urandom(16).hex()
 
+    # Fix orientation, grayscale, downscale and recompress the image before it reaches S3 and Textract
+    try:
+        file = preprocess_upload(receipt_id, file)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     # Upload the receipt image to S3
     s3_url = upload_to_s3(receipt_id, file)  # Call the S3 utility function
+    record_upload_hashes(receipt_id, fingerprint)
 
     # Return a response indicating that the upload was successful
     return jsonify({
         "message": "Receipt uploaded successfully!",
+        "receipt_id": receipt_id,
+        "s3_url": s3_url
+    })
+
+# Issue a presigned POST policy so the browser uploads the image straight to S3
+@app.route('/upload/presign', methods=['POST'])
+def presign_upload():
+    payload = request.get_json(silent=True) or {}
+    receipt_id = os.urandom(16).hex()
+
+    try:
+        upload = create_upload_post(receipt_id, payload.get('content_type'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "receipt_id": receipt_id,
+        "url": upload['url'],
+        "fields": upload['fields']
+    })
+
+# Called by the browser once its direct upload to S3 succeeded
+@app.route('/upload/complete', methods=['POST'])
+def complete_upload():
+    payload = request.get_json(silent=True) or {}
+
+    try:
+        receipt_id, s3_url = record_upload(payload.get('receipt_id'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # A duplicate image is answered with the receipt that already has it
+    duplicate = receipt_id != payload.get('receipt_id')
+    return jsonify({
+        "message": "Receipt already uploaded." if duplicate else "Receipt uploaded successfully!",
+        "receipt_id": receipt_id,
+        "duplicate": duplicate,
         "s3_url": s3_url
     })
 
@@ -32,42 +122,76 @@ def search_receipt():
     #Get the search query from the user input
     search_query = request.form['query']
 
-    #Use OpenAI API to extract keywords from the query
-    keywords = extract_keywords_with_openai(search_query)
+    if ASYNC_SEARCH:
+        # Keyword extraction, DynamoDB lookups and URL signing run as coroutines on the shared event loop
+        keywords, results = async_search.search_receipts_sync(search_query)
+    else:
+        #Extract keywords locally, falling back to the (cached) OpenAI API for complex queries
+        keywords = extract_keywords(search_query)
+        results = None
 
     if not keywords:
         # If no keywords extracted, return an error message or empty results
         return render_template('results.html', results=[], message="No keywords found in the query.")
 
-    #Query DynamoDB for receipts containing the keywords
-    results = query_receipts_by_keywords(keywords)
+    if results is None:
+        #Query DynamoDB for receipts containing the keywords
+        results = search_receipts(keywords)
 
-    #Retrieve the S3 URLs for the matching receipts
-    for result in results:
-        receipt_id = result['receipt_id']
-        # Generate and add the S3 image URL to the result dictionary
-        result['image_url'] = get_receipt_image_url(receipt_id)
+        #Retrieve the S3 URLs for the matching receipts in one batch
+        attach_image_urls(results)
 
     #Render the search results page with the receipt images
     return render_template('results.html', results=results)
 
 
 
-# List all receipts
+def iter_receipts_with_image_urls(page_size):
+    # Fetch and sign one page at a time so only a page of receipts is held in memory
+    for page in iter_receipt_pages(page_size=page_size):
+        yield from attach_image_urls(page)
+
+
+# List receipts, one page at a time
 @app.route('/list', methods=['GET'])
 def list_receipts():
-    # Query DynamoDB to list all receipts
-    receipts = query_receipts()
-
-    #process receipts to include image URLs
-    for receipt in receipts:
-        receipt_id = receipt.get('receipt_id')
-        if receipt_id:
-            receipt['image_url'] = get_receipt_image_url(receipt_id)
-        else:
-            receipt['image_url'] = None  # Or handle accordingly
-
-    return render_template('list.html', receipts=receipts)
+    page_size = min(max(request.args.get('page_size', LIST_PAGE_SIZE, type=int), 1), MAX_LIST_PAGE_SIZE)
+
+    # Streaming mode renders the whole table, sending rows as each page is scanned
+    if request.args.get('stream'):
+        receipts = iter_receipts_with_image_urls(page_size)
+        return app.response_class(stream_template('list.html', receipts=receipts, page_size=page_size))
+
+    # Query DynamoDB for one page of receipts
+    try:
+        receipts, next_cursor = query_receipts_page(page_size, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    #process receipts to include image URLs (receipts without an ID get None)
+    attach_image_urls(receipts)
+
+    return render_template('list.html', receipts=receipts, next_cursor=next_cursor, page_size=page_size)
+
+# Full text of one receipt, loaded when it is opened (pages only carry a preview in the compact layout)
+@app.route('/receipts/<receipt_id>/text', methods=['GET'])
+def receipt_text(receipt_id):
+    if not RECEIPT_ID_PATTERN.match(receipt_id):
+        return jsonify({"error": "Invalid receipt ID."}), 400
+    raw_text = get_receipt_text(receipt_id)
+    if raw_text is None:
+        return jsonify({"error": "Receipt not found."}), 404
+    return jsonify({"receipt_id": receipt_id, "raw_text": raw_text})
+
+# Spend and receipt counts from the precomputed rollups, e.g. /stats?q=starbucks+september or ?merchant=starbucks&from=2024-01
+@app.route('/stats', methods=['GET'])
+def spend_stats():
+    try:
+        stats = query_stats(request.args.get('q'), request.args.get('merchant'), request.args.get('from'),
+                            request.args.get('to'), request.args.get('group', 'month'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(stats)
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,88 @@
+"""
+A long-lived asyncio event loop for the sync Flask workers.
+
+Flask's own async views start a new event loop for every request, so pooled
+async clients (httpx connection pools) could never be reused across requests.
+Instead one loop runs in a daemon thread for the life of the process; request
+threads submit coroutines to it with run() and block until they finish.
+Blocking boto3 calls made from coroutines run on the loop's default executor,
+sized with ASYNC_IO_WORKERS to match the botocore connection pool.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads available to blocking (boto3) calls made from coroutines; keep at or below AWS_MAX_POOL_CONNECTIONS (aws_clients)
+ASYNC_IO_WORKERS = int(os.getenv('ASYNC_IO_WORKERS', '10'))
+# Longest a request thread waits for a coroutine
+ASYNC_TIMEOUT = float(os.getenv('ASYNC_TIMEOUT', '30'))
+
+
+class EventLoopThread:
+    """
+    An event loop running forever in a daemon thread.
+
+    Args:
+        io_workers (int): Size of the loop's default executor.
+    """
+
+    def __init__(self, io_workers=ASYNC_IO_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=io_workers,
+                                                          thread_name_prefix='async-io'))
+        self._thread = threading.Thread(target=self.loop.run_forever, name='event-loop', daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine, timeout=ASYNC_TIMEOUT):
+        """
+        Run a coroutine on the loop and wait for its result.
+
+        Args:
+            coroutine: The coroutine to run.
+            timeout (float): Seconds to wait before cancelling it.
+
+        Returns:
+            The coroutine's result.
+
+        Raises:
+            TimeoutError: If the coroutine didn't finish in time.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def close(self):
+        """
+        Stop the loop and its executor.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_event_loop_thread():
+    """
+    Get the process-wide event loop thread, starting it on first use.
+    """
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = EventLoopThread()
+    return _runtime
+
+
+def run(coroutine, timeout=ASYNC_TIMEOUT):
+    """
+    Run a coroutine on the process-wide event loop and wait for its result.
+    """
+    return get_event_loop_thread().run(coroutine, timeout)
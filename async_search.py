@@ -0,0 +1,156 @@
+"""
+Async request path for /search.
+
+The sync path waits on each step in turn: keyword extraction, then one
+DynamoDB request after another (a posting list per token, a batch get per
+100 receipts, a query per date range). Here the same steps run as
+coroutines on the async_runtime event loop:
+
+- OpenAI is called over a pooled httpx connection (utils.extract_keywords_with_openai_async)
+- the independent DynamoDB requests of a search are issued concurrently,
+  each in the loop's executor (boto3 is blocking; its clients are thread-safe
+  and pool connections)
+- image URLs are signed for the whole result set at once, in memory
+
+search_receipts_sync is the entry point for Flask's sync views.
+"""
+import asyncio
+
+import async_runtime
+import keyword_index
+import receipt_fields
+import receipt_storage
+import utils
+from tokenizer import tokenize
+
+
+async def find_receipt_ids_async(keywords):
+    """
+    Fetch every keyword token's posting list concurrently and intersect them.
+
+    Args:
+        keywords (list): Keywords to match.
+
+    Returns:
+        set: Receipt IDs matching all keyword tokens.
+    """
+    tokens = list(dict.fromkeys(token for keyword in keywords for token in tokenize(keyword)))
+    if not tokens:
+        return set()
+
+    postings = await asyncio.gather(*(
+        asyncio.to_thread(keyword_index.get_posting_list, utils.get_keyword_index_table(), token) for token in tokens
+    ))
+    return set.intersection(*postings)
+
+
+async def batch_get_receipts_async(receipt_ids):
+    """
+    Fetch receipt items by ID, with the 100-key batches in flight concurrently.
+
+    Returns:
+        list: Receipt items, ordered by receipt ID.
+    """
+    receipt_ids = sorted(receipt_ids)
+    limit = keyword_index.BATCH_GET_LIMIT
+    chunks = await asyncio.gather(*(
+        asyncio.to_thread(keyword_index.batch_get_receipts, utils.get_dynamodb(), utils.TABLE_NAME,
+                          receipt_ids[start:start + limit])
+        for start in range(0, len(receipt_ids), limit)
+    ))
+    items = [item for chunk in chunks for item in chunk]
+    items.sort(key=lambda item: item['receipt_id'])
+    return items
+
+
+async def query_receipts_by_fields_async(plan):
+    """
+    Run the GSI queries of a structured query plan concurrently.
+
+    Returns:
+        list: Matching receipts, in the same order as utils.query_receipts_by_fields.
+    """
+    results = await asyncio.gather(*(
+        asyncio.to_thread(utils.run_query, query_kwargs) for query_kwargs in utils.field_queries(plan)
+    ))
+    receipts = [item for items in results for item in items]
+    if receipt_storage.COMPACT_STORAGE and plan.keywords:
+        # Fetches the candidates' texts
+        return await asyncio.to_thread(utils.filter_field_results, receipts, plan)
+    return receipts
+
+
+async def search_receipts_async(keywords):
+    """
+    Coroutine version of utils.search_receipts.
+
+    Args:
+        keywords (list): Keywords extracted from the user's query.
+
+    Returns:
+        list: Matching receipt items.
+    """
+    if utils.STRUCTURED_SEARCH:
+        plan = receipt_fields.plan_query(keywords, utils.MERCHANTS)
+        if plan.indexed:
+            receipts = await query_receipts_by_fields_async(plan)
+            if not utils.needs_backend_search(plan, receipts):
+                return receipts
+            return utils.merge_receipts(receipts, await search_receipts_by_backend_async(keywords))
+    return await search_receipts_by_backend_async(keywords)
+
+
+async def search_receipts_by_backend_async(keywords):
+    """
+    Coroutine version of utils.search_receipts_by_backend.
+
+    Args:
+        keywords (list): Keywords extracted from the user's query.
+
+    Returns:
+        list: Matching receipt items.
+    """
+    if utils.SEARCH_BACKEND == 'scan':
+        # The parallel scan already fans out over segments
+        return await asyncio.to_thread(utils.query_receipts_by_keywords, keywords)
+    if utils.SEARCH_BACKEND == 'bm25':
+        # In memory and fast, not worth a thread hop
+        results = utils.text_index.search(keywords)
+        if results is not None:
+            return results
+    if utils.SEARCH_BACKEND == 'vector':
+        results = await asyncio.to_thread(utils.query_receipts_by_vector, keywords)
+        if results is not None:
+            return results
+
+    if not await asyncio.to_thread(utils.keyword_index_ready):
+        return await asyncio.to_thread(utils.query_receipts_by_keywords, keywords)
+    receipt_ids = await find_receipt_ids_async(keywords)
+    if not receipt_ids:
+        return []
+    return await batch_get_receipts_async(receipt_ids)
+
+
+async def search(query):
+    """
+    Run a whole /search request: extract keywords, find receipts and sign their image URLs.
+
+    Args:
+        query (str): The user's search query.
+
+    Returns:
+        tuple: (keywords, receipts with image URLs attached).
+    """
+    keywords = await utils.keyword_pipeline.extract_async(query)
+    if not keywords:
+        return keywords, []
+    results = await search_receipts_async(keywords)
+    # Signing is in-memory HMAC work on cached keys, one batch for the whole result set
+    return keywords, utils.attach_image_urls(results)
+
+
+def search_receipts_sync(query):
+    """
+    Run search(query) on the shared event loop from a sync (Flask) thread.
+    """
+    return async_runtime.run(search(query))
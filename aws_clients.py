@@ -0,0 +1,79 @@
+"""
+Shared botocore settings and lazily built, memoized AWS clients.
+
+Building a boto3 client or resource loads and parses its service model, a
+few hundred milliseconds for S3 plus DynamoDB. utils and the ingest Lambda
+used to do that at import, so every gunicorn worker, every test run and
+every Lambda cold start paid for it (and needed credentials and a region
+just to import). They now build each client on first use with
+get_or_create, which memoizes it in the calling module's globals:
+
+- the first caller builds it under a lock, concurrent callers wait and reuse it
+- a client assigned or patched into the module (tests, benchmark stubs)
+  is returned as is
+
+All clients share client_config(): a connection pool sized for the request
+threads and the async executor, the 'standard' retry mode (exponential
+backoff with jitter on throttling and transient errors) and TCP keepalive,
+so idle pooled connections to S3 and DynamoDB aren't silently dropped.
+"""
+import os
+import threading
+
+from botocore.config import Config
+
+# Connections pooled per client; botocore defaults to 10, below gunicorn's threads plus the async executor
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '32'))
+# 'standard' or 'adaptive' (adds client-side rate limiting when throttled)
+AWS_RETRY_MODE = os.getenv('AWS_RETRY_MODE', 'standard')
+# Attempts per request, including the first one
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', '3'))
+# Seconds; botocore waits 60 for both by default
+AWS_CONNECT_TIMEOUT = float(os.getenv('AWS_CONNECT_TIMEOUT', '5'))
+AWS_READ_TIMEOUT = float(os.getenv('AWS_READ_TIMEOUT', '60'))
+
+# Reentrant: building a table builds the DynamoDB resource first
+_lock = threading.RLock()
+
+
+def client_config(**overrides):
+    """
+    Build the botocore Config shared by the app's and the Lambda's clients.
+
+    Args:
+        **overrides: Config options replacing the defaults (e.g. max_pool_connections).
+
+    Returns:
+        botocore.config.Config: The client configuration.
+    """
+    options = {
+        'max_pool_connections': AWS_MAX_POOL_CONNECTIONS,
+        'retries': {'mode': AWS_RETRY_MODE, 'max_attempts': AWS_MAX_ATTEMPTS},
+        'tcp_keepalive': True,
+        'connect_timeout': AWS_CONNECT_TIMEOUT,
+        'read_timeout': AWS_READ_TIMEOUT,
+    }
+    options.update(overrides)
+    return Config(**options)
+
+
+def get_or_create(namespace, name, factory):
+    """
+    Get namespace[name], building it with factory() on first use.
+
+    Args:
+        namespace (dict): Where the object is memoized, usually the calling module's globals().
+        name (str): Key of the object in namespace.
+        factory (callable): Builds the object; called at most once per namespace and name.
+
+    Returns:
+        The memoized object.
+    """
+    value = namespace.get(name)
+    if value is None:
+        with _lock:
+            value = namespace.get(name)
+            if value is None:
+                value = factory()
+                namespace[name] = value
+    return value
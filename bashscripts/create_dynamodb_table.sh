@@ -29,4 +29,201 @@ if [[ $existing_tables != *"$TABLE_NAME"* ]]; then
   fi
 else
   echo "Table '$TABLE_NAME' already exists."
-fi
\ No newline at end of file
+fi
+
+# Sparse GSIs over the structured fields (merchant, receipt_date, receipt_month) set by the ingest Lambda
+existing_indexes=$(aws dynamodb describe-table --table-name $TABLE_NAME --region $REGION \
+  --query "Table.GlobalSecondaryIndexes[].IndexName" --output text)
+
+for index_spec in "merchant-date-index:merchant" "month-date-index:receipt_month"; do
+  INDEX_NAME="${index_spec%%:*}"
+  HASH_KEY="${index_spec##*:}"
+
+  if [[ $existing_indexes != *"$INDEX_NAME"* ]]; then
+    echo "Index '$INDEX_NAME' does not exist. Creating now..."
+
+    # DynamoDB only accepts one GSI creation per update-table call, so wait for each to become ACTIVE
+    update_table_output=$(aws dynamodb update-table \
+      --table-name $TABLE_NAME \
+      --attribute-definitions AttributeName=$HASH_KEY,AttributeType=S AttributeName=receipt_date,AttributeType=S \
+      --global-secondary-index-updates "[{\"Create\": {\"IndexName\": \"$INDEX_NAME\", \"KeySchema\": [{\"AttributeName\": \"$HASH_KEY\", \"KeyType\": \"HASH\"}, {\"AttributeName\": \"receipt_date\", \"KeyType\": \"RANGE\"}], \"Projection\": {\"ProjectionType\": \"ALL\"}, \"ProvisionedThroughput\": {\"ReadCapacityUnits\": 5, \"WriteCapacityUnits\": 5}}}]" \
+      --region $REGION \
+      2>&1)
+
+    if [ $? -eq 0 ]; then
+      echo "Index '$INDEX_NAME' is being created..."
+      until [[ $(aws dynamodb describe-table --table-name $TABLE_NAME --region $REGION \
+        --query "Table.GlobalSecondaryIndexes[?IndexName=='$INDEX_NAME'].IndexStatus" --output text) == "ACTIVE" ]]; do
+        sleep 10
+      done
+      echo "Index '$INDEX_NAME' created successfully."
+    else
+      echo "Failed to create index '$INDEX_NAME'. Error:"
+      echo "$update_table_output"
+      exit 1
+    fi
+  else
+    echo "Index '$INDEX_NAME' already exists."
+  fi
+done
+echo "Run 'python receipt_fields.py backfill' to add structured fields to existing receipts."
+
+# Hourly ingest_bucket partitions sorted by ingested_at, queried by the app's index refreshes (see search_engine.py)
+create_ingest_time_index() {
+  local table_name=$1 throughput=$2
+  local table_indexes=$(aws dynamodb describe-table --table-name $table_name --region $REGION \
+    --query "Table.GlobalSecondaryIndexes[].IndexName" --output text)
+
+  if [[ $table_indexes == *"ingest-time-index"* ]]; then
+    echo "Index 'ingest-time-index' already exists on '$table_name'."
+    return
+  fi
+  echo "Index 'ingest-time-index' does not exist on '$table_name'. Creating now..."
+  update_table_output=$(aws dynamodb update-table \
+    --table-name $table_name \
+    --attribute-definitions AttributeName=ingest_bucket,AttributeType=N AttributeName=ingested_at,AttributeType=N \
+    --global-secondary-index-updates "[{\"Create\": {\"IndexName\": \"ingest-time-index\", \"KeySchema\": [{\"AttributeName\": \"ingest_bucket\", \"KeyType\": \"HASH\"}, {\"AttributeName\": \"ingested_at\", \"KeyType\": \"RANGE\"}], \"Projection\": {\"ProjectionType\": \"ALL\"}$throughput}}]" \
+    --region $REGION \
+    2>&1)
+
+  if [ $? -eq 0 ]; then
+    echo "Index 'ingest-time-index' is being created on '$table_name'..."
+    until [[ $(aws dynamodb describe-table --table-name $table_name --region $REGION \
+      --query "Table.GlobalSecondaryIndexes[?IndexName=='ingest-time-index'].IndexStatus" --output text) == "ACTIVE" ]]; do
+      sleep 10
+    done
+    echo "Index 'ingest-time-index' created successfully on '$table_name'."
+  else
+    echo "Failed to create index 'ingest-time-index' on '$table_name'. Error:"
+    echo "$update_table_output"
+    exit 1
+  fi
+}
+
+create_ingest_time_index $TABLE_NAME ', "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}'
+
+# Stream of new item images, followed by the app's receipt cache (RECEIPT_CACHE_SOURCE=stream)
+stream_enabled=$(aws dynamodb describe-table --table-name $TABLE_NAME --region $REGION \
+  --query "Table.StreamSpecification.StreamEnabled" --output text)
+
+if [[ $stream_enabled != "True" ]]; then
+  echo "Enabling the stream on '$TABLE_NAME'..."
+  update_table_output=$(aws dynamodb update-table \
+    --table-name $TABLE_NAME \
+    --stream-specification StreamEnabled=true,StreamViewType=NEW_IMAGE \
+    --region $REGION \
+    2>&1)
+
+  if [ $? -eq 0 ]; then
+    echo "Stream enabled on '$TABLE_NAME'."
+  else
+    echo "Failed to enable the stream on '$TABLE_NAME'. Error:"
+    echo "$update_table_output"
+    exit 1
+  fi
+else
+  echo "Stream already enabled on '$TABLE_NAME'."
+fi
+
+# Inverted keyword index (token -> receipt_id) written by the ingest Lambda
+INDEX_TABLE_NAME="ReceiptKeywords"
+
+if [[ $existing_tables != *"$INDEX_TABLE_NAME"* ]]; then
+  echo "Table '$INDEX_TABLE_NAME' does not exist. Creating now..."
+
+  create_table_output=$(aws dynamodb create-table \
+    --table-name $INDEX_TABLE_NAME \
+    --attribute-definitions AttributeName=token,AttributeType=S AttributeName=receipt_id,AttributeType=S \
+    --key-schema AttributeName=token,KeyType=HASH AttributeName=receipt_id,KeyType=RANGE \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    2>&1)
+
+  if [ $? -eq 0 ]; then
+    echo "Table '$INDEX_TABLE_NAME' created successfully."
+    echo "Run 'python keyword_index.py backfill' to index existing receipts."
+  else
+    echo "Failed to create table '$INDEX_TABLE_NAME'. Error:"
+    echo "$create_table_output"
+    exit 1
+  fi
+else
+  echo "Table '$INDEX_TABLE_NAME' already exists."
+fi
+
+# Content hashes of stored receipt images (hash_key -> receipt_id), used to skip duplicate uploads
+HASHES_TABLE_NAME="ReceiptHashes"
+
+if [[ $existing_tables != *"$HASHES_TABLE_NAME"* ]]; then
+  echo "Table '$HASHES_TABLE_NAME' does not exist. Creating now..."
+
+  create_table_output=$(aws dynamodb create-table \
+    --table-name $HASHES_TABLE_NAME \
+    --attribute-definitions AttributeName=hash_key,AttributeType=S \
+    --key-schema AttributeName=hash_key,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    2>&1)
+
+  if [ $? -eq 0 ]; then
+    echo "Table '$HASHES_TABLE_NAME' created successfully."
+  else
+    echo "Failed to create table '$HASHES_TABLE_NAME'. Error:"
+    echo "$create_table_output"
+    exit 1
+  fi
+else
+  echo "Table '$HASHES_TABLE_NAME' already exists."
+fi
+
+# Compressed full texts of receipts in the compact storage layout (see receipt_storage.py)
+TEXTS_TABLE_NAME="ReceiptTexts"
+
+if [[ $existing_tables != *"$TEXTS_TABLE_NAME"* ]]; then
+  echo "Table '$TEXTS_TABLE_NAME' does not exist. Creating now..."
+
+  create_table_output=$(aws dynamodb create-table \
+    --table-name $TEXTS_TABLE_NAME \
+    --attribute-definitions AttributeName=receipt_id,AttributeType=S \
+    --key-schema AttributeName=receipt_id,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    2>&1)
+
+  if [ $? -eq 0 ]; then
+    echo "Table '$TEXTS_TABLE_NAME' created successfully."
+  else
+    echo "Failed to create table '$TEXTS_TABLE_NAME'. Error:"
+    echo "$create_table_output"
+    exit 1
+  fi
+else
+  echo "Table '$TEXTS_TABLE_NAME' already exists."
+fi
+# The vector index refreshes from ReceiptTexts in the compact layout
+create_ingest_time_index $TEXTS_TABLE_NAME ''
+
+# Spend per merchant per month and counts per day, for /stats (see receipt_stats.py)
+STATS_TABLE_NAME="ReceiptStats"
+
+if [[ $existing_tables != *"$STATS_TABLE_NAME"* ]]; then
+  echo "Table '$STATS_TABLE_NAME' does not exist. Creating now..."
+
+  create_table_output=$(aws dynamodb create-table \
+    --table-name $STATS_TABLE_NAME \
+    --attribute-definitions AttributeName=rollup,AttributeType=S AttributeName=period,AttributeType=S \
+    --key-schema AttributeName=rollup,KeyType=HASH AttributeName=period,KeyType=RANGE \
+    --billing-mode PAY_PER_REQUEST \
+    --region $REGION \
+    2>&1)
+
+  if [ $? -eq 0 ]; then
+    echo "Table '$STATS_TABLE_NAME' created successfully."
+  else
+    echo "Failed to create table '$STATS_TABLE_NAME'. Error:"
+    echo "$create_table_output"
+    exit 1
+  fi
+else
+  echo "Table '$STATS_TABLE_NAME' already exists."
+fi
@@ -17,3 +17,20 @@ then
 else
     echo "Bucket '$BUCKET_NAME' already exists."
 fi
+
+# Allow browsers to upload receipts directly with presigned POST policies issued by /upload/presign
+aws s3api put-bucket-cors \
+    --bucket $BUCKET_NAME \
+    --region $REGION \
+    --cors-configuration '{
+      "CORSRules": [
+        {
+          "AllowedOrigins": ["*"],
+          "AllowedMethods": ["POST"],
+          "AllowedHeaders": ["*"],
+          "MaxAgeSeconds": 3000
+        }
+      ]
+    }'
+
+echo "CORS configuration applied to bucket '$BUCKET_NAME'."
@@ -6,10 +6,16 @@ ROLE_NAME="ReceiptProcessorRole"                     # Name of your IAM role
 S3_BUCKET_NAME="my-receipt-manager-bucket"           # Your S3 bucket name
 LAMBDA_HANDLER="lambda_function.lambda_handler"      # The handler function in lambda_function.py
 DYNAMODB_TABLE="Receipts"                            # Your DynamoDB table name
+KEYWORD_INDEX_TABLE="ReceiptKeywords"                # Inverted keyword index table
+RECEIPT_HASHES_TABLE="ReceiptHashes"                 # Content hashes of stored images, for dedup
+RECEIPT_TEXTS_TABLE="ReceiptTexts"                   # Compressed receipt texts, for the compact layout
+RECEIPT_STATS_TABLE="ReceiptStats"                   # Spend and count rollups, for /stats
+RECEIPT_STORAGE="inline"                             # "inline" or "compact" (see receipt_storage.py)
 LAMBDA_RUNTIME="python3.11"                          # Lambda runtime version
 LAMBDA_REGION="ap-southeast-2"                       # AWS region
 ZIP_FILE_NAME="lambda_function.zip"                  # Name of the deployment ZIP file
 PACKAGE_DIR="lambda_package"                         # Directory to hold the Lambda package files
+LAMBDA_MODULES="lambda_function.py aws_clients.py dedup.py json_logging.py metrics.py embeddings.py tokenizer.py keyword_index.py parallel_scan.py textract_modes.py textract_parser.py merchants.py receipt_fields.py receipt_stats.py receipt_storage.py thumbnails.py"  # Modules shipped in the Lambda package
 
 # Step 1: Create IAM Role for Lambda (if it doesn't exist)
 echo "Creating IAM Role for Lambda function..."
@@ -59,8 +65,13 @@ sleep 20
 
 # Step 4: Create Lambda Deployment Package
 echo "Creating Lambda deployment package..."
+# Built from the shared modules on every deploy, never a stale copy
+rm -rf $PACKAGE_DIR $ZIP_FILE_NAME
 mkdir -p $PACKAGE_DIR
-cp lambda_function.py $PACKAGE_DIR/
+cp $LAMBDA_MODULES $PACKAGE_DIR/
+# Pillow (for thumbnails) built for the Lambda runtime
+pip install --target $PACKAGE_DIR --platform manylinux2014_x86_64 --python-version 3.11 \
+  --only-binary=:all: pillow==10.4.0
 cd $PACKAGE_DIR
 zip -r ../$ZIP_FILE_NAME .
 cd ..
@@ -76,7 +87,7 @@ CREATE_RESPONSE=$(aws lambda create-function \
   --timeout 120 \
   --memory-size 512 \
   --region $LAMBDA_REGION \
-  --environment Variables="{DYNAMODB_TABLE=$DYNAMODB_TABLE,S3_BUCKET_NAME=$S3_BUCKET_NAME}" \
+  --environment Variables="{DYNAMODB_TABLE=$DYNAMODB_TABLE,S3_BUCKET_NAME=$S3_BUCKET_NAME,KEYWORD_INDEX_TABLE=$KEYWORD_INDEX_TABLE,RECEIPT_HASHES_TABLE=$RECEIPT_HASHES_TABLE,RECEIPT_TEXTS_TABLE=$RECEIPT_TEXTS_TABLE,RECEIPT_STATS_TABLE=$RECEIPT_STATS_TABLE,RECEIPT_STORAGE=$RECEIPT_STORAGE,TEXTRACT_WORKERS=4,TEXTRACT_MODE=text}" \
   2>&1)
 
 # Check if the Lambda function was created successfully
@@ -0,0 +1,128 @@
+"""
+Shared helpers for the benchmark scripts: synthetic receipt corpora and
+local DynamoDB tables (moto by default, or DynamoDB Local via --endpoint-url).
+"""
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+# Make the application modules importable when running `python benchmarks/<script>.py`
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+import boto3
+
+REGION = 'ap-southeast-2'
+
+MERCHANTS = [
+    'starbucks', 'woolworths', 'coles', 'aldi', 'bunnings', 'kmart', 'target', 'big w',
+    "mcdonald's", 'subway', 'officeworks', 'jb hi-fi', 'chemist warehouse', 'dan murphys',
+    'ikea', 'harvey norman', 'priceline', 'iga', 'seven eleven', 'ampol',
+]
+PRODUCTS = [
+    'milk', 'bread', 'eggs', 'coffee', 'latte', 'flat white', 'bananas', 'apples', 'cheese',
+    'butter', 'rice', 'pasta', 'chicken', 'beef', 'paper towel', 'batteries', 'printer ink',
+    'notebook', 'shampoo', 'toothpaste', 'wine', 'beer', 'fuel', 'sandwich', 'muffin',
+    'drill', 'screws', 'paint', 'light bulb', 'headphones', 'hdmi cable', 'vitamins',
+]
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+          'september', 'october', 'november', 'december']
+
+
+def synthetic_receipt(rng, receipt_id):
+    """
+    Build a receipt item whose raw_text looks like lowercased Textract LINE output.
+    """
+    merchant = rng.choice(MERCHANTS)
+    month = rng.randint(1, 12)
+    day = rng.randint(1, 28)
+    lines = [merchant, f"tax invoice {rng.randint(1000, 99999)}", f"{day:02d}/{month:02d}/2024"]
+    total = 0.0
+    for _ in range(rng.randint(2, 8)):
+        price = round(rng.uniform(1, 60), 2)
+        total += price
+        lines.append(f"{rng.choice(PRODUCTS)} ${price:.2f}")
+    lines.append(f"total ${total:.2f}")
+    lines.append(f"thank you for shopping at {merchant}")
+    return {'receipt_id': receipt_id, 'raw_text': "\n".join(lines)}
+
+
+def synthetic_receipts(count, seed=0):
+    """
+    Yield `count` deterministic synthetic receipts.
+    """
+    rng = random.Random(seed)
+    for index in range(count):
+        yield synthetic_receipt(rng, f"{index:032x}")
+
+
+@contextmanager
+def local_dynamodb(endpoint_url=None):
+    """
+    Yield a DynamoDB resource backed by moto, or by DynamoDB Local when endpoint_url is given.
+    """
+    os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+    if endpoint_url:
+        yield boto3.resource('dynamodb', region_name=REGION, endpoint_url=endpoint_url)
+        return
+
+    from moto import mock_aws
+    with mock_aws():
+        yield boto3.resource('dynamodb', region_name=REGION)
+
+
+def create_table(dynamodb, name, hash_key, range_key=None):
+    """
+    Create an on-demand table with string keys and wait until it exists.
+    """
+    attributes = [{'AttributeName': hash_key, 'AttributeType': 'S'}]
+    key_schema = [{'AttributeName': hash_key, 'KeyType': 'HASH'}]
+    if range_key:
+        attributes.append({'AttributeName': range_key, 'AttributeType': 'S'})
+        key_schema.append({'AttributeName': range_key, 'KeyType': 'RANGE'})
+
+    table = dynamodb.create_table(
+        TableName=name,
+        AttributeDefinitions=attributes,
+        KeySchema=key_schema,
+        BillingMode='PAY_PER_REQUEST',
+    )
+    table.wait_until_exists()
+    return table
+
+
+def load_items(table, items):
+    """
+    Write items through a batch writer and return how many were written.
+    """
+    count = 0
+    with table.batch_writer() as writer:
+        for item in items:
+            writer.put_item(Item=item)
+            count += 1
+    return count
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def time_call(fn, *args, **kwargs):
+    """
+    Call fn and return (result, elapsed_seconds).
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
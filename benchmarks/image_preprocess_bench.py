@@ -0,0 +1,86 @@
+"""
+Benchmark receipt image preprocessing: bytes saved and throughput per core.
+
+    python benchmarks/image_preprocess_bench.py --images 24 --workers 1 2 4
+
+Synthetic "phone photos" are rendered at camera resolution (12 MP by
+default): a receipt of text lines on a noisy, colored background, saved as a
+high-quality JPEG the way phones do, and some as PNG. Each is run through
+image_preprocess.preprocess_image serially to get the single-core rate, then
+through a process pool with each worker count.
+"""
+import argparse
+import io
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from common import MERCHANTS, PRODUCTS
+from image_preprocess import JPEG_QUALITY, OCR_MAX_DIMENSION, preprocess_image
+
+
+def synthetic_photo(rng, width, height, format):
+    # Warm background with sensor-like noise, which is what makes real photos compress poorly
+    noise = Image.effect_noise((width // 4, height // 4), 40).resize((width, height))
+    background = Image.merge('RGB', (noise.point(lambda v: min(255, v + 60)), noise, noise.point(lambda v: v // 2)))
+    margin = width // 6
+    paper = Image.new('RGB', (width - 2 * margin, height - margin), (245, 243, 236))
+    draw = ImageDraw.Draw(paper)
+    lines = [rng.choice(MERCHANTS).upper(), 'TAX INVOICE'] + [
+        f"{rng.choice(PRODUCTS)}  ${rng.uniform(1, 50):.2f}" for _ in range(40)]
+    for number, line in enumerate(lines):
+        draw.text((40, 40 + number * (paper.height - 80) // len(lines)), line, fill=(20, 20, 20))
+    background.paste(paper.filter(ImageFilter.GaussianBlur(0.6)), (margin, margin // 2))
+
+    output = io.BytesIO()
+    if format == 'JPEG':
+        background.save(output, format='JPEG', quality=95)
+    else:
+        background.save(output, format='PNG')
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=24)
+    parser.add_argument('--width', type=int, default=3024)
+    parser.add_argument('--height', type=int, default=4032)
+    parser.add_argument('--png-ratio', type=float, default=0.25, help="Share of uploads that are PNG screenshots.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--max-dimension', type=int, default=OCR_MAX_DIMENSION)
+    parser.add_argument('--quality', type=int, default=JPEG_QUALITY)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    images = [synthetic_photo(rng, args.width, args.height, 'PNG' if rng.random() < args.png_ratio else 'JPEG')
+              for _ in range(args.images)]
+
+    start = time.perf_counter()
+    results = [preprocess_image(data, args.max_dimension, args.quality) for data in images]
+    serial_seconds = time.perf_counter() - start
+
+    original = sum(info['original_bytes'] for _, info in results)
+    processed = sum(info['bytes'] for _, info in results)
+    print(f"images: {len(images)} at {args.width}x{args.height}, max dimension {args.max_dimension}, "
+          f"quality {args.quality}")
+    print(f"original: {original / len(images) / 1024:.0f} KB avg, processed: {processed / len(images) / 1024:.0f} KB avg, "
+          f"saved {100 * (1 - processed / original):.1f}% ({(original - processed) / 1024 / 1024:.1f} MB)")
+    print(f"serial: {len(images) / serial_seconds:.2f} images/s per core "
+          f"({serial_seconds / len(images) * 1000:.0f} ms/image)")
+
+    print(f"{'workers':>8}{'images/s':>10}{'per core':>10}")
+    for workers in args.workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Warm the workers up so process start-up isn't measured
+            list(pool.map(preprocess_image, images[:workers]))
+            start = time.perf_counter()
+            list(pool.map(preprocess_image, images, [args.max_dimension] * len(images),
+                          [args.quality] * len(images)))
+            seconds = time.perf_counter() - start
+        print(f"{workers:>8}{len(images) / seconds:>10.2f}{len(images) / seconds / workers:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
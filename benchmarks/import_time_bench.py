@@ -0,0 +1,90 @@
+"""
+Measure import time and cold start of the Flask app and the ingest Lambda.
+
+    python benchmarks/import_time_bench.py --runs 10
+
+Every run is a fresh interpreter (a new gunicorn worker or Lambda execution
+environment without preloading), timing:
+
+    import        `import app` / `import lambda_function`, dependencies included
+    first call    the first request (GET / on the app's test client) or the
+                  first invocation (lambda_handler on an empty event)
+    clients       building the AWS clients the first real request needs, which
+                  happens on first use rather than at import
+    process       interpreter start to exit, as seen from the parent
+
+The sum of import and clients is what the old eager modules spent before
+they could serve anything. Nothing talks to AWS: the clients are built with
+dummy credentials and never called. Run `python -X importtime -c "import app"`
+for the per-module breakdown.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import ROOT_DIR
+
+PROBES = {
+    'app': '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.config['TESTING'] = True
+app.app.test_client().get('/')
+first_call = time.perf_counter()
+import utils
+utils.get_s3(); utils.get_presigner(); utils.get_table(); utils.get_keyword_index_table()
+clients = time.perf_counter()
+json.dump({'import': imported - start, 'first call': first_call - imported, 'clients': clients - first_call}, sys.stdout)
+''',
+    'lambda': '''
+import json, sys, time
+start = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+lambda_function.lambda_handler({'Records': []}, None)
+first_call = time.perf_counter()
+lambda_function.get_textract(); lambda_function.get_s3(); lambda_function.get_keyword_index_table()
+clients = time.perf_counter()
+json.dump({'import': imported - start, 'first call': first_call - imported, 'clients': clients - first_call}, sys.stdout)
+''',
+}
+PHASES = ('import', 'first call', 'clients', 'process')
+
+
+def run_probe(probe, env):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', probe], cwd=ROOT_DIR, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings['process'] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--target', choices=sorted(PROBES), action='append',
+                        help="Module to measure, repeatable (default: both).")
+    args = parser.parse_args()
+
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.getenv('AWS_DEFAULT_REGION', 'ap-southeast-2'),
+               AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark')
+
+    print(f"{'target':>8}" + ''.join(f"{phase + ' ms':>15}" for phase in PHASES))
+    for target in args.target or sorted(PROBES):
+        # One untimed run so every module has compiled bytecode on disk
+        run_probe(PROBES[target], env)
+        runs = [run_probe(PROBES[target], env) for _ in range(args.runs)]
+        print(f"{target:>8}" + ''.join(
+            f"{statistics.median(run[phase] for run in runs) * 1000:>15.1f}" for phase in PHASES
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare /search keyword extraction latency: OpenAI only vs the local fast path + OpenAI.
+
+    python benchmarks/keyword_extraction_bench.py --openai-latency-ms 400 --queries 200
+
+OpenAI is replaced by a stub with a configurable latency (log-normal jitter
+around the given median), so the numbers show how much of the corpus the
+local extractor answers on its own and what that does to p50/p99.
+"""
+import argparse
+import random
+import time
+
+from common import MERCHANTS, MONTHS, PRODUCTS, percentile
+from keyword_extraction import CallableKeywordExtractor, KeywordExtractionPipeline, LocalKeywordExtractor
+
+COMPLEX_TEMPLATES = [
+    "how much did I spend at {merchant} last month",
+    "what was my most expensive {product} purchase this year",
+    "receipts between {month} and {other_month} over $50",
+    "show me {merchant} receipts from last week",
+]
+SIMPLE_TEMPLATES = [
+    "{merchant}",
+    "{merchant} {product}",
+    "{merchant} receipts in {month}",
+    "{product}",
+    "find receipts from {merchant}",
+]
+
+
+def query_corpus(count, complex_share, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        templates = COMPLEX_TEMPLATES if rng.random() < complex_share else SIMPLE_TEMPLATES
+        yield rng.choice(templates).format(
+            merchant=rng.choice(MERCHANTS), product=rng.choice(PRODUCTS),
+            month=rng.choice(MONTHS), other_month=rng.choice(MONTHS))
+
+
+def stub_openai(median_seconds, rng):
+    def extract(query):
+        time.sleep(median_seconds * rng.lognormvariate(0, 0.35))
+        return [word for word in query.lower().split() if len(word) > 3]
+    return extract
+
+
+def run(pipeline, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        pipeline.extract(query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--complex-share', type=float, default=0.3, help="Fraction of queries needing the LLM")
+    parser.add_argument('--openai-latency-ms', type=float, default=400.0)
+    args = parser.parse_args()
+
+    queries = list(query_corpus(args.queries, args.complex_share))
+    rng = random.Random(1)
+    openai_stub = stub_openai(args.openai_latency_ms / 1000.0, rng)
+
+    pipelines = {
+        'openai only': KeywordExtractionPipeline([CallableKeywordExtractor('openai', openai_stub)]),
+        'local + openai': KeywordExtractionPipeline([LocalKeywordExtractor(),
+                                                     CallableKeywordExtractor('openai', openai_stub)]),
+    }
+
+    print(f"{args.queries} queries, {args.complex_share:.0%} complex, OpenAI stub median {args.openai_latency_ms} ms")
+    print(f"{'pipeline':<16}{'p50 ms':>10}{'p99 ms':>10}{'LLM calls':>11}")
+    for name, pipeline in pipelines.items():
+        latencies = run(pipeline, queries)
+        llm_calls = pipeline.stats()['openai']['calls']
+        print(f"{name:<16}{percentile(latencies, 50) * 1000:>10.2f}{percentile(latencies, 99) * 1000:>10.2f}"
+              f"{llm_calls:>11}")
+
+    local = pipelines['local + openai'].stats()['local']
+    print(f"local extractor: {local['confident']}/{local['calls']} confident, "
+          f"p50 {local['p50_seconds'] * 1e6:.1f} us, p99 {local['p99_seconds'] * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compare keyword search through a full table scan with the inverted keyword index.
+
+    python benchmarks/keyword_index_bench.py --receipts 100000
+    python benchmarks/keyword_index_bench.py --endpoint-url http://localhost:8000
+
+Uses moto unless --endpoint-url points at DynamoDB Local. The scan baseline
+follows LastEvaluatedKey so that both paths return the same, complete result.
+"reads" counts the items each path reads, which is what DynamoDB bills for;
+moto's query is itself linear in table size, so use DynamoDB Local for
+representative latencies.
+"""
+import argparse
+import statistics
+
+from boto3.dynamodb.conditions import Attr
+
+from common import (create_table, load_items, local_dynamodb, percentile, synthetic_receipts,
+                    time_call)
+import keyword_index
+
+QUERIES = [
+    ['starbucks'],
+    ['starbucks', 'latte'],
+    ['woolworths', 'milk'],
+    ['bunnings', 'drill'],
+    ['officeworks', 'printer ink'],
+    ['coles', 'bread', 'eggs'],
+]
+
+
+def scan_search(table, keywords):
+    filter_expression = None
+    for keyword in keywords:
+        condition = Attr('raw_text').contains(keyword)
+        filter_expression = condition if filter_expression is None else filter_expression & condition
+
+    items, scanned = [], 0
+    scan_kwargs = {'FilterExpression': filter_expression}
+    while True:
+        response = table.scan(**scan_kwargs)
+        items.extend(response.get('Items', []))
+        scanned += response.get('ScannedCount', 0)
+        if not response.get('LastEvaluatedKey'):
+            return items, scanned
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class CountingTable:
+    """
+    Wrap a Table and count the items its queries return.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.items_read = 0
+
+    def query(self, **kwargs):
+        response = self.table.query(**kwargs)
+        self.items_read += len(response.get('Items', []))
+        return response
+
+
+def index_search(dynamodb, receipts_table, index_table, keywords):
+    counting_table = CountingTable(index_table)
+    items = keyword_index.search(counting_table, dynamodb, receipts_table.name, keywords)
+    return items, counting_table.items_read + len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per query and path")
+    parser.add_argument('--endpoint-url', default=None)
+    args = parser.parse_args()
+
+    with local_dynamodb(args.endpoint_url) as dynamodb:
+        receipts_table = create_table(dynamodb, 'Receipts', 'receipt_id')
+        index_table = create_table(dynamodb, keyword_index.KEYWORD_INDEX_TABLE, 'token', 'receipt_id')
+
+        _, load_seconds = time_call(load_items, receipts_table, synthetic_receipts(args.receipts))
+        _, backfill_seconds = time_call(keyword_index.backfill, receipts_table, index_table)
+        print(f"Loaded {args.receipts} receipts in {load_seconds:.1f}s, backfilled index in {backfill_seconds:.1f}s")
+        print(f"{'query':<28}{'matches':>8}{'scan p50 ms':>13}{'index p50 ms':>14}{'scan reads':>12}{'index reads':>13}")
+
+        all_scan_times, all_index_times = [], []
+        for keywords in QUERIES:
+            scan_times, index_times = [], []
+            for _ in range(args.repeat):
+                (scan_items, scan_reads), elapsed = time_call(scan_search, receipts_table, keywords)
+                scan_times.append(elapsed)
+                (index_items, index_reads), elapsed = time_call(
+                    index_search, dynamodb, receipts_table, index_table, keywords)
+                index_times.append(elapsed)
+            all_scan_times.extend(scan_times)
+            all_index_times.extend(index_times)
+
+            # The index matches whole tokens, the scan matches substrings; report both counts if they differ
+            matches = str(len(index_items)) if len(index_items) == len(scan_items) \
+                else f"{len(index_items)}/{len(scan_items)}"
+            print(f"{' '.join(keywords):<28}{matches:>8}"
+                  f"{statistics.median(scan_times) * 1000:>13.1f}{statistics.median(index_times) * 1000:>14.1f}"
+                  f"{scan_reads:>12}{index_reads:>13}")
+
+        print(f"p99 over all queries: scan {percentile(all_scan_times, 99) * 1000:.1f} ms, "
+              f"index {percentile(all_index_times, 99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
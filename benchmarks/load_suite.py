@@ -0,0 +1,421 @@
+"""
+End-to-end load tests of /upload, /search, /list and the ingest Lambda against local stand-ins.
+
+    python benchmarks/load_suite.py --scales 1000,10000 --output load.json
+    python benchmarks/load_suite.py --scenarios search,list --baseline load.json
+    python benchmarks/load_suite.py --endpoint-url http://localhost:8000
+
+Stand-ins, so the suite runs offline:
+- DynamoDB and S3 are moto, in this process. With --endpoint-url the
+  tables live in DynamoDB Local instead (S3 stays in moto).
+- OpenAI is stubs.start_openai_stub, an HTTP server answering after
+  --openai-latency seconds.
+- Textract is textract_stub.start_textract_server, an HTTP server
+  answering after --textract-latency seconds. The Lambda's own client
+  reaches it through AWS_ENDPOINT_URL_TEXTRACT.
+
+For each corpus scale the tables are created and filled with synthetic
+receipts, stored the way the ingest Lambda stores them
+(lambda_function.store_receipts: items and keyword postings). Each
+scenario then runs --concurrency closed-loop clients for --duration
+seconds. The clients call the Flask app through its test client, with no
+HTTP server in between:
+
+    upload  POST /upload with a distinct JPEG each time (dedup lookup, preprocessing, S3 put)
+    search  POST /search, --llm-ratio of the queries needing OpenAI
+    list    GET /list, the first page or one further on
+    ingest  lambda_handler on an S3 event for a stored image (Textract, parsing, DynamoDB writes)
+
+Preparing a request (rendering an image, putting it in S3 for the ingest
+scenario) is not timed. Each scenario reports:
+- requests, errors and requests/s
+- p50/p95/p99 latency in ms
+- the process RSS after the scenario and its peak so far, in MB. Upload
+  preprocessing runs in a separate process pool and is not counted.
+
+--output writes every result as JSON. --baseline compares with an
+earlier output and exits with status 1 if a p95 got worse by more than
+--tolerance.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from common import REGION, ROOT_DIR, percentile, synthetic_receipts
+from stubs import make_queries, start_openai_stub
+from textract_stub import start_textract_server
+
+os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import boto3
+import openai
+from PIL import Image, ImageDraw
+
+import app as app_module
+import dedup
+import keyword_index
+import lambda_function
+import receipt_fields
+import receipt_storage
+import utils
+from tokenizer import unique_tokens
+
+SCENARIOS = ('upload', 'search', 'list', 'ingest')
+# Receipts per store_receipts call while loading a corpus
+LOAD_BATCH_SIZE = 500
+# Key attributes stored as numbers, the others are strings
+NUMBER_KEYS = ('ingest_bucket', 'ingested_at')
+
+
+def table_specs():
+    """
+    (name, key attributes, GSIs) of the app's tables, as bashscripts/create_dynamodb_table.sh creates them.
+    """
+    ingest_index = (receipt_storage.INGEST_TIME_INDEX, 'ingest_bucket', 'ingested_at')
+    field_indexes = [(receipt_fields.MERCHANT_DATE_INDEX, 'merchant', 'receipt_date'),
+                     (receipt_fields.MONTH_DATE_INDEX, 'receipt_month', 'receipt_date'), ingest_index]
+    return [
+        (utils.TABLE_NAME, ['receipt_id'], field_indexes),
+        (keyword_index.KEYWORD_INDEX_TABLE, ['token', 'receipt_id'], []),
+        (dedup.RECEIPT_HASHES_TABLE, ['hash_key'], []),
+        (receipt_storage.RECEIPT_TEXTS_TABLE, ['receipt_id'], [ingest_index]),
+    ]
+
+
+def create_tables(dynamodb):
+    """
+    Create the app's tables, dropping earlier copies.
+    """
+    existing = {table.name for table in dynamodb.tables.all()}
+    for name, keys, indexes in table_specs():
+        if name in existing:
+            dynamodb.Table(name).delete()
+            dynamodb.Table(name).wait_until_not_exists()
+        attributes = set(keys) | {key for _, hash_key, range_key in indexes for key in (hash_key, range_key)}
+        kwargs = {
+            'TableName': name,
+            'AttributeDefinitions': [{'AttributeName': attribute, 'AttributeType': 'N' if attribute in NUMBER_KEYS else 'S'}
+                                     for attribute in sorted(attributes)],
+            'KeySchema': [{'AttributeName': key, 'KeyType': key_type} for key, key_type in zip(keys, ('HASH', 'RANGE'))],
+            'BillingMode': 'PAY_PER_REQUEST',
+        }
+        if indexes:
+            kwargs['GlobalSecondaryIndexes'] = [{
+                'IndexName': index_name,
+                'KeySchema': [{'AttributeName': hash_key, 'KeyType': 'HASH'},
+                              {'AttributeName': range_key, 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'},
+            } for index_name, hash_key, range_key in indexes]
+        dynamodb.create_table(**kwargs).wait_until_exists()
+
+
+def load_corpus(count):
+    """
+    Store `count` synthetic receipts through the Lambda's write path.
+    """
+    batch = []
+    for item in synthetic_receipts(count):
+        item['s3_url'] = f"https://{utils.BUCKET_NAME}.s3.amazonaws.com/receipts/{item['receipt_id']}.jpg"
+        item['ingested_at'] = int(time.time())
+        item['ingest_bucket'] = receipt_storage.ingest_bucket(item['ingested_at'])
+        item.update(receipt_fields.structured_fields(item['raw_text'], merchants=lambda_function.MERCHANTS))
+        batch.append((item, unique_tokens(item['raw_text'])[:keyword_index.MAX_TOKENS_PER_RECEIPT]))
+        if len(batch) == LOAD_BATCH_SIZE:
+            lambda_function.store_receipts(batch)
+            batch = []
+    lambda_function.store_receipts(batch)
+
+
+def receipt_image(index):
+    """
+    A distinct receipt-like grayscale JPEG for every index.
+    """
+    rng = random.Random(index)
+    image = Image.new('L', (600, 900), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((20, 10), f"receipt {index}", fill=0)
+    for row in range(30):
+        top = 40 + row * 28
+        draw.rectangle([20, top, 20 + rng.randint(80, 540), top + 12], fill=rng.randint(0, 80))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+def upload_scenario(args, counter):
+    def new_worker():
+        client = app_module.app.test_client()
+
+        def prepare():
+            return receipt_image(next(counter))
+
+        def send(data):
+            response = client.post('/upload', data={'file': (io.BytesIO(data), 'receipt.jpg')})
+            return response.status_code == 200 and not response.get_json().get('duplicate')
+        return prepare, send
+    return new_worker
+
+
+def search_scenario(args, counter):
+    queries = make_queries(random.Random(0), 100000, args.llm_ratio)
+
+    def new_worker():
+        client = app_module.app.test_client()
+
+        def prepare():
+            return queries[next(counter) % len(queries)]
+
+        def send(query):
+            return client.post('/search', data={'query': query}).status_code == 200
+        return prepare, send
+    return new_worker
+
+
+def list_scenario(args, counter):
+    def new_worker():
+        client = app_module.app.test_client()
+        rng = random.Random(next(counter))
+
+        def prepare():
+            # Every other request follows a cursor to a page further into the table
+            if rng.random() < 0.5:
+                return '/list'
+            return f"/list?cursor={utils.encode_cursor({'receipt_id': f'{rng.randrange(args.scale):032x}'})}"
+
+        def send(path):
+            return client.get(path).status_code == 200
+        return prepare, send
+    return new_worker
+
+
+def ingest_scenario(args, counter):
+    s3 = boto3.client('s3')
+
+    def new_worker():
+        def prepare():
+            key = f"receipts/{next(counter) + 10 ** 9:032x}.jpg"
+            etag = s3.put_object(Bucket=utils.BUCKET_NAME, Key=key, Body=receipt_image(next(counter)))['ETag']
+            return {'Records': [{'s3': {'bucket': {'name': utils.BUCKET_NAME},
+                                        'object': {'key': key, 'eTag': etag.strip('"')}}}]}
+
+        def send(event):
+            response = lambda_function.lambda_handler(event, None)
+            return response['statusCode'] == 200 and not response['batchItemFailures']
+        return prepare, send
+    return new_worker
+
+
+SCENARIO_FACTORIES = {
+    'upload': upload_scenario,
+    'search': search_scenario,
+    'list': list_scenario,
+    'ingest': ingest_scenario,
+}
+
+
+def run_load(new_worker, concurrency, duration):
+    """
+    Run closed-loop clients, each preparing a request (untimed) and then timing it.
+
+    Returns:
+        tuple: (latencies in seconds, errors, elapsed seconds).
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        prepare, send = new_worker()
+        while time.perf_counter() < deadline:
+            request = prepare()
+            start = time.perf_counter()
+            try:
+                ok = send(request)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += not ok
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def memory_mb():
+    """
+    Current and peak resident set size of this process, in MB (current is None off Linux).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        current = None
+    return current, peak
+
+
+def summarize(scale, scenario, args, latencies, errors, elapsed):
+    rss, peak_rss = memory_mb()
+    return {
+        'scale': scale,
+        'scenario': scenario,
+        'concurrency': args.concurrency,
+        'duration_s': round(elapsed, 3),
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_s': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            'max': round(max(latencies, default=0) * 1000, 2),
+        },
+        'rss_mb': round(rss, 1) if rss is not None else None,
+        'peak_rss_mb': round(peak_rss, 1),
+    }
+
+
+def reset_app_state():
+    # In-memory indexes from the previous scale would answer from receipts that no longer exist
+    utils.text_index.index = utils.text_index.built_at = utils.text_index.refreshed_at = None
+    for name in ('receipt_cache', 'vector_search'):
+        vars(utils).pop(name, None)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print p95 latency and throughput changes against an earlier run.
+
+    Returns:
+        list: (scale, scenario) of the results whose p95 got worse by more than tolerance.
+    """
+    previous = {(result['scale'], result['scenario']): result for result in baseline['results']}
+    regressions = []
+    print(f"\n{'vs baseline':<18}{'p95 change':>12}{'req/s change':>14}")
+    for result in results:
+        before = previous.get((result['scale'], result['scenario']))
+        if before is None or not before['latency_ms']['p95'] or not before['requests_per_s']:
+            continue
+        p95_change = result['latency_ms']['p95'] / before['latency_ms']['p95'] - 1
+        rps_change = result['requests_per_s'] / before['requests_per_s'] - 1
+        flag = '  REGRESSION' if p95_change > tolerance else ''
+        print(f"{result['scenario'] + ' @' + str(result['scale']):<18}{p95_change:>+12.1%}{rps_change:>+14.1%}{flag}")
+        if p95_change > tolerance:
+            regressions.append((result['scale'], result['scenario']))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='1000,10000', help="Comma-separated corpus sizes")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument('--openai-latency', type=float, default=0.4)
+    parser.add_argument('--textract-latency', type=float, default=1.0)
+    parser.add_argument('--llm-ratio', type=float, default=0.3)
+    parser.add_argument('--endpoint-url', default=None, help="DynamoDB Local, e.g. http://localhost:8000")
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="Earlier --output to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p95 increase over the baseline")
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    openai_server, openai.api_base = start_openai_stub(args.openai_latency)
+    openai.api_key = 'stub'
+    textract_server, os.environ['AWS_ENDPOINT_URL_TEXTRACT'] = start_textract_server(args.textract_latency)
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = args.endpoint_url
+    app_module.app.config['TESTING'] = True
+
+    from moto import mock_aws
+    results = []
+    with mock_aws():
+        boto3.client('s3', region_name=REGION).create_bucket(
+            Bucket=utils.BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': REGION})
+        dynamodb = boto3.resource('dynamodb', region_name=REGION)
+        print(f"{args.concurrency} clients, {args.duration:.0f}s per scenario, OpenAI {args.openai_latency * 1000:.0f} ms, "
+              f"Textract {args.textract_latency * 1000:.0f} ms, {args.llm_ratio:.0%} LLM queries", file=sys.stderr)
+        print(f"{'scale':>8}{'scenario':>9}{'requests':>10}{'errors':>8}{'req/s':>9}"
+              f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RSS MB':>9}")
+        for scale in (int(value) for value in args.scales.split(',')):
+            args.scale = scale
+            create_tables(dynamodb)
+            start = time.perf_counter()
+            load_corpus(scale)
+            print(f"Loaded {scale} receipts in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            reset_app_state()
+            for scenario in scenarios:
+                counter = itertools.count(scale * 10)
+                new_worker = SCENARIO_FACTORIES[scenario](args, counter)
+                # The app and the Lambda log to stdout; keep the report readable
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    latencies, errors, elapsed = run_load(new_worker, args.concurrency, args.duration)
+                result = summarize(scale, scenario, args, latencies, errors, elapsed)
+                results.append(result)
+                latency = result['latency_ms']
+                rss = f"{result['rss_mb']:.0f}" if result['rss_mb'] is not None else '-'
+                print(f"{scale:>8}{scenario:>9}{result['requests']:>10}{errors:>8}{result['requests_per_s']:>9.1f}"
+                      f"{latency['p50']:>9.1f}{latency['p95']:>9.1f}{latency['p99']:>9.1f}{rss:>9}")
+
+    openai_server.shutdown()
+    textract_server.shutdown()
+
+    if args.output:
+        config = {name: value for name, value in vars(args).items() if name not in ('output', 'baseline', 'scale')}
+        document = {
+            'suite': 'load_suite',
+            'version': 1,
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'config': config,
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure full-table scan wall-clock time against the number of scan segments.
+
+    python benchmarks/parallel_scan_bench.py --receipts 20000 --segments 1 2 4 8
+    python benchmarks/parallel_scan_bench.py --endpoint-url http://localhost:8000
+
+moto serves every request in-process and each moto scan call walks the whole
+table while holding the GIL, so segment speedups only show up against
+DynamoDB Local. --latency-ms adds a per-request delay that stands in for the
+network round trip to DynamoDB.
+"""
+import argparse
+import statistics
+import time
+
+from common import create_table, load_items, local_dynamodb, synthetic_receipts
+import parallel_scan
+
+
+class SlowTable:
+    """
+    Wrap a Table and add a fixed delay to every scan request.
+    """
+
+    def __init__(self, table, latency):
+        self.table = table
+        self.latency = latency
+
+    def scan(self, **kwargs):
+        time.sleep(self.latency)
+        return self.table.scan(**kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=20000)
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--page-size', type=int, default=500, help="Scan Limit, forces several pages per segment")
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--endpoint-url', default=None)
+    args = parser.parse_args()
+
+    with local_dynamodb(args.endpoint_url) as dynamodb:
+        table = create_table(dynamodb, 'Receipts', 'receipt_id')
+        load_items(table, synthetic_receipts(args.receipts))
+        scan_table = SlowTable(table, args.latency_ms / 1000.0) if args.latency_ms else table
+
+        print(f"{args.receipts} receipts, page size {args.page_size}, {args.latency_ms} ms per request")
+        print(f"{'segments':>8}{'median s':>10}{'first page ms':>15}{'items':>8}")
+        baseline = None
+        for total_segments in args.segments:
+            times, first_page_times, count = [], [], 0
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                count, first_page = 0, None
+                for page in parallel_scan.iter_scan_pages(scan_table, total_segments, Limit=args.page_size):
+                    if first_page is None:
+                        first_page = time.perf_counter() - start
+                    count += len(page)
+                times.append(time.perf_counter() - start)
+                first_page_times.append(first_page)
+
+            median = statistics.median(times)
+            baseline = baseline or median
+            print(f"{total_segments:>8}{median:>10.2f}{statistics.median(first_page_times) * 1000:>15.1f}"
+                  f"{count:>8}   x{baseline / median:.1f}")
+
+
+if __name__ == "__main__":
+    main()
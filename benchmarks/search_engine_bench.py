@@ -0,0 +1,96 @@
+"""
+Measure the in-memory BM25 search engine on a large synthetic corpus.
+
+    python benchmarks/search_engine_bench.py --receipts 100000
+
+Reports:
+- build time and throughput of BM25Index.add over the whole corpus
+- memory held by the index structures (postings, document frequencies,
+  lengths), excluding the receipt items themselves, which every backend
+  has to hold or fetch
+- query latency percentiles for ranked top-k search, next to an in-memory
+  "contains every keyword" filter over raw_text, the same matching the
+  scan backend asks DynamoDB to do
+- incremental add latency once the index is full
+"""
+import argparse
+import random
+import sys
+import time
+
+from common import MERCHANTS, PRODUCTS, percentile, synthetic_receipts, time_call
+from search_engine import BM25Index
+
+
+def make_queries(rng, count):
+    queries = []
+    for _ in range(count):
+        size = rng.randint(1, 3)
+        terms = [rng.choice(MERCHANTS)] + rng.sample(PRODUCTS, size - 1)
+        queries.append(terms)
+    return queries
+
+
+def index_memory_bytes(index):
+    size = sys.getsizeof(index._postings) + sys.getsizeof(index._document_frequency)
+    for token, (documents, counts) in index._postings.items():
+        size += sys.getsizeof(token) + sys.getsizeof(documents) + sys.getsizeof(counts) + 56  # the tuple
+    size += sys.getsizeof(index._documents) + sys.getsizeof(index._items)
+    size += sys.getsizeof(index._lengths) + sys.getsizeof(index._live)
+    return size
+
+
+def contains_all(raw_texts, keywords):
+    return [index for index, raw_text in enumerate(raw_texts) if all(keyword in raw_text for keyword in keywords)]
+
+
+def latency_row(name, latencies):
+    return (f"{name:>22}{percentile(latencies, 50) * 1000:>10.2f}{percentile(latencies, 90) * 1000:>10.2f}"
+            f"{percentile(latencies, 99) * 1000:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=50)
+    args = parser.parse_args()
+
+    items = list(synthetic_receipts(args.receipts))
+    raw_texts = [item['raw_text'] for item in items]
+
+    index = BM25Index()
+    _, build_seconds = time_call(lambda: [index.add(item) for item in items])
+    index_bytes = index_memory_bytes(index)
+    stats = index.stats()
+
+    print(f"{args.receipts} receipts, {stats['tokens']} distinct tokens, {stats['postings']} postings")
+    print(f"build: {build_seconds:.2f}s ({args.receipts / build_seconds:.0f} receipts/s), "
+          f"index memory {index_bytes / 2 ** 20:.1f} MiB ({index_bytes / args.receipts:.0f} bytes/receipt)")
+
+    rng = random.Random(1)
+    queries = make_queries(rng, args.queries)
+    # The first search imports numpy
+    index.search(queries[0], args.top_k)
+    ranked, filtered = [], []
+    for keywords in queries:
+        _, elapsed = time_call(index.search, keywords, args.top_k)
+        ranked.append(elapsed)
+        _, elapsed = time_call(contains_all, raw_texts, keywords)
+        filtered.append(elapsed)
+
+    print(f"\n{'query (ms)':>22}{'p50':>10}{'p90':>10}{'p99':>10}")
+    print(latency_row(f"bm25 top-{args.top_k}", ranked))
+    print(latency_row('contains-all filter', filtered))
+
+    additions = []
+    for item in synthetic_receipts(1000, seed=99):
+        item = dict(item, receipt_id='new-' + item['receipt_id'])
+        start = time.perf_counter()
+        index.add(item)
+        additions.append(time.perf_counter() - start)
+    print(latency_row('incremental add', additions))
+
+
+if __name__ == "__main__":
+    main()
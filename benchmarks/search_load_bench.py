@@ -0,0 +1,104 @@
+"""
+Load-test /search on the sync and the async (ASYNC_SEARCH) request paths.
+
+    python benchmarks/search_load_bench.py --concurrency 8 --duration 10
+
+Everything runs locally:
+- OpenAI is a stub HTTP server on 127.0.0.1 that answers chat completions
+  after --openai-latency seconds; both paths really call it over HTTP
+  (openai.ChatCompletion / requests for sync, pooled httpx for async).
+- DynamoDB is an in-memory stub of the keyword index and the Receipts table
+  that sleeps --db-latency seconds per request, standing in for the network
+  round trip (see stubs.py).
+
+--concurrency closed-loop clients call the Flask app (test client, no HTTP
+server in between) for --duration seconds per path. --llm-ratio of the
+queries need OpenAI ("how much ..."), the rest are answered by the local
+extractor; every query is unique so the keyword cache doesn't hide the LLM.
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+from common import percentile
+from stubs import install_dynamodb_stubs, make_queries, start_openai_stub
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import openai
+
+import app as app_module
+import utils
+
+
+def run_load(client_factory, queries, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    position = [0]
+
+    def worker():
+        client = client_factory()
+        while time.perf_counter() < deadline:
+            with lock:
+                query = queries[position[0] % len(queries)]
+                position[0] += 1
+            start = time.perf_counter()
+            response = client.post('/search', data={'query': query})
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--openai-latency', type=float, default=0.4)
+    parser.add_argument('--db-latency', type=float, default=0.01)
+    parser.add_argument('--llm-ratio', type=float, default=0.3)
+    args = parser.parse_args()
+
+    server, openai.api_base = start_openai_stub(args.openai_latency)
+    openai.api_key = 'stub'
+    install_dynamodb_stubs(utils, args.receipts, args.db_latency)
+
+    app_module.app.config['TESTING'] = True
+    queries = make_queries(random.Random(0), 100000, args.llm_ratio)
+
+    print(f"{args.concurrency} clients, {args.duration:.0f}s per path, OpenAI {args.openai_latency * 1000:.0f} ms, "
+          f"DynamoDB {args.db_latency * 1000:.0f} ms/request, {args.llm_ratio:.0%} LLM queries", file=sys.stderr)
+    print(f"{'path':>6}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for path, async_enabled in (('sync', False), ('async', True)):
+        app_module.ASYNC_SEARCH = async_enabled
+        utils.keyword_cache.clear()
+        # utils logs every OpenAI response and request, keep that out of the report
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            latencies, errors, elapsed = run_load(app_module.app.test_client, queries, args.concurrency,
+                                                  args.duration)
+        print(f"{path:>6}{len(latencies):>10}{len(latencies) / elapsed:>9.1f}"
+              f"{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 99) * 1000:>9.1f}{errors:>8}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Compare the Flask development server with the gunicorn profile under load.
+
+    python benchmarks/serve_bench.py --concurrency 16 --duration 10
+
+Each profile serves benchmarks/stub_app.py (the real app with in-memory
+DynamoDB stubs) in a subprocess, with OpenAI answered by a local stub server:
+
+    dev       python stub_app.py, what `CMD ["python", "app.py"]` ran
+    gunicorn  gunicorn --config gunicorn.conf.py stub_app:app
+
+--concurrency clients with keep-alive connections then hit GET /list and
+POST /search for --duration seconds each, and the throughput and latency
+percentiles are reported per profile and endpoint.
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+from common import ROOT_DIR, percentile
+from stubs import make_queries, start_openai_stub
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during start-up.")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start in time.")
+
+
+def start_server(profile, port, env):
+    if profile == 'dev':
+        command = [sys.executable, 'stub_app.py']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT_DIR, 'gunicorn.conf.py'),
+                   'stub_app:app']
+    process = subprocess.Popen(command, cwd=BENCHMARK_DIR, env=dict(env, PORT=str(port)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_ready(port, process)
+    return process
+
+
+def run_load(port, make_request, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        connection = None
+        while time.perf_counter() < deadline:
+            method, path, body, headers = make_request(rng)
+            start = time.perf_counter()
+            try:
+                # The development server speaks HTTP/1.0 and closes every connection, reconnect as needed
+                if connection is None:
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+                if response.will_close:
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection = None
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += 0 if ok else 1
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=['dev', 'gunicorn'], choices=['dev', 'gunicorn'])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--receipts', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--openai-latency', type=float, default=0.4)
+    parser.add_argument('--db-latency', type=float, default=0.01)
+    parser.add_argument('--llm-ratio', type=float, default=0.3)
+    args = parser.parse_args()
+
+    server, api_base = start_openai_stub(args.openai_latency)
+    env = dict(os.environ, OPENAI_API_BASE=api_base, OPENAI_API_KEY='stub', AWS_DEFAULT_REGION='ap-southeast-2',
+               AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark', GUNICORN_ACCESS_LOG='',
+               STUB_RECEIPTS=str(args.receipts), STUB_DB_LATENCY=str(args.db_latency))
+    queries = make_queries(random.Random(0), 100000, args.llm_ratio)
+    query_position = iter(range(10 ** 9))
+
+    endpoints = {
+        '/list': lambda rng: ('GET', f"/list?page_size={args.page_size}", None, {}),
+        '/search': lambda rng: ('POST', '/search', urlencode({'query': queries[next(query_position) % len(queries)]}),
+                                {'Content-Type': 'application/x-www-form-urlencoded'}),
+    }
+
+    print(f"{args.concurrency} clients, {args.duration:.0f}s per endpoint, OpenAI {args.openai_latency * 1000:.0f} ms, "
+          f"DynamoDB {args.db_latency * 1000:.0f} ms/request", file=sys.stderr)
+    print(f"{'profile':>9}{'endpoint':>9}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for profile in args.profiles:
+        port = free_port()
+        process = start_server(profile, port, env)
+        try:
+            for endpoint, make_request in endpoints.items():
+                latencies, errors, elapsed = run_load(port, make_request, args.concurrency, args.duration)
+                print(f"{profile:>9}{endpoint:>9}{len(latencies):>10}{len(latencies) / elapsed:>9.1f}"
+                      f"{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 99) * 1000:>9.1f}{errors:>8}")
+        finally:
+            # SIGTERM, as ECS sends it, exercises gunicorn's graceful shutdown
+            process.terminate()
+            process.wait(timeout=60)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare answering spend questions by scanning Receipts with the ReceiptStats rollups.
+
+    python benchmarks/stats_bench.py --receipts 1000,10000
+    python benchmarks/stats_bench.py --endpoint-url http://localhost:8000
+
+For each corpus size the Receipts table is loaded with synthetic receipts
+and their structured fields, the rollups are built with
+receipt_stats.rebuild, and each question is answered three ways:
+
+    scan     a full scan of Receipts, added up in Python (what /stats would do without rollups)
+    rollups  receipt_stats.summarize, one or a few queries of ReceiptStats
+    columns  receipt_stats.report over columns loaded once (the ad-hoc path, numpy)
+
+It also times the incremental path the Lambda takes, update_rollups on
+batches of --batch-size new receipts, per receipt.
+
+moto answers a query in time proportional to the whole table, not the
+partition it reads (about 150 ms for a one-item partition of a 10,000-item
+table, most of ReceiptStats being the receipt# items), so the rollups
+column grows with the corpus here; against DynamoDB Local or a real table
+it depends only on the counters read.
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from common import MERCHANTS, create_table, load_items, local_dynamodb, synthetic_receipts, time_call
+import receipt_stats
+from receipt_fields import structured_fields
+
+QUESTIONS = [
+    # (name, ranges, merchant, group)
+    ('starbucks, september', [('2024-09-01', '2024-09-30')], 'starbucks', 'month'),
+    ('by merchant, 2024', [('2024-01-01', '2024-12-31')], None, 'merchant'),
+    ('by day, q3', [('2024-07-01', '2024-09-30')], None, 'day'),
+]
+INCREMENTAL_SAMPLE = 500
+
+
+def receipts(count, seed=0):
+    for item in synthetic_receipts(count, seed):
+        item.update(structured_fields(item['raw_text'], merchants=MERCHANTS))
+        yield item
+
+
+def scan_summary(table, ranges, merchant, group):
+    first, last = ranges[0]
+    totals = {}
+    for item in receipt_stats.iter_table_items(table):
+        receipt_date = item.get('receipt_date')
+        if not receipt_date or not first <= receipt_date <= last or (merchant and item.get('merchant') != merchant):
+            continue
+        label = {'month': receipt_date[:7], 'day': receipt_date}.get(group, item.get('merchant'))
+        total = totals.setdefault(label, [Decimal(0), 0])
+        total[0] += item.get('amount', 0)
+        total[1] += 1
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', default='1000,10000', help="Comma-separated corpus sizes")
+    parser.add_argument('--batch-size', type=int, default=10, help="Receipts per update_rollups call")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--endpoint-url', default=None)
+    args = parser.parse_args()
+
+    print(f"{'receipts':>9}  {'question':<22}{'scan ms':>10}{'rollups ms':>12}{'columns ms':>12}")
+    with local_dynamodb(args.endpoint_url) as dynamodb:
+        for count in (int(value) for value in args.receipts.split(',')):
+            table = create_table(dynamodb, f"Receipts{count}", 'receipt_id')
+            stats_table = create_table(dynamodb, f"ReceiptStats{count}", 'rollup', 'period')
+            load_items(table, receipts(count))
+
+            columns, load_seconds = time_call(receipt_stats.load_columns, receipt_stats.iter_table_items(table))
+            _, rebuild_seconds = time_call(receipt_stats.rebuild, stats_table, columns, log=lambda message: None)
+
+            for name, ranges, merchant, group in QUESTIONS:
+                scan = min(time_call(scan_summary, table, ranges, merchant, group)[1] for _ in range(args.repeat))
+                rollups = min(time_call(receipt_stats.summarize, stats_table, ranges, merchant, group)[1]
+                              for _ in range(args.repeat))
+                vectorized = min(time_call(receipt_stats.report, columns, group, *ranges[0], merchant)[1]
+                                 for _ in range(args.repeat))
+                print(f"{count:>9}  {name:<22}{scan * 1000:>10.1f}{rollups * 1000:>12.2f}{vectorized * 1000:>12.2f}")
+
+            # New receipts (ids past the corpus) counted the way the Lambda counts them
+            new = [dict(item, receipt_id=f"new{item['receipt_id']}") for item in receipts(INCREMENTAL_SAMPLE, seed=1)]
+            start = time.perf_counter()
+            for offset in range(0, len(new), args.batch_size):
+                receipt_stats.update_rollups(stats_table, new[offset:offset + args.batch_size])
+            incremental = (time.perf_counter() - start) / len(new)
+            print(f"{count:>9}  columns loaded in {load_seconds:.2f}s, rollups rebuilt in {rebuild_seconds:.2f}s, "
+                  f"update_rollups {incremental * 1000:.2f} ms per new receipt")
+
+
+if __name__ == "__main__":
+    main()
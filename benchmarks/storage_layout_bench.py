@@ -0,0 +1,112 @@
+"""
+Compare the read and write capacity of the inline and compact receipt layouts.
+
+    python benchmarks/storage_layout_bench.py --receipts 20000
+    python benchmarks/storage_layout_bench.py --lines 60 --endpoint-url http://localhost:8000
+
+Both layouts are loaded with the same synthetic receipts, padded to --lines
+item lines and carrying what the ingest Lambda stores (structured fields,
+an embedding, a thumbnail key). Capacity is computed from the items with
+DynamoDB's sizing rules (receipt_storage.item_size): moto reports a flat
+capacity per request, so the "reported" column is only meaningful against
+DynamoDB Local or a real table.
+"""
+import argparse
+import math
+import random
+
+from common import MERCHANTS, PRODUCTS, create_table, load_items, local_dynamodb, synthetic_receipts, time_call
+import receipt_storage
+from embeddings import HashingEmbedder, embed_item
+from receipt_fields import structured_fields
+
+LIST_PAGE_SIZE = 50
+
+
+def full_receipts(count, lines, seed=0):
+    """
+    Synthetic receipts shaped like the Lambda's items, with `lines` extra item lines each.
+    """
+    rng = random.Random(seed)
+    embedder = HashingEmbedder()
+    for item in synthetic_receipts(count, seed):
+        extra = [f"{rng.choice(PRODUCTS)} {rng.randint(1, 9)} x ${rng.uniform(1, 30):.2f}" for _ in range(lines)]
+        head, _, tail = item['raw_text'].partition('\ntotal')
+        item['raw_text'] = '\n'.join([head] + extra) + '\ntotal' + tail
+        item['s3_url'] = f"https://my-receipt-manager-bucket.s3.ap-southeast-2.amazonaws.com/receipts/{item['receipt_id']}.jpg"
+        item['thumbnail_key'] = f"thumbnails/{item['receipt_id']}.webp"
+        item['ingested_at'] = 1700000000 + rng.randint(0, 10 ** 7)
+        item.update(structured_fields(item['raw_text'], merchants=MERCHANTS))
+        embed_item(item, embedder)
+        yield item
+
+
+def read_units(size, consistent=False):
+    # Eventually consistent reads cost half a unit per started 4 KB
+    units = math.ceil(size / receipt_storage.READ_UNIT_BYTES)
+    return units if consistent else units / 2
+
+
+def write_units(size):
+    return math.ceil(size / 1024)
+
+
+def scan_reported(table, **scan_kwargs):
+    units, items = 0.0, 0
+    while True:
+        response = table.scan(ReturnConsumedCapacity='TOTAL', **scan_kwargs)
+        units += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+        items += len(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return units, items
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--receipts', type=int, default=20000)
+    parser.add_argument('--lines', type=int, default=30, help="Extra item lines per receipt")
+    parser.add_argument('--endpoint-url', default=None)
+    args = parser.parse_args()
+
+    items = list(full_receipts(args.receipts, args.lines))
+    hot_items = [receipt_storage.hot_item(item) for item in items]
+    cold_sizes = [receipt_storage.item_size(receipt_storage.cold_item(item)[0]) for item in items]
+    inline_sizes = [receipt_storage.item_size(item) for item in items]
+    hot_sizes = [receipt_storage.item_size(item) for item in hot_items]
+    text_bytes = sum(len(item['raw_text'].encode('utf-8')) for item in items)
+    compressed_bytes = sum(len(receipt_storage.compress_text(item['raw_text'])) for item in items)
+
+    with local_dynamodb(args.endpoint_url) as dynamodb:
+        inline_table = create_table(dynamodb, 'ReceiptsInline', 'receipt_id')
+        hot_table = create_table(dynamodb, 'ReceiptsCompact', 'receipt_id')
+        load_items(inline_table, items)
+        load_items(hot_table, hot_items)
+        (inline_reported, _), inline_seconds = time_call(scan_reported, inline_table)
+        (hot_reported, _), hot_seconds = time_call(scan_reported, hot_table, **receipt_storage.hot_projection())
+
+    n = len(items)
+    page = slice(0, LIST_PAGE_SIZE)
+    rows = [
+        ('bytes per Receipts item', sum(inline_sizes) / n, sum(hot_sizes) / n),
+        ('full scan RCU', receipt_storage.scan_read_units(inline_sizes), receipt_storage.scan_read_units(hot_sizes)),
+        ('full scan RCU (reported)', inline_reported, hot_reported),
+        (f"/list page of {LIST_PAGE_SIZE} RCU",
+         receipt_storage.scan_read_units(inline_sizes[page]), receipt_storage.scan_read_units(hot_sizes[page])),
+        ('detail view RCU (avg)', sum(map(read_units, inline_sizes)) / n,
+         sum(read_units(hot) + read_units(cold) for hot, cold in zip(hot_sizes, cold_sizes)) / n),
+        ('ingest WCU per receipt (avg)', sum(map(write_units, inline_sizes)) / n,
+         sum(write_units(hot) + write_units(cold) for hot, cold in zip(hot_sizes, cold_sizes)) / n),
+        ('stored MB (all tables)', sum(inline_sizes) / 1e6, (sum(hot_sizes) + sum(cold_sizes)) / 1e6),
+        ('full scan seconds (moto)', inline_seconds, hot_seconds),
+    ]
+    print(f"{n} receipts, {text_bytes / n:.0f} bytes of raw_text each, "
+          f"compressed {text_bytes / compressed_bytes:.1f}x to {compressed_bytes / n:.0f} bytes")
+    print(f"{'':<32}{'inline':>12}{'compact':>12}{'ratio':>8}")
+    for name, inline, compact in rows:
+        ratio = f"{inline / compact:.1f}x" if compact else '-'
+        print(f"{name:<32}{inline:>12.2f}{compact:>12.2f}{ratio:>8}")
+
+
+if __name__ == "__main__":
+    main()
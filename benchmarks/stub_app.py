@@ -0,0 +1,20 @@
+"""
+The Flask app with DynamoDB replaced by the in-memory stubs, for serve_bench.py.
+
+    gunicorn --config gunicorn.conf.py --chdir benchmarks stub_app:app
+
+Configured from the environment: STUB_RECEIPTS, STUB_DB_LATENCY, and
+OPENAI_API_BASE pointing at a running OpenAI stub.
+"""
+import os
+
+from stubs import install_dynamodb_stubs
+
+import utils
+from app import app
+
+install_dynamodb_stubs(utils, int(os.getenv('STUB_RECEIPTS', '5000')), float(os.getenv('STUB_DB_LATENCY', '0.01')))
+
+if __name__ == "__main__":
+    # Flask's development server, as the Dockerfile used to run it
+    app.run(host='127.0.0.1', port=int(os.getenv('PORT', '5000')))
@@ -0,0 +1,140 @@
+"""
+Local stand-ins for OpenAI and DynamoDB used by the load benchmarks.
+
+- start_openai_stub runs an HTTP server on 127.0.0.1 answering chat
+  completions after a fixed latency, with the known products named in the
+  prompt as keywords.
+- StubIndexTable, StubReceiptsTable and StubDynamoDB keep the keyword index
+  and receipts in memory and sleep a fixed latency per request, standing in
+  for the network round trip to DynamoDB.
+- install_dynamodb_stubs swaps them into utils.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import PRODUCTS, synthetic_receipts
+from tokenizer import unique_tokens
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.4
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content'].lower()
+        keywords = [product for product in PRODUCTS if product in prompt]
+        time.sleep(self.latency)
+
+        payload = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': json.dumps(keywords)}}]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_openai_stub(latency):
+    """
+    Start the OpenAI stub server in a daemon thread.
+
+    Returns:
+        tuple: (server, API base URL to use as openai.api_base / OPENAI_API_BASE).
+    """
+    handler = type('StubOpenAI', (StubOpenAIHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1"
+
+
+class StubIndexTable:
+    """
+    In-memory keyword index (token -> receipt IDs) answering query() like a DynamoDB Table.
+    """
+
+    def __init__(self, postings, latency):
+        self.postings = postings
+        self.latency = latency
+
+    def query(self, **kwargs):
+        time.sleep(self.latency)
+        token = kwargs['KeyConditionExpression'].get_expression()['values'][1]
+        return {'Items': [{'receipt_id': receipt_id} for receipt_id in sorted(self.postings.get(token, ()))]}
+
+
+class StubReceiptsTable:
+    """
+    In-memory Receipts table answering paginated scan() like a DynamoDB Table.
+    """
+
+    def __init__(self, receipts, latency):
+        self.receipt_ids = sorted(receipts)
+        self.receipts = receipts
+        self.latency = latency
+
+    def scan(self, Limit=100, ExclusiveStartKey=None, **kwargs):
+        time.sleep(self.latency)
+        start = 0
+        if ExclusiveStartKey:
+            start = self.receipt_ids.index(ExclusiveStartKey['receipt_id']) + 1
+        page = self.receipt_ids[start:start + Limit]
+        response = {'Items': [dict(self.receipts[receipt_id]) for receipt_id in page]}
+        if start + Limit < len(self.receipt_ids):
+            response['LastEvaluatedKey'] = {'receipt_id': page[-1]}
+        return response
+
+
+class StubDynamoDB:
+    """
+    In-memory Receipts table answering batch_get_item like the DynamoDB resource.
+    """
+
+    def __init__(self, receipts, latency):
+        self.receipts = receipts
+        self.latency = latency
+
+    def batch_get_item(self, RequestItems):
+        time.sleep(self.latency)
+        table_name, request = next(iter(RequestItems.items()))
+        items = [dict(self.receipts[key['receipt_id']]) for key in request['Keys'] if key['receipt_id'] in self.receipts]
+        return {'Responses': {table_name: items}}
+
+
+def make_queries(rng, count, llm_ratio):
+    """
+    Build /search queries: two products each, llm_ratio of them phrased so only OpenAI handles them.
+    """
+    queries = []
+    for index in range(count):
+        products = rng.sample(PRODUCTS, 2)
+        if rng.random() < llm_ratio:
+            # "how much" makes the local extractor defer to OpenAI; the number keeps the query uncached
+            queries.append(f"how much did i spend on {products[0]} and {products[1]} {index}")
+        else:
+            queries.append(f"{products[0]} {products[1]}")
+    return queries
+
+
+def install_dynamodb_stubs(utils, receipt_count, latency):
+    """
+    Replace utils' DynamoDB tables with in-memory stubs holding synthetic receipts.
+
+    Search goes through the keyword index (structured GSI search is turned off,
+    the stubs don't implement it).
+    """
+    receipts = {item['receipt_id']: item for item in synthetic_receipts(receipt_count)}
+    postings = {}
+    for item in receipts.values():
+        for token in unique_tokens(item['raw_text']):
+            postings.setdefault(token, set()).add(item['receipt_id'])
+
+    utils.keyword_index_table = StubIndexTable(postings, latency)
+    utils.table = StubReceiptsTable(receipts, latency)
+    utils.dynamodb = StubDynamoDB(receipts, latency)
+    utils.STRUCTURED_SEARCH = False
+    utils.SEARCH_BACKEND = 'index'
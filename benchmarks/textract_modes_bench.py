@@ -0,0 +1,82 @@
+"""
+Compare Textract modes by response payload size, parse time and price.
+
+    python benchmarks/textract_modes_bench.py
+    python benchmarks/textract_modes_bench.py --record --bucket my-receipt-manager-bucket \
+        --keys receipts/a.jpg receipts/b.jpg
+
+--record calls the real Textract APIs once per mode and key and saves the
+responses under --fixtures; without it, responses are replayed from
+--fixtures through the local Textract stub (synthetic ones are generated
+first if the directory is empty).
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from common import synthetic_receipts
+from textract_stub import ReplayTextract, write_synthetic_fixtures
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-2')
+
+import boto3
+from lambda_function import extract_raw_text
+from textract_modes import PRICE_PER_1000_PAGES, TEXTRACT_MODES, analyze_receipt
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'textract')
+
+
+def record(fixtures_dir, bucket, keys):
+    textract = boto3.client('textract')
+    for mode in TEXTRACT_MODES:
+        os.makedirs(os.path.join(fixtures_dir, mode), exist_ok=True)
+        for key in keys:
+            response = analyze_receipt(textract, bucket, key, mode)
+            response.pop('ResponseMetadata', None)
+            name = key.split('/')[-1].rsplit('.', 1)[0]
+            with open(os.path.join(fixtures_dir, mode, f"{name}.json"), 'w') as f:
+                json.dump(response, f)
+            print(f"Recorded {mode} response for {key}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES)
+    parser.add_argument('--synthetic-receipts', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--record', action='store_true')
+    parser.add_argument('--bucket')
+    parser.add_argument('--keys', nargs='*', default=[])
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.fixtures, args.bucket, args.keys)
+    elif not os.path.isdir(args.fixtures):
+        write_synthetic_fixtures(args.fixtures, list(synthetic_receipts(args.synthetic_receipts)))
+
+    stub = ReplayTextract(args.fixtures)
+    count = len(os.listdir(os.path.join(args.fixtures, 'text')))
+
+    print(f"{count} receipts per mode, {args.repeat} passes")
+    print(f"{'mode':<10}{'payload KB':>12}{'json.loads us':>15}{'extract us':>12}{'USD/1k pages':>14}")
+    for mode in TEXTRACT_MODES:
+        payloads = [json.dumps(analyze_receipt(stub, 'bucket', 'key', mode)) for _ in range(count)]
+        load_times, extract_times = [], []
+        for _ in range(args.repeat):
+            for payload in payloads:
+                start = time.perf_counter()
+                response = json.loads(payload)
+                loaded = time.perf_counter()
+                extract_raw_text(response)
+                load_times.append(loaded - start)
+                extract_times.append(time.perf_counter() - loaded)
+
+        print(f"{mode:<10}{statistics.mean(len(p) for p in payloads) / 1024:>12.1f}"
+              f"{statistics.median(load_times) * 1e6:>15.1f}{statistics.median(extract_times) * 1e6:>12.1f}"
+              f"{PRICE_PER_1000_PAGES[mode]:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
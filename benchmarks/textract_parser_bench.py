@@ -0,0 +1,82 @@
+"""
+Micro-benchmark the Textract block parser on large synthetic responses.
+
+    python benchmarks/textract_parser_bench.py --blocks 10000
+
+Compares the original string-concatenation extract_raw_text (plus a
+separate tokenization pass, as the keyword index needed) with the
+single-pass textract_parser.parse_blocks, which also returns line offsets.
+CPython resizes `raw_text +=` in place, so the old loop is not quadratic in
+practice and both parsers run at similar speed. The "log" columns show the
+larger cost: formatting the whole response for the old
+print(f"Textract response received: {textract_response}") versus the
+summary line logged now.
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+
+from common import PRODUCTS
+from textract_parser import log_textract_response, parse_blocks
+from tokenizer import unique_tokens
+
+
+def legacy_extract(textract_response):
+    raw_text = ""
+    for block in textract_response['Blocks']:
+        if block['BlockType'] == 'LINE':
+            raw_text += block['Text'] + "\n"
+    raw_text = raw_text.strip().lower()
+    return raw_text, unique_tokens(raw_text)
+
+
+def synthetic_blocks(count, seed=0):
+    # Roughly what Textract returns: a LINE block followed by its WORD blocks
+    rng = random.Random(seed)
+    blocks = [{'BlockType': 'PAGE', 'Id': 'page'}]
+    while len(blocks) < count:
+        text = f"{rng.choice(PRODUCTS).upper()} {rng.randint(1, 9)} x ${rng.uniform(1, 99):.2f}"
+        blocks.append({'BlockType': 'LINE', 'Text': text, 'Id': str(len(blocks))})
+        for word in text.split():
+            blocks.append({'BlockType': 'WORD', 'Text': word, 'Id': str(len(blocks))})
+    return blocks[:count]
+
+
+def measure(fn, argument, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(argument)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    logger = logging.getLogger('textract_parser_bench')
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    print(f"{'blocks':>8}{'legacy ms':>12}{'single-pass ms':>16}{'legacy log ms':>15}{'summary log ms':>16}")
+    for count in args.blocks:
+        blocks = synthetic_blocks(count)
+        response = {'Blocks': blocks}
+        assert legacy_extract(response)[0] == parse_blocks(blocks).raw_text
+
+        legacy = measure(legacy_extract, response, args.repeat)
+        single_pass = measure(parse_blocks, blocks, args.repeat)
+        legacy_log = measure(lambda r: f"Textract response received: {r}", response, args.repeat)
+        summary_log = measure(lambda r: log_textract_response(logger, r), response, args.repeat)
+        print(f"{count:>8}{legacy * 1000:>12.2f}{single_pass * 1000:>16.2f}"
+              f"{legacy_log * 1000:>15.2f}{summary_log * 1000:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Local Textract stand-ins.
+
+ReplayTextract replays recorded responses in process. Responses are JSON
+files under <fixtures>/<mode>/, one per receipt, as saved by
+`textract_modes_bench.py --record` from real Textract calls. When no
+recordings exist, synthetic responses with the same block structure are
+generated so the harness still runs offline.
+
+start_textract_server runs an HTTP server speaking Textract's JSON
+protocol, for code that builds its own boto3 client (point
+AWS_ENDPOINT_URL_TEXTRACT at it). It answers with a synthetic receipt
+derived from the object key, after a fixed latency.
+"""
+import glob
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import synthetic_receipt
+from textract_modes import TEXTRACT_MODES
+
+
+def _geometry(rng):
+    left, top = rng.random(), rng.random()
+    width, height = rng.uniform(0.05, 0.5), rng.uniform(0.01, 0.03)
+    return {
+        'BoundingBox': {'Width': width, 'Height': height, 'Left': left, 'Top': top},
+        'Polygon': [{'X': left, 'Y': top}, {'X': left + width, 'Y': top},
+                    {'X': left + width, 'Y': top + height}, {'X': left, 'Y': top + height}],
+    }
+
+
+def _block(rng, block_type, **fields):
+    block = {'BlockType': block_type, 'Confidence': rng.uniform(90, 100), 'Geometry': _geometry(rng),
+             'Id': str(uuid.UUID(int=rng.getrandbits(128)))}
+    block.update(fields)
+    return block
+
+
+def _text_blocks(rng, lines):
+    page = _block(rng, 'PAGE', Relationships=[{'Type': 'CHILD', 'Ids': []}])
+    blocks = [page]
+    for line in lines:
+        words = [_block(rng, 'WORD', Text=word, TextType='PRINTED') for word in line.split()]
+        line_block = _block(rng, 'LINE', Text=line, Relationships=[{'Type': 'CHILD', 'Ids': [w['Id'] for w in words]}])
+        page['Relationships'][0]['Ids'].append(line_block['Id'])
+        blocks.append(line_block)
+        blocks.extend(words)
+    return blocks
+
+
+def synthetic_response(mode, lines, seed=0):
+    """
+    Build a response shaped like the given Textract mode's output for the receipt lines.
+    """
+    rng = random.Random(seed)
+    blocks = _text_blocks(rng, lines)
+    metadata = {'DocumentMetadata': {'Pages': 1}}
+
+    if mode == 'text':
+        return dict(metadata, Blocks=blocks, DetectDocumentTextModelVersion='1.0')
+
+    if mode == 'forms':
+        # FORMS/TABLES add key-value pairs and a table with one cell per word of each line
+        words = [block for block in blocks if block['BlockType'] == 'WORD']
+        for key_word, value_word in zip(words[::2], words[1::2]):
+            blocks.append(_block(rng, 'KEY_VALUE_SET', EntityTypes=['KEY'],
+                                 Relationships=[{'Type': 'CHILD', 'Ids': [key_word['Id']]}]))
+            blocks.append(_block(rng, 'KEY_VALUE_SET', EntityTypes=['VALUE'],
+                                 Relationships=[{'Type': 'CHILD', 'Ids': [value_word['Id']]}]))
+        cells = [_block(rng, 'CELL', RowIndex=row, ColumnIndex=1, RowSpan=1, ColumnSpan=1,
+                        Relationships=[{'Type': 'CHILD', 'Ids': [word['Id']]}])
+                 for row, word in enumerate(words, start=1)]
+        blocks.append(_block(rng, 'TABLE', Relationships=[{'Type': 'CHILD', 'Ids': [c['Id'] for c in cells]}]))
+        blocks.extend(cells)
+        return dict(metadata, Blocks=blocks, AnalyzeDocumentModelVersion='1.0')
+
+    if mode == 'expense':
+        def field(field_type, text):
+            return {'Type': {'Text': field_type, 'Confidence': 99.0},
+                    'ValueDetection': {'Text': text, 'Geometry': _geometry(rng), 'Confidence': 98.0},
+                    'PageNumber': 1}
+        summary = [field('VENDOR_NAME', lines[0]), field('INVOICE_RECEIPT_DATE', lines[2]),
+                   field('TOTAL', lines[-2].split()[-1])]
+        line_items = [{'LineItemExpenseFields': [field('ITEM', ' '.join(line.split()[:-1])),
+                                                 field('PRICE', line.split()[-1])]}
+                      for line in lines[3:-2]]
+        return dict(metadata, ExpenseDocuments=[{
+            'ExpenseIndex': 1, 'SummaryFields': summary,
+            'LineItemGroups': [{'LineItemGroupIndex': 1, 'LineItems': line_items}],
+            'Blocks': blocks,
+        }])
+
+    raise ValueError(mode)
+
+
+def write_synthetic_fixtures(fixtures_dir, receipts):
+    """
+    Save synthetic responses for every mode, one file per receipt.
+    """
+    for mode in TEXTRACT_MODES:
+        os.makedirs(os.path.join(fixtures_dir, mode), exist_ok=True)
+        for index, receipt in enumerate(receipts):
+            response = synthetic_response(mode, receipt['raw_text'].split('\n'), seed=index)
+            with open(os.path.join(fixtures_dir, mode, f"{receipt['receipt_id']}.json"), 'w') as f:
+                json.dump(response, f)
+
+
+class ReplayTextract:
+    """
+    Textract client stand-in that returns recorded responses in a loop.
+
+    Args:
+        fixtures_dir (str): Directory with one sub-directory of JSON responses per mode.
+        latency (float): Seconds to sleep per call, to emulate the service.
+    """
+
+    def __init__(self, fixtures_dir, latency=0.0):
+        self.latency = latency
+        self.responses = {}
+        for mode in TEXTRACT_MODES:
+            paths = sorted(glob.glob(os.path.join(fixtures_dir, mode, '*.json')))
+            self.responses[mode] = itertools.cycle([self._load(path) for path in paths]) if paths else None
+
+    @staticmethod
+    def _load(path):
+        with open(path) as f:
+            return json.load(f)
+
+    def _replay(self, mode):
+        if self.responses[mode] is None:
+            raise RuntimeError(f"No recorded responses for Textract mode '{mode}'.")
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responses[mode].__next__()
+
+    def detect_document_text(self, Document):
+        return self._replay('text')
+
+    def analyze_expense(self, Document):
+        return self._replay('expense')
+
+    def analyze_document(self, Document, FeatureTypes):
+        return self._replay('forms')
+
+
+# X-Amz-Target operation -> Textract mode of the synthetic response
+SERVER_OPERATIONS = {
+    'Textract.DetectDocumentText': 'text',
+    'Textract.AnalyzeExpense': 'expense',
+    'Textract.AnalyzeDocument': 'forms',
+}
+
+
+class TextractHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 1.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        mode = SERVER_OPERATIONS.get(self.headers.get('X-Amz-Target'))
+        if mode is None:
+            self.send_error(400)
+            return
+        # The same object always reads as the same receipt
+        name = body['Document']['S3Object']['Name']
+        seed = zlib.crc32(name.encode('utf-8'))
+        lines = synthetic_receipt(random.Random(seed), name)['raw_text'].split('\n')
+        payload = json.dumps(synthetic_response(mode, lines, seed)).encode('utf-8')
+        time.sleep(self.latency)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_textract_server(latency):
+    """
+    Start the Textract stub server in a daemon thread.
+
+    Returns:
+        tuple: (server, endpoint URL to use as AWS_ENDPOINT_URL_TEXTRACT).
+    """
+    handler = type('StubTextract', (TextractHandler,), {'latency': latency})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
@@ -0,0 +1,83 @@
+"""
+Measure exact (flat) and IVF vector search as the corpus grows.
+
+    python benchmarks/vector_index_bench.py --sizes 10000,50000,200000
+
+Receipts are synthetic and embedded with the hashing embedder (see
+embeddings), so the numbers need no network. For each corpus size it reports:
+- IVF training time (k-means plus sorting the rows by cluster)
+- base matrix memory (float32, dimensions * 4 bytes per receipt)
+- query latency percentiles for FlatIndex and IVFIndex, queries embedded
+  beforehand so only the search is timed
+- IVF recall@k: the share of the exact top k that IVF also returns
+"""
+import argparse
+import random
+
+import numpy as np
+
+from common import MERCHANTS, MONTHS, PRODUCTS, percentile, synthetic_receipts, time_call
+from embeddings import HashingEmbedder, embedding_text
+from vector_index import IVF_PROBES, FlatIndex, IVFIndex
+
+
+def make_queries(rng, count):
+    queries = []
+    for _ in range(count):
+        terms = [rng.choice(MERCHANTS)] + rng.sample(PRODUCTS, rng.randint(0, 2))
+        if rng.random() < 0.3:
+            terms.append(rng.choice(MONTHS))
+        queries.append(' '.join(terms))
+    return queries
+
+
+def latency_row(name, latencies):
+    return (f"{name:>14}{percentile(latencies, 50) * 1000:>10.2f}{percentile(latencies, 90) * 1000:>10.2f}"
+            f"{percentile(latencies, 99) * 1000:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,50000,200000')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--probes', type=int, default=IVF_PROBES)
+    parser.add_argument('--dimensions', type=int, default=256)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    embedder = HashingEmbedder(args.dimensions)
+    texts = [embedding_text(item) for item in synthetic_receipts(max(sizes))]
+    vectors, embed_seconds = time_call(
+        lambda: np.vstack([np.frombuffer(vector, dtype=np.float32) for vector in embedder.embed(texts)])
+    )
+    print(f"embedded {len(texts)} receipts in {embed_seconds:.1f}s "
+          f"({len(texts) / embed_seconds:.0f} receipts/s, {embedder.name})")
+
+    queries = [np.frombuffer(vector, dtype=np.float32)
+               for vector in embedder.embed(make_queries(random.Random(1), args.queries))]
+
+    for size in sizes:
+        matrix = np.ascontiguousarray(vectors[:size])
+        flat = FlatIndex(matrix)
+        (order, centroids, offsets), train_seconds = time_call(IVFIndex.train, matrix)
+        ivf = IVFIndex(matrix[order], centroids, offsets, probes=args.probes)
+
+        flat_latencies, ivf_latencies, recalls = [], [], []
+        for query in queries:
+            (exact, _), elapsed = time_call(flat.search, query, args.top_k)
+            flat_latencies.append(elapsed)
+            (approximate, _), elapsed = time_call(ivf.search, query, args.top_k)
+            ivf_latencies.append(elapsed)
+            recalls.append(len(set(exact) & set(order[approximate])) / max(1, len(exact)))
+
+        print(f"\n{size} receipts: base matrix {matrix.nbytes / 2 ** 20:.1f} MiB, "
+              f"IVF {len(centroids)} clusters trained in {train_seconds:.2f}s, "
+              f"recall@{args.top_k} {np.mean(recalls):.3f} with {args.probes} probes")
+        print(f"{'query (ms)':>14}{'p50':>10}{'p90':>10}{'p99':>10}")
+        print(latency_row('flat', flat_latencies))
+        print(latency_row("ivf", ivf_latencies))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Bulk import and re-extraction of receipts, outside the Lambda.
+
+    python bulk_import.py import ./scans --checkpoint scans.ckpt
+    python bulk_import.py import s3://old-bucket/scans/ --textract-tps 5
+    python bulk_import.py reindex --checkpoint reindex.ckpt
+
+`import` walks a local directory or an S3 prefix and stores every image as a
+receipt: upload to receipts/{id}.jpg, Textract, DynamoDB. `reindex` runs
+Textract again on every receipts/*.jpg already in the bucket and overwrites
+the items, e.g. after a parser change.
+
+The steps are lambda_function.process_receipt and store_receipts, the ingest
+Lambda's own code. Images are processed by a pool of IMPORT_WORKERS threads
+while a writer thread batches the finished receipts into DynamoDB, so uploads,
+Textract calls and writes overlap. Two token buckets keep the run within the
+account's Textract TPS quota and the tables' write capacity, leaving headroom
+for live traffic.
+
+Receipt IDs are derived from the image content, so a run can be stopped and
+restarted: the checkpoint file lists the sources already stored and a source
+processed twice overwrites the same receipt. Imported images are claimed in
+the ReceiptHashes table with ingest='bulk_import' before they are uploaded,
+which makes the S3-triggered Lambda skip them (see dedup), and images already
+stored under another receipt are skipped as duplicates.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+import lambda_function
+from dedup import DEDUP_UPLOADS, claim, claim_item, etag_key, sha256_key
+
+BUCKET_NAME = os.getenv('S3_BUCKET_NAME', 'my-receipt-manager-bucket')
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '8'))
+# Textract calls per second; the default DetectDocumentText quota is 10 TPS in most regions
+TEXTRACT_TPS = float(os.getenv('IMPORT_TEXTRACT_TPS', '5'))
+# Write capacity units per second for the Receipts and keyword index writes together, 0 for no limit
+DYNAMODB_WCU = float(os.getenv('IMPORT_DYNAMODB_WCU', '200'))
+# Seconds between progress lines
+PROGRESS_INTERVAL = 10
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+# Receipts per DynamoDB write, the batch_write_item limit
+WRITE_BATCH_SIZE = 25
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by worker threads: `rate` tokens per second, bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until `tokens` are available and take them. A rate of 0 never blocks.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        if not self.rate:
+            return 0.0
+        # A request larger than the bucket waits for a full bucket instead of forever
+        tokens = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class Checkpoint:
+    """
+    Sources already stored, one name per line, appended as their receipts are written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self._file = open(path, 'a') if path else None
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.done
+
+    def add(self, names):
+        with self._lock:
+            self.done.update(names)
+            if self._file:
+                self._file.writelines(f"{name}\n" for name in names)
+                self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def iter_local(directory):
+    """
+    Yield (name, load) for every image under a directory, in a stable order.
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_SUFFIXES):
+                path = os.path.join(root, filename)
+                yield path, lambda path=path: _read_file(path)
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def iter_s3(s3, bucket, prefix='', suffixes=IMAGE_SUFFIXES):
+    """
+    Yield (name, load) for every image under an S3 prefix.
+    """
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key.lower().endswith(suffixes):
+                yield f"s3://{bucket}/{key}", lambda key=key: s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+def write_units(item, tokens):
+    """
+    Estimate the WCUs of storing a receipt: 1 per started KB of the item, 1 per keyword posting.
+    """
+    size = len(json.dumps(item, default=str).encode('utf-8'))
+    return math.ceil(size / 1024) + len(tokens)
+
+
+class BulkImporter:
+    """
+    Runs sources through process_receipt and store_receipts with bounded rates.
+
+    Args:
+        bucket (str): Bucket receipts are stored in.
+        workers (int): Images processed concurrently.
+        textract_tps (float): Textract calls per second, 0 for no limit.
+        dynamodb_wcu (float): Write capacity units per second, 0 for no limit.
+        checkpoint (Checkpoint): Sources to skip, and where stored sources are recorded.
+        preprocess (bool): Normalize images with image_preprocess before uploading them.
+        reindex (bool): The sources are the bucket's own receipts/*.jpg, don't upload them again.
+    """
+
+    def __init__(self, bucket=BUCKET_NAME, workers=IMPORT_WORKERS, textract_tps=TEXTRACT_TPS,
+                 dynamodb_wcu=DYNAMODB_WCU, checkpoint=None, preprocess=False, reindex=False, log=print):
+        self.bucket = bucket
+        self.workers = workers
+        self.textract_bucket = TokenBucket(textract_tps)
+        self.write_bucket = TokenBucket(dynamodb_wcu)
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.preprocess = preprocess
+        self.reindex = reindex
+        self.log = log
+        self.stats = {'stored': 0, 'duplicates': 0, 'skipped': 0, 'failed': 0, 'resumed': 0,
+                      'textract_calls': 0, 'write_units': 0}
+        self._stats_lock = threading.Lock()
+        self._started = None
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def upload(self, name, data):
+        """
+        Store a source image as receipts/{id}.jpg, unless it's already stored under another receipt.
+
+        Returns:
+            str: The object key, or None for a duplicate.
+        """
+        # Content-derived, so a resumed run gives the same image the same receipt
+        digest = hashlib.sha256(data).hexdigest()
+        receipt_id = digest[:32]
+        if DEDUP_UPLOADS and claim(lambda_function.get_hashes_table(), sha256_key(digest), receipt_id) != receipt_id:
+            return None
+        if self.preprocess:
+            # Pillow is only needed for this option
+            from image_preprocess import preprocess_image
+            data, _ = preprocess_image(data)
+        if DEDUP_UPLOADS:
+            # The ETag of a single-part upload is the MD5; claiming it first makes the S3-triggered Lambda skip the object
+            owner = claim_item(lambda_function.get_hashes_table(), etag_key(hashlib.md5(data).hexdigest()),
+                               receipt_id, ingest='bulk_import')
+            if owner['receipt_id'] != receipt_id:
+                return None
+        object_key = f"receipts/{receipt_id}.jpg"
+        lambda_function.get_s3().put_object(Bucket=self.bucket, Key=object_key, Body=data, ContentType='image/jpeg')
+        return object_key
+
+    def process(self, name, load):
+        """
+        Upload (unless reindexing) and extract one source.
+
+        Returns:
+            tuple: (item, tokens) from process_receipt, or None if the source is not stored.
+        """
+        try:
+            if self.reindex:
+                object_key = name.split(f"s3://{self.bucket}/", 1)[-1]
+            else:
+                object_key = self.upload(name, load())
+                if object_key is None:
+                    self._count(duplicates=1)
+                    self.checkpoint.add([name])
+                    return None
+            self.textract_bucket.acquire()
+            self._count(textract_calls=1)
+            return lambda_function.process_receipt(self.bucket, object_key)
+        except lambda_function.ReceiptSkipped as e:
+            self.log(f"Skipped {name}: {e}")
+            self._count(skipped=1)
+            self.checkpoint.add([name])
+        except Exception as e:
+            self.log(f"Failed {name}: {e}")
+            self._count(failed=1)
+        return None
+
+    def _write(self, batch):
+        units = sum(write_units(item, tokens) for _, (item, tokens) in batch)
+        self.write_bucket.acquire(units)
+        try:
+            lambda_function.store_receipts([receipt for _, receipt in batch])
+        except Exception as e:
+            self.log(f"Failed to store {len(batch)} receipts: {e}")
+            self._count(failed=len(batch))
+            return
+        self._count(stored=len(batch), write_units=units)
+        self.checkpoint.add([name for name, _ in batch])
+
+    def _writer(self, results):
+        batch = []
+        last_progress = time.monotonic()
+        while True:
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                result = ()
+            if result is None:
+                break
+            if result:
+                batch.append(result)
+            # Write full batches, and partial ones while the workers wait on Textract
+            if len(batch) >= WRITE_BATCH_SIZE or (batch and not result):
+                self._write(batch)
+                batch = []
+            if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                self.log(self.summary())
+                last_progress = time.monotonic()
+        if batch:
+            self._write(batch)
+
+    def run(self, sources):
+        """
+        Process sources with the worker pool and write their receipts.
+
+        Args:
+            sources: (name, load) pairs, from iter_local or iter_s3.
+
+        Returns:
+            dict: Counters: stored, duplicates, skipped, failed, resumed, textract_calls, write_units.
+        """
+        self._started = time.monotonic()
+        results = queue.Queue()
+        writer = threading.Thread(target=self._writer, args=(results,), daemon=True)
+        writer.start()
+        # Bounds the sources in flight, so a large directory isn't read into memory up front
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def work(name, load):
+            try:
+                receipt = self.process(name, load)
+                if receipt is not None:
+                    results.put((name, receipt))
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for name, load in sources:
+                if name in self.checkpoint:
+                    self._count(resumed=1)
+                    continue
+                slots.acquire()
+                executor.submit(work, name, load)
+        results.put(None)
+        writer.join()
+        return self.stats
+
+    def summary(self):
+        """
+        One line of progress: counters and throughput since run() started.
+        """
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        stats = self.stats
+        return (f"{stats['stored']} stored, {stats['duplicates']} duplicates, {stats['skipped']} skipped, "
+                f"{stats['failed']} failed, {stats['resumed']} already done in {elapsed:.1f}s: "
+                f"{stats['stored'] / elapsed:.1f} receipts/s, {stats['textract_calls'] / elapsed:.1f} Textract calls/s, "
+                f"{stats['write_units'] / elapsed:.1f} WCU/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import or re-extract receipts.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Store every image in a directory or S3 prefix as a receipt.")
+    import_parser.add_argument('source', help="A local directory or s3://bucket/prefix")
+    import_parser.add_argument('--preprocess', action='store_true', help="Normalize images as /upload does")
+    reindex_parser = subparsers.add_parser('reindex', help="Run Textract again on every stored receipt image.")
+    for subparser in (import_parser, reindex_parser):
+        subparser.add_argument('--bucket', default=BUCKET_NAME)
+        subparser.add_argument('--checkpoint', default=None, help="File recording finished sources, to resume a run")
+        subparser.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+        subparser.add_argument('--textract-tps', type=float, default=TEXTRACT_TPS)
+        subparser.add_argument('--dynamodb-wcu', type=float, default=DYNAMODB_WCU)
+    args = parser.parse_args(argv)
+
+    checkpoint = Checkpoint(args.checkpoint)
+    importer = BulkImporter(args.bucket, args.workers, args.textract_tps, args.dynamodb_wcu, checkpoint,
+                            preprocess=getattr(args, 'preprocess', False), reindex=args.command == 'reindex')
+    if args.command == 'reindex':
+        sources = iter_s3(lambda_function.get_s3(), args.bucket, 'receipts/', suffixes=('.jpg',))
+    elif args.source.startswith('s3://'):
+        source_bucket, _, prefix = args.source[len('s3://'):].partition('/')
+        sources = iter_s3(boto3.client('s3'), source_bucket, prefix)
+    else:
+        sources = iter_local(args.source)
+    try:
+        importer.run(sources)
+    finally:
+        checkpoint.close()
+    print(importer.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Duplicate receipt detection by content hash.
+
+Mobile clients retry uploads, so the same receipt often arrives twice. Every
+stored receipt image is recorded in the ReceiptHashes table under the hashes
+it can be recognized by, each claimed by exactly one receipt_id:
+
+    sha256#<hex>      SHA-256 of the bytes posted to /upload, before preprocessing
+    etag#<etag>       S3 ETag of receipts/{id}.jpg (the MD5 for single-part uploads)
+    dhash#<band>#<v>  one band of the image's 64-bit difference hash, for
+                      re-photographed receipts (PERCEPTUAL_DEDUP, off by default)
+
+/upload hashes the file as it reads it and answers a known hash with the
+existing receipt_id without storing anything. Uploads presigned straight to
+S3 are only seen by S3, so the ingest Lambda claims the object's ETag before
+calling Textract and skips objects whose ETag another receipt already owns;
+/upload/complete checks the same claim. Claims are conditional puts, so two
+concurrent uploads of one image can't both win.
+
+bulk_import claims the ETag of every image it uploads with ingest='bulk_import'
+before the upload triggers the Lambda, and runs Textract itself; the Lambda
+skips those objects.
+
+Each hash item counts the duplicates it caught; `python dedup.py stats`
+adds them up, the Textract calls dedup avoided.
+
+A perceptual match is a near-duplicate image, which can also be a different
+receipt from the same till, so it's reported as 'similar' and the
+threshold is kept small. The 64 bits are split into DHASH_MAX_DISTANCE + 1
+bands: two hashes at most that many bits apart agree on at least one band
+exactly, so looking up the bands finds every candidate.
+"""
+import argparse
+import hashlib
+import os
+
+import boto3
+from botocore.exceptions import ClientError
+
+RECEIPT_HASHES_TABLE = os.getenv('RECEIPT_HASHES_TABLE', 'ReceiptHashes')
+DEDUP_UPLOADS = os.getenv('DEDUP_UPLOADS', 'true').lower() in ('1', 'true', 'yes')
+PERCEPTUAL_DEDUP = os.getenv('PERCEPTUAL_DEDUP', 'false').lower() in ('1', 'true', 'yes')
+# Most differing dHash bits for two images to count as the same receipt
+DHASH_MAX_DISTANCE = int(os.getenv('DHASH_MAX_DISTANCE', '3'))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DHASH_BITS = 64
+
+
+def content_hash(file):
+    """
+    SHA-256 of a file object, read in chunks and rewound for the upload.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def sha256_key(digest):
+    return f"sha256#{digest}"
+
+
+def etag_key(etag):
+    # S3 reports ETags quoted in HeadObject and unquoted in event notifications
+    return 'etag#' + etag.strip('"')
+
+
+def dhash_bands(value, max_distance=DHASH_MAX_DISTANCE):
+    """
+    Split a dHash into the band keys it is indexed under.
+
+    Returns:
+        list: max_distance + 1 keys.
+    """
+    bands = max_distance + 1
+    keys = []
+    for band in range(bands):
+        start, end = band * DHASH_BITS // bands, (band + 1) * DHASH_BITS // bands
+        bits = (value >> start) & ((1 << (end - start)) - 1)
+        keys.append(f"dhash#{band}#{bits:x}")
+    return keys
+
+
+def hamming_distance(first, second):
+    return bin(first ^ second).count('1')
+
+
+def lookup(table, hash_key):
+    """
+    Get the receipt that claimed a hash.
+
+    Returns:
+        str: Its receipt_id, or None if the hash is new.
+    """
+    item = table.get_item(Key={'hash_key': hash_key}, ConsistentRead=True).get('Item')
+    return item['receipt_id'] if item else None
+
+
+def claim_item(table, hash_key, receipt_id, **attributes):
+    """
+    Claim a hash for a receipt, unless another receipt claimed it first.
+
+    Args:
+        attributes: Stored on the hash item with the claim, e.g. ingest='bulk_import'.
+
+    Returns:
+        dict: The hash item: the new claim, or the earlier one (which may be receipt_id's own).
+    """
+    item = dict(attributes, hash_key=hash_key, receipt_id=receipt_id)
+    try:
+        table.put_item(Item=item, ConditionExpression='attribute_not_exists(hash_key)')
+        return item
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+    return table.get_item(Key={'hash_key': hash_key}, ConsistentRead=True).get('Item') or item
+
+
+def claim(table, hash_key, receipt_id):
+    """
+    Claim a hash for a receipt, unless another receipt claimed it first.
+
+    Returns:
+        str: The receipt_id owning the hash: receipt_id itself if the claim succeeded (or it already owned it).
+    """
+    return claim_item(table, hash_key, receipt_id)['receipt_id']
+
+
+def record_duplicate(table, hash_key):
+    """
+    Count a duplicate caught by a hash (one Textract call avoided).
+    """
+    table.update_item(Key={'hash_key': hash_key}, UpdateExpression='ADD duplicates :one',
+                      ExpressionAttributeValues={':one': 1})
+
+
+def index_dhash(table, value, receipt_id, max_distance=DHASH_MAX_DISTANCE):
+    """
+    Add a receipt's dHash to the band items find_similar looks up.
+    """
+    entry = f"{receipt_id}:{value:016x}"
+    for hash_key in dhash_bands(value, max_distance):
+        table.update_item(Key={'hash_key': hash_key}, UpdateExpression='ADD entries :entry',
+                          ExpressionAttributeValues={':entry': {entry}})
+
+
+def find_similar(dynamodb, value, max_distance=DHASH_MAX_DISTANCE, table_name=RECEIPT_HASHES_TABLE):
+    """
+    Find the indexed receipt whose dHash is closest to value, within max_distance bits.
+
+    Args:
+        dynamodb: The DynamoDB service resource.
+        value (int): The new image's dHash.
+
+    Returns:
+        tuple: (receipt_id, band key that found it), or (None, None).
+    """
+    keys = dhash_bands(value, max_distance)
+    response = dynamodb.batch_get_item(RequestItems={table_name: {'Keys': [{'hash_key': key} for key in keys]}})
+    best = (max_distance + 1, None, None)
+    for item in response.get('Responses', {}).get(table_name, []):
+        for entry in item.get('entries', ()):
+            receipt_id, _, other = entry.rpartition(':')
+            distance = hamming_distance(value, int(other, 16))
+            if distance < best[0]:
+                best = (distance, receipt_id, item['hash_key'])
+    return best[1], best[2]
+
+
+def avoided_calls(table):
+    """
+    Add up the duplicates every hash caught.
+
+    Returns:
+        dict: Duplicates per hash kind ('sha256', 'etag', 'dhash') and their 'total'.
+    """
+    counts = {'sha256': 0, 'etag': 0, 'dhash': 0}
+    kwargs = {'ProjectionExpression': 'hash_key, duplicates'}
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get('Items', []):
+            kind = item['hash_key'].split('#', 1)[0]
+            counts[kind] = counts.get(kind, 0) + int(item.get('duplicates', 0))
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    counts['total'] = sum(counts.values())
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receipt deduplication tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    stats_parser = subparsers.add_parser('stats', help="Count the Textract calls deduplication avoided.")
+    stats_parser.add_argument('--table', default=RECEIPT_HASHES_TABLE)
+    stats_parser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+    args = parser.parse_args(argv)
+
+    table = boto3.resource('dynamodb', region_name=args.region).Table(args.table)
+    counts = avoided_calls(table)
+    print(f"Textract calls avoided: {counts.pop('total')} "
+          f"({', '.join(f'{kind}: {count}' for kind, count in counts.items())})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Text embeddings for semantic receipt search.
+
+With EMBEDDINGS=true (off by default, for SEARCH_BACKEND=vector only) the
+ingest Lambda embeds every receipt and stores the vector on its item
+(`embedding`, float32 bytes, with the `embedding_model` that produced it;
+on its ReceiptTexts item in the compact layout, see receipt_storage);
+the app embeds queries with the same provider and compares them with
+vector_index. Providers, chosen with EMBEDDING_PROVIDER:
+
+- 'hashing' (default): a deterministic local embedder. Word unigrams and
+  bigrams are hashed into HASHING_DIMENSIONS signed buckets (the hashing
+  trick), then the vector is L2-normalized. No network, no model, the same
+  output everywhere, which makes it suitable for tests and offline use; it
+  matches shared words rather than meaning.
+- 'openai': OpenAI's embeddings API (OPENAI_EMBEDDING_MODEL).
+
+Receipts are embedded together with their structured fields (merchant,
+month name, year), so "starbucks receipts in september" lands near a
+Starbucks receipt dated 12/09/2024 even though "september" isn't on it.
+
+Vectors are array('f') so the Lambda doesn't need numpy.
+
+    python embeddings.py backfill --region ap-southeast-2
+"""
+import argparse
+import calendar
+import functools
+import hashlib
+import math
+import os
+from array import array
+
+import boto3
+
+import receipt_storage
+from tokenizer import tokenize
+
+EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'hashing')
+HASHING_DIMENSIONS = int(os.getenv('HASHING_DIMENSIONS', '256'))
+OPENAI_EMBEDDING_MODEL = os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-ada-002')
+# Bigrams count half as much as single words
+BIGRAM_WEIGHT = 0.5
+# Texts per OpenAI embeddings request
+OPENAI_BATCH_SIZE = 100
+
+
+def normalize(vector):
+    """
+    Scale a vector to unit length in place (cosine similarity becomes a dot product).
+
+    Returns:
+        array: The vector.
+    """
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm:
+        for index in range(len(vector)):
+            vector[index] /= norm
+    return vector
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder using the hashing trick.
+
+    Args:
+        dimensions (int): Vector size.
+    """
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def _add(self, vector, feature, weight):
+        digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+        # Signed buckets keep collisions from only ever adding up
+        vector[digest % self.dimensions] += weight if digest >> 63 else -weight
+
+    def embed_one(self, text):
+        vector = array('f', bytes(4 * self.dimensions))
+        tokens = tokenize(text)
+        for token in tokens:
+            self._add(vector, token, 1.0)
+        for first, second in zip(tokens, tokens[1:]):
+            self._add(vector, f"{first} {second}", BIGRAM_WEIGHT)
+        return normalize(vector)
+
+    def embed(self, texts):
+        """
+        Embed texts.
+
+        Args:
+            texts (list): Texts to embed.
+
+        Returns:
+            list: One unit-length array('f') per text.
+        """
+        return [self.embed_one(text) for text in texts]
+
+
+class OpenAIEmbedder:
+    """
+    Embedder backed by OpenAI's embeddings API.
+
+    Args:
+        model (str): Embedding model name.
+    """
+
+    def __init__(self, model=OPENAI_EMBEDDING_MODEL):
+        self.model = model
+        self.name = f"openai-{model}"
+
+    def embed(self, texts):
+        import openai
+        vectors = []
+        for start in range(0, len(texts), OPENAI_BATCH_SIZE):
+            response = openai.Embedding.create(model=self.model, input=texts[start:start + OPENAI_BATCH_SIZE])
+            for entry in sorted(response['data'], key=lambda entry: entry['index']):
+                vectors.append(normalize(array('f', entry['embedding'])))
+        return vectors
+
+
+def get_embedder(provider=None):
+    """
+    Create the embedder for a provider name.
+
+    Args:
+        provider (str): 'hashing' or 'openai', defaults to EMBEDDING_PROVIDER.
+
+    Raises:
+        ValueError: If the provider is unknown.
+    """
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == 'hashing':
+        return HashingEmbedder()
+    if provider == 'openai':
+        return OpenAIEmbedder()
+    raise ValueError(f"Unknown embedding provider: {provider}")
+
+
+def embedding_text(item):
+    """
+    Text embedded for a receipt: its structured fields, then its raw text.
+
+    Args:
+        item (dict): The receipt item.
+
+    Returns:
+        str: The text to embed.
+    """
+    parts = []
+    if item.get('merchant'):
+        parts.append(item['merchant'])
+    month = item.get('receipt_month')
+    if month:
+        year, month_number = month.split('-')
+        parts.append(f"{calendar.month_name[int(month_number)].lower()} {year}")
+    parts.append(item.get('raw_text') or '')
+    return "\n".join(parts)
+
+
+def to_bytes(vector):
+    """
+    Serialize a vector for the item's `embedding` attribute (little-endian float32).
+    """
+    return array('f', vector).tobytes()
+
+
+def from_bytes(value):
+    """
+    Read an `embedding` attribute (bytes, or the Binary boto3 returns) into an array('f').
+    """
+    vector = array('f')
+    vector.frombytes(bytes(getattr(value, 'value', value)))
+    return vector
+
+
+def embed_item(item, embedder):
+    """
+    Add `embedding` and `embedding_model` to a receipt item.
+
+    Args:
+        item (dict): The receipt item, with raw_text and optionally structured fields.
+        embedder: An embedder from get_embedder.
+
+    Returns:
+        dict: The item.
+    """
+    item['embedding'] = to_bytes(embedder.embed([embedding_text(item)])[0])
+    item['embedding_model'] = embedder.name
+    return item
+
+
+def backfill(table, embedder, batch_size=25, get_texts=None, texts_table=None):
+    """
+    Embed every receipt that has no embedding from this embedder yet.
+
+    Inline receipts are embedded from their raw_text and updated in place.
+    Compact ones (see receipt_storage) have their texts fetched with
+    get_texts and their embeddings written to ReceiptTexts, where the vector
+    index reads them; their Receipts item records the embedding_model so a
+    rerun skips them.
+
+    Args:
+        table: The Receipts Table.
+        embedder: An embedder from get_embedder.
+        batch_size (int): Receipts embedded per call.
+        get_texts (callable): receipt_ids -> {receipt_id: raw_text}, e.g. a bound receipt_storage.fetch_texts.
+        texts_table: The ReceiptTexts Table. Compact receipts are skipped without it and get_texts.
+
+    Returns:
+        int: Number of receipts updated.
+    """
+    from parallel_scan import iter_scan_pages
+
+    projection = {
+        'ProjectionExpression': 'receipt_id, embedding_model, token_signature, merchant, receipt_month, raw_text'
+    }
+    updated = 0
+    for page in iter_scan_pages(table, **projection):
+        pending = [item for item in page if item.get('embedding_model') != embedder.name and (
+            item.get('raw_text') or (texts_table is not None and item.get('token_signature') is not None))]
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            compact_ids = [item['receipt_id'] for item in batch if 'raw_text' not in item]
+            texts = get_texts(compact_ids) if compact_ids else {}
+            batch = [item if 'raw_text' in item else dict(item, raw_text=texts.get(item['receipt_id']))
+                     for item in batch]
+            batch = [item for item in batch if item['raw_text']]
+            vectors = embedder.embed([embedding_text(item) for item in batch])
+            for item, vector in zip(batch, vectors):
+                values = {':embedding': to_bytes(vector), ':model': embedder.name}
+                if item['receipt_id'] in compact_ids:
+                    texts_table.update_item(
+                        Key={'receipt_id': item['receipt_id']},
+                        UpdateExpression='SET embedding = :embedding, embedding_model = :model',
+                        ExpressionAttributeValues=values
+                    )
+                    table.update_item(
+                        Key={'receipt_id': item['receipt_id']},
+                        UpdateExpression='SET embedding_model = :model',
+                        ExpressionAttributeValues={':model': embedder.name}
+                    )
+                else:
+                    table.update_item(
+                        Key={'receipt_id': item['receipt_id']},
+                        UpdateExpression='SET embedding = :embedding, embedding_model = :model',
+                        ExpressionAttributeValues=values
+                    )
+                updated += 1
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute receipt embeddings.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help="Embed receipts that have no embedding yet.")
+    backfill_parser.add_argument('--table', default='Receipts')
+    backfill_parser.add_argument('--texts-table', default=receipt_storage.RECEIPT_TEXTS_TABLE)
+    backfill_parser.add_argument('--bucket', default=receipt_storage.TEXT_BUCKET)
+    backfill_parser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+    backfill_parser.add_argument('--provider', default=EMBEDDING_PROVIDER)
+    args = parser.parse_args(argv)
+
+    dynamodb = boto3.resource('dynamodb', region_name=args.region)
+    s3 = boto3.client('s3', region_name=args.region)
+    get_texts = functools.partial(receipt_storage.fetch_texts, dynamodb, s3,
+                                  table_name=args.texts_table, bucket=args.bucket)
+    updated = backfill(dynamodb.Table(args.table), get_embedder(args.provider),
+                       get_texts=get_texts, texts_table=dynamodb.Table(args.texts_table))
+    print(f"Embedded {updated} receipts.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+gunicorn settings for serving the Flask app in production.
+
+    gunicorn --config gunicorn.conf.py app:app
+
+Every setting can be overridden from the environment (GUNICORN_* variables,
+PORT and WEB_CONCURRENCY) without rebuilding the image.
+
+Requests mostly wait on OpenAI, DynamoDB and S3, so the default is the
+gthread worker: one process per available CPU, each serving GUNICORN_THREADS
+requests at a time. The app is preloaded in the master so workers share the
+imported modules and configuration copy-on-write and start faster; nothing
+opens a network connection at import, and the few per-process resources
+(SQLite keyword cache, thread and process pools, the async event loop) are
+created after the fork or reopened in post_fork.
+"""
+import os
+
+
+def available_cpus():
+    """
+    CPUs this container may use: the cgroup CPU quota when set (ECS/Fargate), else the CPU affinity.
+    """
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# gthread for the I/O-bound request mix; 'sync' for one request per process, or 'gevent' if it is installed
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', str(max(2, available_cpus()))))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Connections per gevent worker (ignored by gthread)
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# Keep connections from the load balancer open longer than its idle timeout (ALB default: 60s),
+# otherwise gunicorn may close a connection the ALB is about to reuse and the client gets a 502
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '75'))
+
+# Longer than the slowest request (OpenAI timeout, ASYNC_TIMEOUT) so busy workers aren't killed
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+# ECS sends SIGTERM and waits stopTimeout (30s by default) before SIGKILL; finish in-flight requests before that
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '25'))
+
+# Recycle workers now and then to bound memory growth; jitter keeps them from restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# The worker heartbeat file lives in memory; /tmp may be slow or disk-backed in containers
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Set GUNICORN_ACCESS_LOG to an empty value to turn the access log off
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+# Trust X-Forwarded-* from the load balancer in front of the task
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '*')
+
+
+def post_fork(server, worker):
+    # The SQLite keyword cache connection was opened in the master when the app was preloaded
+    import utils
+    utils.keyword_cache.reopen()
+    # Threads don't survive the fork: warm and sync the receipt cache from each worker
+    if utils.RECEIPT_CACHE:
+        utils.get_receipt_cache().start()
@@ -0,0 +1,135 @@
+"""
+Receipt image normalization before upload and Textract.
+
+preprocess_image fixes the EXIF orientation, converts to grayscale, downscales
+so the long edge is at most OCR_MAX_DIMENSION pixels and recompresses as JPEG.
+Phone photos shrink from several MB to a few hundred KB while keeping enough
+resolution for Textract, and every object stored under receipts/{id}.jpg is
+really a JPEG.
+
+The work is CPU-bound, so it runs in a process pool (see preprocess_in_pool)
+rather than on the web server's request threads.
+"""
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Long edge in pixels after downscaling; receipts stay legible for OCR well below phone camera resolution
+OCR_MAX_DIMENSION = int(os.getenv('OCR_MAX_DIMENSION', '2000'))
+JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', '85'))
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', str(os.cpu_count() or 1)))
+
+# Images larger than this many pixels are rejected before decoding (decompression bombs)
+Image.MAX_IMAGE_PIXELS = 80_000_000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def preprocess_image(data, max_dimension=OCR_MAX_DIMENSION, quality=JPEG_QUALITY):
+    """
+    Normalize a receipt image for OCR.
+
+    Args:
+        data (bytes): The uploaded image, any format Pillow can read.
+        max_dimension (int): Maximum width and height of the result.
+        quality (int): JPEG quality of the result.
+
+    Returns:
+        tuple: (JPEG bytes, dict with the original and new size in bytes and the new width and height).
+
+    Raises:
+        ValueError: If the data is not a readable image.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Apply the camera's EXIF orientation, Textract and browsers may not
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('L')
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+    # thumbnail keeps the aspect ratio and never upscales
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    processed = output.getvalue()
+    return processed, {
+        'original_bytes': len(data),
+        'bytes': len(processed),
+        'width': image.width,
+        'height': image.height,
+    }
+
+
+def dhash(data, size=8):
+    """
+    Difference hash of an image: which of each pair of neighbouring pixels is brighter.
+
+    The image is shrunk to (size + 1) x size grayscale pixels first, so
+    re-encoding, rescaling and small lighting changes flip few bits.
+
+    Args:
+        data (bytes): The image.
+        size (int): Hash size; the hash has size * size bits.
+
+    Returns:
+        int: The hash.
+
+    Raises:
+        ValueError: If the data is not a readable image.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Let the JPEG decoder downscale while decoding
+        image.draft('L', (size * 8, size * 8))
+        image = ImageOps.exif_transpose(image).convert('L').resize((size + 1, size), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+    pixels = image.tobytes()
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            value = value << 1 | (left > pixels[row * (size + 1) + column + 1])
+    return value
+
+
+def get_pool():
+    """
+    Get the shared process pool, creating it on first use.
+
+    Workers are spawned rather than forked, so they don't inherit the web
+    server's threads and locks.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def preprocess_in_pool(data, max_dimension=OCR_MAX_DIMENSION, quality=JPEG_QUALITY):
+    """
+    Run preprocess_image in the process pool and wait for the result.
+
+    Args:
+        data (bytes): The uploaded image.
+        max_dimension (int): Maximum width and height of the result.
+        quality (int): JPEG quality of the result.
+
+    Returns:
+        tuple: Same as preprocess_image.
+
+    Raises:
+        ValueError: If the data is not a readable image.
+    """
+    return get_pool().submit(preprocess_image, data, max_dimension, quality).result()
@@ -0,0 +1,135 @@
+"""
+Structured JSON logs with sampling, in place of the print diagnostics.
+
+Each record is one JSON object per line on stdout (picked up by the ECS
+awslogs driver and Lambda alike):
+
+    {"time": "2024-09-12T10:00:00.123Z", "level": "INFO", "logger": "receipt_manager",
+     "event": "openai_response", "message": "...", "raw_response": "[\"milk\"]"}
+
+Pass structured fields with extra={'fields': {...}}; they become top-level
+keys next to the message.
+
+Logging every search would cost more than some of the searches, so records
+below WARNING are sampled: a request is logged with probability
+LOG_SAMPLE_RATE and then all of its records are kept, so a sampled request
+tells its whole story. Warnings and errors are always logged. The
+sampling decision is made before the record is formatted, so dropped
+records cost next to nothing.
+"""
+import contextvars
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+
+# Share of requests whose INFO/DEBUG records are logged; warnings and errors are always logged
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+_sampled = contextvars.ContextVar('log_sampled', default=None)
+
+
+def sample_request(rate=None):
+    """
+    Decide whether the current request's INFO/DEBUG records are logged.
+
+    Args:
+        rate (float): Sampling probability, LOG_SAMPLE_RATE by default.
+
+    Returns:
+        bool: True if the request is sampled.
+    """
+    sampled = random.random() < (LOG_SAMPLE_RATE if rate is None else rate)
+    _sampled.set(sampled)
+    return sampled
+
+
+def end_request():
+    _sampled.set(None)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep warnings and errors, and lower-level records of sampled requests.
+
+    Records logged outside a request are sampled one by one.
+    """
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        sampled = _sampled.get()
+        if sampled is None:
+            return random.random() < LOG_SAMPLE_RATE
+        return sampled
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as a single-line JSON object.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                    .isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StdoutHandler(logging.Handler):
+    """
+    Write each formatted record to the current sys.stdout in a single write.
+    """
+
+    def emit(self, record):
+        try:
+            sys.stdout.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+def get_logger(name):
+    """
+    Get a logger writing sampled JSON lines to stdout, configuring it on first use.
+
+    Args:
+        name (str): Logger name.
+
+    Returns:
+        logging.Logger: The configured logger. It doesn't propagate, so records aren't
+        printed a second time by the root logger's handlers (e.g. the Lambda runtime's).
+    """
+    logger = logging.getLogger(name)
+    if not any(isinstance(handler, StdoutHandler) for handler in logger.handlers):
+        handler = StdoutHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.addFilter(SamplingFilter())
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+
+def log_event(logger, level, event, message, **fields):
+    """
+    Log a named event with structured fields.
+
+    Args:
+        logger (logging.Logger): A logger from get_logger.
+        level (int): Logging level, e.g. logging.INFO.
+        event (str): Short machine-readable event name.
+        message (str): Human-readable message.
+        **fields: More keys for the JSON object.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'fields': dict(fields, event=event)})
@@ -0,0 +1,278 @@
+"""
+Cache for LLM keyword extraction results.
+
+Queries are normalized (case and whitespace) and their keywords kept in a
+bounded LRU with a TTL. Concurrent requests for the same uncached query are
+coalesced so only one of them calls the LLM and the others wait for its
+result. When a path is given, entries are also written to a SQLite file so
+the cache survives process and container restarts (point it at a mounted
+volume on Fargate).
+
+get_or_compute_async is the same cache for coroutines running on one event
+loop; it coalesces concurrent coroutines with futures instead of blocking.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """
+    Normalize a query so trivially different spellings share a cache entry.
+    """
+    return ' '.join(query.lower().split())
+
+
+class _InFlight:
+    """
+    A computation other threads can wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class KeywordCache:
+    """
+    LRU + TTL cache of query -> keywords with single-flight and optional SQLite backing.
+
+    Args:
+        max_entries (int): Maximum number of queries kept in memory.
+        ttl (float): Seconds an entry stays valid.
+        path (str): SQLite file for the persistent copy, None to keep the cache in memory only.
+    """
+
+    def __init__(self, max_entries=1024, ttl=86400, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._async_in_flight = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.compute_count = 0
+        self.compute_seconds = 0.0
+
+        if path:
+            self._connect()
+
+    def _connect(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS keywords "
+                "(query TEXT PRIMARY KEY, keywords TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM keywords WHERE expires_at <= ?", (time.time(),))
+
+    def reopen(self):
+        """
+        Replace the SQLite connection with a new one.
+
+        SQLite connections must not be used across fork(), so a worker process
+        forked after the cache was created (gunicorn --preload) calls this first.
+        """
+        if self.path:
+            self._db_lock = threading.Lock()
+            self._connect()
+
+    def _lookup(self, key, now):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        keywords, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return keywords
+
+    def _store(self, key, keywords, expires_at):
+        # Caller holds the lock
+        self._entries[key] = (keywords, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_persistent(self, key, now):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT keywords, expires_at FROM keywords WHERE query = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _save_persistent(self, key, keywords, expires_at):
+        if self._db is None:
+            return
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO keywords (query, keywords, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(keywords), expires_at)
+            )
+
+    def get_or_compute(self, query, compute):
+        """
+        Get the keywords for a query, computing them at most once across concurrent callers.
+
+        Empty results are returned but not cached, so a failed LLM call is retried next time.
+
+        Args:
+            query (str): The user's search query.
+            compute (callable): compute(query) -> list of keywords.
+
+        Returns:
+            list: The keywords for the query.
+        """
+        key = normalize_query(query)
+        now = time.time()
+
+        with self._lock:
+            keywords = self._lookup(key, now)
+            if keywords is not None:
+                self.hits += 1
+                return list(keywords)
+
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+
+        # Another request is already computing this query, wait for its result
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return list(in_flight.result)
+
+        try:
+            keywords = self._load_persistent_into_memory(key, now)
+            if keywords is None:
+                start = time.perf_counter()
+                keywords = compute(query)
+                self._record_computed(key, keywords, time.perf_counter() - start)
+            in_flight.result = keywords
+            return list(keywords)
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    async def get_or_compute_async(self, query, compute):
+        """
+        Coroutine version of get_or_compute, for callers on a single event loop.
+
+        Args:
+            query (str): The user's search query.
+            compute (callable): Coroutine function, compute(query) -> list of keywords.
+
+        Returns:
+            list: The keywords for the query.
+        """
+        key = normalize_query(query)
+        now = time.time()
+
+        with self._lock:
+            keywords = self._lookup(key, now)
+            if keywords is not None:
+                self.hits += 1
+                return list(keywords)
+            future = self._async_in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+
+        # Another coroutine is already computing this query, wait for its result
+        if future is not None:
+            return list(await asyncio.shield(future))
+
+        future = self._async_in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            keywords = self._load_persistent_into_memory(key, now)
+            if keywords is None:
+                start = time.perf_counter()
+                keywords = await compute(query)
+                self._record_computed(key, keywords, time.perf_counter() - start)
+            future.set_result(keywords)
+            return list(keywords)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no other coroutine was waiting
+            future.exception()
+            raise
+        finally:
+            del self._async_in_flight[key]
+
+    def _load_persistent_into_memory(self, key, now):
+        persisted = self._load_persistent(key, now)
+        if persisted is None:
+            return None
+        keywords, expires_at = persisted
+        with self._lock:
+            self.persistent_hits += 1
+            self._store(key, keywords, expires_at)
+        return keywords
+
+    def _record_computed(self, key, keywords, elapsed):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self.misses += 1
+            self.compute_count += 1
+            self.compute_seconds += elapsed
+            if keywords:
+                self._store(key, keywords, expires_at)
+        if keywords:
+            self._save_persistent(key, keywords, expires_at)
+
+    def clear(self):
+        """
+        Drop every cached entry (memory and SQLite) and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.persistent_hits = self.misses = self.coalesced = 0
+            self.compute_count = 0
+            self.compute_seconds = 0.0
+        if self._db is not None:
+            with self._db_lock, self._db:
+                self._db.execute("DELETE FROM keywords")
+
+    def stats(self):
+        """
+        Report hit/miss counters and the latency of the computations the cache made.
+
+        Returns:
+            dict: Cache statistics.
+        """
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses + self.coalesced
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+                'compute_count': self.compute_count,
+                'compute_seconds_total': self.compute_seconds,
+                'compute_seconds_avg': self.compute_seconds / self.compute_count if self.compute_count else 0.0,
+            }
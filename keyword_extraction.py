@@ -0,0 +1,252 @@
+"""
+Pluggable keyword extraction for search queries.
+
+A KeywordExtractionPipeline runs a list of extractors in order and returns
+the first confident result. The LocalKeywordExtractor handles the common
+short queries ("starbucks", "woolworths milk", "coles receipts in march")
+deterministically in microseconds; anything it is not confident about falls
+through to OpenAI. Every extractor's latency is recorded so the split can be
+watched in production.
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import deque
+
+from merchants import KNOWN_MERCHANTS
+from tokenizer import tokenize
+
+# Words that carry no search meaning in a receipt query
+STOPWORDS = frozenset("""
+    a an and any all at bought by can find for from get give i in is it list me my of on or our please
+    purchase purchases receipt receipts search show the to were what which with
+""".split())
+
+MONTHS = {
+    'jan': 'january', 'january': 'january', 'feb': 'february', 'february': 'february',
+    'mar': 'march', 'march': 'march', 'apr': 'april', 'april': 'april', 'may': 'may',
+    'jun': 'june', 'june': 'june', 'jul': 'july', 'july': 'july', 'aug': 'august', 'august': 'august',
+    'sep': 'september', 'sept': 'september', 'september': 'september', 'oct': 'october', 'october': 'october',
+    'nov': 'november', 'november': 'november', 'dec': 'december', 'december': 'december',
+}
+
+# Words that mean the query needs real language understanding (relative dates, comparisons, totals)
+COMPLEX_MARKERS = frozenset("""
+    after ago before between cheapest cost costs expensive how last latest least less more most much
+    next over previous recent since spend spending spent than this today under week weekend when
+    yesterday year
+""".split())
+
+DATE_PATTERN = re.compile(r"^(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|(19|20)\d{2})$")
+
+# Queries with more unrecognized words than this are handed to the next extractor
+MAX_PLAIN_TERMS = 3
+
+
+class ExtractorMetrics:
+    """
+    Call counts and a rolling window of latencies for one extractor.
+    """
+
+    def __init__(self, window=2048):
+        self.calls = 0
+        self.confident = 0
+        self.total_seconds = 0.0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, confident):
+        with self._lock:
+            self.calls += 1
+            self.confident += 1 if confident else 0
+            self.total_seconds += seconds
+            self._latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            calls, confident, total_seconds = self.calls, self.confident, self.total_seconds
+
+        def percentile(pct):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(pct / 100.0 * len(latencies)))]
+
+        return {
+            'calls': calls,
+            'confident': confident,
+            'seconds_total': total_seconds,
+            'p50_seconds': percentile(50),
+            'p99_seconds': percentile(99),
+        }
+
+
+class LocalKeywordExtractor:
+    """
+    Deterministic extractor: tokenizer, stopword removal, month/date and merchant recognition.
+
+    Args:
+        merchants (iterable): Merchant names to recognize, multi-word names allowed.
+    """
+
+    name = 'local'
+
+    def __init__(self, merchants=KNOWN_MERCHANTS):
+        # Index merchants by their token tuples; lookups try the longest match first so "uber eats" wins over "uber"
+        self.merchants = {}
+        for merchant in merchants:
+            tokens = tuple(tokenize(merchant))
+            if tokens:
+                self.merchants[tokens] = merchant
+        self.max_merchant_tokens = max((len(tokens) for tokens in self.merchants), default=1)
+
+    def extract(self, query):
+        """
+        Extract keywords from a query.
+
+        Args:
+            query (str): The user's search query.
+
+        Returns:
+            tuple: (list of keywords, True if the extractor understood the whole query).
+        """
+        tokens = tokenize(query)
+        keywords = []
+        plain_terms = 0
+        confident = True
+        position = 0
+
+        while position < len(tokens):
+            merchant = self._match_merchant(tokens, position)
+            if merchant:
+                keywords.append(merchant[0])
+                position += merchant[1]
+                continue
+
+            token = tokens[position]
+            position += 1
+            if token in STOPWORDS:
+                continue
+            if token in COMPLEX_MARKERS:
+                confident = False
+            elif token in MONTHS:
+                keywords.append(MONTHS[token])
+                continue
+            elif DATE_PATTERN.match(token) or token.isdigit():
+                # Dates and numbers ("12/09/2024" tokenizes to "12", "09", "2024") are matched as-is
+                keywords.append(token)
+                continue
+            plain_terms += 1
+            keywords.append(token)
+
+        keywords = list(dict.fromkeys(keywords))
+        confident = confident and bool(keywords) and plain_terms <= MAX_PLAIN_TERMS
+        return keywords, confident
+
+    def _match_merchant(self, tokens, position):
+        for length in range(min(self.max_merchant_tokens, len(tokens) - position), 0, -1):
+            merchant = self.merchants.get(tuple(tokens[position:position + length]))
+            if merchant:
+                return merchant, length
+        return None
+
+
+class CallableKeywordExtractor:
+    """
+    Adapt a query -> keywords function (e.g. the cached OpenAI call) to the extractor interface.
+
+    Its results are always treated as confident when non-empty.
+
+    Args:
+        name (str): Name used in metrics.
+        extract_fn (callable): extract_fn(query) -> list of keywords.
+        extract_async_fn (callable): Optional coroutine function with the same signature, used by
+            extract_async. Without it extract_fn runs in a worker thread.
+    """
+
+    def __init__(self, name, extract_fn, extract_async_fn=None):
+        self.name = name
+        self.extract_fn = extract_fn
+        self.extract_async_fn = extract_async_fn
+
+    def extract(self, query):
+        keywords = self.extract_fn(query)
+        return keywords, bool(keywords)
+
+    async def extract_async(self, query):
+        if self.extract_async_fn is None:
+            keywords = await asyncio.to_thread(self.extract_fn, query)
+        else:
+            keywords = await self.extract_async_fn(query)
+        return keywords, bool(keywords)
+
+
+class KeywordExtractionPipeline:
+    """
+    Run extractors in order until one is confident.
+
+    If no extractor is confident (e.g. OpenAI is down), the first non-empty
+    best-effort result is used so search still works.
+
+    Args:
+        extractors (list): Objects with a `name` and an extract(query) -> (keywords, confident) method.
+    """
+
+    def __init__(self, extractors):
+        self.extractors = list(extractors)
+        self.metrics = {extractor.name: ExtractorMetrics() for extractor in self.extractors}
+
+    def extract(self, query):
+        """
+        Extract keywords from a query.
+
+        Args:
+            query (str): The user's search query.
+
+        Returns:
+            list: A list of keywords extracted from the query.
+        """
+        fallback = []
+        for extractor in self.extractors:
+            start = time.perf_counter()
+            keywords, confident = extractor.extract(query)
+            self.metrics[extractor.name].record(time.perf_counter() - start, confident)
+
+            if confident:
+                return keywords
+            if keywords and not fallback:
+                fallback = keywords
+        return fallback
+
+    async def extract_async(self, query):
+        """
+        Coroutine version of extract; extractors with an extract_async method are awaited.
+
+        Args:
+            query (str): The user's search query.
+
+        Returns:
+            list: A list of keywords extracted from the query.
+        """
+        fallback = []
+        for extractor in self.extractors:
+            start = time.perf_counter()
+            if hasattr(extractor, 'extract_async'):
+                keywords, confident = await extractor.extract_async(query)
+            else:
+                keywords, confident = extractor.extract(query)
+            self.metrics[extractor.name].record(time.perf_counter() - start, confident)
+
+            if confident:
+                return keywords
+            if keywords and not fallback:
+                fallback = keywords
+        return fallback
+
+    def stats(self):
+        """
+        Per-extractor call counts and latency percentiles.
+        """
+        return {name: metrics.snapshot() for name, metrics in self.metrics.items()}
+
@@ -0,0 +1,232 @@
+"""
+Inverted keyword index for receipts.
+
+Every receipt is broken into tokens at ingest time and one posting
+(token -> receipt_id) is written per distinct token into a separate DynamoDB
+table. A keyword search then reads only the posting lists for the query
+tokens, intersects them and fetches the matching receipts with
+batch_get_item, so its cost follows the number of matches instead of the
+size of the Receipts table.
+
+Index table layout:
+    token (S, partition key) | receipt_id (S, sort key)
+
+Matching is by whole token: "coffee" finds receipts with the token
+"coffee", but "coff" finds nothing. The scan backend (SEARCH_BACKEND=scan)
+keeps substring matching on raw_text.
+
+The index only knows the receipts ingested since it was deployed until
+`python keyword_index.py backfill` has indexed the older ones. The backfill
+writes BACKFILL_MARKER last; the app searches with a scan until it is there
+(see is_backfilled).
+"""
+import argparse
+import os
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+import metrics
+from parallel_scan import iter_scan_pages
+from tokenizer import tokenize, unique_tokens
+
+KEYWORD_INDEX_TABLE = os.getenv('KEYWORD_INDEX_TABLE', 'ReceiptKeywords')
+
+# Upper bound on postings written per receipt, keeps write cost bounded for very long receipts
+MAX_TOKENS_PER_RECEIPT = 512
+
+# batch_get_item accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+
+# Written by a finished backfill; "#" never appears in a token
+BACKFILL_MARKER = {'token': '#backfilled', 'receipt_id': '#'}
+
+
+def receipt_tokens(raw_text):
+    """
+    Get the tokens that should be indexed for a receipt.
+
+    Args:
+        raw_text (str): The raw text extracted from the receipt.
+
+    Returns:
+        list: Distinct tokens, at most MAX_TOKENS_PER_RECEIPT of them.
+    """
+    return unique_tokens(raw_text)[:MAX_TOKENS_PER_RECEIPT]
+
+
+def write_postings(writer, receipt_id, tokens):
+    """
+    Write one posting per token for a receipt.
+
+    Args:
+        writer: A DynamoDB Table or a table.batch_writer() for the index table.
+        receipt_id (str): The receipt the tokens belong to.
+        tokens (list): Tokens to index.
+    """
+    for token in tokens:
+        writer.put_item(Item={'token': token, 'receipt_id': receipt_id})
+
+
+def get_posting_list(index_table, token):
+    """
+    Read every receipt ID indexed under a token.
+
+    Args:
+        index_table: The DynamoDB Table holding the keyword index.
+        token (str): The token to look up.
+
+    Returns:
+        set: Receipt IDs containing the token.
+    """
+    receipt_ids = set()
+    query_kwargs = {
+        'KeyConditionExpression': Key('token').eq(token),
+        'ProjectionExpression': 'receipt_id',
+    }
+
+    while True:
+        with metrics.timed('dynamodb', 'query'):
+            response = index_table.query(**query_kwargs)
+        receipt_ids.update(item['receipt_id'] for item in response.get('Items', []))
+
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            break
+        query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+    return receipt_ids
+
+
+def find_receipt_ids(index_table, keywords):
+    """
+    Find the receipts that contain every token of the given keywords.
+
+    Args:
+        index_table: The DynamoDB Table holding the keyword index.
+        keywords (list): Keywords, e.g. as returned by the keyword extractor.
+
+    Returns:
+        set: Receipt IDs matching all keyword tokens.
+    """
+    tokens = list(dict.fromkeys(token for keyword in keywords for token in tokenize(keyword)))
+    if not tokens:
+        return set()
+
+    matches = None
+    for token in tokens:
+        postings = get_posting_list(index_table, token)
+        matches = postings if matches is None else matches & postings
+        # Nothing can match once the intersection is empty, skip the remaining lookups
+        if not matches:
+            return set()
+
+    return matches
+
+
+def batch_get_receipts(dynamodb, table_name, receipt_ids):
+    """
+    Fetch full receipt items by ID, 100 keys per request.
+
+    Args:
+        dynamodb: The DynamoDB service resource.
+        table_name (str): Name of the Receipts table.
+        receipt_ids (iterable): Receipt IDs to fetch.
+
+    Returns:
+        list: Receipt items, ordered by receipt ID.
+    """
+    receipt_ids = sorted(receipt_ids)
+    items = []
+
+    for start in range(0, len(receipt_ids), BATCH_GET_LIMIT):
+        chunk = receipt_ids[start:start + BATCH_GET_LIMIT]
+        request_items = {table_name: {'Keys': [{'receipt_id': receipt_id} for receipt_id in chunk]}}
+
+        # Keep asking for unprocessed keys until DynamoDB has returned everything
+        while request_items:
+            with metrics.timed('dynamodb', 'batch_get'):
+                response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            request_items = response.get('UnprocessedKeys') or None
+
+    items.sort(key=lambda item: item['receipt_id'])
+    return items
+
+
+def search(index_table, dynamodb, table_name, keywords):
+    """
+    Search receipts through the keyword index.
+
+    Args:
+        index_table: The DynamoDB Table holding the keyword index.
+        dynamodb: The DynamoDB service resource.
+        table_name (str): Name of the Receipts table.
+        keywords (list): Keywords to search for.
+
+    Returns:
+        list: Receipt items containing every keyword.
+    """
+    receipt_ids = find_receipt_ids(index_table, keywords)
+    if not receipt_ids:
+        return []
+    return batch_get_receipts(dynamodb, table_name, receipt_ids)
+
+
+def is_backfilled(index_table):
+    """
+    Check whether a backfill has indexed the receipts stored before the index existed.
+
+    Returns:
+        bool: True once BACKFILL_MARKER has been written.
+    """
+    return 'Item' in index_table.get_item(Key=BACKFILL_MARKER)
+
+
+def backfill(receipts_table, index_table, total_segments=None):
+    """
+    Build index postings for every receipt already stored in the Receipts table.
+
+    Args:
+        receipts_table: The DynamoDB Table holding receipts.
+        index_table: The DynamoDB Table holding the keyword index.
+        total_segments (int): Parallel scan segments used to read the receipts.
+
+    Returns:
+        int: Number of receipts indexed.
+    """
+    indexed = 0
+    pages = iter_scan_pages(receipts_table, total_segments, ProjectionExpression='receipt_id, raw_text')
+
+    with index_table.batch_writer(overwrite_by_pkeys=['token', 'receipt_id']) as writer:
+        for page in pages:
+            for item in page:
+                write_postings(writer, item['receipt_id'], receipt_tokens(item.get('raw_text', '')))
+                indexed += 1
+
+    # Only after every posting is written, so the app doesn't switch to a half-built index
+    index_table.put_item(Item=BACKFILL_MARKER)
+
+    return indexed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the receipt keyword index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill_parser = subparsers.add_parser('backfill', help="Index every existing receipt.")
+    backfill_parser.add_argument('--receipts-table', default=os.getenv('DYNAMODB_TABLE', 'Receipts'))
+    backfill_parser.add_argument('--index-table', default=KEYWORD_INDEX_TABLE)
+    backfill_parser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+    backfill_parser.add_argument('--endpoint-url', default=None, help="e.g. http://localhost:8000 for DynamoDB Local")
+    backfill_parser.add_argument('--segments', type=int, default=None, help="Parallel scan segments")
+
+    args = parser.parse_args(argv)
+
+    dynamodb = boto3.resource('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url)
+    count = backfill(dynamodb.Table(args.receipts_table), dynamodb.Table(args.index_table), args.segments)
+    print(f"Indexed {count} receipts into {args.index_table}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,364 @@
 import boto3
+import contextvars
 import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+from aws_clients import client_config, get_or_create
+from dedup import DEDUP_UPLOADS, RECEIPT_HASHES_TABLE, claim_item, etag_key, record_duplicate
+from embeddings import embed_item, get_embedder
+from json_logging import get_logger, log_event
+from keyword_index import KEYWORD_INDEX_TABLE, MAX_TOKENS_PER_RECEIPT, write_postings
+from merchants import merchants_from_env
+import metrics
+from receipt_fields import structured_fields
+from receipt_stats import RECEIPT_STATS_TABLE, STATS_ROLLUPS, update_rollups
+from receipt_storage import COMPACT_STORAGE, RECEIPT_TEXTS_TABLE, hot_item, ingest_bucket, write_cold
+from textract_modes import analyze_receipt, response_blocks
+from textract_parser import log_raw_text, log_textract_response, parse_response
+from thumbnails import PILLOW_AVAILABLE, create_thumbnail
+
+# Payloads are only dumped at DEBUG level, see textract_parser; records are sampled JSON lines, see json_logging
+logger = get_logger(__name__)
+
+REGION = 'ap-southeast-2'
+
+# Maximum number of concurrent Textract calls per invocation
+TEXTRACT_WORKERS = int(os.getenv('TEXTRACT_WORKERS', '4'))
+
+# Merchants recognized when parsing the merchant field
+MERCHANTS = merchants_from_env()
+
+# Thumbnails need Pillow in the deployment package
+THUMBNAILS_ENABLED = PILLOW_AVAILABLE and os.getenv('THUMBNAILS', 'true').lower() in ('1', 'true', 'yes')
+
+# Store an embedding on each receipt for the app's vector search backend (provider from EMBEDDING_PROVIDER).
+# Off by default: only SEARCH_BACKEND=vector reads it, and its ~1 KB makes every read of the item dearer
+EMBEDDINGS_ENABLED = os.getenv('EMBEDDINGS', 'false').lower() in ('1', 'true', 'yes')
+
+
+
+# AWS clients are built on first use and reused by later invocations of the same execution environment
+def get_textract():
+    """
+    Get the Textract client, with a connection per Textract worker.
+    """
+    return get_or_create(globals(), 'textract', lambda: boto3.client(
+        'textract', config=client_config(max_pool_connections=max(10, TEXTRACT_WORKERS))
+    ))
+
+def get_s3():
+    """
+    Get the S3 client.
+    """
+    return get_or_create(globals(), 's3', lambda: boto3.client('s3', config=client_config()))
+
+def get_dynamodb():
+    """
+    Get the DynamoDB resource.
+    """
+    return get_or_create(globals(), 'dynamodb', lambda: boto3.resource('dynamodb', config=client_config()))
+
+def get_table():
+    """
+    Get the Receipts table.
+    """
+    return get_or_create(globals(), 'table', lambda: get_dynamodb().Table('Receipts'))
+
+def get_hashes_table():
+    """
+    Get the ReceiptHashes table used to skip duplicate uploads (see dedup).
+    """
+    return get_or_create(globals(), 'hashes_table', lambda: get_dynamodb().Table(RECEIPT_HASHES_TABLE))
+
+def get_texts_table():
+    """
+    Get the ReceiptTexts table holding full texts in the compact layout (see receipt_storage).
+    """
+    return get_or_create(globals(), 'texts_table', lambda: get_dynamodb().Table(RECEIPT_TEXTS_TABLE))
+
+def get_stats_table():
+    """
+    Get the ReceiptStats table holding the spend rollups (see receipt_stats).
+    """
+    return get_or_create(globals(), 'stats_table', lambda: get_dynamodb().Table(RECEIPT_STATS_TABLE))
+
+def get_receipt_embedder():
+    """
+    Get the embedder for new receipts.
+    """
+    return get_or_create(globals(), 'embedder', get_embedder)
+
+def get_keyword_index_table():
+    """
+    Get the keyword index table.
+    """
+    return get_or_create(globals(), 'keyword_index_table', lambda: get_dynamodb().Table(KEYWORD_INDEX_TABLE))
+
+_LAZY_ATTRIBUTES = {
+    'textract': get_textract,
+    's3': get_s3,
+    'dynamodb': get_dynamodb,
+    'table': get_table,
+    'keyword_index_table': get_keyword_index_table,
+    'hashes_table': get_hashes_table,
+    'texts_table': get_texts_table,
+    'stats_table': get_stats_table,
+}
+
+def __getattr__(name):
+    # lambda_function.textract, .table, ... are built on first access
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class ReceiptSkipped(Exception):
+    """
+    The receipt can't be processed and retrying won't help (e.g. Textract found no text).
+    """
+
+
+class DuplicateReceipt(ReceiptSkipped):
+    """
+    The image is a copy of one another receipt already owns, so Textract isn't called again.
+    """
+
+    def __init__(self, original):
+        super().__init__(f"Duplicate of receipt {original}.")
+        self.original = original
+
+
+def s3_object(s3_record):
+    """
+    Get the (bucket name, decoded object key) of an S3 event record.
+    """
+    return s3_record['s3']['bucket']['name'], unquote_plus(s3_record['s3']['object']['key'])
+
+
+def iter_s3_records(event, malformed=None):
+    """
+    Yield the S3 event records in an S3 event or an SQS batch of S3 events.
+
+    A record that can't be read (an SQS body that isn't JSON, or an S3 record
+    without a bucket or key) is logged and skipped, so it doesn't fail the
+    rest of the batch.
+
+    Args:
+        event (dict): The Lambda event.
+        malformed (set): Collects the identifiers of the skipped records.
+
+    Yields:
+        tuple: (record identifier, S3 event record). For SQS records the
+        identifier is the messageId, used to report partial batch failures;
+        otherwise it is the object key.
+    """
+    for position, record in enumerate(event.get('Records', [])):
+        record_id = record.get('messageId') or f"record {position}"
+        try:
+            if record.get('eventSource') == 'aws:sqs':
+                # S3 sends a test event without Records when the notification is first configured
+                parsed = [(record_id, s3_record) for s3_record in json.loads(record['body']).get('Records', [])]
+            else:
+                parsed = [(s3_object(record)[1], record)]
+            # Fails here for a record without a bucket or key
+            for _, s3_record in parsed:
+                s3_object(s3_record)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error("Malformed record %s: %r", record_id, e)
+            if malformed is not None:
+                malformed.add(record_id)
+            continue
+        yield from parsed
+
+
+def process_receipt(bucket_name, object_key, etag=None):
+    """
+    Run Textract on a receipt image and build its DynamoDB item.
+
+    Args:
+        bucket_name (str): Bucket holding the image.
+        object_key (str): Key of the image.
+        etag (str): The object's ETag from the S3 event, used to skip duplicate images.
+
+    Returns:
+        tuple: (receipt item to store, list of tokens to index).
+
+    Raises:
+        DuplicateReceipt: If another receipt already owns an identical image.
+        ReceiptSkipped: If Textract found no text in the image.
+    """
+    logger.info("Processing file from bucket: %s, key: %s", bucket_name, object_key)
+    receipt_id = object_key.split('/')[-1].split('.')[0]  # Derive receipt ID from S3 object key
+
+    # A retried upload of the same image has the same ETag; its first receipt keeps the claim
+    if DEDUP_UPLOADS and etag:
+        hash_key = etag_key(etag)
+        with metrics.timed('dynamodb', 'put_item'):
+            owner = claim_item(get_hashes_table(), hash_key, receipt_id)
+        if owner['receipt_id'] != receipt_id:
+            with metrics.timed('dynamodb', 'update_item'):
+                record_duplicate(get_hashes_table(), hash_key)
+            raise DuplicateReceipt(owner['receipt_id'])
+        if owner.get('ingest') == 'bulk_import':
+            raise ReceiptSkipped('Processed by bulk_import.')
+
+    # Call Textract (API chosen by TEXTRACT_MODE) to extract text from the uploaded receipt image
+    with metrics.timed('textract', 'analyze'):
+        textract_response = analyze_receipt(get_textract(), bucket_name, object_key)
+    log_textract_response(logger, textract_response)
+
+    # Check if Textract returned valid data
+    if not response_blocks(textract_response):
+        raise ReceiptSkipped('Textract did not return any text blocks.')
+
+    # Extract raw text and tokens from the Textract response in one pass
+    parsed = parse_response(textract_response)
+    log_raw_text(logger, receipt_id, parsed.raw_text)
+
+    # Check if raw_text is empty
+    if not parsed.raw_text:
+        raise ReceiptSkipped('No text found in Textract response.')
+
+    #Create receipt metadata
+    ingested_at = int(time.time())
+    item = {
+        'receipt_id': receipt_id,
+        'raw_text': parsed.raw_text,  # Store the raw text extracted from the receipt
+        's3_url': f"https://{bucket_name}.s3.{REGION}.amazonaws.com/{object_key}",
+        # Let the app's indexes query ingest-time-index for new receipts instead of scanning (see search_engine)
+        'ingested_at': ingested_at,
+        'ingest_bucket': ingest_bucket(ingested_at)
+    }
+    # Merchant, date and total, indexed by the merchant-date-index and month-date-index GSIs
+    item.update(structured_fields(parsed.raw_text, textract_response, MERCHANTS))
+
+    # Embedded after the structured fields, which are part of the embedded text; optional like the thumbnail
+    if EMBEDDINGS_ENABLED:
+        try:
+            with metrics.timed('embeddings', 'embed'):
+                embed_item(item, get_receipt_embedder())
+        except Exception as e:
+            logger.warning("Embedding failed for %s: %s", receipt_id, e)
+
+    # Small preview for the list and search pages; the receipt is still stored if this fails
+    if THUMBNAILS_ENABLED:
+        try:
+            with metrics.timed('s3', 'thumbnail'):
+                item['thumbnail_key'] = create_thumbnail(get_s3(), bucket_name, object_key, receipt_id)
+        except Exception as e:
+            logger.warning("Thumbnail generation failed for %s: %s", receipt_id, e)
+    return item, parsed.tokens[:MAX_TOKENS_PER_RECEIPT]
+
+
+def store_receipts(receipts):
+    """
+    Write receipt items and their keyword postings with batch writers, then count them in the stats rollups.
+
+    In the compact layout the texts and embeddings go to ReceiptTexts and the Receipts items keep a preview.
+
+    Args:
+        receipts (list): (item, tokens) pairs returned by process_receipt.
+
+    Raises:
+        ClientError: If a write or a rollup update failed; storing the same receipts again is safe.
+    """
+    if not receipts:
+        return
+    if COMPACT_STORAGE:
+        # Cold items first, so a receipt item never points at a text that wasn't written
+        with metrics.timed('dynamodb', 'batch_write'):
+            with get_texts_table().batch_writer(overwrite_by_pkeys=['receipt_id']) as text_writer:
+                for item, _ in receipts:
+                    write_cold(text_writer, get_s3(), item)
+        receipts = [(hot_item(item), tokens) for item, tokens in receipts]
+    # Timed as one call: the writers flush 25-item batches as they fill and the rest on exit
+    with metrics.timed('dynamodb', 'batch_write'):
+        with get_table().batch_writer(overwrite_by_pkeys=['receipt_id']) as receipt_writer, \
+                get_keyword_index_table().batch_writer(overwrite_by_pkeys=['token', 'receipt_id']) as index_writer:
+            for item, tokens in receipts:
+                receipt_writer.put_item(Item=item)
+                # Index the receipt tokens so keyword searches don't need to scan the Receipts table
+                write_postings(index_writer, item['receipt_id'], tokens)
+
+    # Spend rollups for /stats. A failure fails the batch: the retry stores the receipts again (idempotent)
+    # and counts the ones that weren't, instead of leaving /stats silently short
+    if STATS_ROLLUPS:
+        with metrics.timed('dynamodb', 'update_rollups'):
+            update_rollups(get_stats_table(), [item for item, _ in receipts])
 
-# Initialize the necessary AWS clients
-textract = boto3.client('textract')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('Receipts')
 
 def lambda_handler(event, context):
+    """
+    Process every receipt in an S3 event, or an SQS batch of S3 events.
+
+    Textract runs concurrently on up to TEXTRACT_WORKERS receipts, then all
+    results are written in one batch. A failing record doesn't fail the
+    others: failed SQS messages are returned in batchItemFailures so only
+    they are retried.
+    """
+    invocation = metrics.start_request()
+    # Malformed messages fail on their own; the rest of the batch is still processed
+    failed = set()
+    s3_records = list(iter_s3_records(event, failed))
+    records = [(record_id,) + s3_object(s3_record) for record_id, s3_record in s3_records]
+    etags = {s3_object(s3_record): s3_record['s3']['object'].get('eTag') for _, s3_record in s3_records}
+    skipped, duplicates, stored = [], [], []
+
+    def process(record):
+        record_id, bucket_name, object_key = record
+        try:
+            return record_id, process_receipt(bucket_name, object_key, etags.get((bucket_name, object_key))), None
+        except Exception as e:
+            return record_id, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(TEXTRACT_WORKERS, len(records)))) as executor:
+        # Each record runs in a copy of this context, so its Textract and S3 calls count towards the invocation
+        contexts = [contextvars.copy_context() for _ in records]
+        for record_id, item, error in executor.map(lambda context, record: context.run(process, record),
+                                                   contexts, records):
+            if isinstance(error, DuplicateReceipt):
+                log_event(logger, logging.INFO, 'duplicate_skipped', f"Skipped {record_id}: {error}",
+                          record_id=record_id, duplicate_of=error.original)
+                duplicates.append(record_id)
+            elif isinstance(error, ReceiptSkipped):
+                logger.error("Error: %s (%s)", error, record_id)
+                skipped.append(record_id)
+            elif error is not None:
+                logger.error("Error processing receipt %s: %s", record_id, error)
+                failed.add(record_id)
+            else:
+                stored.append((record_id, item))
+
     try:
-        REGION = 'ap-southeast-2'
-        # Get the bucket and object key from the S3 event
-        bucket_name = event['Records'][0]['s3']['bucket']['name']
-        object_key = event['Records'][0]['s3']['object']['key']
-        print(f"Processing file from bucket: {bucket_name}, key: {object_key}")
-
-        # Call Textract to extract text from the uploaded receipt image
-        textract_response = textract.analyze_document(
-            Document={'S3Object': {'Bucket': bucket_name, 'Name': object_key}},
-            FeatureTypes=["FORMS", "TABLES"]
-        )
-        print(f"Textract response received: {textract_response}")
-
-        # Check if Textract returned valid data
-        if 'Blocks' not in textract_response or not textract_response['Blocks']:
-            print("Error: Textract did not return any text blocks.")
-            return {
-                'statusCode': 400,
-                'body': json.dumps('Error: Textract did not return any text blocks.')
-            }
-
-        # Extract raw text from the Textract response
-        raw_text = extract_raw_text(textract_response)
-        print(f"Extracted raw text: {raw_text}")
-
-        # Check if raw_text is empty
-        if not raw_text:
-            print("Error: No text found in Textract response.")
-            return {
-                'statusCode': 400,
-                'body': json.dumps('Error: No text found in Textract response.')
-            }
-
-        #Create receipt metadata and store it in DynamoDB
-        receipt_id = object_key.split('/')[-1].split('.')[0]  # Derive receipt ID from S3 object key
-        item = {
-            'receipt_id': receipt_id,
-            'raw_text': raw_text,  # Store the raw text extracted from the receipt
-            's3_url': f"https://{bucket_name}.s3.{REGION}.amazonaws.com/{object_key}"
-        }
-        print(f"Storing item in DynamoDB: {item}")
-
-        # Store the item in DynamoDB
-        table.put_item(Item=item)
-        print(f"Receipt metadata stored successfully for {receipt_id}.")
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps(f'Receipt metadata stored successfully for {receipt_id}.')
-        }
+        store_receipts([receipt for _, receipt in stored])
+        logger.info("Receipt metadata stored successfully for %d receipts.", len(stored))
     except Exception as e:
-        print(f"Error processing receipt: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f'Error processing receipt: {str(e)}')
-        }
+        logger.error("Error storing receipts: %s", e)
+        failed.update(record_id for record_id, _ in stored)
+        stored = []
+
+    metrics.end_request()
+    log_event(logger, logging.INFO, 'invocation', f"Processed {len(records)} receipts",
+              stored=len(stored), skipped=len(skipped), failed=len(failed),
+              textract_calls_avoided=len(duplicates), **invocation.summary())
+
+    return {
+        'statusCode': 500 if failed else 200,
+        'body': json.dumps({
+            'stored': [item['receipt_id'] for _, (item, _) in stored],
+            'skipped': skipped,
+            'duplicates': duplicates,
+            'failed': sorted(failed),
+        }),
+        # Partial batch response for SQS event sources with ReportBatchItemFailures enabled
+        'batchItemFailures': [{'itemIdentifier': record_id} for record_id in sorted(failed)],
+    }
 
 def extract_raw_text(textract_response):
     """
     Extract raw text from Textract response. The raw text will be stored in DynamoDB.
     """
-    raw_text = ""
-    for block in textract_response['Blocks']:
-        if block['BlockType'] == 'LINE':
-            raw_text += block['Text'] + "\n"
-    return raw_text.strip().lower()  # Remove leading/trailing whitespace
+    return parse_response(textract_response).raw_text
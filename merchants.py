@@ -0,0 +1,34 @@
+import os
+import re
+
+# Merchants recognized as a whole, including multi-word names
+KNOWN_MERCHANTS = (
+    'starbucks', 'woolworths', 'coles', 'aldi', 'iga', 'bunnings', 'kmart', 'target', 'big w',
+    "mcdonald's", 'mcdonalds', 'kfc', 'subway', 'hungry jacks', 'dominos', 'officeworks', 'jb hi-fi',
+    'harvey norman', 'the good guys', 'chemist warehouse', 'priceline', 'dan murphys', 'bws', 'liquorland',
+    'ikea', 'myer', 'david jones', 'uniqlo', 'seven eleven', '7-eleven', 'ampol', 'bp', 'shell', 'caltex',
+    'uber', 'uber eats', 'menulog', 'amazon', 'apple', 'costco',
+)
+
+_NON_NAME_CHARACTERS = re.compile(r"[^a-z0-9&' -]+")
+
+
+def merchants_from_env():
+    """
+    Known merchants plus any listed in the comma-separated LOCAL_EXTRACTOR_MERCHANTS variable.
+    """
+    extra = [name.strip().lower() for name in os.getenv('LOCAL_EXTRACTOR_MERCHANTS', '').split(',') if name.strip()]
+    return KNOWN_MERCHANTS + tuple(extra)
+
+
+def normalize_merchant(name):
+    """
+    Normalize a merchant name for storage and lookups ("STARBUCKS Coffee!" -> "starbucks coffee").
+
+    Args:
+        name (str): Merchant name as printed or typed.
+
+    Returns:
+        str: Lowercase name with punctuation removed and whitespace collapsed.
+    """
+    return ' '.join(_NON_NAME_CHARACTERS.sub(' ', name.lower()).split())
@@ -0,0 +1,297 @@
+"""
+Request-level timing of external dependency calls.
+
+Every call to OpenAI, DynamoDB, S3 or Textract is wrapped in timed():
+
+    with metrics.timed('dynamodb', 'query'):
+        response = table.query(**query_kwargs)
+
+which records its duration in two places:
+
+- the process-wide DEPENDENCY_SECONDS histogram, labelled by dependency
+  and operation, served in the Prometheus text format by /metrics
+- the current request's RequestTimings, if one was started: the app turns
+  it into a Server-Timing header, the Lambda logs it per invocation
+
+The current request lives in a context variable, so calls made from
+coroutines (asyncio copies the context into every task) and from
+asyncio.to_thread are attributed to the request that started them.
+Threads from a plain ThreadPoolExecutor don't inherit it; time those
+calls from the submitting thread instead.
+
+Histograms are per process: behind gunicorn every worker keeps its own and
+/metrics reports the one that served the scrape. That is enough for latency
+distributions (every worker sees the same request mix); exact totals would
+need a shared store such as prometheus_client's multiprocess mode.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a signed URL (sub-millisecond) to a slow OpenAI call or Textract page
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Cumulative Prometheus-style histogram with one series per label combination.
+
+    Args:
+        name (str): Metric name.
+        help_text (str): Description shown in the exposition.
+        label_names (tuple): Label names, in the order observe() receives their values.
+        buckets (tuple): Bucket upper bounds in seconds, ascending.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, seconds):
+        """
+        Record one observation.
+
+        Args:
+            label_values (tuple): One value per label name.
+            seconds (float): The observed duration.
+        """
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def snapshot(self):
+        """
+        Copy the series.
+
+        Returns:
+            dict: label values -> (cumulative bucket counts, sum, count).
+        """
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        snapshot = {}
+        for labels, (counts, total, count) in series.items():
+            cumulative, running = [], 0
+            for bucket_count in counts:
+                running += bucket_count
+                cumulative.append(running)
+            snapshot[labels] = (cumulative, total, count)
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """
+        Format the histogram in the Prometheus text exposition format.
+
+        Returns:
+            list: Lines of the exposition.
+        """
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (cumulative, total, count) in sorted(self.snapshot().items()):
+            label_text = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), cumulative):
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {bucket_count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_samples(name, metric_type, help_text, samples):
+    """
+    Format a counter or gauge in the Prometheus text exposition format.
+
+    Args:
+        name (str): Metric name.
+        metric_type (str): 'counter' or 'gauge'.
+        help_text (str): Description shown in the exposition.
+        samples (list): (labels dict, value) pairs.
+
+    Returns:
+        list: Lines of the exposition.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+
+DEPENDENCY_SECONDS = Histogram(
+    'receipt_manager_dependency_call_seconds',
+    'Duration of calls to external services.',
+    ('dependency', 'operation')
+)
+REQUEST_SECONDS = Histogram(
+    'receipt_manager_http_request_seconds',
+    'Duration of HTTP requests, up to the response headers.',
+    ('method', 'endpoint', 'status')
+)
+
+
+class RequestTimings:
+    """
+    Dependency call durations of one request or invocation.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # dependency -> [calls, seconds]
+        self.dependencies = {}
+        self._lock = threading.Lock()
+
+    def add(self, dependency, seconds):
+        # Concurrent calls of one request (async path) add up, so the total can exceed the wall time
+        with self._lock:
+            entry = self.dependencies.setdefault(dependency, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        """
+        Summarize the request for a log record.
+
+        Returns:
+            dict: Total milliseconds, and calls and milliseconds per dependency.
+        """
+        with self._lock:
+            dependencies = {name: {'calls': calls, 'ms': round(seconds * 1000, 1)}
+                            for name, (calls, seconds) in self.dependencies.items()}
+        return {'total_ms': round(self.elapsed() * 1000, 1), 'dependencies': dependencies}
+
+    def server_timing(self):
+        """
+        Format the timings as a Server-Timing header value.
+
+        Returns:
+            str: e.g. 'openai;dur=412.3;desc="1 call", dynamodb;dur=35.0;desc="3 calls", total;dur=455.1'
+        """
+        with self._lock:
+            entries = [
+                f'{name};dur={seconds * 1000:.1f};desc="{calls} call{"" if calls == 1 else "s"}"'
+                for name, (calls, seconds) in sorted(self.dependencies.items())
+            ]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request():
+    """
+    Start collecting the current request's dependency timings.
+
+    Returns:
+        RequestTimings: The new request's timings.
+    """
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current_request():
+    """
+    Get the current request's timings, or None outside a request.
+    """
+    return _current.get()
+
+
+def end_request():
+    """
+    Stop attributing calls to the current request.
+
+    Returns:
+        RequestTimings: The finished request's timings, or None.
+    """
+    timings = _current.get()
+    _current.set(None)
+    return timings
+
+
+def record(dependency, operation, seconds):
+    """
+    Record a dependency call that was timed elsewhere.
+    """
+    DEPENDENCY_SECONDS.observe((dependency, operation), seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(dependency, seconds)
+
+
+@contextmanager
+def timed(dependency, operation):
+    """
+    Time the block as one call to a dependency, whether it succeeds or raises.
+
+    Args:
+        dependency (str): The external service: 'openai', 'dynamodb', 's3' or 'textract'.
+        operation (str): The call, e.g. 'query' or 'presign'.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(dependency, operation, time.perf_counter() - start)
+
+
+def timed_pages(dependency, operation, pages):
+    """
+    Time fetching each page of a paginated iterator, not the caller's work in between.
+
+    Args:
+        dependency (str): The external service.
+        operation (str): The call made per page.
+        pages (iterable): The page iterator, e.g. from parallel_scan.iter_scan_pages.
+
+    Yields:
+        Each page.
+    """
+    iterator = iter(pages)
+    while True:
+        start = time.perf_counter()
+        try:
+            page = next(iterator)
+        except StopIteration:
+            return
+        except Exception:
+            record(dependency, operation, time.perf_counter() - start)
+            raise
+        record(dependency, operation, time.perf_counter() - start)
+        yield page
+
+
+def render(extra_lines=()):
+    """
+    Format the dependency and request histograms in the Prometheus text exposition format.
+
+    Args:
+        extra_lines (iterable): More exposition lines to append (e.g. cache counters).
+
+    Returns:
+        str: The exposition.
+    """
+    lines = DEPENDENCY_SECONDS.render() + REQUEST_SECONDS.render() + list(extra_lines)
+    return '\n'.join(lines) + '\n'
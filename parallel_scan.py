@@ -0,0 +1,151 @@
+"""
+Paginated, parallel DynamoDB scans.
+
+A scan is split into TotalSegments segments. Each segment is paged through
+(following LastEvaluatedKey) on a shared thread pool and every page is handed
+back to the caller as soon as it arrives, so callers can start consuming
+results before the whole table has been read. Pages travel through a bounded
+queue, which keeps memory bounded when the consumer is slower than DynamoDB.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of scan segments and worker threads used by default
+SCAN_SEGMENTS = int(os.getenv('SCAN_SEGMENTS', '1'))
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', '8'))
+
+# Pages buffered between the segment workers and the consumer
+MAX_BUFFERED_PAGES = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Marks the end of one segment on the page queue
+_SEGMENT_DONE = object()
+
+
+def get_executor():
+    """
+    Get the thread pool shared by all parallel scans, creating it on first use.
+
+    Returns:
+        ThreadPoolExecutor: The shared scan pool.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix='dynamodb-scan')
+    return _executor
+
+
+def iter_segment_pages(table, segment=None, total_segments=None, **scan_kwargs):
+    """
+    Page through one scan segment (or the whole table when no segment is given).
+
+    Args:
+        table: The DynamoDB Table to scan.
+        segment (int): Segment number, or None for a non-segmented scan.
+        total_segments (int): Total number of segments.
+        **scan_kwargs: Extra arguments for table.scan (FilterExpression, ProjectionExpression, ...).
+
+    Yields:
+        list: The items of each page.
+    """
+    scan_kwargs = dict(scan_kwargs)
+    if segment is not None:
+        scan_kwargs['Segment'] = segment
+        scan_kwargs['TotalSegments'] = total_segments
+
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield response.get('Items', [])
+
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            break
+        scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+def iter_scan_pages(table, total_segments=None, **scan_kwargs):
+    """
+    Scan a table in parallel segments and yield pages as they arrive.
+
+    Pages from different segments are interleaved in arrival order. If the
+    caller stops iterating early, the remaining segments are cancelled.
+
+    Args:
+        table: The DynamoDB Table to scan.
+        total_segments (int): Number of segments, defaults to SCAN_SEGMENTS.
+        **scan_kwargs: Extra arguments for table.scan.
+
+    Yields:
+        list: The items of each page.
+    """
+    total_segments = total_segments or SCAN_SEGMENTS
+
+    # A single segment gains nothing from threads, scan inline
+    if total_segments <= 1:
+        yield from iter_segment_pages(table, **scan_kwargs)
+        return
+
+    pages = queue.Queue(maxsize=MAX_BUFFERED_PAGES)
+    cancelled = threading.Event()
+
+    def put(entry):
+        # Block while the consumer is behind, but give up once the scan is cancelled
+        while not cancelled.is_set():
+            try:
+                pages.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scan_segment(segment):
+        try:
+            for items in iter_segment_pages(table, segment, total_segments, **scan_kwargs):
+                if not put(items):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_SEGMENT_DONE)
+
+    executor = get_executor()
+    futures = [executor.submit(scan_segment, segment) for segment in range(total_segments)]
+
+    try:
+        remaining = total_segments
+        while remaining:
+            entry = pages.get()
+            if entry is _SEGMENT_DONE:
+                remaining -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield entry
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+
+def scan_all(table, total_segments=None, **scan_kwargs):
+    """
+    Scan a table in parallel segments and return every item.
+
+    Args:
+        table: The DynamoDB Table to scan.
+        total_segments (int): Number of segments, defaults to SCAN_SEGMENTS.
+        **scan_kwargs: Extra arguments for table.scan.
+
+    Returns:
+        list: All items returned by the scan.
+    """
+    items = []
+    for page in iter_scan_pages(table, total_segments, **scan_kwargs):
+        items.extend(page)
+    return items
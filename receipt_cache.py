@@ -0,0 +1,649 @@
+"""
+Read-through cache of receipt metadata for /list and the scan search backend.
+
+Receipts are written once, by the ingest Lambda (and the pending item
+written by /upload/complete), so the app can keep a copy of the table and
+follow its changes instead of scanning DynamoDB on every request:
+
+- gunicorn's post_fork (or else the first read) starts a background
+  warm-up, a full scan into the store, and a thread that keeps syncing
+- every RECEIPT_CACHE_SYNC_INTERVAL seconds the cache applies the changes
+  since the last sync. With RECEIPT_CACHE_SOURCE=stream they come from the
+  table's DynamoDB Stream (NEW_IMAGE, see create_dynamodb_table.sh), which
+  costs a GetRecords call per shard instead of a scan; with 'scan' they
+  come from a query of the ingest-time-index GSI for newer `ingested_at`
+  stamps, like search_engine (the name predates the GSI)
+- every RECEIPT_CACHE_REBUILD seconds the store is rebuilt from a full scan
+
+Reads are only answered from the cache while the last successful sync is
+at most RECEIPT_CACHE_MAX_STALENESS seconds old; otherwise, before the
+warm-up finishes, or once the store has evicted receipts to stay within
+RECEIPT_CACHE_MAX_ENTRIES, they return None and the caller reads DynamoDB.
+Single receipts (get) are still served from an incomplete store.
+
+The store is process-local by default (MemoryStore). With
+RECEIPT_CACHE_REDIS_URL it is a Redis (or Redis-compatible) server shared
+by every worker (RedisStore, needs the optional `redis` package); one
+process at a time holds a sync lease and keeps it up to date, and stream
+positions are kept in the store so the next lease holder resumes where the
+last one stopped.
+"""
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary, TypeDeserializer
+
+from receipt_storage import signature_contains
+from search_engine import TableIndex
+from tokenizer import tokenize
+
+RECEIPT_CACHE = os.getenv('RECEIPT_CACHE', 'false').lower() in ('1', 'true', 'yes')
+# 'stream' follows the table's DynamoDB Stream, 'scan' queries ingest-time-index for newer ingested_at stamps
+RECEIPT_CACHE_SOURCE = os.getenv('RECEIPT_CACHE_SOURCE', 'stream')
+RECEIPT_CACHE_MAX_ENTRIES = int(os.getenv('RECEIPT_CACHE_MAX_ENTRIES', '100000'))
+# Seconds between syncs, and the oldest sync reads are still answered from
+RECEIPT_CACHE_SYNC_INTERVAL = int(os.getenv('RECEIPT_CACHE_SYNC_INTERVAL', '5'))
+RECEIPT_CACHE_MAX_STALENESS = int(os.getenv('RECEIPT_CACHE_MAX_STALENESS', '30'))
+RECEIPT_CACHE_REBUILD = int(os.getenv('RECEIPT_CACHE_REBUILD', str(24 * 3600)))
+# Shared store for all workers and tasks; process-local when unset
+RECEIPT_CACHE_REDIS_URL = os.getenv('RECEIPT_CACHE_REDIS_URL')
+# Receipts per page when the whole cache is read page by page (iter_pages without a page size)
+RECEIPT_CACHE_PAGE_SIZE = 1000
+
+# Large attributes no cached read needs
+EXCLUDED_ATTRIBUTES = ('embedding',)
+
+_deserializer = TypeDeserializer()
+
+
+def cacheable(item):
+    """
+    Copy of an item without the attributes the cache doesn't keep.
+    """
+    return {name: value for name, value in item.items() if name not in EXCLUDED_ATTRIBUTES}
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (bytes, bytearray, Binary)):
+        return {'__bytes__': base64.b64encode(bytes(getattr(value, 'value', value))).decode('ascii')}
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"Cannot cache {type(value).__name__}")
+
+
+def _decode_object(value):
+    if set(value) == {'__bytes__'}:
+        return Binary(base64.b64decode(value['__bytes__']))
+    return value
+
+
+def encode_item(item):
+    """
+    Serialize an item to JSON, numbers kept exact enough to come back as Decimals.
+    """
+    return json.dumps(item, default=_encode_value, separators=(',', ':'))
+
+
+def decode_item(data):
+    """
+    Read an item written by encode_item, numbers as Decimals like boto3 returns them.
+    """
+    return json.loads(data, parse_float=Decimal, parse_int=Decimal, object_hook=_decode_object)
+
+
+class MemoryStore:
+    """
+    Process-local receipt store, least recently used receipts evicted first.
+
+    The receipt_ids are also kept in a sorted list, updated as receipts are
+    put, deleted and evicted, so a page in receipt_id order is a bisect and
+    a slice rather than a sort of the whole store.
+
+    Args:
+        max_entries (int): Maximum number of receipts kept.
+    """
+
+    shared = False
+
+    def __init__(self, max_entries=RECEIPT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._keys = []
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def empty(self):
+        """
+        Get an empty store to build into, swapped in when the build is done.
+        """
+        return MemoryStore(self.max_entries)
+
+    def put(self, item):
+        with self._lock:
+            if item['receipt_id'] not in self._items:
+                insort(self._keys, item['receipt_id'])
+            self._items[item['receipt_id']] = cacheable(item)
+            self._items.move_to_end(item['receipt_id'])
+            while len(self._items) > self.max_entries:
+                receipt_id, _ = self._items.popitem(last=False)
+                self._remove_key(receipt_id)
+                self.evictions += 1
+
+    def _remove_key(self, receipt_id):
+        position = bisect_left(self._keys, receipt_id)
+        if position < len(self._keys) and self._keys[position] == receipt_id:
+            del self._keys[position]
+
+    def get(self, receipt_id):
+        with self._lock:
+            item = self._items.get(receipt_id)
+            if item is not None:
+                self._items.move_to_end(receipt_id)
+            return item
+
+    def delete(self, receipt_id):
+        with self._lock:
+            if self._items.pop(receipt_id, None) is not None:
+                self._remove_key(receipt_id)
+
+    def values(self):
+        with self._lock:
+            return list(self._items.values())
+
+    def page(self, page_size, after=None):
+        """
+        Receipts in receipt_id order.
+
+        Args:
+            page_size (int): Maximum number of receipts.
+            after (str): Only receipts with a greater receipt_id, None to start at the first.
+
+        Returns:
+            tuple: (receipts, whether more follow).
+        """
+        with self._lock:
+            start = bisect_right(self._keys, after) if after is not None else 0
+            keys = self._keys[start:start + page_size]
+            return [self._items[receipt_id] for receipt_id in keys], start + page_size < len(self._keys)
+
+    def __len__(self):
+        return len(self._items)
+
+    def complete(self):
+        """
+        Whether the store holds every receipt (nothing was evicted).
+        """
+        return self.evictions == 0
+
+    def get_state(self):
+        """
+        Sync state: synced_at, watermark and stream positions ('shard:<id>').
+        """
+        return dict(self._state)
+
+    def set_state(self, **state):
+        self._state.update(state)
+
+    def acquire_lease(self, owner, ttl):
+        return True
+
+
+class RedisStore:
+    """
+    Receipt store in a Redis server shared by every worker.
+
+    Items are JSON in one hash, with their last use in a sorted set for
+    eviction and their receipt_ids in another, all scored 0, that pages
+    read in receipt_id order (ZRANGEBYLEX); the sync state and lease live
+    next to them.
+
+    Args:
+        url (str): Redis URL, e.g. redis://localhost:6379/0.
+        max_entries (int): Maximum number of receipts kept.
+        prefix (str): Key prefix.
+        client: An existing redis client, instead of url.
+    """
+
+    shared = True
+
+    def __init__(self, url=None, max_entries=RECEIPT_CACHE_MAX_ENTRIES, prefix='receipt-cache', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.max_entries = max_entries
+        self._items_key = f"{prefix}:items"
+        self._used_key = f"{prefix}:used"
+        self._keys_key = f"{prefix}:keys"
+        self._state_key = f"{prefix}:state"
+        self._lease_key = f"{prefix}:lease"
+
+    def empty(self):
+        # Rebuilt in place (the lease keeps that to one process), and stale until the rebuild finishes
+        self.client.delete(self._items_key, self._used_key, self._keys_key)
+        self.client.hset(self._state_key, mapping={'evictions': 0, 'synced_at': 0})
+        return self
+
+    def put(self, item):
+        pipeline = self.client.pipeline()
+        pipeline.hset(self._items_key, item['receipt_id'], encode_item(cacheable(item)))
+        pipeline.zadd(self._used_key, {item['receipt_id']: time.time()})
+        pipeline.zadd(self._keys_key, {item['receipt_id']: 0})
+        pipeline.zcard(self._used_key)
+        size = pipeline.execute()[-1]
+        if size > self.max_entries:
+            evicted = [member for member, _ in self.client.zpopmin(self._used_key, size - self.max_entries)]
+            if evicted:
+                self.client.hdel(self._items_key, *evicted)
+                self.client.zrem(self._keys_key, *evicted)
+                self.client.hincrby(self._state_key, 'evictions', len(evicted))
+
+    def get(self, receipt_id):
+        data = self.client.hget(self._items_key, receipt_id)
+        if data is None:
+            return None
+        self.client.zadd(self._used_key, {receipt_id: time.time()}, xx=True)
+        return decode_item(data)
+
+    def delete(self, receipt_id):
+        self.client.hdel(self._items_key, receipt_id)
+        self.client.zrem(self._used_key, receipt_id)
+        self.client.zrem(self._keys_key, receipt_id)
+
+    def values(self):
+        return [decode_item(data) for data in self.client.hvals(self._items_key)]
+
+    def page(self, page_size, after=None):
+        keys = self.client.zrangebylex(self._keys_key, f"({after}" if after is not None else '-', '+',
+                                       start=0, num=page_size + 1)
+        data = self.client.hmget(self._items_key, keys[:page_size]) if keys else []
+        return [decode_item(value) for value in data if value is not None], len(keys) > page_size
+
+    def __len__(self):
+        return self.client.hlen(self._items_key)
+
+    def complete(self):
+        return int(self.client.hget(self._state_key, 'evictions') or 0) == 0
+
+    def get_state(self):
+        state = {}
+        for name, value in self.client.hgetall(self._state_key).items():
+            name, value = name.decode('utf-8'), value.decode('utf-8')
+            state[name] = value if name.startswith('shard:') else float(value)
+        return state
+
+    def set_state(self, **state):
+        self.client.hset(self._state_key, mapping=state)
+
+    def acquire_lease(self, owner, ttl):
+        """
+        Take or renew the sync lease; only its holder writes to the store.
+        """
+        if self.client.set(self._lease_key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        holder = self.client.get(self._lease_key)
+        if holder is not None and holder.decode('utf-8') == owner:
+            self.client.pexpire(self._lease_key, int(ttl * 1000))
+            return True
+        return False
+
+
+class StreamFollower:
+    """
+    Reads a DynamoDB Stream shard by shard, remembering how far each shard was read.
+
+    Positions map shard IDs to the last sequence number read, '' for a
+    shard nothing was read from yet and '*' for a finished (closed) shard.
+
+    Args:
+        client: The dynamodbstreams client.
+        stream_arn (str): The table's LatestStreamArn.
+        positions (dict): Positions to resume from, None to start at the stream's end.
+    """
+
+    def __init__(self, client, stream_arn, positions=None):
+        self.client = client
+        self.stream_arn = stream_arn
+        self.positions = dict(positions or {})
+        self._iterators = {}
+        self._discover(latest=positions is None)
+
+    def _shards(self):
+        kwargs = {'StreamArn': self.stream_arn}
+        while True:
+            description = self.client.describe_stream(**kwargs)['StreamDescription']
+            yield from description.get('Shards', [])
+            if not description.get('LastEvaluatedShardId'):
+                return
+            kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+    def _iterator(self, shard_id, iterator_type, sequence_number=None):
+        kwargs = {'StreamArn': self.stream_arn, 'ShardId': shard_id, 'ShardIteratorType': iterator_type}
+        if sequence_number:
+            kwargs['SequenceNumber'] = sequence_number
+        return self.client.get_shard_iterator(**kwargs)['ShardIterator']
+
+    def _discover(self, latest):
+        shard_ids = set()
+        for shard in self._shards():
+            shard_id = shard['ShardId']
+            shard_ids.add(shard_id)
+            position = self.positions.get(shard_id)
+            if shard_id in self._iterators or position == '*':
+                continue
+            if latest:
+                # Starting out: changes before now are covered by the full scan that follows
+                if 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {}):
+                    self.positions[shard_id] = '*'
+                else:
+                    self._iterators[shard_id] = self._iterator(shard_id, 'LATEST')
+                    self.positions[shard_id] = ''
+            elif position:
+                self._iterators[shard_id] = self._iterator(shard_id, 'AFTER_SEQUENCE_NUMBER', position)
+            else:
+                # A new child shard, or one opened before the last holder read anything from it
+                self._iterators[shard_id] = self._iterator(shard_id, 'TRIM_HORIZON')
+                self.positions[shard_id] = ''
+        # Shards past the stream's 24 hour retention are gone for good
+        for shard_id in set(self.positions) - shard_ids:
+            del self.positions[shard_id]
+
+    def poll(self, limit=1000):
+        """
+        Read every record added to the stream since the last poll.
+
+        Returns:
+            list: Stream records, in order within each shard.
+        """
+        records = []
+        closed = False
+        for shard_id, iterator in list(self._iterators.items()):
+            while iterator:
+                response = self.client.get_records(ShardIterator=iterator, Limit=limit)
+                batch = response.get('Records', [])
+                records.extend(batch)
+                if batch:
+                    self.positions[shard_id] = batch[-1]['dynamodb']['SequenceNumber']
+                iterator = response.get('NextShardIterator')
+                if not batch:
+                    break
+            if iterator:
+                self._iterators[shard_id] = iterator
+            else:
+                # Closed shards hand over to their children
+                del self._iterators[shard_id]
+                self.positions[shard_id] = '*'
+                closed = True
+        if closed or not self._iterators:
+            self._discover(latest=False)
+        return records
+
+
+def deserialize_image(image):
+    """
+    Turn a stream record's NewImage into an item like boto3's Table returns.
+    """
+    return {name: _deserializer.deserialize(value) for name, value in image.items()}
+
+
+def contains_all(item, keywords):
+    """
+    Same match as utils.keyword_filter_expression: raw_text contains every keyword.
+
+    Compact items (see receipt_storage) are matched on their token signature,
+    which can be a false positive; utils checks their texts.
+    """
+    raw_text = item.get('raw_text')
+    if isinstance(raw_text, str):
+        return all(keyword in raw_text for keyword in keywords)
+    tokens = [token for keyword in keywords for token in tokenize(keyword)]
+    return signature_contains(item.get('token_signature'), tokens)
+
+
+class ReceiptCache(TableIndex):
+    """
+    The Receipts table's items, warmed by a full scan and kept in sync from its changes.
+
+    Args:
+        get_table (callable): Returns the Receipts Table.
+        get_streams (callable): Returns the dynamodbstreams client, for the 'stream' source.
+        store: MemoryStore or RedisStore, a MemoryStore by default.
+        source (str): 'stream' or 'scan'.
+        max_staleness (float): Oldest sync reads are answered from, in seconds.
+        **kwargs: Refresh settings, see search_engine.TableIndex.
+    """
+
+    name = 'receipt-cache'
+
+    def __init__(self, get_table, get_streams=None, store=None, source=RECEIPT_CACHE_SOURCE,
+                 max_staleness=RECEIPT_CACHE_MAX_STALENESS, **kwargs):
+        kwargs.setdefault('refresh_interval', RECEIPT_CACHE_SYNC_INTERVAL)
+        kwargs.setdefault('rebuild_interval', RECEIPT_CACHE_REBUILD)
+        super().__init__(get_table, **kwargs)
+        self.get_streams = get_streams
+        self.store = store if store is not None else MemoryStore()
+        self.source = source
+        self.max_staleness = max_staleness
+        self.follower = None
+        self.owner = uuid.uuid4().hex
+        self.stream_records = 0
+        self.hits = 0
+        self.misses = 0
+
+    def new_index(self):
+        return self.store.empty()
+
+    def add_item(self, index, item):
+        index.put(item)
+
+    def _start_follower(self, positions=None):
+        if self.source != 'stream' or self.get_streams is None:
+            return None
+        stream_arn = self.get_table().latest_stream_arn
+        if not stream_arn:
+            raise RuntimeError("The Receipts table has no stream; enable it or set RECEIPT_CACHE_SOURCE=scan.")
+        return StreamFollower(self.get_streams(), stream_arn, positions)
+
+    def _holds_lease(self):
+        return self.store.acquire_lease(self.owner, self.max_staleness)
+
+    def build(self):
+        """
+        Fill a new store from a full scan, following the stream from just before it.
+        """
+        if self.store.shared and not self._holds_lease():
+            # Another process keeps the shared store in sync
+            with self._lock:
+                self.index = self.store
+                self.built_at = self.refreshed_at = time.time()
+            return
+        # Positioned before the scan, so changes made while it runs are applied by the next sync
+        follower = self._start_follower()
+        super().build()
+        self.store = self.index
+        self.follower = follower
+        self._save_state()
+
+    def refresh(self):
+        """
+        Apply the changes since the last sync.
+
+        Returns:
+            int: Number of receipts added, replaced or removed.
+        """
+        if self.store.shared and not self._holds_lease():
+            with self._lock:
+                self.refreshed_at = time.time()
+            return 0
+        state = self.store.get_state()
+        if self.follower is None:
+            # Taking over a shared store, or after a stream error: resume from the saved positions
+            self._watermark = max(self._watermark, int(state.get('watermark', 0)))
+            positions = {name[len('shard:'):]: value for name, value in state.items() if name.startswith('shard:')}
+            self.follower = self._start_follower(positions) if positions else None
+        if self.follower is None:
+            changed = super().refresh()
+        else:
+            try:
+                changed = self.apply(self.follower.poll())
+            except Exception:
+                self.follower = None
+                raise
+        self._save_state()
+        return changed
+
+    def apply(self, records):
+        """
+        Apply DynamoDB Stream records to the store.
+
+        Returns:
+            int: Number of records applied.
+        """
+        with self._lock:
+            for record in records:
+                change = record['dynamodb']
+                if record['eventName'] == 'REMOVE':
+                    self.store.delete(change['Keys']['receipt_id']['S'])
+                elif 'NewImage' in change:
+                    item = deserialize_image(change['NewImage'])
+                    self.store.put(item)
+                    self._watermark = max(self._watermark, int(item.get('ingested_at', 0)))
+            self.refreshed_at = time.time()
+        self.stream_records += len(records)
+        return len(records)
+
+    def _save_state(self):
+        state = {'synced_at': time.time(), 'watermark': self._watermark}
+        if self.follower is not None:
+            state.update({f"shard:{shard_id}": position for shard_id, position in self.follower.positions.items()})
+        self.store.set_state(**state)
+
+    def start(self):
+        """
+        Warm the cache now and keep syncing it in the background, whether or not it is read.
+        """
+        def run():
+            while True:
+                if self._updating.acquire(blocking=False):
+                    self._update()
+                time.sleep(self.refresh_interval)
+        threading.Thread(target=run, name=f"{self.name}-sync", daemon=True).start()
+
+    def put(self, item):
+        """
+        Cache a receipt this process has just written.
+        """
+        with self._lock:
+            if self.index is not None:
+                self.store.put(item)
+
+    def fresh(self):
+        """
+        Whether reads can be answered from the store: warm, synced recently and complete.
+        """
+        if self.index is None:
+            return False
+        synced_at = self.store.get_state().get('synced_at', 0)
+        return time.time() - synced_at <= self.max_staleness and self.store.complete()
+
+    def _read(self):
+        """
+        Start a warm-up or sync if one is due, and count whether the read can be answered from the store.
+        """
+        self.maybe_update()
+        if not self.fresh():
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def receipts(self):
+        """
+        Every receipt, starting a warm-up or sync if one is due.
+
+        Returns:
+            list: Copies of the receipt items, or None if the caller should read DynamoDB.
+        """
+        if not self._read():
+            return None
+        return [dict(item) for item in self.store.values()]
+
+    def matching(self, keywords):
+        """
+        Receipts whose raw_text contains every keyword, or None if the caller should scan DynamoDB.
+        """
+        receipts = self.receipts()
+        if receipts is None:
+            return None
+        return [item for item in receipts if contains_all(item, keywords)]
+
+    def page(self, page_size, exclusive_start_key=None):
+        """
+        One page of receipts in receipt_id order, with the same cursor keys as a scan.
+
+        Returns:
+            tuple: (receipts, LastEvaluatedKey or None on the last page), or None if the caller should scan DynamoDB.
+        """
+        if not self._read():
+            return None
+        after = exclusive_start_key['receipt_id'] if exclusive_start_key else None
+        items, more = self.store.page(page_size, after)
+        page = [dict(item) for item in items]
+        last_key = {'receipt_id': page[-1]['receipt_id']} if more and page else None
+        return page, last_key
+
+    def iter_pages(self, page_size=None):
+        """
+        Every receipt in receipt_id order, a page at a time, copying only the page being read.
+
+        Args:
+            page_size (int): Receipts per page, RECEIPT_CACHE_PAGE_SIZE by default.
+
+        Returns:
+            iterator: Lists of receipt copies, or None if the caller should scan DynamoDB.
+        """
+        if not self._read():
+            return None
+        return self._iter_pages(page_size or RECEIPT_CACHE_PAGE_SIZE)
+
+    def _iter_pages(self, page_size):
+        after, more = None, True
+        while more:
+            items, more = self.store.page(page_size, after)
+            if not items:
+                return
+            yield [dict(item) for item in items]
+            after = items[-1]['receipt_id']
+
+    def get(self, receipt_id):
+        """
+        A cached receipt, or None if it isn't cached or the cache is stale.
+        """
+        self.maybe_update()
+        if self.index is None or time.time() - self.store.get_state().get('synced_at', 0) > self.max_staleness:
+            return None
+        item = self.store.get(receipt_id)
+        return dict(item) if item is not None else None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.store),
+                'stream_records': self.stream_records, 'evictions': getattr(self.store, 'evictions', 0)}
+
+
+def create_store():
+    """
+    The store configured by RECEIPT_CACHE_REDIS_URL: shared Redis, or process-local memory.
+    """
+    if RECEIPT_CACHE_REDIS_URL:
+        return RedisStore(RECEIPT_CACHE_REDIS_URL)
+    return MemoryStore()
@@ -0,0 +1,427 @@
+"""
+Structured receipt fields: merchant, purchase date and total.
+
+Fields come from analyze_expense SummaryFields when the ingest Lambda runs in
+expense mode, otherwise from a local parser over the extracted raw text.
+They are stored as typed attributes on the receipt item:
+
+    merchant       (S)  normalized merchant name, e.g. "starbucks"
+    receipt_date   (S)  ISO date, e.g. "2024-09-12"
+    receipt_month  (S)  "2024-09", partition key of the month index
+    amount         (N)  receipt total
+
+and indexed by two sparse GSIs on the Receipts table:
+
+    merchant-date-index  merchant (HASH) + receipt_date (RANGE)
+    month-date-index     receipt_month (HASH) + receipt_date (RANGE)
+
+plan_query turns search keywords into key-condition queries against them.
+"""
+import argparse
+import calendar
+import functools
+import os
+import re
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+import boto3
+
+import receipt_storage
+from merchants import normalize_merchant
+
+MERCHANT_DATE_INDEX = 'merchant-date-index'
+MONTH_DATE_INDEX = 'month-date-index'
+
+MONTH_NUMBERS = {name: number for number, name in enumerate(calendar.month_name) if name}
+MONTH_NUMBERS.update({name[:3]: number for name, number in list(MONTH_NUMBERS.items())})
+MONTH_NUMBERS = {name.lower(): number for name, number in MONTH_NUMBERS.items()}
+MONTH_NUMBERS['sept'] = 9
+# "this month", "last year": periods back from the current one, for the word before week/month/year
+RELATIVE_PERIODS = {'this': 0, 'current': 0, 'last': 1, 'previous': 1}
+
+_MONTH_WORD = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+DATE_PATTERNS = (
+    # 2024-09-12
+    (re.compile(r"(?<!\d)(\d{4})-(\d{1,2})-(\d{1,2})(?!\d)"), ('year', 'month', 'day')),
+    # 12/09/2024, 12-09-24, 12.09.2024 (Australian day-first order)
+    (re.compile(r"(?<![\d/.-])(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})(?![\d/.-])"), ('day', 'month', 'year')),
+    # 12 sep 2024, 12 september, 2024
+    (re.compile(r"\b(\d{1,2})\s+" + _MONTH_WORD + r",?\s+(\d{4})\b"), ('day', 'month', 'year')),
+    # sep 12, 2024
+    (re.compile(r"\b" + _MONTH_WORD + r"\s+(\d{1,2}),?\s+(\d{4})\b"), ('month', 'day', 'year')),
+)
+
+AMOUNT_PATTERN = re.compile(r"(?<![\d.])\$?\s?(\d{1,3}(?:,\d{3})+|\d+)\.(\d{2})(?![\d.])")
+
+# Lines that hold the amount paid, most specific first
+TOTAL_LABELS = ('amount due', 'balance due', 'total due', 'grand total', 'total', 'amount paid', 'eftpos')
+# Lines at the top of a receipt that are not the merchant name
+NON_MERCHANT_LINES = re.compile(r"^(tax invoice|invoice|receipt|abn\b|phone|ph\b|tel\b|www\.|https?:|\d)")
+
+
+def parse_date(text):
+    """
+    Find the first valid date in a text.
+
+    Args:
+        text (str): Lowercased receipt text or a date field.
+
+    Returns:
+        str: ISO date (YYYY-MM-DD), or None.
+    """
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parts = dict(zip(order, match.groups()))
+            month = int(parts['month']) if parts['month'].isdigit() else MONTH_NUMBERS.get(parts['month'][:3])
+            year = int(parts['year'])
+            year = year + 2000 if year < 100 else year
+            try:
+                return date(year, month, int(parts['day'])).isoformat()
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+def parse_amount(text):
+    """
+    Parse the last money amount in a text ("Total $1,234.50" -> Decimal('1234.50')).
+
+    Returns:
+        Decimal: The amount, or None.
+    """
+    matches = AMOUNT_PATTERN.findall(text)
+    if not matches:
+        return None
+    whole, cents = matches[-1]
+    try:
+        return Decimal(f"{whole.replace(',', '')}.{cents}")
+    except InvalidOperation:
+        return None
+
+
+def parse_total(lines):
+    """
+    Find the receipt total: the amount on the most specific total line, else the largest amount.
+
+    Args:
+        lines (list): Lowercased receipt lines.
+
+    Returns:
+        Decimal: The total, or None.
+    """
+    for label in TOTAL_LABELS:
+        # The last matching line is usually the final total rather than a running subtotal
+        for line in reversed(lines):
+            if label in line and 'subtotal' not in line and 'sub total' not in line:
+                amount = parse_amount(line)
+                if amount is not None:
+                    return amount
+
+    amounts = [amount for amount in map(parse_amount, lines) if amount is not None]
+    return max(amounts) if amounts else None
+
+
+def parse_merchant(lines, merchants=()):
+    """
+    Find the merchant: a known merchant named on the receipt, else the first name-like line.
+
+    Args:
+        lines (list): Lowercased receipt lines.
+        merchants (iterable): Known merchant names.
+
+    Returns:
+        str: Normalized merchant name, or None.
+    """
+    header = ' '.join(lines[:5])
+    for merchant in sorted(merchants, key=len, reverse=True):
+        if re.search(r"\b" + re.escape(merchant) + r"\b", header):
+            return merchant
+
+    for line in lines[:5]:
+        name = normalize_merchant(line)
+        if len(name) >= 2 and not NON_MERCHANT_LINES.match(name) and any(c.isalpha() for c in name):
+            return name
+    return None
+
+
+def fields_from_text(raw_text, merchants=()):
+    """
+    Extract merchant, date and total from raw receipt text.
+
+    Args:
+        raw_text (str): Lowercased raw text, one Textract LINE per line.
+        merchants (iterable): Known merchant names.
+
+    Returns:
+        dict: The fields that could be found.
+    """
+    lines = [line.strip() for line in raw_text.split('\n') if line.strip()]
+    return {
+        'merchant': parse_merchant(lines, merchants),
+        'receipt_date': parse_date(raw_text),
+        'amount': parse_total(lines),
+    }
+
+
+def fields_from_expense(textract_response):
+    """
+    Extract merchant, date and total from analyze_expense SummaryFields.
+
+    Args:
+        textract_response (dict): An analyze_expense response.
+
+    Returns:
+        dict: The fields that could be found.
+    """
+    values = {}
+    for document in textract_response.get('ExpenseDocuments', []):
+        for field in document.get('SummaryFields', []):
+            field_type = field.get('Type', {}).get('Text')
+            text = field.get('ValueDetection', {}).get('Text', '')
+            if field_type and text and field_type not in values:
+                values[field_type] = text
+
+    amount_text = values.get('TOTAL') or values.get('AMOUNT_PAID') or ''
+    vendor = normalize_merchant(values.get('VENDOR_NAME', ''))
+    return {
+        'merchant': vendor or None,
+        'receipt_date': parse_date(values.get('INVOICE_RECEIPT_DATE', '').lower()),
+        'amount': parse_amount(amount_text) if '.' in amount_text else parse_amount(amount_text + '.00'),
+    }
+
+
+def structured_fields(raw_text, textract_response=None, merchants=()):
+    """
+    Build the typed attributes to store on a receipt item.
+
+    Expense summary fields win; the local parser fills whatever they lack.
+
+    Args:
+        raw_text (str): Lowercased raw text of the receipt.
+        textract_response (dict): The Textract response, used when it is an analyze_expense response.
+        merchants (iterable): Known merchant names.
+
+    Returns:
+        dict: merchant / receipt_date / receipt_month / amount, only those that were found.
+    """
+    fields = fields_from_text(raw_text, merchants)
+    if textract_response and 'ExpenseDocuments' in textract_response:
+        for name, value in fields_from_expense(textract_response).items():
+            if value is not None:
+                fields[name] = value
+
+    # Known merchants are canonicalized so "starbucks coffee" and "starbucks" share an index partition
+    if fields['merchant']:
+        for merchant in sorted(merchants, key=len, reverse=True):
+            if re.search(r"\b" + re.escape(merchant) + r"\b", fields['merchant']):
+                fields['merchant'] = merchant
+                break
+    if fields['receipt_date']:
+        fields['receipt_month'] = fields['receipt_date'][:7]
+    return {name: value for name, value in fields.items() if value is not None}
+
+
+class QueryPlan:
+    """
+    Key-condition queries derived from search keywords.
+
+    Attributes:
+        merchant (str): Merchant partition to query, or None.
+        date_ranges (list): (first ISO date, last ISO date) ranges, empty for any date.
+        keywords (list): Remaining keywords, matched against raw_text after the query.
+    """
+
+    def __init__(self, merchant, date_ranges, keywords):
+        self.merchant = merchant
+        self.date_ranges = date_ranges
+        self.keywords = keywords
+
+    @property
+    def indexed(self):
+        """
+        True if the plan can be answered from the GSIs.
+        """
+        return bool(self.merchant or self.date_ranges)
+
+
+def relative_range(unit, offset, today):
+    """
+    The ISO date range of a week (from Monday), month or year counted back from today's.
+
+    Args:
+        unit (str): 'week', 'month' or 'year'.
+        offset (int): Periods back, 0 for the current one.
+        today (date): Reference date.
+
+    Returns:
+        tuple: (first ISO date, last ISO date).
+    """
+    if unit == 'week':
+        first = today - timedelta(days=today.weekday() + 7 * offset)
+        return first.isoformat(), (first + timedelta(days=6)).isoformat()
+    if unit == 'month':
+        year, month = divmod(today.year * 12 + today.month - 1 - offset, 12)
+        month += 1
+        return date(year, month, 1).isoformat(), date(year, month, calendar.monthrange(year, month)[1]).isoformat()
+    return f"{today.year - offset}-01-01", f"{today.year - offset}-12-31"
+
+
+def plan_query(keywords, merchants=(), today=None, lookback_years=2):
+    """
+    Turn search keywords into merchant / date range conditions.
+
+    Month names without a year match that month in each of the last
+    `lookback_years` calendar years, counting the current one, and ignoring
+    months still in the future: with the default of 2, "march" asked in
+    September 2025 searches March 2025 and March 2024, while "september" asked
+    in March 2025 searches September 2024 only. Name the year to search
+    further back.
+
+    "this" or "last" (RELATIVE_PERIODS) before "week", "month" or "year" is
+    resolved against today: "last month" asked in March 2025 searches
+    February 2025, and "march last year" March 2024.
+
+    Args:
+        keywords (list): Keywords from the keyword extractor.
+        merchants (iterable): Known merchant names.
+        today (date): Reference date, defaults to today.
+        lookback_years (int): Years searched for a month without a year.
+
+    Returns:
+        QueryPlan: The plan.
+    """
+    today = today or date.today()
+    known = set(merchants)
+    merchant, months, years, remaining, relative_ranges = None, [], [], [], []
+
+    for keyword in keywords:
+        keyword = keyword.lower().strip()
+        # "last month" as one keyword, or "month" after a "last" keyword
+        relative = re.fullmatch(r"(\w+) (week|month|year)", keyword)
+        if relative and relative.group(1) in RELATIVE_PERIODS:
+            period, unit = relative.groups()
+        elif keyword in ('week', 'month', 'year') and remaining and remaining[-1] in RELATIVE_PERIODS:
+            period, unit = remaining.pop(), keyword
+        else:
+            period = unit = None
+
+        if unit == 'year':
+            years.append(today.year - RELATIVE_PERIODS[period])
+        elif unit:
+            relative_ranges.append(relative_range(unit, RELATIVE_PERIODS[period], today))
+        elif merchant is None and normalize_merchant(keyword) in known:
+            merchant = normalize_merchant(keyword)
+        elif keyword in MONTH_NUMBERS:
+            months.append(MONTH_NUMBERS[keyword])
+        elif re.fullmatch(r"(19|20)\d{2}", keyword):
+            years.append(int(keyword))
+        else:
+            remaining.append(keyword)
+
+    if not years and months:
+        years = [today.year - offset for offset in range(lookback_years)]
+
+    date_ranges = []
+    for year in sorted(set(years), reverse=True):
+        for month in sorted(set(months or range(1, 13))):
+            first = date(year, month, 1)
+            if first > today:
+                continue
+            last = date(year, month, calendar.monthrange(year, month)[1])
+            date_ranges.append((first.isoformat(), last.isoformat()))
+
+    # A year alone is one contiguous range
+    if years and not months:
+        date_ranges = [(f"{year}-01-01", f"{year}-12-31") for year in sorted(set(years), reverse=True)]
+
+    date_ranges = sorted(set(relative_ranges), reverse=True) + date_ranges
+    return QueryPlan(merchant, date_ranges, remaining)
+
+
+def months_between(first, last):
+    """
+    List the YYYY-MM months covered by an ISO date range, newest first.
+
+    Args:
+        first (str): First ISO date of the range.
+        last (str): Last ISO date of the range.
+
+    Returns:
+        list: Months as "YYYY-MM" strings.
+    """
+    year, month = int(last[:4]), int(last[5:7])
+    months = []
+    while f"{year:04d}-{month:02d}" >= first[:7]:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months
+
+
+def backfill(table, merchants=(), get_texts=None):
+    """
+    Parse structured fields for existing receipts that don't have them yet.
+
+    Inline receipts are parsed from their raw_text. Compact ones (see
+    receipt_storage) have their texts fetched with get_texts.
+
+    Args:
+        table: The DynamoDB Receipts table.
+        merchants (iterable): Known merchant names.
+        get_texts (callable): receipt_ids -> {receipt_id: raw_text}, e.g. a bound receipt_storage.fetch_texts.
+            Compact receipts are skipped without it.
+
+    Returns:
+        int: Number of receipts updated.
+    """
+    from parallel_scan import iter_scan_pages
+
+    updated = 0
+    for page in iter_scan_pages(table, ProjectionExpression='receipt_id, raw_text, merchant, token_signature'):
+        pending = [item for item in page if 'merchant' not in item]
+        compact_ids = [item['receipt_id'] for item in pending
+                       if 'raw_text' not in item and item.get('token_signature') is not None]
+        texts = get_texts(compact_ids) if compact_ids and get_texts else {}
+        for item in pending:
+            raw_text = item.get('raw_text') or texts.get(item['receipt_id'])
+            if not raw_text:
+                continue
+            fields = structured_fields(raw_text, merchants=merchants)
+            if not fields:
+                continue
+            names = {f"#{name}": name for name in fields}
+            values = {f":{name}": value for name, value in fields.items()}
+            table.update_item(
+                Key={'receipt_id': item['receipt_id']},
+                UpdateExpression='SET ' + ', '.join(f"#{name} = :{name}" for name in fields),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+            updated += 1
+    return updated
+
+
+def main(argv=None):
+    from merchants import merchants_from_env
+
+    parser = argparse.ArgumentParser(description="Manage structured receipt fields.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill_parser = subparsers.add_parser('backfill', help="Parse fields for receipts stored without them.")
+    backfill_parser.add_argument('--table', default=os.getenv('DYNAMODB_TABLE', 'Receipts'))
+    backfill_parser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+    backfill_parser.add_argument('--texts-table', default=receipt_storage.RECEIPT_TEXTS_TABLE)
+    backfill_parser.add_argument('--bucket', default=receipt_storage.TEXT_BUCKET)
+    backfill_parser.add_argument('--endpoint-url', default=None)
+
+    args = parser.parse_args(argv)
+    dynamodb = boto3.resource('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url)
+    s3 = boto3.client('s3', region_name=args.region, endpoint_url=args.endpoint_url)
+    get_texts = functools.partial(receipt_storage.fetch_texts, dynamodb, s3,
+                                  table_name=args.texts_table, bucket=args.bucket)
+    count = backfill(dynamodb.Table(args.table), merchants_from_env(), get_texts)
+    print(f"Added structured fields to {count} receipts.")
+
+
+if __name__ == "__main__":
+    main()
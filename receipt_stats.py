@@ -0,0 +1,518 @@
+"""
+Precomputed spend and count rollups, for /stats.
+
+Answering "how much did I spend at Starbucks in September" from the
+Receipts table means reading every receipt. Instead the ingest Lambda adds
+each stored receipt's amount to a few counters in the ReceiptStats table
+(rollup HASH + period RANGE), so a question is one or a few small queries
+however many receipts there are:
+
+    rollup               period      attributes
+    month                2024-09     spend, receipts   all merchants
+    day                  2024-09-12  spend, receipts   all merchants
+    merchant#starbucks   2024-09     spend, receipts   one merchant, by month
+    merchants#2024-09    starbucks   spend, receipts   one month, by merchant
+    receipt#<id>         counted     merchant, receipt_date, amount, version
+
+Only receipts with a receipt_date are counted; receipts without a merchant
+count towards the month and day totals only. Per-merchant spend is rolled
+up by month, so merchant questions are answered for whole months.
+
+The counters are updated with ADD. The receipt#<id> item records what a
+receipt was counted as, so storing it again (Lambda retries, bulk_import
+reindex) changes nothing, and storing it with different fields moves its
+amount to the right counters. A receipt's marker and its counter updates
+are written in one TransactWriteItems call, so a receipt is never marked
+counted without its amounts being added, or the other way round.
+
+A failed transaction writes nothing and update_rollups raises; the Lambda
+fails the batch so it is retried and the receipts are counted then.
+`python receipt_stats.py rebuild` recomputes every rollup from
+the Receipts table, or from a DynamoDB export to S3 with --export. The same
+columns answer ad-hoc questions the rollups don't cover, e.g.
+`python receipt_stats.py report --group weekday --from 2024-01`; both
+aggregate with numpy.
+"""
+import argparse
+import calendar
+import glob
+import gzip
+import json
+import os
+from datetime import date
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+import metrics
+from parallel_scan import iter_scan_pages
+from receipt_fields import months_between
+
+RECEIPT_STATS_TABLE = os.getenv('RECEIPT_STATS_TABLE', 'ReceiptStats')
+STATS_ROLLUPS = os.getenv('STATS_ROLLUPS', 'true').lower() in ('1', 'true', 'yes')
+
+# Fields a receipt is counted by
+COUNTED_FIELDS = ('merchant', 'receipt_date', 'amount')
+MARKER_PERIOD = 'counted'
+GROUPS = ('month', 'day', 'merchant')
+# Groups report can compute from exported columns
+REPORT_GROUPS = GROUPS + ('weekday',)
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def counted_fields(item):
+    return {name: item[name] for name in COUNTED_FIELDS if item.get(name) is not None}
+
+
+def rollup_keys(fields):
+    """
+    The (rollup, period) counters a receipt's fields add to.
+
+    Returns:
+        list: Counter keys, empty for a receipt without a receipt_date.
+    """
+    receipt_date = fields.get('receipt_date')
+    if not receipt_date:
+        return []
+    month = receipt_date[:7]
+    keys = [('month', month), ('day', receipt_date)]
+    if fields.get('merchant'):
+        keys += [(f"merchant#{fields['merchant']}", month), (f"merchants#{month}", fields['merchant'])]
+    return keys
+
+
+def marker_key(receipt_id):
+    return {'rollup': f"receipt#{receipt_id}", 'period': MARKER_PERIOD}
+
+
+def marker_exists(error):
+    """
+    Whether a cancelled count transaction failed on its marker's condition (the receipt was counted before).
+    """
+    if error.response.get('Error', {}).get('Code') != 'TransactionCanceledException':
+        return False
+    reasons = error.response.get('CancellationReasons') or [{}]
+    return reasons[0].get('Code') == 'ConditionalCheckFailed'
+
+
+def count_transaction(table, item, previous=None, version=None):
+    """
+    The TransactWriteItems actions counting a receipt: its marker, then its counter changes.
+
+    Args:
+        table: The ReceiptStats Table.
+        item (dict): The receipt item as stored.
+        previous (dict): Fields the receipt was counted as before, None if it wasn't.
+        version (int): Version of its marker, None if there is none.
+
+    Returns:
+        list: The actions.
+    """
+    fields = counted_fields(item)
+    key = marker_key(item['receipt_id'])
+    if version is None:
+        condition = {'ConditionExpression': 'attribute_not_exists(#r)', 'ExpressionAttributeNames': {'#r': 'rollup'}}
+    else:
+        condition = {'ConditionExpression': '#v = :v', 'ExpressionAttributeNames': {'#v': 'version'},
+                     'ExpressionAttributeValues': {':v': version}}
+    actions = [{'Put': dict(condition, TableName=table.name, Item=dict(fields, version=(version or 0) + 1, **key))}]
+    for (rollup, period), (spend, receipts) in rollup_deltas([(previous or {}, fields)]).items():
+        actions.append({'Update': {'TableName': table.name, 'Key': {'rollup': rollup, 'period': period},
+                                   'UpdateExpression': 'ADD spend :s, receipts :n',
+                                   'ExpressionAttributeValues': {':s': spend, ':n': receipts}}})
+    return actions
+
+
+def count_receipt(table, item):
+    """
+    Count a receipt in the rollups, replacing what it was counted as before.
+
+    Returns:
+        int: Number of counters updated, 0 if the receipt is already counted as it is now.
+
+    Raises:
+        ClientError: If another writer counted the same receipt at the same time, or the
+            transaction failed; nothing was written.
+    """
+    client = table.meta.client
+    try:
+        actions = count_transaction(table, item)
+        client.transact_write_items(TransactItems=actions)
+        return len(actions) - 1
+    except ClientError as e:
+        if not marker_exists(e):
+            raise
+    marker = table.get_item(Key=marker_key(item['receipt_id']), ConsistentRead=True).get('Item', {})
+    previous = counted_fields(marker)
+    if previous == counted_fields(item):
+        return 0
+    actions = count_transaction(table, item, previous, marker.get('version', 0))
+    client.transact_write_items(TransactItems=actions)
+    return len(actions) - 1
+
+
+def rollup_deltas(changes):
+    """
+    Sum the counter changes of (previous fields, new fields) pairs.
+
+    Returns:
+        dict: (rollup, period) -> [spend, receipts] change, without the counters that cancel out.
+    """
+    deltas = {}
+    for previous, fields in changes:
+        for sign, counted in ((-1, previous), (1, fields)):
+            amount = Decimal(counted.get('amount', 0))
+            for key in rollup_keys(counted):
+                delta = deltas.setdefault(key, [Decimal(0), 0])
+                delta[0] += sign * amount
+                delta[1] += sign
+    return {key: delta for key, delta in deltas.items() if any(delta)}
+
+
+def update_rollups(table, items):
+    """
+    Count stored receipts in the rollups, one transaction per receipt.
+
+    Receipts counted before a failure stay counted; calling again with the
+    same items counts the rest and changes nothing for those.
+
+    Args:
+        table: The ReceiptStats Table.
+        items (list): Receipt items as stored, with their structured fields.
+
+    Returns:
+        int: Number of counter updates written.
+
+    Raises:
+        ClientError: If a receipt's transaction failed.
+    """
+    return sum(count_receipt(table, item) for item in items)
+
+
+def query_rollup(table, rollup, first=None, last=None):
+    """
+    Read one rollup's counters, optionally between two periods (inclusive).
+
+    Returns:
+        list: Counter items.
+    """
+    condition = Key('rollup').eq(rollup)
+    if first and last:
+        condition &= Key('period').between(first, last)
+    elif first:
+        condition &= Key('period').gte(first)
+    elif last:
+        condition &= Key('period').lte(last)
+    query_kwargs = {'KeyConditionExpression': condition}
+    items = []
+    while True:
+        with metrics.timed('dynamodb', 'query'):
+            response = table.query(**query_kwargs)
+        items += response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def date_bound(value, end=False):
+    """
+    Turn a YYYY-MM month or an ISO date into the ISO date a range starts or ends at.
+
+    Args:
+        value (str): The month or date, or None.
+        end (bool): True for the last day of a month, False for the first.
+
+    Returns:
+        str: ISO date, or None.
+
+    Raises:
+        ValueError: If value is neither.
+    """
+    if not value:
+        return None
+    try:
+        if len(value) == 7:
+            year, month = int(value[:4]), int(value[5:7])
+            day = calendar.monthrange(year, month)[1] if end else 1
+            return date(year, month, day).isoformat()
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM or YYYY-MM-DD.") from None
+
+
+def whole_months(first, last):
+    """
+    True if an ISO date range (either end None for open-ended) covers whole months.
+    """
+    if first and not first.endswith('-01'):
+        return False
+    if last:
+        year, month = int(last[:4]), int(last[5:7])
+        return int(last[8:10]) == calendar.monthrange(year, month)[1]
+    return True
+
+
+def summarize(table, ranges=((None, None),), merchant=None, group='month'):
+    """
+    Answer a spend question from the rollups.
+
+    Args:
+        table: The ReceiptStats Table.
+        ranges (list): (first ISO date, last ISO date) ranges, either end None for open-ended.
+        merchant (str): Only count this merchant's receipts.
+        group (str): Break the totals down by 'month', 'day' or 'merchant'.
+
+    Returns:
+        dict: 'spend', 'receipts' and 'groups', a list of {'period' or 'merchant', 'spend', 'receipts'}
+            in period order, or largest spend first by merchant.
+
+    Raises:
+        ValueError: For a question the rollups can't answer: an unknown group, or a merchant
+            with days or partial months.
+    """
+    if group not in GROUPS:
+        raise ValueError(f"Unknown group {group!r}, expected one of {', '.join(GROUPS)}.")
+    totals = {}
+    for first, last in ranges:
+        months = (first and first[:7], last and last[:7])
+        if merchant and (group == 'day' or not whole_months(first, last)):
+            raise ValueError("Spend per merchant is rolled up by month; ask for whole months.")
+        if group == 'day' or (group == 'month' and not whole_months(first, last)):
+            counters = [(item['period'][:7] if group == 'month' else item['period'], item)
+                        for item in query_rollup(table, 'day', first, last)]
+        elif group == 'month':
+            rollup = f"merchant#{merchant}" if merchant else 'month'
+            counters = [(item['period'], item) for item in query_rollup(table, rollup, *months)]
+        elif merchant:
+            counters = [(merchant, item) for item in query_rollup(table, f"merchant#{merchant}", *months)]
+        elif whole_months(first, last):
+            # An open-ended range takes its months from the month rollup
+            in_range = (months_between(first, last) if first and last
+                        else [item['period'] for item in query_rollup(table, 'month', *months)])
+            counters = [(item['period'], item) for month in in_range
+                        for item in query_rollup(table, f"merchants#{month}")]
+        else:
+            raise ValueError("Spend per merchant is rolled up by month; ask for whole months.")
+        for label, item in counters:
+            total = totals.setdefault(label, [Decimal(0), 0])
+            total[0] += item.get('spend', 0)
+            total[1] += int(item.get('receipts', 0))
+
+    label = 'merchant' if group == 'merchant' else 'period'
+    groups = [{label: name, 'spend': float(spend), 'receipts': receipts}
+              for name, (spend, receipts) in totals.items() if receipts]
+    groups.sort(key=(lambda entry: -entry['spend']) if group == 'merchant' else (lambda entry: entry['period']))
+    return {
+        'spend': float(sum(spend for spend, _ in totals.values())),
+        'receipts': sum(receipts for _, receipts in totals.values()),
+        'groups': groups,
+    }
+
+
+def iter_table_items(table, total_segments=None):
+    """
+    Read the counted fields of every receipt in the Receipts table.
+    """
+    for page in iter_scan_pages(table, total_segments, ProjectionExpression='receipt_id, merchant, receipt_date, amount'):
+        yield from page
+
+
+def iter_export_items(path):
+    """
+    Read receipts from a DynamoDB export to S3 (DYNAMODB_JSON format), downloaded to path.
+
+    Args:
+        path (str): The export's data directory or one of its .json.gz files.
+    """
+    deserializer = TypeDeserializer()
+    files = sorted(glob.glob(os.path.join(path, '*.json*'))) if os.path.isdir(path) else [path]
+    for name in files:
+        with (gzip.open if name.endswith('.gz') else open)(name, 'rt') as f:
+            for line in f:
+                if line.strip():
+                    yield {key: deserializer.deserialize(value) for key, value in json.loads(line)['Item'].items()}
+
+
+def load_columns(items):
+    """
+    Columns of the dated receipts, for vectorized rollups.
+
+    Returns:
+        dict: numpy arrays 'receipt_id' and 'merchant' (str, '' for none), 'date' (datetime64[D])
+            and 'cents' (int64, the amount).
+    """
+    # Imported here so the Lambda and the app don't need numpy for the incremental rollups
+    import numpy as np
+
+    receipt_ids, merchants, dates, cents = [], [], [], []
+    for item in items:
+        if not item.get('receipt_date'):
+            continue
+        receipt_ids.append(item['receipt_id'])
+        merchants.append(item.get('merchant') or '')
+        dates.append(item['receipt_date'])
+        cents.append(int(Decimal(item.get('amount', 0)) * 100))
+    return {
+        'receipt_id': np.array(receipt_ids, dtype=str),
+        'merchant': np.array(merchants, dtype=str),
+        'date': np.array(dates, dtype='datetime64[D]'),
+        'cents': np.array(cents, dtype=np.int64),
+    }
+
+
+def group_labels(columns, group):
+    import numpy as np
+
+    if group == 'month':
+        return columns['date'].astype('datetime64[M]')
+    if group == 'day':
+        return columns['date']
+    if group == 'weekday':
+        # Day 0 of datetime64 is a Thursday
+        return (columns['date'].astype(np.int64) + 3) % 7
+    return columns['merchant']
+
+
+def aggregate(labels, cents):
+    """
+    Sum cents and count receipts per distinct label.
+
+    Returns:
+        tuple: (distinct labels, spend in cents, receipts), numpy arrays in label order.
+    """
+    import numpy as np
+
+    distinct, inverse = np.unique(labels, return_inverse=True)
+    spend = np.bincount(inverse, weights=cents, minlength=len(distinct))
+    return distinct, spend, np.bincount(inverse, minlength=len(distinct))
+
+
+def report(columns, group='month', first=None, last=None, merchant=None):
+    """
+    Compute an ad-hoc rollup from columns.
+
+    Args:
+        columns (dict): Columns returned by load_columns.
+        group (str): 'month', 'day', 'merchant' or 'weekday'.
+        first (str): First ISO date, or None.
+        last (str): Last ISO date, or None.
+        merchant (str): Only count this merchant's receipts.
+
+    Returns:
+        list: (label, spend, receipts) tuples in label order.
+    """
+    import numpy as np
+
+    mask = np.ones(len(columns['date']), dtype=bool)
+    if first:
+        mask &= columns['date'] >= np.datetime64(first, 'D')
+    if last:
+        mask &= columns['date'] <= np.datetime64(last, 'D')
+    if merchant:
+        mask &= columns['merchant'] == merchant
+    distinct, spend, receipts = aggregate(group_labels(columns, group)[mask], columns['cents'][mask])
+    labels = [WEEKDAYS[label] for label in distinct] if group == 'weekday' else [str(label) or '-' for label in distinct]
+    return [(label, int(cents) / 100, int(count)) for label, cents, count in zip(labels, spend, receipts)]
+
+
+def rollup_items(columns):
+    """
+    Compute every rollup counter from columns.
+
+    Returns:
+        list: ReceiptStats items (counters only, not the receipt# items).
+    """
+    import numpy as np
+
+    items = []
+
+    def add(rollups, periods, spend, receipts):
+        for rollup, period, cents, count in zip(rollups, periods, spend, receipts):
+            items.append({'rollup': rollup, 'period': period, 'spend': Decimal(int(cents)) / 100, 'receipts': int(count)})
+
+    months = columns['date'].astype('datetime64[M]')
+    for group, labels in (('month', months), ('day', columns['date'])):
+        distinct, spend, receipts = aggregate(labels, columns['cents'])
+        add([group] * len(distinct), distinct.astype(str), spend, receipts)
+
+    # Merchant x month pairs, as one code per pair
+    known = columns['merchant'] != ''
+    merchant_names, merchant_codes = np.unique(columns['merchant'][known], return_inverse=True)
+    month_names, month_codes = np.unique(months[known], return_inverse=True)
+    distinct, spend, receipts = aggregate(merchant_codes * len(month_names) + month_codes, columns['cents'][known])
+    merchants = merchant_names[distinct // len(month_names)] if len(month_names) else merchant_names[:0]
+    pair_months = month_names[distinct % len(month_names)].astype(str) if len(month_names) else []
+    add([f"merchant#{name}" for name in merchants], pair_months, spend, receipts)
+    add([f"merchants#{month}" for month in pair_months], merchants, spend, receipts)
+    return items
+
+
+def rebuild(stats_table, columns, log=print):
+    """
+    Replace the rollups with counters computed from columns, and the receipt# items to match.
+
+    Counters the new rollups don't have (periods and merchants no receipt counts towards any more) are deleted.
+
+    Returns:
+        dict: 'counters' and 'receipts' written, 'deleted' counters.
+    """
+    items = rollup_items(columns)
+    keys = {(item['rollup'], item['period']) for item in items}
+    stale = []
+    for page in iter_scan_pages(stats_table, ProjectionExpression='#r, #p',
+                                ExpressionAttributeNames={'#r': 'rollup', '#p': 'period'}):
+        stale += [item for item in page if item['period'] != MARKER_PERIOD
+                  and (item['rollup'], item['period']) not in keys]
+
+    with stats_table.batch_writer(overwrite_by_pkeys=['rollup', 'period']) as writer:
+        for item in items:
+            writer.put_item(Item=item)
+        for receipt_id, merchant, receipt_date, cents in zip(columns['receipt_id'], columns['merchant'],
+                                                             columns['date'].astype(str), columns['cents']):
+            marker = dict(marker_key(receipt_id), receipt_date=receipt_date, amount=Decimal(int(cents)) / 100, version=1)
+            if merchant:
+                marker['merchant'] = merchant
+            writer.put_item(Item=marker)
+        for item in stale:
+            writer.delete_item(Key={'rollup': item['rollup'], 'period': item['period']})
+    log(f"Wrote {len(items)} counters for {len(columns['date'])} receipts, deleted {len(stale)} stale counters.")
+    return {'counters': len(items), 'receipts': len(columns['date']), 'deleted': len(stale)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Spend and count rollups of the receipts.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help="Recompute every rollup counter.")
+    rebuild_parser.add_argument('--stats-table', default=RECEIPT_STATS_TABLE)
+    report_parser = subparsers.add_parser('report', help="Print an ad-hoc rollup.")
+    report_parser.add_argument('--group', choices=REPORT_GROUPS, default='month')
+    report_parser.add_argument('--from', dest='first', default=None, help="First ISO date, e.g. 2024-01-01")
+    report_parser.add_argument('--to', dest='last', default=None, help="Last ISO date")
+    report_parser.add_argument('--merchant', default=None)
+    for subparser in (rebuild_parser, report_parser):
+        subparser.add_argument('--export', default=None, help="Read a DynamoDB export (DYNAMODB_JSON) instead of the table")
+        subparser.add_argument('--receipts-table', default=os.getenv('DYNAMODB_TABLE', 'Receipts'))
+        subparser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+        subparser.add_argument('--endpoint-url', default=None, help="e.g. http://localhost:8000 for DynamoDB Local")
+        subparser.add_argument('--segments', type=int, default=None, help="Parallel scan segments")
+    args = parser.parse_args(argv)
+
+    dynamodb = boto3.resource('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url)
+    items = iter_export_items(args.export) if args.export else iter_table_items(dynamodb.Table(args.receipts_table),
+                                                                                args.segments)
+    columns = load_columns(items)
+    if args.command == 'rebuild':
+        rebuild(dynamodb.Table(args.stats_table), columns)
+        return
+
+    rows = report(columns, args.group, args.first, args.last, args.merchant)
+    for label, spend, receipts in rows:
+        print(f"{label:<24}{spend:>14.2f}{receipts:>10}")
+    print(f"{'total':<24}{sum(row[1] for row in rows):>14.2f}{sum(row[2] for row in rows):>10}")
+
+
+if __name__ == "__main__":
+    main()
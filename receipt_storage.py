@@ -0,0 +1,367 @@
+"""
+Hot/cold storage layout for receipt items.
+
+raw_text and the embedding are most of a Receipts item, and DynamoDB
+charges a read by the size of the whole item, whatever its
+ProjectionExpression: every scan and every /list page pays for the full
+text of every receipt it touches. In the compact layout
+(RECEIPT_STORAGE=compact) the Receipts item keeps only what pages show and
+queries filter on, and the rest lives in the ReceiptTexts table:
+
+    Receipts      receipt_id, merchant, receipt_date, amount, ..., preview, token_signature,
+                  embedding_model
+    ReceiptTexts  receipt_id | text (B, zlib) or text_key (texts/{id}.txt.z in S3),
+                  embedding, embedding_model, ingested_at, ingest_bucket
+
+- preview is the first PREVIEW_CHARS characters of the text, for the list page
+- token_signature is a Bloom filter of the text's tokens (SIGNATURE_BITS
+  bits), so keyword matching can rule a receipt out without its text;
+  only the candidates' texts are fetched and checked (see match_keywords).
+  Keywords then match compact receipts as whole tokens, not substrings
+- texts compressing to more than COLD_TEXT_MAX_BYTES go to S3 instead of
+  the item
+- the vector index is built from ReceiptTexts, where the embeddings are;
+  embedding_model is kept on both items so the embedding backfill can
+  skip embedded receipts without reading their texts
+
+Reads project HOT_ATTRIBUTES and the detail view fetches the full text on
+demand (/receipts/<id>/text).
+
+Items still in the inline layout (raw_text on the item) are read and
+matched as before, so the app and the Lambda can switch to compact before
+`python receipt_storage.py migrate` has moved the existing receipts (the
+vector index only sees migrated ones). The keyword index backfill reads
+raw_text from the Receipts item: run it before migrating. The structured
+field and embedding backfills handle both layouts.
+
+Both tables also carry `ingest_bucket`, the hour the receipt was ingested
+in, so the app's in-memory indexes can pick up new receipts with a query of
+the ingest-time-index GSI (ingest_bucket, ingested_at) instead of a scan
+(see search_engine.TableIndex.refresh).
+
+`python receipt_storage.py stats` reports the table's item sizes and what a
+full scan costs.
+"""
+import argparse
+import hashlib
+import math
+import os
+import zlib
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+import keyword_index
+import metrics
+from parallel_scan import iter_scan_pages
+from tokenizer import tokenize, unique_tokens
+
+COMPACT_STORAGE = os.getenv('RECEIPT_STORAGE', 'inline').lower() == 'compact'
+RECEIPT_TEXTS_TABLE = os.getenv('RECEIPT_TEXTS_TABLE', 'ReceiptTexts')
+TEXT_BUCKET = os.getenv('S3_BUCKET_NAME', 'my-receipt-manager-bucket')
+# Characters of raw_text kept on the Receipts item for the list page
+PREVIEW_CHARS = int(os.getenv('PREVIEW_CHARS', '160'))
+# Compressed texts larger than this are stored in S3 rather than in ReceiptTexts
+COLD_TEXT_MAX_BYTES = int(os.getenv('COLD_TEXT_MAX_BYTES', str(64 * 1024)))
+
+# 128 bytes per receipt; a 100-token receipt matches an absent token ~1.6% of the time
+SIGNATURE_BITS = 1024
+SIGNATURE_HASHES = 3
+ZLIB_LEVEL = 9
+
+# Attributes moved from Receipts to ReceiptTexts (embedding_model is copied)
+COLD_ATTRIBUTES = ('raw_text', 'embedding')
+# Attributes reads fetch in the compact layout
+HOT_ATTRIBUTES = ('receipt_id', 's3_url', 'upload_status', 'ingested_at', 'thumbnail_key', 'merchant',
+                  'receipt_date', 'receipt_month', 'amount', 'preview', 'token_signature')
+
+# GSI on both tables over (ingest_bucket, ingested_at), and the width of a bucket in seconds
+INGEST_TIME_INDEX = 'ingest-time-index'
+INGEST_BUCKET_SECONDS = 3600
+
+# A read capacity unit covers 4 KB of a strongly consistent read, scans are eventually consistent (half)
+READ_UNIT_BYTES = 4096
+
+
+def hot_projection():
+    """
+    Keyword arguments projecting HOT_ATTRIBUTES, for scan, query and get_item.
+    """
+    names = {f"#h{position}": name for position, name in enumerate(HOT_ATTRIBUTES)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def ingest_bucket(ingested_at):
+    """
+    The ingest-time-index partition of a receipt ingested at a Unix time.
+    """
+    return int(ingested_at) // INGEST_BUCKET_SECONDS
+
+
+def compress_text(text):
+    return zlib.compress(text.encode('utf-8'), ZLIB_LEVEL)
+
+
+def decompress_text(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+def _signature_positions(token):
+    digest = hashlib.blake2b(token.encode('utf-8'), digest_size=2 * SIGNATURE_HASHES).digest()
+    return [int.from_bytes(digest[2 * i:2 * i + 2], 'big') % SIGNATURE_BITS for i in range(SIGNATURE_HASHES)]
+
+
+def token_signature(tokens):
+    """
+    Bloom filter of a receipt's tokens.
+
+    Returns:
+        bytes: SIGNATURE_BITS // 8 bytes.
+    """
+    signature = bytearray(SIGNATURE_BITS // 8)
+    for token in tokens:
+        for position in _signature_positions(token):
+            signature[position // 8] |= 1 << (position % 8)
+    return bytes(signature)
+
+
+def signature_contains(signature, tokens):
+    """
+    Whether a receipt may contain every token: False is certain, True may be a false positive.
+    """
+    if signature is None:
+        return False
+    signature = bytes(signature)
+    return all(signature[position // 8] & (1 << (position % 8))
+               for token in tokens for position in _signature_positions(token))
+
+
+def hot_item(item):
+    """
+    The compact Receipts item for a receipt item with raw_text.
+    """
+    hot = {name: value for name, value in item.items() if name not in COLD_ATTRIBUTES}
+    raw_text = item.get('raw_text') or ''
+    hot['preview'] = raw_text[:PREVIEW_CHARS]
+    hot['token_signature'] = token_signature(unique_tokens(raw_text))
+    return hot
+
+
+def text_object_key(receipt_id):
+    return f"texts/{receipt_id}.txt.z"
+
+
+def cold_item(item):
+    """
+    The ReceiptTexts item for a receipt item with raw_text, its text compressed.
+
+    Returns:
+        tuple: (the item, compressed text to store in S3 under its text_key, or None).
+    """
+    cold = {name: item[name] for name in ('receipt_id', 'embedding', 'embedding_model', 'ingested_at', 'ingest_bucket')
+            if name in item}
+    compressed = compress_text(item.get('raw_text') or '')
+    if len(compressed) > COLD_TEXT_MAX_BYTES:
+        cold['text_key'] = text_object_key(item['receipt_id'])
+        return cold, compressed
+    cold['text'] = compressed
+    return cold, None
+
+
+def write_cold(writer, s3, item, bucket=TEXT_BUCKET):
+    """
+    Store the cold part of a receipt item in ReceiptTexts, and its text in S3 when large.
+
+    Args:
+        writer: The ReceiptTexts Table or a batch_writer() for it.
+        s3: The S3 client, used for large texts only.
+        item (dict): The full receipt item.
+
+    Returns:
+        int: Size of the ReceiptTexts item in bytes.
+    """
+    cold, large_text = cold_item(item)
+    if large_text is not None:
+        with metrics.timed('s3', 'put_object'):
+            s3.put_object(Bucket=bucket, Key=cold['text_key'], Body=large_text, ContentType='application/zlib')
+    writer.put_item(Item=cold)
+    return item_size(cold)
+
+
+def read_text(item, s3, bucket=TEXT_BUCKET):
+    """
+    Decompress the text of a ReceiptTexts item, from S3 if it was stored there.
+    """
+    if 'text_key' in item:
+        with metrics.timed('s3', 'get_object'):
+            data = s3.get_object(Bucket=bucket, Key=item['text_key'])['Body'].read()
+        return decompress_text(data)
+    return decompress_text(item['text'])
+
+
+def fetch_texts(dynamodb, s3, receipt_ids, table_name=RECEIPT_TEXTS_TABLE, bucket=TEXT_BUCKET):
+    """
+    Fetch the full texts of compact receipts.
+
+    Returns:
+        dict: receipt_id -> raw_text, for the receipts that have one.
+    """
+    if not receipt_ids:
+        return {}
+    items = keyword_index.batch_get_receipts(dynamodb, table_name, receipt_ids)
+    return {item['receipt_id']: read_text(item, s3, bucket) for item in items}
+
+
+def match_keywords(items, keywords, get_texts):
+    """
+    Keep the receipts whose text contains every keyword, in their order.
+
+    Inline items are matched on their raw_text, as substrings. Compact ones
+    are first matched on their token signature, and only those candidates'
+    texts are fetched and checked. The signature only holds whole tokens,
+    so a compact receipt matches "starbucks" but not "star": in the compact
+    layout the scan backend matches whole tokens, like the keyword index.
+
+    Args:
+        items (list): Receipt items, inline or compact.
+        keywords (list): Keywords to match, as utils.keyword_filter_expression does.
+        get_texts (callable): receipt_ids -> {receipt_id: raw_text}, e.g. a bound fetch_texts.
+
+    Returns:
+        list: The matching items.
+    """
+    if not keywords:
+        return list(items)
+    tokens = [token for keyword in keywords for token in tokenize(keyword)]
+    candidates = [item for item in items
+                  if isinstance(item.get('raw_text'), str) or signature_contains(item.get('token_signature'), tokens)]
+    texts = get_texts([item['receipt_id'] for item in candidates if 'raw_text' not in item])
+    matches = []
+    for item in candidates:
+        raw_text = item.get('raw_text', texts.get(item['receipt_id']))
+        if isinstance(raw_text, str) and all(keyword in raw_text for keyword in keywords):
+            matches.append(item)
+    return matches
+
+
+def attribute_size(value):
+    """
+    Size DynamoDB bills for an attribute value, in bytes.
+    """
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(abs(Decimal(str(value)))).replace('.', '').lstrip('0')) or 1
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(name.encode('utf-8')) + attribute_size(item) + 1 for name, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(attribute_size(item) + 1 for item in value)
+    if isinstance(value, (set, frozenset)):
+        return sum(attribute_size(item) for item in value)
+    return len(bytes(value))
+
+
+def item_size(item):
+    """
+    Size DynamoDB bills for an item: attribute names and values, in bytes.
+    """
+    return sum(len(name.encode('utf-8')) + attribute_size(value) for name, value in item.items())
+
+
+def scan_read_units(sizes):
+    """
+    Read capacity a scan of items of these sizes consumes (eventually consistent).
+    """
+    return math.ceil(sum(sizes) / READ_UNIT_BYTES) / 2
+
+
+def migrate(table, texts_table, s3, bucket=TEXT_BUCKET, total_segments=None, dry_run=False, log=print):
+    """
+    Move the cold attributes of every inline Receipts item to ReceiptTexts.
+
+    Each page's cold items are written before its hot items replace the inline
+    ones, so an interrupted migration loses nothing and a rerun picks up
+    the items still holding raw_text.
+
+    Args:
+        table: The Receipts Table.
+        texts_table: The ReceiptTexts Table.
+        dry_run (bool): Only measure what the migration would save.
+
+    Returns:
+        dict: receipts migrated, and bytes of their items 'before' and 'after' plus their 'cold' items.
+    """
+    stats = {'receipts': 0, 'before': 0, 'after': 0, 'cold': 0}
+    for page in iter_scan_pages(table, total_segments, FilterExpression=Attr('raw_text').exists()):
+        hot_items = [hot_item(item) for item in page]
+        stats['receipts'] += len(page)
+        stats['before'] += sum(item_size(item) for item in page)
+        stats['after'] += sum(item_size(item) for item in hot_items)
+        if dry_run:
+            stats['cold'] += sum(item_size(cold_item(item)[0]) for item in page)
+            continue
+        with texts_table.batch_writer(overwrite_by_pkeys=['receipt_id']) as writer:
+            for item in page:
+                stats['cold'] += write_cold(writer, s3, item, bucket)
+        with table.batch_writer(overwrite_by_pkeys=['receipt_id']) as writer:
+            for item in hot_items:
+                writer.put_item(Item=item)
+        log(f"Migrated {stats['receipts']} receipts")
+    return stats
+
+
+def table_stats(table, total_segments=None):
+    """
+    Measure the items of a Receipts table.
+
+    Returns:
+        dict: receipts, inline receipts (still holding raw_text), total item bytes and full scan RCUs.
+    """
+    sizes = []
+    inline = 0
+    for page in iter_scan_pages(table, total_segments):
+        sizes.extend(item_size(item) for item in page)
+        inline += sum(1 for item in page if 'raw_text' in item)
+    return {'receipts': len(sizes), 'inline': inline, 'bytes': sum(sizes), 'scan_rcu': scan_read_units(sizes)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the compact receipt storage layout.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="Move raw_text of existing receipts to ReceiptTexts.")
+    migrate_parser.add_argument('--dry-run', action='store_true', help="Only report the size reduction")
+    migrate_parser.add_argument('--texts-table', default=RECEIPT_TEXTS_TABLE)
+    migrate_parser.add_argument('--bucket', default=TEXT_BUCKET)
+    stats_parser = subparsers.add_parser('stats', help="Report item sizes and the RCUs of a full scan.")
+    for subparser in (migrate_parser, stats_parser):
+        subparser.add_argument('--receipts-table', default=os.getenv('DYNAMODB_TABLE', 'Receipts'))
+        subparser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+        subparser.add_argument('--endpoint-url', default=None, help="e.g. http://localhost:8000 for DynamoDB Local")
+        subparser.add_argument('--segments', type=int, default=None, help="Parallel scan segments")
+    args = parser.parse_args(argv)
+
+    dynamodb = boto3.resource('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url)
+    table = dynamodb.Table(args.receipts_table)
+    if args.command == 'stats':
+        stats = table_stats(table, args.segments)
+        average = stats['bytes'] / stats['receipts'] if stats['receipts'] else 0
+        print(f"{stats['receipts']} receipts ({stats['inline']} inline), {average:.0f} bytes per item, "
+              f"{stats['scan_rcu']:.1f} RCU per full scan")
+        return
+
+    stats = migrate(table, dynamodb.Table(args.texts_table), boto3.client('s3', region_name=args.region),
+                    args.bucket, args.segments, args.dry_run)
+    if stats['receipts']:
+        print(f"{'Would migrate' if args.dry_run else 'Migrated'} {stats['receipts']} receipts: "
+              f"{stats['before'] / stats['receipts']:.0f} -> {stats['after'] / stats['receipts']:.0f} bytes per item, "
+              f"{stats['cold'] / stats['receipts']:.0f} bytes per item in {args.texts_table}")
+    else:
+        print("No inline receipts to migrate.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+In-memory ranked full-text search over receipt raw_text with BM25.
+
+The DynamoDB search paths match receipts containing every keyword and
+return them unranked, so one wrong keyword from the LLM empties the result.
+Here every receipt containing any query token is scored with BM25 and the
+best BM25_TOP_K come back in order, in a few milliseconds and without a
+DynamoDB round trip:
+
+    score(doc) = sum over query tokens t of
+                 idf(t) * tf(t, doc) * (k1 + 1) / (tf(t, doc) + k1 * (1 - b + b * len(doc) / avg_len))
+
+BM25Index holds the postings compactly: per token, an array of document
+numbers and an array of term frequencies (4 bytes each per posting).
+Receipts are added or replaced one at a time; a replaced or removed
+receipt is only marked dead and its postings skipped, until compact()
+rebuilds the arrays. Tokens come from tokenizer.tokenize, the same
+tokenizer the ingest Lambda uses for the keyword index.
+
+Scoring reads the posting arrays through numpy without copying them and
+adds up each token's contributions with one bincount, so a search costs a
+few vectorized passes over the postings of its tokens rather than a
+Python loop over every posting; the top k are then selected with
+argpartition instead of sorting every match.
+
+SearchEngine keeps a BM25Index of the Receipts table in sync:
+
+- the first search starts a full build in the background (searches fall
+  back to the other backends until it is ready)
+- afterwards, at most every SEARCH_INDEX_REFRESH seconds, a refresh
+  queries the ingest-time-index GSI for receipts stamped with an
+  `ingested_at` newer than the newest one seen (minus a small overlap) and
+  adds them. The GSI is partitioned by the hour (`ingest_bucket`, see
+  receipt_storage), so a refresh reads one or two partitions and only the
+  new items in them, never the whole table
+- every SEARCH_INDEX_REBUILD seconds the index is rebuilt from a full scan,
+  which also drops deleted receipts and picks up items written without
+  an ingest_bucket
+
+Every gunicorn worker holds its own copy: budget the memory of the full
+index (reported by the benchmark) once per worker.
+"""
+import math
+import os
+import threading
+import time
+from array import array
+
+from boto3.dynamodb.conditions import Key
+
+import metrics
+from parallel_scan import iter_scan_pages
+from receipt_storage import INGEST_TIME_INDEX, ingest_bucket
+from tokenizer import tokenize
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+# Ranked results returned per search
+BM25_TOP_K = int(os.getenv('BM25_TOP_K', '50'))
+# Seconds between incremental refreshes, and between full rebuilds
+SEARCH_INDEX_REFRESH = int(os.getenv('SEARCH_INDEX_REFRESH', '60'))
+SEARCH_INDEX_REBUILD = int(os.getenv('SEARCH_INDEX_REBUILD', str(6 * 3600)))
+# Refreshes look this many seconds behind the newest ingested_at seen (clock skew, eventual consistency)
+REFRESH_OVERLAP = 120
+# compact() runs once this share of the documents is dead
+COMPACT_DEAD_RATIO = 0.25
+
+
+class BM25Index:
+    """
+    Postings index of receipt raw_text ranked with BM25.
+
+    Not thread-safe; SearchEngine serializes access.
+
+    Args:
+        k1 (float): Term frequency saturation.
+        b (float): Document length normalization, 0 (none) to 1 (full).
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        # token -> (array of document numbers, array of term frequencies)
+        self._postings = {}
+        # token -> number of live documents containing it
+        self._document_frequency = {}
+        # Per document number: the receipt item (None once dead), its token count and 1 while live
+        self._items = []
+        self._lengths = array('I')
+        self._live = bytearray()
+        # receipt_id -> live document number
+        self._documents = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, receipt_id):
+        return receipt_id in self._documents
+
+    def add(self, item):
+        """
+        Add a receipt, replacing the indexed version with the same receipt_id.
+
+        Args:
+            item (dict): The receipt item; its raw_text is indexed and it is returned by search.
+        """
+        receipt_id = item['receipt_id']
+        existing = self._documents.get(receipt_id)
+        if existing is not None:
+            if self._items[existing] == item:
+                return
+            self.remove(receipt_id)
+
+        counts = {}
+        for token in tokenize(item.get('raw_text')):
+            counts[token] = counts.get(token, 0) + 1
+
+        document = len(self._items)
+        for token, count in counts.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = (array('I'), array('I'))
+            postings[0].append(document)
+            postings[1].append(count)
+            self._document_frequency[token] = self._document_frequency.get(token, 0) + 1
+
+        length = sum(counts.values())
+        self._items.append(item)
+        self._lengths.append(length)
+        self._live.append(1)
+        self._documents[receipt_id] = document
+        self._total_length += length
+
+    def remove(self, receipt_id):
+        """
+        Remove a receipt; its postings are skipped until the next compact().
+
+        Returns:
+            bool: True if the receipt was indexed.
+        """
+        document = self._documents.pop(receipt_id, None)
+        if document is None:
+            return False
+        for token in set(tokenize(self._items[document].get('raw_text'))):
+            self._document_frequency[token] -= 1
+        self._total_length -= self._lengths[document]
+        self._items[document] = None
+        self._live[document] = 0
+        return True
+
+    def dead_ratio(self):
+        return 1 - len(self._documents) / len(self._items) if self._items else 0.0
+
+    def compact(self):
+        """
+        Rebuild the postings without the removed and replaced receipts.
+        """
+        live_items = [item for item in self._items if item is not None]
+        self.__init__(self.k1, self.b)
+        for item in live_items:
+            self.add(item)
+
+    def search(self, keywords, k=BM25_TOP_K):
+        """
+        Rank the receipts containing any token of the keywords.
+
+        Args:
+            keywords (list): Keywords or whole queries; they are tokenized like raw_text.
+            k (int): Number of results to return.
+
+        Returns:
+            list: (score, receipt item) pairs, best first.
+        """
+        # Imported here so importing the app doesn't pay for numpy until the first ranked search
+        import numpy as np
+
+        document_count = len(self._documents)
+        if not document_count or k <= 0:
+            return []
+        tokens = dict.fromkeys(token for keyword in keywords for token in tokenize(keyword))
+
+        k1 = self.k1
+        # k1 * (1 - b + b * length / average length) == base + per_token * length
+        base = k1 * (1 - self.b)
+        per_token = k1 * self.b * document_count / self._total_length if self._total_length else 0.0
+        # Zero-copy views; add() must not run while they are alive (the arrays can't grow while exported)
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        scores = None
+        for token in tokens:
+            postings = self._postings.get(token)
+            frequency = self._document_frequency.get(token, 0)
+            if not postings or not frequency:
+                continue
+            idf = math.log(1 + (document_count - frequency + 0.5) / (frequency + 0.5))
+            documents = np.frombuffer(postings[0], dtype=np.uint32)
+            counts = np.frombuffer(postings[1], dtype=np.uint32).astype(np.float64)
+            contributions = idf * (k1 + 1) * counts / (counts + base + per_token * lengths[documents])
+            token_scores = np.bincount(documents, weights=contributions, minlength=len(self._items))
+            scores = token_scores if scores is None else scores + token_scores
+            del documents
+        del lengths
+        if scores is None:
+            return []
+
+        # Dead documents keep their postings until compact(), drop their scores
+        scores *= np.frombuffer(self._live, dtype=np.uint8)
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(scores[matches], -k)[-k:]]
+        # Best first; ties in document order, i.e. the order receipts were added
+        best = matches[np.lexsort((matches, -scores[matches]))]
+        return [(float(scores[document]), self._items[document]) for document in best]
+
+    def stats(self):
+        """
+        Report the index size.
+
+        Returns:
+            dict: Live and dead documents, distinct tokens and postings.
+        """
+        return {
+            'documents': len(self._documents),
+            'dead_documents': len(self._items) - len(self._documents),
+            'tokens': len(self._postings),
+            'postings': sum(len(documents) for documents, _ in self._postings.values()),
+        }
+
+
+class TableIndex:
+    """
+    An in-memory index of the Receipts table, built and refreshed in a background thread.
+
+    Subclasses say how an index is created and filled (new_index, add_item),
+    and may post-process a finished build or refresh.
+
+    Args:
+        get_table (callable): Returns the Receipts Table.
+        refresh_interval (int): Seconds between incremental refreshes.
+        rebuild_interval (int): Seconds between full rebuilds.
+        total_segments (int): Parallel scan segments, defaults to SCAN_SEGMENTS.
+        scan_kwargs (dict): Extra arguments for the scans and ingest-time-index queries,
+            e.g. a ProjectionExpression.
+    """
+
+    name = 'table-index'
+
+    def __init__(self, get_table, refresh_interval=SEARCH_INDEX_REFRESH, rebuild_interval=SEARCH_INDEX_REBUILD,
+                 total_segments=None, scan_kwargs=None):
+        self.get_table = get_table
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.total_segments = total_segments
+        self.scan_kwargs = scan_kwargs or {}
+        self.index = None
+        self.built_at = None
+        self.refreshed_at = None
+        self.last_error = None
+        # Newest ingested_at seen (or the start of the last build's scan), refreshes query from there
+        self._watermark = 0
+        self._lock = threading.Lock()
+        self._updating = threading.Lock()
+
+    def new_index(self):
+        raise NotImplementedError
+
+    def add_item(self, index, item):
+        raise NotImplementedError
+
+    def finish_build(self, index, watermark):
+        """
+        Post-process a freshly built index before it is swapped in.
+
+        Args:
+            index: The index filled by add_item.
+            watermark (int): Newest ingested_at in the build, or the time its scan started if later.
+
+        Returns:
+            The index to serve.
+        """
+        return index
+
+    def finish_refresh(self, index):
+        """
+        Post-process the index after a refresh, with the lock held.
+        """
+
+    def load_page(self, page):
+        """
+        Complete a scanned or queried page before its items are added, e.g. with data stored outside the table.
+
+        Returns:
+            list: The items to add.
+        """
+        return page
+
+    def _scan(self, **scan_kwargs):
+        pages = iter_scan_pages(self.get_table(), self.total_segments, **dict(self.scan_kwargs, **scan_kwargs))
+        return (self.load_page(page) for page in metrics.timed_pages('dynamodb', 'scan', pages))
+
+    def _query_since(self, since):
+        """
+        Pages of the items ingested after `since`, one ingest-time-index query per hour bucket.
+        """
+        table = self.get_table()
+        for bucket in range(ingest_bucket(since), ingest_bucket(time.time()) + 1):
+            query_kwargs = dict(self.scan_kwargs, IndexName=INGEST_TIME_INDEX,
+                                KeyConditionExpression=Key('ingest_bucket').eq(bucket) & Key('ingested_at').gt(since))
+            while True:
+                with metrics.timed('dynamodb', 'query'):
+                    response = table.query(**query_kwargs)
+                yield self.load_page(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def build(self):
+        """
+        Build a new index from a full scan and swap it in.
+        """
+        index = self.new_index()
+        # Receipts stored while the scan runs may be missed by it, the first refresh picks them up
+        watermark = int(time.time())
+        for page in self._scan():
+            for item in page:
+                self.add_item(index, item)
+                watermark = max(watermark, int(item.get('ingested_at', 0)))
+        index = self.finish_build(index, watermark)
+        with self._lock:
+            self.index = index
+            self._watermark = watermark
+            self.built_at = self.refreshed_at = time.time()
+
+    def refresh(self):
+        """
+        Add the receipts ingested since the last build or refresh.
+
+        Returns:
+            int: Number of receipts added or replaced.
+        """
+        # Never further back than the oldest index that is still served, whatever a loaded watermark says
+        since = max(self._watermark, self.built_at - self.rebuild_interval) - REFRESH_OVERLAP
+        added = 0
+        for page in self._query_since(since):
+            with self._lock:
+                for item in page:
+                    self.add_item(self.index, item)
+                    self._watermark = max(self._watermark, int(item.get('ingested_at', 0)))
+                added += len(page)
+        with self._lock:
+            self.finish_refresh(self.index)
+            self.refreshed_at = time.time()
+        return added
+
+    def add(self, item):
+        """
+        Index a receipt written by this process right away.
+        """
+        with self._lock:
+            if self.index is not None:
+                self.add_item(self.index, item)
+
+    def _update(self):
+        try:
+            if self.index is None or time.time() - self.built_at >= self.rebuild_interval:
+                self.build()
+            else:
+                self.refresh()
+            self.last_error = None
+        except Exception as e:
+            # Keep serving the current index; the next search retries
+            self.last_error = str(e)
+            self.refreshed_at = time.time()
+        finally:
+            self._updating.release()
+
+    def maybe_update(self):
+        """
+        Start a background build or refresh if one is due and none is running.
+        """
+        if self.refreshed_at is not None and time.time() - self.refreshed_at < self.refresh_interval:
+            return
+        if not self._updating.acquire(blocking=False):
+            return
+        threading.Thread(target=self._update, name=self.name, daemon=True).start()
+
+
+class SearchEngine(TableIndex):
+    """
+    A BM25Index of the Receipts table, built and refreshed in a background thread.
+
+    Args:
+        get_table (callable): Returns the Receipts Table.
+        get_texts (callable): receipt_ids -> {receipt_id: raw_text}, for receipts stored without
+            their text (the compact layout, see receipt_storage).
+        **kwargs: Refresh settings, see TableIndex.
+    """
+
+    name = 'search-index'
+
+    def __init__(self, get_table, get_texts=None, **kwargs):
+        super().__init__(get_table, **kwargs)
+        self.get_texts = get_texts
+
+    def load_page(self, page):
+        missing = [item['receipt_id'] for item in page if 'raw_text' not in item and 'token_signature' in item]
+        if not self.get_texts or not missing:
+            return page
+        texts = self.get_texts(missing)
+        return [dict(item, raw_text=texts[item['receipt_id']]) if item['receipt_id'] in texts else item
+                for item in page]
+
+    def new_index(self):
+        return BM25Index()
+
+    def add_item(self, index, item):
+        index.add(item)
+
+    def finish_refresh(self, index):
+        if index.dead_ratio() > COMPACT_DEAD_RATIO:
+            index.compact()
+
+    def search(self, keywords, k=BM25_TOP_K):
+        """
+        Rank receipts by BM25, starting a build or refresh if one is due.
+
+        Args:
+            keywords (list): Keywords extracted from the user's query.
+            k (int): Number of results to return.
+
+        Returns:
+            list: Copies of the receipt items, best first, or None while the first build is running.
+        """
+        self.maybe_update()
+        with self._lock:
+            if self.index is None:
+                return None
+            ranked = self.index.search(keywords, k)
+        # Callers attach image URLs to the results, keep the indexed items untouched
+        return [dict(item) for _, item in ranked]
@@ -0,0 +1,228 @@
+import io
+import pytest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+import utils
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    app_module.app.config['TESTING'] = True
+    utils.url_cache.clear()
+    with patch('utils.presigner.presign_many',
+               side_effect=lambda keys, expires_in: {key: f"https://signed/{key}" for key in keys}), \
+            patch('utils.hashes_table.get_item', return_value={}), \
+            patch('utils.hashes_table.put_item'), patch('utils.hashes_table.update_item'):
+        with app_module.app.test_client() as client:
+            yield client
+
+# Test /list returns one page and a link to the next one
+@patch('utils.table.scan')
+def test_list_receipts_paginated(mock_scan, client):
+    mock_scan.return_value = {
+        'Items': [{'receipt_id': 'r1', 'raw_text': 'starbucks'}],
+        'LastEvaluatedKey': {'receipt_id': 'r1'}
+    }
+
+    response = client.get('/list?page_size=1')
+
+    assert response.status_code == 200
+    assert mock_scan.call_args.kwargs == {'Limit': 1}
+    body = response.get_data(as_text=True)
+    assert 'https://signed/receipts/r1.jpg' in body
+    assert f"cursor={utils.encode_cursor({'receipt_id': 'r1'})}" in body
+
+# Test the cursor from one page resumes the scan on the next
+@patch('utils.table.scan')
+def test_list_receipts_cursor(mock_scan, client):
+    mock_scan.return_value = {'Items': []}
+    cursor = utils.encode_cursor({'receipt_id': 'r1'})
+
+    response = client.get(f'/list?cursor={cursor}')
+
+    assert response.status_code == 200
+    assert mock_scan.call_args.kwargs['ExclusiveStartKey'] == {'receipt_id': 'r1'}
+    assert 'No receipts available to display.' in response.get_data(as_text=True)
+    assert 'Next page' not in response.get_data(as_text=True)
+
+# Test an invalid cursor is rejected
+def test_list_receipts_invalid_cursor(client):
+    response = client.get('/list?cursor=not-a-cursor')
+
+    assert response.status_code == 400
+
+# Test streaming mode renders every page of the table
+@patch('utils.table.scan')
+def test_list_receipts_stream(mock_scan, client):
+    mock_scan.side_effect = [
+        {'Items': [{'receipt_id': 'r1'}], 'LastEvaluatedKey': {'receipt_id': 'r1'}},
+        {'Items': [{'receipt_id': 'r2'}]},
+    ]
+
+    response = client.get('/list?stream=1&page_size=1')
+    body = response.get_data(as_text=True)
+
+    assert mock_scan.call_count == 2
+    assert 'r1' in body and 'r2' in body
+    assert body.count('<table') == 1
+
+# Test /upload/presign returns a POST policy pinned to the content type and size limit
+@patch('utils.s3.generate_presigned_post')
+def test_presign_upload(mock_presigned_post, client):
+    mock_presigned_post.return_value = {'url': 'https://bucket.s3.amazonaws.com/', 'fields': {'key': 'k'}}
+
+    response = client.post('/upload/presign', json={'content_type': 'image/png'})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['url'] == 'https://bucket.s3.amazonaws.com/'
+    kwargs = mock_presigned_post.call_args.kwargs
+    assert kwargs['Key'] == f"receipts/{data['receipt_id']}.jpg"
+    assert {'Content-Type': 'image/png'} in kwargs['Conditions']
+    assert ['content-length-range', 1, utils.MAX_UPLOAD_BYTES] in kwargs['Conditions']
+
+# Test unsupported content types are rejected before a policy is issued
+@patch('utils.s3.generate_presigned_post')
+def test_presign_upload_invalid_content_type(mock_presigned_post, client):
+    response = client.post('/upload/presign', json={'content_type': 'text/html'})
+
+    assert response.status_code == 400
+    mock_presigned_post.assert_not_called()
+
+# Test the completion callback records the receipt as pending
+@patch('utils.table.put_item')
+@patch('utils.s3.head_object', return_value={'ETag': '"5d41402abc4b2a76b9719d911017c592"'})
+def test_complete_upload(mock_head_object, mock_put_item, client):
+    receipt_id = 'ab' * 16
+
+    response = client.post('/upload/complete', json={'receipt_id': receipt_id})
+
+    assert response.status_code == 200
+    item = mock_put_item.call_args.kwargs['Item']
+    assert item['receipt_id'] == receipt_id
+    assert item['upload_status'] == 'pending'
+    assert mock_put_item.call_args.kwargs['ConditionExpression'] == 'attribute_not_exists(receipt_id)'
+
+# Test a receipt the Lambda already stored is not overwritten
+@patch('utils.table.put_item', side_effect=ClientError(
+    {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem'))
+@patch('utils.s3.head_object', return_value={'ETag': '"5d41402abc4b2a76b9719d911017c592"'})
+def test_complete_upload_already_processed(mock_head_object, mock_put_item, client):
+    response = client.post('/upload/complete', json={'receipt_id': 'ab' * 16})
+
+    assert response.status_code == 200
+
+# Test the callback rejects malformed IDs and images that were never uploaded
+@patch('utils.table.put_item')
+@patch('utils.s3.head_object', side_effect=ClientError({'Error': {'Code': '404'}}, 'HeadObject'))
+def test_complete_upload_invalid(mock_head_object, mock_put_item, client):
+    assert client.post('/upload/complete', json={'receipt_id': '../etc'}).status_code == 400
+    assert client.post('/upload/complete', json={'receipt_id': 'ab' * 16}).status_code == 400
+    mock_put_item.assert_not_called()
+
+# Test /upload stores the preprocessed image rather than the raw upload
+@patch('utils.preprocess_in_pool', side_effect=lambda data: (b'processed', {
+    'original_bytes': len(data), 'bytes': 9, 'width': 1, 'height': 1}))
+@patch('utils.s3.upload_fileobj')
+def test_upload_receipt_preprocessed(mock_upload_fileobj, mock_preprocess, client):
+    response = client.post('/upload', data={'file': (io.BytesIO(b'raw image'), 'receipt.png')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    mock_preprocess.assert_called_once_with(b'raw image')
+    uploaded, bucket, key = mock_upload_fileobj.call_args.args
+    assert uploaded.read() == b'processed'
+    assert key.startswith('receipts/') and key.endswith('.jpg')
+
+# Test unreadable images are rejected without uploading anything
+@patch('utils.preprocess_in_pool', side_effect=ValueError('Unreadable image'))
+@patch('utils.s3.upload_fileobj')
+def test_upload_receipt_invalid_image(mock_upload_fileobj, mock_preprocess, client):
+    response = client.post('/upload', data={'file': (io.BytesIO(b'junk'), 'receipt.jpg')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 400
+    mock_upload_fileobj.assert_not_called()
+
+# Test /search uses the async path when ASYNC_SEARCH is enabled
+@patch('async_search.search_receipts_sync', return_value=(['coffee'], [
+    {'receipt_id': 'r1', 'merchant': 'starbucks', 'image_url': 'https://signed/receipts/r1.jpg',
+     'thumb_url': 'https://signed/receipts/r1.jpg'}]))
+def test_search_async(mock_search, client):
+    with patch('app.ASYNC_SEARCH', True):
+        response = client.post('/search', data={'query': 'coffee'})
+
+    assert response.status_code == 200
+    mock_search.assert_called_once_with('coffee')
+    assert 'starbucks' in response.get_data(as_text=True)
+
+# Test responses carry the request's DynamoDB and S3 timings, and /metrics exposes the histograms
+@patch('utils.table.scan')
+def test_server_timing_and_metrics(mock_scan, client):
+    mock_scan.return_value = {'Items': [{'receipt_id': 'r1', 'raw_text': 'starbucks'}]}
+
+    response = client.get('/list')
+
+    server_timing = response.headers['Server-Timing']
+    assert 'dynamodb;dur=' in server_timing
+    assert 's3;dur=' in server_timing
+    assert 'total;dur=' in server_timing
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'receipt_manager_dependency_call_seconds_count{dependency="dynamodb",operation="scan"}' in body
+    assert 'receipt_manager_http_request_seconds_bucket{method="GET",endpoint="/list",status="200",le="+Inf"}' in body
+    assert 'receipt_manager_url_cache_lookups_total{result="miss"}' in body
+
+# Test a re-uploaded file gets the receipt it already created, without preprocessing or storing it again
+@patch('utils.preprocess_in_pool')
+@patch('utils.s3.upload_fileobj')
+def test_upload_receipt_duplicate(mock_upload_fileobj, mock_preprocess, client):
+    with patch('utils.hashes_table.get_item', return_value={'Item': {'receipt_id': 'cd' * 16}}), \
+            patch('utils.hashes_table.update_item') as mock_update_item:
+        response = client.post('/upload', data={'file': (io.BytesIO(b'raw image'), 'receipt.png')},
+                               content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert response.get_json()['receipt_id'] == 'cd' * 16
+    assert response.get_json()['duplicate'] == 'exact'
+    mock_preprocess.assert_not_called()
+    mock_upload_fileobj.assert_not_called()
+    assert mock_update_item.call_args.kwargs['UpdateExpression'] == 'ADD duplicates :one'
+
+# Test a direct upload of an image another receipt owns is deleted and answered with that receipt
+@patch('utils.table.put_item')
+@patch('utils.s3.delete_object')
+@patch('utils.s3.head_object', return_value={'ETag': '"5d41402abc4b2a76b9719d911017c592"'})
+def test_complete_upload_duplicate(mock_head_object, mock_delete_object, mock_put_item, client):
+    with patch('utils.hashes_table.put_item', side_effect=ClientError(
+            {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')), \
+            patch('utils.hashes_table.get_item', return_value={'Item': {'receipt_id': 'cd' * 16}}):
+        response = client.post('/upload/complete', json={'receipt_id': 'ab' * 16})
+
+    assert response.get_json()['receipt_id'] == 'cd' * 16
+    assert response.get_json()['duplicate'] is True
+    assert mock_delete_object.call_args.kwargs['Key'] == f"receipts/{'ab' * 16}.jpg"
+    mock_put_item.assert_not_called()
+
+# Test the full text of a receipt is served on demand
+@patch('app.get_receipt_text', return_value='starbucks\nlatte')
+def test_receipt_text(mock_get_receipt_text, client):
+    receipt_id = 'a' * 32
+    response = client.get(f'/receipts/{receipt_id}/text')
+    assert response.get_json() == {'receipt_id': receipt_id, 'raw_text': 'starbucks\nlatte'}
+
+    mock_get_receipt_text.return_value = None
+    assert client.get(f'/receipts/{receipt_id}/text').status_code == 404
+    assert client.get('/receipts/bad/text').status_code == 400
+
+# Test /stats answers from the rollups and rejects questions they can't answer
+@patch('app.query_stats', return_value={'spend': 9.5, 'receipts': 1, 'groups': [], 'merchant': 'starbucks', 'ranges': []})
+def test_spend_stats(mock_query_stats, client):
+    response = client.get('/stats?q=starbucks+september&group=month')
+    assert response.status_code == 200
+    assert response.get_json()['spend'] == 9.5
+    mock_query_stats.assert_called_once_with('starbucks september', None, None, None, 'month')
+
+    mock_query_stats.side_effect = ValueError("Invalid date 'x', expected YYYY-MM or YYYY-MM-DD.")
+    assert client.get('/stats?from=x').status_code == 400
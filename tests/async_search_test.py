@@ -0,0 +1,64 @@
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+import async_search
+import utils
+
+
+@pytest.fixture(autouse=True)
+def signed_urls():
+    utils.url_cache.clear()
+    utils.keyword_cache.clear()
+    with patch('utils.presigner.presign_many',
+               side_effect=lambda keys, expires_in: {key: f"https://signed/{key}" for key in keys}):
+        yield
+
+# Test the index path intersects posting lists fetched concurrently and signs the results
+@patch('keyword_index.batch_get_receipts')
+@patch('keyword_index.get_posting_list')
+def test_search_index(mock_get_posting_list, mock_batch_get_receipts):
+    postings = {'milk': {'r1', 'r2'}, 'bread': {'r2', 'r3'}}
+    mock_get_posting_list.side_effect = lambda table, token: postings[token]
+    mock_batch_get_receipts.side_effect = lambda dynamodb, table_name, ids: [{'receipt_id': i} for i in ids]
+
+    with patch('utils.STRUCTURED_SEARCH', False), patch('utils.SEARCH_BACKEND', 'index'), \
+            patch('utils.keyword_index_ready', return_value=True):
+        keywords, results = async_search.search_receipts_sync('milk bread')
+
+    assert keywords == ['milk', 'bread']
+    assert mock_get_posting_list.call_count == 2
+    assert results == [{'receipt_id': 'r2', 'image_url': 'https://signed/receipts/r2.jpg',
+                        'thumb_url': 'https://signed/receipts/r2.jpg'}]
+
+# Test structured plans run one concurrent query per GSI request
+@patch('utils.run_query', side_effect=lambda query_kwargs: [{'receipt_id': query_kwargs['IndexName']}])
+def test_search_structured(mock_run_query):
+    plan = utils.receipt_fields.QueryPlan(None, [('2024-01-01', '2024-02-29')], [])
+
+    results = asyncio.run(async_search.query_receipts_by_fields_async(plan))
+
+    assert mock_run_query.call_count == 2
+    assert [item['receipt_id'] for item in results] == ['month-date-index', 'month-date-index']
+
+# Test the async OpenAI call posts the same prompt over httpx and parses the JSON array
+def test_extract_keywords_with_openai_async():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={'choices': [{'message': {'content': '["Starbucks", "March"]'}}]})
+
+    client = httpx.AsyncClient(base_url='https://openai.test/v1', transport=httpx.MockTransport(handler))
+    with patch('utils.get_openai_http_client', return_value=client):
+        keywords = asyncio.run(utils.extract_keywords_with_openai_async('starbucks in march'))
+
+    assert keywords == ['starbucks', 'march']
+    assert requests[0].url.path == '/v1/chat/completions'
+
+# Test failed OpenAI calls return no keywords
+def test_extract_keywords_with_openai_async_error():
+    client = httpx.AsyncClient(base_url='https://openai.test/v1',
+                               transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+    with patch('utils.get_openai_http_client', return_value=client):
+        assert asyncio.run(utils.extract_keywords_with_openai_async('how much did i spend')) == []
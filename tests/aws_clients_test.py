@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+from aws_clients import client_config, get_or_create
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+# Test the shared config pools connections, retries with backoff and keeps connections alive
+def test_client_config():
+    config = client_config()
+
+    assert config.max_pool_connections == 32
+    assert config.retries == {'mode': 'standard', 'max_attempts': 3}
+    assert config.tcp_keepalive is True
+
+    assert client_config(max_pool_connections=4).max_pool_connections == 4
+
+# Test the factory runs once and later calls reuse the object
+def test_get_or_create_memoizes():
+    namespace = {}
+    factory = MagicMock(return_value='client')
+
+    assert get_or_create(namespace, 's3', factory) == 'client'
+    assert get_or_create(namespace, 's3', factory) == 'client'
+    assert namespace['s3'] == 'client'
+    factory.assert_called_once()
+
+# Test an object already in the namespace (a stub or a patch) is returned as is
+def test_get_or_create_keeps_assigned_object():
+    factory = MagicMock()
+
+    assert get_or_create({'table': 'stub'}, 'table', factory) == 'stub'
+    factory.assert_not_called()
+
+# Test concurrent first calls build the client once
+def test_get_or_create_is_thread_safe():
+    namespace = {}
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_or_create(namespace, 's3', factory)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+# Test the app and the Lambda import without a region or credentials, and build no client at import
+def test_modules_import_without_clients():
+    env = {key: value for key, value in os.environ.items() if not key.startswith('AWS_')}
+    probe = ("import app, lambda_function, utils; "
+             "assert not {'s3', 'table', 'dynamodb', 'openai'} & set(vars(utils)); "
+             "assert not {'textract', 's3', 'table'} & set(vars(lambda_function))")
+
+    subprocess.run([sys.executable, '-c', probe], cwd=ROOT_DIR, env=env, check=True)
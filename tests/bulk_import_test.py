@@ -0,0 +1,109 @@
+import hashlib
+import time
+from unittest.mock import patch, MagicMock
+import pytest
+from botocore.exceptions import ClientError
+import bulk_import
+import lambda_function
+
+
+@pytest.fixture
+def aws():
+    with patch('lambda_function.get_hashes_table') as mock_hashes, \
+            patch('lambda_function.get_s3') as mock_s3, \
+            patch('lambda_function.process_receipt') as mock_process, \
+            patch('lambda_function.store_receipts') as mock_store:
+        mock_hashes.return_value.put_item.return_value = {}
+        mock_process.side_effect = lambda bucket, key: (
+            {'receipt_id': key.split('/')[-1].split('.')[0], 'raw_text': 'starbucks latte'}, ['starbucks', 'latte'])
+        yield mock_hashes.return_value, mock_s3.return_value, mock_process, mock_store
+
+def sources(*contents):
+    return [(f"scan{i}.jpg", lambda data=data: data) for i, data in enumerate(contents)]
+
+# Test the bucket allows a burst of `capacity`, then paces to `rate`
+def test_token_bucket():
+    bucket = bulk_import.TokenBucket(rate=100, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    bucket.acquire(5)
+    assert time.monotonic() - start >= 0.04
+    assert bulk_import.TokenBucket(0).acquire(1000) == 0.0
+
+# Test every source is uploaded under a content-derived ID, extracted and written
+def test_run_imports_sources(aws):
+    hashes_table, s3, mock_process, mock_store = aws
+    importer = bulk_import.BulkImporter(workers=2, textract_tps=0, dynamodb_wcu=0, log=MagicMock())
+
+    stats = importer.run(sources(b'one', b'two'))
+
+    assert stats['stored'] == 2 and stats['textract_calls'] == 2
+    receipt_id = hashlib.sha256(b'one').hexdigest()[:32]
+    assert s3.put_object.call_args_list[0].kwargs['Key'] in (f"receipts/{receipt_id}.jpg",
+                                                             s3.put_object.call_args_list[1].kwargs['Key'])
+    stored = [item['receipt_id'] for call in mock_store.call_args_list for item, _ in call.args[0]]
+    assert receipt_id in stored
+    # The ETag claim tells the S3-triggered Lambda to leave the object alone
+    etag_claims = [call.kwargs['Item'] for call in hashes_table.put_item.call_args_list
+                   if call.kwargs['Item']['hash_key'].startswith('etag#')]
+    assert all(item['ingest'] == 'bulk_import' for item in etag_claims) and len(etag_claims) == 2
+
+# Test an image another receipt already owns is not uploaded or sent to Textract
+def test_run_skips_duplicates(aws):
+    hashes_table, s3, mock_process, _ = aws
+    hashes_table.put_item.side_effect = ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+    hashes_table.get_item.return_value = {'Item': {'receipt_id': 'other'}}
+    importer = bulk_import.BulkImporter(textract_tps=0, dynamodb_wcu=0, log=MagicMock())
+
+    stats = importer.run(sources(b'one'))
+
+    assert stats['duplicates'] == 1 and stats['stored'] == 0
+    s3.put_object.assert_not_called()
+    mock_process.assert_not_called()
+
+# Test a resumed run skips the sources the checkpoint recorded
+def test_checkpoint_resume(aws, tmp_path):
+    _, _, mock_process, _ = aws
+    path = str(tmp_path / 'import.ckpt')
+    checkpoint = bulk_import.Checkpoint(path)
+    bulk_import.BulkImporter(textract_tps=0, dynamodb_wcu=0, checkpoint=checkpoint, log=MagicMock()).run(
+        sources(b'one'))
+    checkpoint.close()
+
+    checkpoint = bulk_import.Checkpoint(path)
+    stats = bulk_import.BulkImporter(textract_tps=0, dynamodb_wcu=0, checkpoint=checkpoint, log=MagicMock()).run(
+        sources(b'one', b'two'))
+
+    assert stats['resumed'] == 1 and stats['stored'] == 1
+    assert mock_process.call_count == 2
+    assert 'scan1.jpg' in bulk_import.Checkpoint(path)
+
+# Test a receipt Textract found no text in is skipped and not retried
+def test_run_records_skipped(aws):
+    _, _, mock_process, mock_store = aws
+    mock_process.side_effect = lambda_function.ReceiptSkipped('No text found in Textract response.')
+    checkpoint = bulk_import.Checkpoint(None)
+
+    stats = bulk_import.BulkImporter(textract_tps=0, dynamodb_wcu=0, checkpoint=checkpoint, log=MagicMock()).run(
+        sources(b'blank'))
+
+    assert stats['skipped'] == 1
+    assert 'scan0.jpg' in checkpoint
+    mock_store.assert_not_called()
+
+# Test reindexing extracts the stored objects again without uploading them
+def test_reindex(aws):
+    _, s3, mock_process, _ = aws
+    importer = bulk_import.BulkImporter(bucket='bucket', reindex=True, textract_tps=0, dynamodb_wcu=0, log=MagicMock())
+
+    stats = importer.run([('s3://bucket/receipts/abc.jpg', MagicMock())])
+
+    assert stats['stored'] == 1
+    mock_process.assert_called_once_with('bucket', 'receipts/abc.jpg')
+    s3.put_object.assert_not_called()
+
+# Test the WCU estimate counts item size and postings
+def test_write_units():
+    assert bulk_import.write_units({'raw_text': 'x' * 3000}, ['a', 'b']) == 5
@@ -5,4 +5,7 @@ import os
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
 # Append the parent directory to sys.path
-sys.path.insert(0, parent_dir)
\ No newline at end of file
+sys.path.insert(0, parent_dir)
+
+# The clients are created lazily, but building one still needs a region; tests never reach AWS
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
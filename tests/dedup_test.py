@@ -0,0 +1,57 @@
+import io
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+import dedup
+
+
+# Test the content hash reads the whole file and rewinds it for the upload
+def test_content_hash_rewinds():
+    file = io.BytesIO(b'receipt' * 1000)
+
+    assert dedup.content_hash(file) == dedup.content_hash(io.BytesIO(b'receipt' * 1000))
+    assert file.read() == b'receipt' * 1000
+
+# Test quoted (HeadObject) and unquoted (S3 event) ETags map to the same key
+def test_etag_key():
+    assert dedup.etag_key('"abc"') == dedup.etag_key('abc') == 'etag#abc'
+
+# Test hashes up to DHASH_MAX_DISTANCE bits apart share a band, so find_similar sees them
+def test_dhash_bands_pigeonhole():
+    value = 0x0123456789abcdef
+    close = value ^ (1 << 2) ^ (1 << 20) ^ (1 << 40)
+
+    assert len(dedup.dhash_bands(value, 3)) == 4
+    assert set(dedup.dhash_bands(value, 3)) & set(dedup.dhash_bands(close, 3))
+
+# Test the first claim wins and later claims get its receipt_id
+def test_claim():
+    table = MagicMock()
+    assert dedup.claim(table, 'sha256#x', 'r1') == 'r1'
+    assert table.put_item.call_args.kwargs['ConditionExpression'] == 'attribute_not_exists(hash_key)'
+
+    table.put_item.side_effect = ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+    table.get_item.return_value = {'Item': {'hash_key': 'sha256#x', 'receipt_id': 'r1'}}
+    assert dedup.claim(table, 'sha256#x', 'r2') == 'r1'
+
+# Test the closest indexed image within the distance is found, and farther ones are not
+def test_find_similar():
+    value = 0xffff0000ffff0000
+    dynamodb = MagicMock()
+    dynamodb.batch_get_item.return_value = {'Responses': {'ReceiptHashes': [
+        {'hash_key': 'dhash#0#0', 'entries': {f"far:{value ^ 0xff:016x}", f"near:{value ^ 0b1:016x}"}},
+    ]}}
+
+    assert dedup.find_similar(dynamodb, value, 3) == ('near', 'dhash#0#0')
+    dynamodb.batch_get_item.return_value = {'Responses': {'ReceiptHashes': [
+        {'hash_key': 'dhash#0#0', 'entries': {f"far:{value ^ 0xff:016x}"}}]}}
+    assert dedup.find_similar(dynamodb, value, 3) == (None, None)
+
+# Test the avoided Textract calls are added up per kind of hash
+def test_avoided_calls():
+    table = MagicMock()
+    table.scan.side_effect = [
+        {'Items': [{'hash_key': 'sha256#a', 'duplicates': 2}, {'hash_key': 'etag#b'}], 'LastEvaluatedKey': {'hash_key': 'etag#b'}},
+        {'Items': [{'hash_key': 'etag#c', 'duplicates': 1}]},
+    ]
+
+    assert dedup.avoided_calls(table) == {'sha256': 2, 'etag': 1, 'dhash': 0, 'total': 3}
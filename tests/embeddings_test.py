@@ -0,0 +1,92 @@
+import math
+import pytest
+from unittest.mock import MagicMock, patch
+from boto3.dynamodb.types import Binary
+from embeddings import HashingEmbedder, backfill, embed_item, embedding_text, from_bytes, get_embedder, to_bytes
+
+
+def dot(first, second):
+    return sum(a * b for a, b in zip(first, second))
+
+# Test the hashing embedder is deterministic and returns unit vectors
+def test_hashing_embedder_deterministic_unit_vectors():
+    embedder = HashingEmbedder(dimensions=64)
+    first, second = embedder.embed(['starbucks latte', 'starbucks latte'])
+
+    assert len(first) == 64
+    assert list(first) == list(second)
+    assert math.isclose(dot(first, first), 1.0, rel_tol=1e-5)
+
+# Test texts sharing words are closer than unrelated texts
+def test_hashing_embedder_similarity():
+    embedder = HashingEmbedder()
+    query, related, unrelated = embedder.embed(['starbucks latte', 'starbucks\nlatte $5.50', 'bunnings drill screws'])
+
+    assert dot(query, related) > dot(query, unrelated)
+
+# Test empty text embeds to the zero vector rather than failing
+def test_hashing_embedder_empty_text():
+    assert not any(HashingEmbedder(dimensions=8).embed_one(''))
+
+# Test the embedded text names the receipt's month, which isn't on the receipt itself
+def test_embedding_text_includes_structured_fields():
+    text = embedding_text({'merchant': 'starbucks', 'receipt_month': '2024-09', 'raw_text': 'latte $5.50'})
+
+    assert text == "starbucks\nseptember 2024\nlatte $5.50"
+
+# Test vectors survive the round trip through DynamoDB binary attributes
+def test_bytes_roundtrip():
+    vector = HashingEmbedder(dimensions=16).embed_one('milk bread')
+
+    assert list(from_bytes(to_bytes(vector))) == list(vector)
+    assert list(from_bytes(Binary(to_bytes(vector)))) == list(vector)
+
+# Test embed_item records the model that produced the embedding
+def test_embed_item():
+    item = embed_item({'receipt_id': 'r1', 'raw_text': 'milk'}, HashingEmbedder(dimensions=16))
+
+    assert item['embedding_model'] == 'hashing-16'
+    assert len(item['embedding']) == 16 * 4
+
+# Test unknown providers are rejected
+def test_get_embedder_unknown_provider():
+    with pytest.raises(ValueError, match='word2vec'):
+        get_embedder('word2vec')
+
+# Test backfill only embeds receipts without an embedding from this model
+@patch('parallel_scan.iter_scan_pages')
+def test_backfill_skips_embedded_receipts(mock_iter_scan_pages):
+    embedder = HashingEmbedder(dimensions=16)
+    mock_iter_scan_pages.return_value = [[
+        {'receipt_id': 'r1', 'raw_text': 'milk'},
+        {'receipt_id': 'r2', 'raw_text': 'bread', 'embedding_model': 'hashing-16'},
+        {'receipt_id': 'r3', 'raw_text': 'eggs', 'embedding_model': 'openai-text-embedding-ada-002'},
+    ]]
+    table = MagicMock()
+
+    assert backfill(table, embedder) == 2
+    updated = [call.kwargs['Key']['receipt_id'] for call in table.update_item.call_args_list]
+    assert updated == ['r1', 'r3']
+
+# Test backfill embeds compact receipts from their fetched texts and writes the vectors to ReceiptTexts
+@patch('parallel_scan.iter_scan_pages')
+def test_backfill_compact_receipts(mock_iter_scan_pages):
+    embedder = HashingEmbedder(dimensions=16)
+    mock_iter_scan_pages.return_value = [[
+        {'receipt_id': 'r1', 'raw_text': 'milk'},
+        {'receipt_id': 'r2', 'token_signature': b'\0', 'merchant': 'coles'},
+        {'receipt_id': 'r3', 'token_signature': b'\0', 'embedding_model': 'hashing-16'},
+    ]]
+    table, texts_table = MagicMock(), MagicMock()
+    get_texts = MagicMock(return_value={'r2': 'bread'})
+
+    assert backfill(table, embedder, get_texts=get_texts, texts_table=texts_table) == 2
+    assert 'raw_text' in mock_iter_scan_pages.call_args.kwargs['ProjectionExpression']
+    get_texts.assert_called_once_with(['r2'])
+    texts_call = texts_table.update_item.call_args.kwargs
+    assert texts_call['Key'] == {'receipt_id': 'r2'}
+    expected = embedder.embed([embedding_text({'merchant': 'coles', 'raw_text': 'bread'})])[0]
+    assert texts_call['ExpressionAttributeValues'][':embedding'] == to_bytes(expected)
+    table_calls = [call.kwargs for call in table.update_item.call_args_list]
+    assert [call['Key']['receipt_id'] for call in table_calls] == ['r1', 'r2']
+    assert table_calls[1]['UpdateExpression'] == 'SET embedding_model = :model'
@@ -0,0 +1,55 @@
+import io
+import pytest
+from PIL import Image
+from image_preprocess import dhash, preprocess_image
+
+
+def encode(image, format, **kwargs):
+    output = io.BytesIO()
+    image.save(output, format=format, **kwargs)
+    return output.getvalue()
+
+# Test large color photos are downscaled, converted to grayscale and stored as JPEG
+def test_preprocess_image_downscales():
+    data = encode(Image.new('RGB', (3000, 4000), (200, 30, 30)), 'PNG')
+
+    processed, info = preprocess_image(data, max_dimension=1000)
+
+    image = Image.open(io.BytesIO(processed))
+    assert image.format == 'JPEG'
+    assert image.mode == 'L'
+    assert image.size == (750, 1000)
+    assert info == {'original_bytes': len(data), 'bytes': len(processed), 'width': 750, 'height': 1000}
+
+# Test the EXIF orientation is applied to the pixels
+def test_preprocess_image_orientation():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    data = encode(Image.new('RGB', (400, 200)), 'JPEG', exif=exif.tobytes())
+
+    processed, info = preprocess_image(data)
+
+    assert (info['width'], info['height']) == (200, 400)
+
+# Test small images are not upscaled
+def test_preprocess_image_small():
+    _, info = preprocess_image(encode(Image.new('L', (300, 200)), 'PNG'), max_dimension=1000)
+
+    assert (info['width'], info['height']) == (300, 200)
+
+def test_preprocess_image_invalid():
+    with pytest.raises(ValueError):
+        preprocess_image(b'not an image')
+
+# Test the dHash survives recompression and rescaling but tells different images apart
+def test_dhash_stable():
+    image = Image.linear_gradient('L').resize((400, 600))
+    image.paste(255, (50, 50, 200, 120))
+    other = Image.linear_gradient('L').rotate(90).resize((400, 600))
+
+    value = dhash(encode(image, 'PNG'))
+
+    assert bin(value ^ dhash(encode(image.resize((200, 300)), 'JPEG', quality=60))).count('1') <= 3
+    assert bin(value ^ dhash(encode(other, 'PNG'))).count('1') > 10
+    with pytest.raises(ValueError):
+        dhash(b'not an image')
@@ -0,0 +1,49 @@
+import json
+import logging
+import pytest
+import json_logging
+from json_logging import end_request, get_logger, log_event, sample_request
+
+
+@pytest.fixture
+def logger():
+    logger = get_logger('json_logging_test')
+    logger.setLevel(logging.INFO)
+    yield logger
+    end_request()
+
+def events(output):
+    return [json.loads(line) for line in output.splitlines()]
+
+# Test records are single JSON lines with the structured fields at the top level
+def test_log_event_json(logger, capsys):
+    sample_request(rate=1.0)
+
+    log_event(logger, logging.INFO, 'request', "GET /list 200", status=200, dependencies={'dynamodb': {'calls': 1}})
+
+    [event] = events(capsys.readouterr().out)
+    assert event['event'] == 'request'
+    assert event['message'] == "GET /list 200"
+    assert event['level'] == 'INFO'
+    assert event['status'] == 200
+    assert event['dependencies'] == {'dynamodb': {'calls': 1}}
+    assert event['time'].endswith('Z')
+
+# Test an unsampled request drops its info records but keeps warnings
+def test_sampling_keeps_warnings(logger, capsys):
+    sample_request(rate=0.0)
+
+    log_event(logger, logging.INFO, 'openai_response', "OpenAI Raw Response")
+    log_event(logger, logging.WARNING, 'openai_invalid_response', "Error: not JSON")
+
+    assert [event['event'] for event in events(capsys.readouterr().out)] == ['openai_invalid_response']
+
+# Test records outside a request follow LOG_SAMPLE_RATE
+def test_sampling_outside_request(logger, capsys):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(json_logging, 'LOG_SAMPLE_RATE', 0.0)
+        logger.info("dropped")
+        monkeypatch.setattr(json_logging, 'LOG_SAMPLE_RATE', 1.0)
+        logger.info("kept")
+
+    assert [event['message'] for event in events(capsys.readouterr().out)] == ['kept']
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import pytest
+from unittest.mock import MagicMock, patch
+from keyword_cache import KeywordCache, normalize_query
+
+
+# Test queries differing only in case and whitespace share an entry
+def test_normalized_queries_hit_cache():
+    cache = KeywordCache()
+    compute = MagicMock(return_value=['starbucks'])
+
+    assert cache.get_or_compute('Starbucks  receipts', compute) == ['starbucks']
+    assert cache.get_or_compute(' starbucks receipts ', compute) == ['starbucks']
+
+    compute.assert_called_once_with('Starbucks  receipts')
+    assert normalize_query(' Starbucks\tReceipts ') == 'starbucks receipts'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+# Test entries expire after the TTL
+def test_ttl_expiry():
+    cache = KeywordCache(ttl=60)
+    compute = MagicMock(return_value=['coles'])
+
+    with patch('keyword_cache.time.time', return_value=1000):
+        cache.get_or_compute('coles', compute)
+    with patch('keyword_cache.time.time', return_value=1061):
+        cache.get_or_compute('coles', compute)
+
+    assert compute.call_count == 2
+
+# Test the least recently used query is evicted
+def test_lru_eviction():
+    cache = KeywordCache(max_entries=2)
+    compute = MagicMock(side_effect=lambda query: [query])
+
+    for query in ['a', 'b', 'a', 'c', 'a', 'b']:
+        cache.get_or_compute(query, compute)
+
+    assert [call.args[0] for call in compute.call_args_list] == ['a', 'b', 'c', 'b']
+
+# Test empty results (failed LLM calls) are not cached
+def test_empty_result_not_cached():
+    cache = KeywordCache()
+    compute = MagicMock(side_effect=[[], ['aldi']])
+
+    assert cache.get_or_compute('aldi', compute) == []
+    assert cache.get_or_compute('aldi', compute) == ['aldi']
+
+# Test concurrent identical queries make a single call
+def test_single_flight():
+    cache = KeywordCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute(query):
+        started.set()
+        release.wait(5)
+        return ['woolworths']
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute('woolworths', compute)))
+    leader.start()
+    started.wait(5)
+
+    follower_compute = MagicMock()
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_compute('Woolworths', follower_compute)))
+                 for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while cache.stats()['coalesced'] < 3:
+        pass
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    follower_compute.assert_not_called()
+    assert results == [['woolworths']] * 4
+
+# Test entries survive a restart when a SQLite path is configured
+def test_persistent_backing(tmp_path):
+    path = str(tmp_path / 'keywords.sqlite')
+    KeywordCache(path=path).get_or_compute('bunnings drill', lambda query: ['bunnings', 'drill'])
+
+    restarted = KeywordCache(path=path)
+    compute = MagicMock()
+
+    assert restarted.get_or_compute('bunnings drill', compute) == ['bunnings', 'drill']
+    compute.assert_not_called()
+    assert restarted.stats()['persistent_hits'] == 1
+
+# Test concurrent coroutines for the same query share one computation
+def test_get_or_compute_async_single_flight():
+    cache = KeywordCache()
+    calls = []
+
+    async def compute(query):
+        calls.append(query)
+        await asyncio.sleep(0.01)
+        return ['coles']
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute_async('coles', compute) for _ in range(5)))
+
+    assert asyncio.run(run()) == [['coles']] * 5
+    assert calls == ['coles']
+    assert cache.stats()['coalesced'] == 4
+    assert asyncio.run(cache.get_or_compute_async('Coles', compute)) == ['coles']
+    assert cache.stats()['hits'] == 1
+
+# Test a reopened cache (as in a forked gunicorn worker) still reads and writes the SQLite file
+def test_reopen(tmp_path):
+    path = str(tmp_path / 'keywords.db')
+    cache = KeywordCache(path=path)
+    cache.get_or_compute('aldi', MagicMock(return_value=['aldi']))
+
+    cache.reopen()
+    cache.get_or_compute('coles', MagicMock(return_value=['coles']))
+
+    fresh = KeywordCache(path=path)
+    compute = MagicMock()
+    assert fresh.get_or_compute('aldi', compute) == ['aldi']
+    assert fresh.get_or_compute('coles', compute) == ['coles']
+    compute.assert_not_called()
@@ -0,0 +1,53 @@
+import pytest
+from unittest.mock import MagicMock
+from keyword_extraction import CallableKeywordExtractor, KeywordExtractionPipeline, LocalKeywordExtractor
+
+
+@pytest.mark.parametrize('query, expected', [
+    ("starbucks", ['starbucks']),
+    ("Woolworths milk", ['woolworths', 'milk']),
+    ("Find all receipts from Starbucks in Sept", ['starbucks', 'september']),
+    ("receipts from Big W on 12/09/2024", ['big w', '12', '09', '2024']),
+    ("uber eats", ['uber eats']),
+])
+def test_local_extractor_confident(query, expected):
+    keywords, confident = LocalKeywordExtractor().extract(query)
+
+    assert keywords == expected
+    assert confident
+
+@pytest.mark.parametrize('query', [
+    "how much did I spend at coles last week",
+    "dinner with friends at the beach house on saturday",
+    "receipts",
+])
+def test_local_extractor_not_confident(query):
+    _, confident = LocalKeywordExtractor().extract(query)
+
+    assert not confident
+
+# Test confident local results skip the LLM
+def test_pipeline_local_fast_path():
+    llm = MagicMock(return_value=['starbucks'])
+    pipeline = KeywordExtractionPipeline([LocalKeywordExtractor(), CallableKeywordExtractor('openai', llm)])
+
+    assert pipeline.extract("Starbucks") == ['starbucks']
+    llm.assert_not_called()
+    stats = pipeline.stats()
+    assert stats['local']['calls'] == 1
+    assert stats['openai']['calls'] == 0
+
+# Test complex queries fall through to the LLM
+def test_pipeline_falls_through():
+    llm = MagicMock(return_value=['coles'])
+    pipeline = KeywordExtractionPipeline([LocalKeywordExtractor(), CallableKeywordExtractor('openai', llm)])
+
+    assert pipeline.extract("how much did I spend at coles last week") == ['coles']
+    llm.assert_called_once()
+
+# Test the local best effort is used when the LLM returns nothing
+def test_pipeline_llm_failure_fallback():
+    llm = MagicMock(return_value=[])
+    pipeline = KeywordExtractionPipeline([LocalKeywordExtractor(), CallableKeywordExtractor('openai', llm)])
+
+    assert pipeline.extract("coles spending last week") == ['coles', 'spending', 'last', 'week']
@@ -0,0 +1,84 @@
+import pytest
+from unittest.mock import patch, MagicMock, call
+import keyword_index
+from tokenizer import tokenize
+
+
+# Test tokenizer keeps prices, dates and names whole
+def test_tokenize():
+    tokens = tokenize("McDonald's\nBig Mac $7.50\n12-09-2024 a")
+    assert tokens == ["mcdonald's", "big", "mac", "7.50", "12-09-2024"]
+
+# Test receipt_tokens dedupes and caps the number of tokens
+def test_receipt_tokens(monkeypatch):
+    monkeypatch.setattr(keyword_index, 'MAX_TOKENS_PER_RECEIPT', 2)
+    assert keyword_index.receipt_tokens("milk bread milk eggs") == ["milk", "bread"]
+
+# Test write_postings writes one item per token
+def test_write_postings():
+    writer = MagicMock()
+    keyword_index.write_postings(writer, 'r1', ['milk', 'bread'])
+    writer.put_item.assert_has_calls([
+        call(Item={'token': 'milk', 'receipt_id': 'r1'}),
+        call(Item={'token': 'bread', 'receipt_id': 'r1'}),
+    ])
+
+# Test posting lists are paginated and intersected
+def test_find_receipt_ids():
+    index_table = MagicMock()
+    index_table.query.side_effect = [
+        {'Items': [{'receipt_id': '1'}, {'receipt_id': '2'}], 'LastEvaluatedKey': {'token': 'starbucks'}},
+        {'Items': [{'receipt_id': '3'}]},
+        {'Items': [{'receipt_id': '2'}, {'receipt_id': '3'}, {'receipt_id': '4'}]},
+    ]
+
+    receipt_ids = keyword_index.find_receipt_ids(index_table, ['Starbucks', 'latte'])
+
+    assert index_table.query.call_count == 3
+    assert receipt_ids == {'2', '3'}
+
+# Test lookups stop as soon as the intersection is empty
+def test_find_receipt_ids_early_exit():
+    index_table = MagicMock()
+    index_table.query.side_effect = [{'Items': [{'receipt_id': '1'}]}, {'Items': [{'receipt_id': '2'}]}]
+
+    receipt_ids = keyword_index.find_receipt_ids(index_table, ['coles', 'milk', 'bread'])
+
+    assert index_table.query.call_count == 2
+    assert receipt_ids == set()
+
+# Test batch_get_receipts retries unprocessed keys
+def test_batch_get_receipts_unprocessed_keys():
+    dynamodb = MagicMock()
+    dynamodb.batch_get_item.side_effect = [
+        {'Responses': {'Receipts': [{'receipt_id': 'b'}]},
+         'UnprocessedKeys': {'Receipts': {'Keys': [{'receipt_id': 'a'}]}}},
+        {'Responses': {'Receipts': [{'receipt_id': 'a'}]}, 'UnprocessedKeys': {}},
+    ]
+
+    items = keyword_index.batch_get_receipts(dynamodb, 'Receipts', {'a', 'b'})
+
+    assert dynamodb.batch_get_item.call_count == 2
+    assert items == [{'receipt_id': 'a'}, {'receipt_id': 'b'}]
+
+# Test search with no usable keywords does not touch DynamoDB
+def test_search_no_keywords():
+    index_table = MagicMock()
+    dynamodb = MagicMock()
+
+    assert keyword_index.search(index_table, dynamodb, 'Receipts', ['a', '']) == []
+    index_table.query.assert_not_called()
+    dynamodb.batch_get_item.assert_not_called()
+
+# Test a backfill marks the index as complete after writing the postings
+@patch('keyword_index.iter_scan_pages', return_value=iter([[{'receipt_id': 'r1', 'raw_text': 'milk bread'}]]))
+def test_backfill_marks_index(mock_scan):
+    receipts_table, index_table = MagicMock(), MagicMock()
+    writer = index_table.batch_writer.return_value.__enter__.return_value
+
+    assert keyword_index.backfill(receipts_table, index_table) == 1
+    assert writer.put_item.call_count == 2
+    index_table.put_item.assert_called_once_with(Item=keyword_index.BACKFILL_MARKER)
+
+    index_table.get_item.return_value = {}
+    assert not keyword_index.is_backfilled(index_table)
@@ -0,0 +1,244 @@
+import json
+import pytest
+from unittest.mock import patch, MagicMock
+from botocore.exceptions import ClientError
+import lambda_function
+
+
+def s3_record(key, bucket='my-receipt-manager-bucket'):
+    return {'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}
+
+def textract_lines(*lines):
+    return {'Blocks': [{'BlockType': 'PAGE'}] + [{'BlockType': 'LINE', 'Text': line} for line in lines]}
+
+@pytest.fixture
+def writers():
+    receipt_writer = MagicMock()
+    index_writer = MagicMock()
+    with patch('lambda_function.table.batch_writer') as mock_receipts, \
+            patch('lambda_function.keyword_index_table.batch_writer') as mock_index:
+        mock_receipts.return_value.__enter__.return_value = receipt_writer
+        mock_index.return_value.__enter__.return_value = index_writer
+        yield receipt_writer, index_writer
+
+@pytest.fixture(autouse=True)
+def create_thumbnail():
+    with patch('lambda_function.create_thumbnail', return_value='thumbs/x.webp') as mock_create_thumbnail:
+        yield mock_create_thumbnail
+
+@pytest.fixture(autouse=True)
+def update_rollups():
+    with patch('lambda_function.update_rollups') as mock_update_rollups:
+        yield mock_update_rollups
+
+# Test every record of an S3 event is processed and written in one batch
+@patch('lambda_function.textract.detect_document_text')
+def test_lambda_handler_processes_all_records(mock_analyze, writers):
+    receipt_writer, index_writer = writers
+    mock_analyze.side_effect = lambda Document: textract_lines(
+        'Starbucks', Document['S3Object']['Name'])
+    event = {'Records': [s3_record('receipts/a.jpg'), s3_record('receipts/b.jpg')]}
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response['statusCode'] == 200
+    assert response['batchItemFailures'] == []
+    assert mock_analyze.call_count == 2
+    stored = sorted(call.kwargs['Item']['receipt_id'] for call in receipt_writer.put_item.call_args_list)
+    assert stored == ['a', 'b']
+    assert index_writer.put_item.call_count > 0
+
+# Test one failing SQS message is reported without failing the batch
+@patch('lambda_function.textract.detect_document_text')
+def test_lambda_handler_partial_batch_failure(mock_analyze, writers):
+    receipt_writer, _ = writers
+
+    def analyze(Document):
+        if Document['S3Object']['Name'] == 'receipts/bad.jpg':
+            raise Exception('InvalidImageFormat')
+        return textract_lines('Coles')
+
+    mock_analyze.side_effect = analyze
+    event = {'Records': [
+        {'eventSource': 'aws:sqs', 'messageId': 'm1', 'body': json.dumps({'Records': [s3_record('receipts/good.jpg')]})},
+        {'eventSource': 'aws:sqs', 'messageId': 'm2', 'body': json.dumps({'Records': [s3_record('receipts/bad.jpg')]})},
+        {'eventSource': 'aws:sqs', 'messageId': 'm3', 'body': json.dumps({'Event': 's3:TestEvent'})},
+    ]}
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'm2'}]
+    receipt_writer.put_item.assert_called_once()
+    assert receipt_writer.put_item.call_args.kwargs['Item']['receipt_id'] == 'good'
+
+# Test receipts without text are skipped, not retried
+@patch('lambda_function.textract.detect_document_text')
+def test_lambda_handler_no_text(mock_analyze, writers):
+    receipt_writer, _ = writers
+    mock_analyze.return_value = {'Blocks': []}
+
+    response = lambda_function.lambda_handler({'Records': [s3_record('receipts/blank.jpg')]}, None)
+
+    assert response['statusCode'] == 200
+    assert response['batchItemFailures'] == []
+    assert json.loads(response['body'])['skipped'] == ['receipts/blank.jpg']
+    receipt_writer.put_item.assert_not_called()
+
+# Test URL-encoded S3 keys are decoded
+def test_iter_s3_records_decodes_keys():
+    records = list(lambda_function.iter_s3_records({'Records': [s3_record('receipts/my+receipt%281%29.jpg')]}))
+
+    assert [(record_id, lambda_function.s3_object(record)) for record_id, record in records] == [
+        ('receipts/my receipt(1).jpg', ('my-receipt-manager-bucket', 'receipts/my receipt(1).jpg'))]
+
+# Test extract_raw_text keeps LINE blocks only
+def test_extract_raw_text():
+    assert lambda_function.extract_raw_text(textract_lines('Starbucks', 'Latte $5.50')) == "starbucks\nlatte $5.50"
+
+# Test each Textract mode calls its API
+@pytest.mark.parametrize('mode, api, extra', [
+    ('text', 'detect_document_text', {}),
+    ('expense', 'analyze_expense', {}),
+    ('forms', 'analyze_document', {'FeatureTypes': ["FORMS", "TABLES"]}),
+])
+def test_analyze_receipt_modes(mode, api, extra):
+    textract = MagicMock()
+
+    lambda_function.analyze_receipt(textract, 'bucket', 'receipts/a.jpg', mode)
+
+    getattr(textract, api).assert_called_once_with(
+        Document={'S3Object': {'Bucket': 'bucket', 'Name': 'receipts/a.jpg'}}, **extra)
+
+# Test an unknown mode is rejected
+def test_analyze_receipt_unknown_mode():
+    with pytest.raises(ValueError):
+        lambda_function.analyze_receipt(MagicMock(), 'bucket', 'receipts/a.jpg', 'ocr')
+
+# Test raw text is extracted from analyze_expense responses
+def test_extract_raw_text_expense():
+    response = {'ExpenseDocuments': [{'SummaryFields': [], 'Blocks': textract_lines('Aldi', 'Total $3.00')['Blocks']}]}
+
+    assert lambda_function.extract_raw_text(response) == "aldi\ntotal $3.00"
+
+# Test structured fields are stored on the receipt item
+@patch('lambda_function.textract.detect_document_text')
+def test_process_receipt_structured_fields(mock_analyze):
+    mock_analyze.return_value = textract_lines('Starbucks', '12/09/2024', 'Total $9.70')
+
+    item, _ = lambda_function.process_receipt('my-receipt-manager-bucket', 'receipts/a.jpg')
+
+    assert item['merchant'] == 'starbucks'
+    assert item['receipt_date'] == '2024-09-12'
+    assert item['receipt_month'] == '2024-09'
+    assert str(item['amount']) == '9.70'
+
+# Test the thumbnail key is stored, and a thumbnail failure doesn't fail the receipt
+@patch('lambda_function.textract.detect_document_text')
+def test_process_receipt_thumbnail(mock_analyze, create_thumbnail):
+    mock_analyze.return_value = textract_lines('Starbucks')
+    create_thumbnail.return_value = 'thumbs/a.webp'
+
+    item, _ = lambda_function.process_receipt('my-receipt-manager-bucket', 'receipts/a.jpg')
+    assert item['thumbnail_key'] == 'thumbs/a.webp'
+    assert create_thumbnail.call_args.args[1:] == ('my-receipt-manager-bucket', 'receipts/a.jpg', 'a')
+
+    create_thumbnail.side_effect = Exception('Access denied')
+    item, _ = lambda_function.process_receipt('my-receipt-manager-bucket', 'receipts/a.jpg')
+    assert 'thumbnail_key' not in item
+
+# Test receipts are stored with an embedding when enabled, and an embedding failure doesn't fail the receipt
+@patch('lambda_function.textract.detect_document_text')
+def test_process_receipt_embedding(mock_analyze):
+    mock_analyze.return_value = textract_lines('Starbucks', 'Latte $5.50')
+
+    # Off by default
+    item, _ = lambda_function.process_receipt('my-receipt-manager-bucket', 'receipts/a.jpg')
+    assert 'embedding' not in item
+
+    with patch('lambda_function.EMBEDDINGS_ENABLED', True):
+        item, _ = lambda_function.process_receipt('my-receipt-manager-bucket', 'receipts/a.jpg')
+    assert item['embedding_model'] == lambda_function.get_receipt_embedder().name
+    assert len(item['embedding']) > 0
+
+    with patch('lambda_function.EMBEDDINGS_ENABLED', True), \
+            patch('lambda_function.embed_item', side_effect=Exception('Rate limited')):
+        item, _ = lambda_function.process_receipt('my-receipt-manager-bucket', 'receipts/a.jpg')
+    assert 'embedding' not in item
+
+# Test an image whose ETag another receipt claimed is skipped before Textract
+@patch('lambda_function.textract.detect_document_text')
+def test_lambda_handler_skips_duplicate_etag(mock_analyze, writers):
+    receipt_writer, _ = writers
+    record = s3_record('receipts/b.jpg')
+    record['s3']['object']['eTag'] = '5d41402abc4b2a76b9719d911017c592'
+
+    with patch('lambda_function.hashes_table.put_item', side_effect=ClientError(
+            {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')), \
+            patch('lambda_function.hashes_table.get_item', return_value={'Item': {'receipt_id': 'a'}}), \
+            patch('lambda_function.hashes_table.update_item') as mock_update_item:
+        response = lambda_function.lambda_handler({'Records': [record]}, None)
+
+    assert json.loads(response['body'])['duplicates'] == ['receipts/b.jpg']
+    assert response['batchItemFailures'] == []
+    mock_analyze.assert_not_called()
+    receipt_writer.put_item.assert_not_called()
+    assert mock_update_item.call_args.kwargs['Key'] == {'hash_key': 'etag#5d41402abc4b2a76b9719d911017c592'}
+
+# Test an image bulk_import claimed and uploaded is left to bulk_import
+@patch('lambda_function.textract.detect_document_text')
+def test_lambda_handler_skips_bulk_import(mock_analyze, writers):
+    receipt_writer, _ = writers
+    record = s3_record('receipts/a.jpg')
+    record['s3']['object']['eTag'] = '5d41402abc4b2a76b9719d911017c592'
+
+    with patch('lambda_function.hashes_table.put_item', side_effect=ClientError(
+            {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')), \
+            patch('lambda_function.hashes_table.get_item',
+                  return_value={'Item': {'receipt_id': 'a', 'ingest': 'bulk_import'}}):
+        response = lambda_function.lambda_handler({'Records': [record]}, None)
+
+    assert response['batchItemFailures'] == []
+    mock_analyze.assert_not_called()
+    receipt_writer.put_item.assert_not_called()
+
+# Test the compact layout writes the text to ReceiptTexts and a preview to Receipts
+@patch('lambda_function.COMPACT_STORAGE', True)
+def test_store_receipts_compact(writers):
+    receipt_writer, _ = writers
+    text_writer = MagicMock()
+    with patch('lambda_function.texts_table.batch_writer') as mock_texts:
+        mock_texts.return_value.__enter__.return_value = text_writer
+        lambda_function.store_receipts([({'receipt_id': 'a', 'raw_text': 'starbucks\nlatte'}, ['starbucks', 'latte'])])
+
+    assert text_writer.put_item.call_args.kwargs['Item']['receipt_id'] == 'a'
+    item = receipt_writer.put_item.call_args.kwargs['Item']
+    assert 'raw_text' not in item and item['preview'] == 'starbucks\nlatte'
+
+# Test stored receipts are counted in the stats rollups, and a rollup failure fails the batch so it is retried
+@patch('lambda_function.textract.detect_document_text', return_value=textract_lines('Starbucks', '12/09/2024', 'total $9.50'))
+def test_lambda_handler_updates_rollups(mock_analyze, writers, update_rollups):
+    event = {'Records': [s3_record('receipts/a.jpg')]}
+
+    assert lambda_function.lambda_handler(event, None)['statusCode'] == 200
+    item = update_rollups.call_args.args[1][0]
+    assert (item['receipt_id'], item['receipt_date'], str(item['amount'])) == ('a', '2024-09-12', '9.50')
+
+    update_rollups.side_effect = ClientError({'Error': {'Code': 'TransactionCanceledException'}}, 'TransactWriteItems')
+    response = lambda_function.lambda_handler(event, None)
+    assert response['statusCode'] == 500
+    assert json.loads(response['body'])['failed'] == ['receipts/a.jpg']
+
+# Test a malformed SQS message is reported on its own and the rest of the batch is processed
+@patch('lambda_function.textract.detect_document_text', return_value=textract_lines('Coles'))
+def test_lambda_handler_malformed_message(mock_analyze, writers):
+    receipt_writer, _ = writers
+    event = {'Records': [
+        {'eventSource': 'aws:sqs', 'messageId': 'm1', 'body': json.dumps({'Records': [s3_record('receipts/good.jpg')]})},
+        {'eventSource': 'aws:sqs', 'messageId': 'm2', 'body': 'not json'},
+        {'eventSource': 'aws:sqs', 'messageId': 'm3', 'body': json.dumps({'Records': [{'s3': {}}]})},
+    ]}
+
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'm2'}, {'itemIdentifier': 'm3'}]
+    assert receipt_writer.put_item.call_args.kwargs['Item']['receipt_id'] == 'good'
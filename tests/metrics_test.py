@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from metrics import Histogram, RequestTimings, current_request, end_request, start_request, timed, timed_pages
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.DEPENDENCY_SECONDS.clear()
+    yield
+    end_request()
+
+# Test observations land in the first bucket whose bound is at least the value, and buckets are cumulative
+def test_histogram_render():
+    histogram = Histogram('calls_seconds', 'Call durations.', ('dependency',), buckets=(0.1, 1.0))
+    histogram.observe(('s3',), 0.05)
+    histogram.observe(('s3',), 0.1)
+    histogram.observe(('s3',), 5.0)
+
+    lines = histogram.render()
+
+    assert lines[:2] == ['# HELP calls_seconds Call durations.', '# TYPE calls_seconds histogram']
+    assert 'calls_seconds_bucket{dependency="s3",le="0.1"} 2' in lines
+    assert 'calls_seconds_bucket{dependency="s3",le="1.0"} 2' in lines
+    assert 'calls_seconds_bucket{dependency="s3",le="+Inf"} 3' in lines
+    assert 'calls_seconds_count{dependency="s3"} 3' in lines
+
+# Test timed calls are added to the current request and to the histogram, also when they raise
+def test_timed_records_request():
+    timings = start_request()
+
+    with timed('dynamodb', 'query'):
+        pass
+    with pytest.raises(ValueError):
+        with timed('dynamodb', 'query'):
+            raise ValueError('throttled')
+
+    assert current_request() is timings
+    assert timings.dependencies['dynamodb'][0] == 2
+    assert metrics.DEPENDENCY_SECONDS.snapshot()[('dynamodb', 'query')][2] == 2
+    assert timings.server_timing().startswith('dynamodb;dur=')
+    assert 'desc="2 calls"' in timings.server_timing()
+
+# Test calls made outside a request only go to the histogram
+def test_timed_without_request():
+    with timed('s3', 'presign'):
+        pass
+
+    assert current_request() is None
+    assert metrics.DEPENDENCY_SECONDS.snapshot()[('s3', 'presign')][2] == 1
+
+# Test every page fetch is timed, but not the end of the iteration
+def test_timed_pages():
+    timings = start_request()
+
+    assert list(timed_pages('dynamodb', 'scan', iter([[1], [2]]))) == [[1], [2]]
+    assert timings.dependencies['dynamodb'][0] == 2
+
+# Test coroutines and their threads count towards the request that started them
+def test_timings_follow_coroutines():
+    timings = start_request()
+
+    def blocking_call():
+        with timed('dynamodb', 'batch_get'):
+            pass
+
+    async def search():
+        with timed('openai', 'chat_completion'):
+            await asyncio.sleep(0)
+        await asyncio.gather(asyncio.to_thread(blocking_call), asyncio.to_thread(blocking_call))
+
+    asyncio.run(search())
+
+    assert timings.dependencies['openai'][0] == 1
+    assert timings.dependencies['dynamodb'][0] == 2
@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import MagicMock
+import parallel_scan
+
+
+def segmented_scan(pages_by_segment):
+    """Build a table.scan side effect serving canned pages per segment."""
+    def scan(**kwargs):
+        pages = pages_by_segment[kwargs.get('Segment', 0)]
+        page = kwargs.get('ExclusiveStartKey', {}).get('page', 0)
+        response = {'Items': pages[page]}
+        if page + 1 < len(pages):
+            response['LastEvaluatedKey'] = {'page': page + 1}
+        return response
+    return scan
+
+# Test every page of every segment is returned
+def test_iter_scan_pages_segments():
+    table = MagicMock()
+    table.scan.side_effect = segmented_scan({
+        0: [[{'receipt_id': '1'}], [{'receipt_id': '2'}]],
+        1: [[{'receipt_id': '3'}]],
+        2: [[]],
+    })
+
+    items = parallel_scan.scan_all(table, total_segments=3, ProjectionExpression='receipt_id')
+
+    assert sorted(item['receipt_id'] for item in items) == ['1', '2', '3']
+    assert table.scan.call_count == 4
+    for scan_call in table.scan.call_args_list:
+        assert scan_call.kwargs['TotalSegments'] == 3
+        assert scan_call.kwargs['ProjectionExpression'] == 'receipt_id'
+
+# Test a single segment scans inline without Segment arguments
+def test_iter_scan_pages_single_segment():
+    table = MagicMock()
+    table.scan.side_effect = segmented_scan({0: [[{'receipt_id': '1'}], [{'receipt_id': '2'}]]})
+
+    pages = list(parallel_scan.iter_scan_pages(table, total_segments=1))
+
+    assert pages == [[{'receipt_id': '1'}], [{'receipt_id': '2'}]]
+    assert 'Segment' not in table.scan.call_args.kwargs
+
+# Test errors raised by a segment reach the caller
+def test_iter_scan_pages_error():
+    table = MagicMock()
+    table.scan.side_effect = Exception('Throttled')
+
+    with pytest.raises(Exception) as exc_info:
+        parallel_scan.scan_all(table, total_segments=2)
+
+    assert str(exc_info.value) == 'Throttled'
+
+# Test stopping early does not hang on the remaining segments
+def test_iter_scan_pages_early_close():
+    table = MagicMock()
+    table.scan.side_effect = segmented_scan({segment: [[{'receipt_id': str(segment)}]] * 50 for segment in range(4)})
+
+    pages = parallel_scan.iter_scan_pages(table, total_segments=4)
+    first = next(pages)
+    pages.close()
+
+    assert len(first) == 1
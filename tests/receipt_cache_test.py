@@ -0,0 +1,197 @@
+import pytest
+import time
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+from boto3.dynamodb.types import Binary
+from receipt_cache import (MemoryStore, ReceiptCache, RedisStore, StreamFollower, decode_item, encode_item)
+
+RECEIPTS = [
+    {'receipt_id': 'r1', 'raw_text': 'starbucks\nlatte $5.50', 'total': Decimal('5.50'), 'ingested_at': Decimal(1000)},
+    {'receipt_id': 'r2', 'raw_text': 'woolworths\nmilk $3.10', 'embedding': b'\0' * 8, 'ingested_at': Decimal(1000)},
+    {'receipt_id': 'r3', 'raw_text': 'coles\nmilk $2.90\nbread $4.20', 'ingested_at': Decimal(1000)},
+]
+
+
+def make_table(items):
+    table = MagicMock()
+    table.scan.return_value = {'Items': [dict(item) for item in items]}
+    table.latest_stream_arn = 'arn:aws:dynamodb:stream'
+    return table
+
+def stream_client(records=()):
+    client = MagicMock()
+    client.describe_stream.return_value = {'StreamDescription': {'Shards': [
+        {'ShardId': 'shard-1', 'SequenceNumberRange': {'StartingSequenceNumber': '100'}}
+    ]}}
+    client.get_shard_iterator.side_effect = lambda **kwargs: {'ShardIterator': 'it-' + kwargs['ShardIteratorType']}
+    client.get_records.side_effect = [{'Records': list(records), 'NextShardIterator': 'it-next'},
+                                      {'Records': [], 'NextShardIterator': 'it-next'}]
+    return client
+
+def insert(receipt_id, sequence_number, **attributes):
+    image = {'receipt_id': {'S': receipt_id}}
+    image.update({name: {'S': value} for name, value in attributes.items()})
+    return {'eventName': 'INSERT', 'dynamodb': {'Keys': {'receipt_id': {'S': receipt_id}}, 'NewImage': image,
+                                                 'SequenceNumber': sequence_number}}
+
+# Test the store evicts the least recently used receipt and then reports itself incomplete
+def test_memory_store_eviction():
+    store = MemoryStore(max_entries=2)
+    store.put({'receipt_id': 'a'})
+    store.put({'receipt_id': 'b'})
+    store.get('a')
+    store.put({'receipt_id': 'c'})
+
+    assert sorted(item['receipt_id'] for item in store.values()) == ['a', 'c']
+    assert not store.complete()
+
+# Test pages are sliced from the sorted receipt_ids, which follow puts, deletes and evictions
+def test_memory_store_page():
+    store = MemoryStore(max_entries=3)
+    for receipt_id in ('c', 'a', 'd', 'b'):
+        store.put({'receipt_id': receipt_id})
+
+    # 'c' was the least recently used
+    page, more = store.page(2)
+    assert [item['receipt_id'] for item in page] == ['a', 'b'] and more
+    page, more = store.page(2, 'b')
+    assert [item['receipt_id'] for item in page] == ['d'] and not more
+
+    store.delete('a')
+    store.put({'receipt_id': 'b', 'total': 1})
+    page, more = store.page(5)
+    assert page == [{'receipt_id': 'b', 'total': 1}, {'receipt_id': 'd'}] and not more
+
+# Test the Redis store pages with a lexicographic range of its receipt_id set
+def test_redis_store_page():
+    client = MagicMock()
+    client.zrangebylex.return_value = [b'r2', b'r3']
+    client.hmget.return_value = [encode_item({'receipt_id': 'r2'})]
+    store = RedisStore(client=client)
+
+    assert store.page(1, 'r1') == ([{'receipt_id': 'r2'}], True)
+    client.zrangebylex.assert_called_once_with('receipt-cache:keys', '(r1', '+', start=0, num=2)
+    client.hmget.assert_called_once_with('receipt-cache:items', [b'r2'])
+
+# Test items survive the JSON encoding used by the Redis store, numbers as Decimals
+def test_encode_decode_item():
+    item = {'receipt_id': 'r1', 'total': Decimal('5.5'), 'ingested_at': Decimal(1000), 'cold': Binary(b'\x00\x01')}
+
+    assert decode_item(encode_item(item)) == item
+
+# Test reads are answered from a scan-warmed cache without the excluded attributes
+def test_cache_reads_after_build():
+    cache = ReceiptCache(lambda: make_table(RECEIPTS), source='scan', total_segments=1)
+    cache.build()
+
+    receipts = cache.receipts()
+    assert sorted(item['receipt_id'] for item in receipts) == ['r1', 'r2', 'r3']
+    assert all('embedding' not in item for item in receipts)
+    assert sorted(item['receipt_id'] for item in cache.matching(['milk'])) == ['r2', 'r3']
+
+    page, last_key = cache.page(2)
+    assert [item['receipt_id'] for item in page] == ['r1', 'r2'] and last_key == {'receipt_id': 'r2'}
+    page, last_key = cache.page(2, last_key)
+    assert [item['receipt_id'] for item in page] == ['r3'] and last_key is None
+    assert [[item['receipt_id'] for item in page] for page in cache.iter_pages(2)] == [['r1', 'r2'], ['r3']]
+
+# Test callers can't change the cached items
+def test_cache_returns_copies():
+    cache = ReceiptCache(lambda: make_table(RECEIPTS), source='scan', total_segments=1)
+    cache.build()
+
+    cache.receipts()[0]['image_url'] = 'https://signed'
+
+    assert all('image_url' not in item for item in cache.receipts())
+
+# Test reads fall back to DynamoDB before the warm-up and once the last sync is too old
+def test_cache_staleness_bound():
+    cache = ReceiptCache(lambda: make_table(RECEIPTS), source='scan', total_segments=1, max_staleness=30)
+    with patch('search_engine.threading.Thread'):
+        assert cache.receipts() is None
+
+    cache.build()
+    assert cache.get('r1')['receipt_id'] == 'r1'
+    with patch('receipt_cache.time.time', return_value=time.time() + 60), patch('search_engine.threading.Thread'):
+        assert cache.receipts() is None
+        assert cache.get('r1') is None
+    assert cache.stats()['misses'] == 2
+
+# Test an evicting cache still serves single receipts but not whole-table reads
+def test_cache_incomplete_store():
+    cache = ReceiptCache(lambda: make_table(RECEIPTS), store=MemoryStore(max_entries=2), source='scan',
+                         total_segments=1)
+    cache.build()
+
+    assert cache.receipts() is None
+    assert cache.get('r3')['receipt_id'] == 'r3'
+
+# Test the follower starts at the stream's end and records how far it has read
+def test_stream_follower_poll():
+    client = stream_client([insert('r4', '200'), insert('r5', '201')])
+    follower = StreamFollower(client, 'arn')
+
+    assert [record['dynamodb']['Keys']['receipt_id']['S'] for record in follower.poll()] == ['r4', 'r5']
+    assert client.get_shard_iterator.call_args.kwargs['ShardIteratorType'] == 'LATEST'
+    assert follower.positions == {'shard-1': '201'}
+
+# Test a closed shard hands over to its child, read from its start
+def test_stream_follower_shard_rollover():
+    client = stream_client()
+    client.get_records.side_effect = [{'Records': [insert('r4', '200')]},
+                                      {'Records': [insert('r5', '300')], 'NextShardIterator': 'it-child'},
+                                      {'Records': [], 'NextShardIterator': 'it-child'}]
+    follower = StreamFollower(client, 'arn')
+    client.describe_stream.return_value = {'StreamDescription': {'Shards': [
+        {'ShardId': 'shard-1', 'SequenceNumberRange': {'StartingSequenceNumber': '100', 'EndingSequenceNumber': '200'}},
+        {'ShardId': 'shard-2', 'ParentShardId': 'shard-1', 'SequenceNumberRange': {'StartingSequenceNumber': '300'}},
+    ]}}
+
+    follower.poll()
+    assert follower.positions == {'shard-1': '*', 'shard-2': ''}
+    assert client.get_shard_iterator.call_args.kwargs['ShardIteratorType'] == 'TRIM_HORIZON'
+
+    assert [record['dynamodb']['SequenceNumber'] for record in follower.poll()] == ['300']
+    assert follower.positions['shard-2'] == '300'
+
+# Test stream changes are applied without scanning, and a failed poll resumes from the saved position
+def test_cache_follows_stream():
+    table = make_table(RECEIPTS)
+    client = stream_client([insert('r4', '200', raw_text='aldi\neggs'),
+                            {'eventName': 'REMOVE', 'dynamodb': {'Keys': {'receipt_id': {'S': 'r1'}},
+                                                                 'SequenceNumber': '201'}}])
+    cache = ReceiptCache(lambda: table, lambda: client, source='stream', total_segments=1)
+    cache.build()
+    table.scan.reset_mock()
+
+    assert cache.refresh() == 2
+    table.scan.assert_not_called()
+    assert sorted(item['receipt_id'] for item in cache.receipts()) == ['r2', 'r3', 'r4']
+    assert cache.store.get_state()['shard:shard-1'] == '201'
+
+    client.get_records.side_effect = Exception('ExpiredIteratorException')
+    with pytest.raises(Exception):
+        cache.refresh()
+    assert cache.follower is None
+
+    client.get_records.side_effect = None
+    client.get_records.return_value = {'Records': [], 'NextShardIterator': 'it-next'}
+    cache.refresh()
+    assert client.get_shard_iterator.call_args.kwargs == {
+        'StreamArn': 'arn:aws:dynamodb:stream', 'ShardId': 'shard-1',
+        'ShardIteratorType': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': '201'
+    }
+
+# Test only the lease holder syncs a shared store, the others read what it wrote
+def test_redis_store_lease():
+    client = MagicMock()
+    client.set.return_value = None
+    client.get.return_value = b'other-owner'
+    store = RedisStore(client=client)
+
+    assert not store.acquire_lease('me', 30)
+
+    cache = ReceiptCache(lambda: make_table(RECEIPTS), store=store, source='scan', total_segments=1)
+    cache.build()
+    assert cache.index is store
+    client.pipeline.assert_not_called()
@@ -0,0 +1,118 @@
+from datetime import date
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+from receipt_fields import (backfill, fields_from_expense, months_between, parse_date, plan_query,
+                            structured_fields)
+
+MERCHANTS = ('starbucks', 'coles', 'uber eats', 'uber')
+
+RECEIPT = """starbucks coffee
+abn 12 345 678 901
+12/09/2024 08:15
+latte $5.50
+muffin $4.20
+subtotal $9.70
+total $9.70
+eftpos $9.70"""
+
+# Test dates in the formats printed on Australian receipts
+def test_parse_date():
+    assert parse_date("date: 12/09/2024") == '2024-09-12'
+    assert parse_date("12-09-24") == '2024-09-12'
+    assert parse_date("2024-09-12t10:00") == '2024-09-12'
+    assert parse_date("12 sept 2024") == '2024-09-12'
+    assert parse_date("sep 12, 2024") == '2024-09-12'
+    assert parse_date("31/02/2024 then 01/03/2024") == '2024-03-01'
+    assert parse_date("no date here") is None
+
+# Test merchant, date and total come out of raw text
+def test_structured_fields_from_text():
+    fields = structured_fields(RECEIPT, merchants=MERCHANTS)
+
+    assert fields == {'merchant': 'starbucks', 'receipt_date': '2024-09-12',
+                      'receipt_month': '2024-09', 'amount': Decimal('9.70')}
+
+# Test unknown merchants fall back to the first name-like line and missing fields are left out
+def test_structured_fields_unknown_merchant():
+    fields = structured_fields("tax invoice\nJoe's Cafe\nlong black 4.50", merchants=MERCHANTS)
+
+    assert fields == {'merchant': "joe's cafe", 'amount': Decimal('4.50')}
+
+# Test analyze_expense summary fields take precedence over the text parser
+def test_structured_fields_from_expense():
+    response = {'ExpenseDocuments': [{'SummaryFields': [
+        {'Type': {'Text': 'VENDOR_NAME'}, 'ValueDetection': {'Text': 'COLES Supermarkets'}},
+        {'Type': {'Text': 'INVOICE_RECEIPT_DATE'}, 'ValueDetection': {'Text': '3 Mar 2024'}},
+        {'Type': {'Text': 'TOTAL'}, 'ValueDetection': {'Text': '$1,204'}},
+    ]}]}
+
+    assert fields_from_expense(response)['amount'] == Decimal('1204.00')
+    fields = structured_fields("coles\ntotal 12.00", response, MERCHANTS)
+    assert fields == {'merchant': 'coles', 'receipt_date': '2024-03-03',
+                      'receipt_month': '2024-03', 'amount': Decimal('1204.00')}
+
+# Test a merchant and a month without a year become one range per recent year
+def test_plan_query_merchant_and_month():
+    plan = plan_query(['starbucks', 'september'], MERCHANTS, today=date(2025, 3, 1))
+
+    assert plan.indexed
+    assert plan.merchant == 'starbucks'
+    # September 2025 is still in the future
+    assert plan.date_ranges == [('2024-09-01', '2024-09-30')]
+    assert plan.keywords == []
+
+    # A month without a year looks back over the current and the previous year only
+    assert plan_query(['march'], today=date(2025, 9, 1)).date_ranges == [('2025-03-01', '2025-03-31'),
+                                                                        ('2024-03-01', '2024-03-31')]
+
+# Test a year alone is one range and unrecognized keywords are kept for filtering
+def test_plan_query_year_and_keywords():
+    plan = plan_query(['2024', 'latte'], MERCHANTS, today=date(2025, 3, 1))
+
+    assert plan.merchant is None
+    assert plan.date_ranges == [('2024-01-01', '2024-12-31')]
+    assert plan.keywords == ['latte']
+    assert not plan_query(['latte'], MERCHANTS).indexed
+
+# Test "this"/"last" week, month and year are resolved against today, as words or as one keyword
+def test_plan_query_relative_dates():
+    today = date(2025, 1, 15)
+    assert plan_query(['this', 'year'], today=today).date_ranges == [('2025-01-01', '2025-12-31')]
+    assert plan_query(['starbucks', 'last month'], MERCHANTS, today=today).date_ranges == [('2024-12-01', '2024-12-31')]
+    assert plan_query(['march', 'last', 'year'], today=today).date_ranges == [('2024-03-01', '2024-03-31')]
+    assert plan_query(['last', 'week'], today=today).date_ranges == [('2025-01-06', '2025-01-12')]
+    assert plan_query(['last', 'latte'], today=today).keywords == ['last', 'latte']
+
+def test_months_between():
+    assert months_between('2023-11-15', '2024-02-01') == ['2024-02', '2024-01', '2023-12', '2023-11']
+
+# Test backfill only updates receipts without structured fields
+@patch('parallel_scan.iter_scan_pages')
+def test_backfill(mock_iter_scan_pages):
+    mock_iter_scan_pages.return_value = iter([[
+        {'receipt_id': '1', 'raw_text': RECEIPT},
+        {'receipt_id': '2', 'raw_text': RECEIPT, 'merchant': 'starbucks'},
+        {'receipt_id': '3'},
+    ]])
+    table = MagicMock()
+
+    assert backfill(table, MERCHANTS) == 1
+    kwargs = table.update_item.call_args.kwargs
+    assert kwargs['Key'] == {'receipt_id': '1'}
+    assert kwargs['ExpressionAttributeValues'][':merchant'] == 'starbucks'
+
+# Test backfill parses compact receipts from their fetched texts
+@patch('parallel_scan.iter_scan_pages')
+def test_backfill_compact(mock_iter_scan_pages):
+    mock_iter_scan_pages.return_value = iter([[
+        {'receipt_id': '1', 'token_signature': b'\0'},
+        {'receipt_id': '2', 'token_signature': b'\0', 'merchant': 'starbucks'},
+    ]])
+    table = MagicMock()
+    get_texts = MagicMock(return_value={'1': RECEIPT})
+
+    assert backfill(table, MERCHANTS, get_texts) == 1
+    get_texts.assert_called_once_with(['1'])
+    kwargs = table.update_item.call_args.kwargs
+    assert kwargs['Key'] == {'receipt_id': '1'}
+    assert kwargs['ExpressionAttributeValues'][':merchant'] == 'starbucks'
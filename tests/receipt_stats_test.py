@@ -0,0 +1,122 @@
+from decimal import Decimal
+from unittest.mock import patch, MagicMock
+import pytest
+from botocore.exceptions import ClientError
+import receipt_stats
+
+STARBUCKS = {'receipt_id': 'a', 'merchant': 'starbucks', 'receipt_date': '2024-09-12', 'amount': Decimal('9.50')}
+COLES = {'receipt_id': 'b', 'merchant': 'coles', 'receipt_date': '2024-09-13', 'amount': Decimal('20.00')}
+
+
+# (spend, receipts) added to each counter by the given transact_write_items calls
+def counters(calls):
+    totals = {}
+    for call in calls:
+        for action in call.kwargs['TransactItems']:
+            if 'Update' in action:
+                key = action['Update']['Key']['rollup'] + ' ' + action['Update']['Key']['period']
+                values = action['Update']['ExpressionAttributeValues']
+                spend, receipts = totals.get(key, (0, 0))
+                totals[key] = (spend + values[':s'], receipts + values[':n'])
+    return totals
+
+def counted_before():
+    return ClientError({'Error': {'Code': 'TransactionCanceledException'},
+                        'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]},
+                       'TransactWriteItems')
+
+# Test each new receipt is marked and added to its counters in one transaction, and undated receipts aren't counted
+def test_update_rollups_new_receipts():
+    table = MagicMock()
+    undated = {'receipt_id': 'c', 'merchant': 'coles', 'amount': Decimal('1.00')}
+
+    assert receipt_stats.update_rollups(table, [STARBUCKS, COLES, undated]) == 8
+
+    assert counters(table.meta.client.transact_write_items.call_args_list) == {
+        'month 2024-09': (Decimal('29.50'), 2),
+        'day 2024-09-12': (Decimal('9.50'), 1),
+        'day 2024-09-13': (Decimal('20.00'), 1),
+        'merchant#starbucks 2024-09': (Decimal('9.50'), 1),
+        'merchants#2024-09 starbucks': (Decimal('9.50'), 1),
+        'merchant#coles 2024-09': (Decimal('20.00'), 1),
+        'merchants#2024-09 coles': (Decimal('20.00'), 1),
+    }
+    transactions = [call.kwargs['TransactItems'] for call in table.meta.client.transact_write_items.call_args_list]
+    assert [len(actions) for actions in transactions] == [5, 5, 1]
+    marker = transactions[0][0]['Put']
+    assert marker['Item']['rollup'] == 'receipt#a' and marker['ConditionExpression'] == 'attribute_not_exists(#r)'
+
+# Test a receipt stored again is not counted twice, and a changed one moves its amount under its marker's version
+def test_update_rollups_stored_again():
+    table = MagicMock()
+    table.meta.client.transact_write_items.side_effect = [counted_before(), None]
+    table.get_item.return_value = {'Item': dict(STARBUCKS, rollup='receipt#a', period='counted', version=1)}
+
+    assert receipt_stats.update_rollups(table, [STARBUCKS]) == 0
+    assert table.meta.client.transact_write_items.call_count == 1
+
+    table.meta.client.transact_write_items.reset_mock()
+    table.meta.client.transact_write_items.side_effect = [counted_before(), None]
+    receipt_stats.update_rollups(table, [dict(STARBUCKS, amount=Decimal('10.50'))])
+
+    # The first, cancelled transaction wrote nothing
+    assert counters([table.meta.client.transact_write_items.call_args]) == {
+        'month 2024-09': (Decimal('1.00'), 0), 'day 2024-09-12': (Decimal('1.00'), 0),
+        'merchant#starbucks 2024-09': (Decimal('1.00'), 0), 'merchants#2024-09 starbucks': (Decimal('1.00'), 0)}
+    marker = table.meta.client.transact_write_items.call_args.kwargs['TransactItems'][0]['Put']
+    assert marker['ExpressionAttributeValues'] == {':v': 1} and marker['Item']['version'] == 2
+
+# Test a failed transaction is raised, not mistaken for a receipt counted before
+def test_update_rollups_failure():
+    table = MagicMock()
+    table.meta.client.transact_write_items.side_effect = ClientError(
+        {'Error': {'Code': 'TransactionCanceledException'},
+         'CancellationReasons': [{'Code': 'None'}, {'Code': 'TransactionConflict'}]}, 'TransactWriteItems')
+
+    with pytest.raises(ClientError):
+        receipt_stats.update_rollups(table, [STARBUCKS])
+    table.get_item.assert_not_called()
+
+# Test questions are answered from the rollup that covers them
+@patch('receipt_stats.query_rollup')
+def test_summarize(mock_query):
+    table = MagicMock()
+    mock_query.return_value = [{'period': '2024-09', 'spend': Decimal('9.50'), 'receipts': Decimal(1)}]
+    summary = receipt_stats.summarize(table, [('2024-09-01', '2024-09-30')], 'starbucks')
+    assert summary == {'spend': 9.5, 'receipts': 1, 'groups': [{'period': '2024-09', 'spend': 9.5, 'receipts': 1}]}
+    mock_query.assert_called_once_with(table, 'merchant#starbucks', '2024-09', '2024-09')
+
+    # Partial months without a merchant are added up from the day rollup
+    mock_query.reset_mock()
+    mock_query.return_value = [{'period': '2024-09-12', 'spend': Decimal('9.50'), 'receipts': 1},
+                               {'period': '2024-09-13', 'spend': Decimal('20.00'), 'receipts': 1}]
+    summary = receipt_stats.summarize(table, [('2024-09-10', '2024-09-20')])
+    assert summary['groups'] == [{'period': '2024-09', 'spend': 29.5, 'receipts': 2}]
+    mock_query.assert_called_once_with(table, 'day', '2024-09-10', '2024-09-20')
+
+    with pytest.raises(ValueError):
+        receipt_stats.summarize(table, [('2024-09-10', '2024-09-20')], 'starbucks')
+
+# Test the vectorized rollups match the incremental ones, and ad-hoc reports filter and group
+def test_rollup_items_and_report():
+    columns = receipt_stats.load_columns([STARBUCKS, COLES, {'receipt_id': 'c', 'receipt_date': '2024-10-01'}])
+
+    items = {(item['rollup'], item['period']): (item['spend'], item['receipts'])
+             for item in receipt_stats.rollup_items(columns)}
+    assert items[('month', '2024-09')] == (Decimal('29.5'), 2)
+    assert items[('month', '2024-10')] == (Decimal('0'), 1)
+    assert items[('merchant#coles', '2024-09')] == (Decimal('20'), 1)
+    assert items[('merchants#2024-09', 'starbucks')] == (Decimal('9.5'), 1)
+    assert len(items) == 9
+
+    assert receipt_stats.report(columns, 'weekday') == [('tuesday', 0.0, 1), ('thursday', 9.5, 1), ('friday', 20.0, 1)]
+    assert receipt_stats.report(columns, 'merchant', first='2024-09-13') == [('-', 0.0, 1), ('coles', 20.0, 1)]
+
+# Test months and dates are turned into range bounds
+def test_date_bound():
+    assert receipt_stats.date_bound('2024-02', end=True) == '2024-02-29'
+    assert receipt_stats.date_bound('2024-02') == '2024-02-01'
+    assert receipt_stats.date_bound('2024-02-10', end=True) == '2024-02-10'
+    assert receipt_stats.date_bound(None) is None
+    with pytest.raises(ValueError):
+        receipt_stats.date_bound('september')
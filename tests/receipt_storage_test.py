@@ -0,0 +1,91 @@
+import zlib
+from unittest.mock import patch, MagicMock
+import receipt_storage
+from tokenizer import unique_tokens
+
+RAW_TEXT = "starbucks\n12/09/2024\nflat white $5.50\nmuffin $4.00\ntotal $9.50"
+
+
+# Test a signature has every token of the text, and rules out most others
+def test_token_signature():
+    signature = receipt_storage.token_signature(unique_tokens(RAW_TEXT))
+
+    assert len(signature) == receipt_storage.SIGNATURE_BITS // 8
+    assert receipt_storage.signature_contains(signature, ['starbucks', 'muffin', '9.50'])
+    absent = [f"token{i}" for i in range(200)]
+    assert sum(receipt_storage.signature_contains(signature, [token]) for token in absent) < 10
+    assert not receipt_storage.signature_contains(None, ['starbucks'])
+
+# Test the hot item drops raw_text and keeps a preview and the other attributes
+def test_hot_item():
+    with patch('receipt_storage.PREVIEW_CHARS', 9):
+        hot = receipt_storage.hot_item({'receipt_id': 'r1', 'raw_text': RAW_TEXT, 'merchant': 'starbucks',
+                                        'embedding': b'\x00' * 1024})
+
+    assert 'raw_text' not in hot and 'embedding' not in hot
+    assert hot['preview'] == 'starbucks'
+    assert hot['merchant'] == 'starbucks'
+    assert receipt_storage.signature_contains(hot['token_signature'], ['flat', 'white'])
+
+# Test texts are compressed into ReceiptTexts, or S3 past COLD_TEXT_MAX_BYTES, and read back
+def test_write_and_read_text():
+    writer, s3 = MagicMock(), MagicMock()
+    receipt_storage.write_cold(writer, s3, {'receipt_id': 'r1', 'raw_text': RAW_TEXT, 'embedding': b'\x00' * 8,
+                                            'ingested_at': 1, 'merchant': 'starbucks'})
+    cold = writer.put_item.call_args.kwargs['Item']
+    assert zlib.decompress(cold['text']).decode() == RAW_TEXT
+    assert cold['embedding'] == b'\x00' * 8 and cold['ingested_at'] == 1 and 'merchant' not in cold
+    assert receipt_storage.read_text(cold, s3) == RAW_TEXT
+    s3.put_object.assert_not_called()
+
+    with patch('receipt_storage.COLD_TEXT_MAX_BYTES', 10):
+        receipt_storage.write_cold(writer, s3, {'receipt_id': 'r2', 'raw_text': RAW_TEXT})
+    cold = writer.put_item.call_args.kwargs['Item']
+    assert cold == {'receipt_id': 'r2', 'text_key': 'texts/r2.txt.z'}
+    s3.get_object.return_value = {'Body': MagicMock(read=lambda: s3.put_object.call_args.kwargs['Body'])}
+    assert receipt_storage.read_text(cold, s3) == RAW_TEXT
+
+# Test only the signature candidates' texts are fetched, and they decide the match
+def test_match_keywords():
+    compact = [receipt_storage.hot_item({'receipt_id': 'a', 'raw_text': RAW_TEXT}),
+               receipt_storage.hot_item({'receipt_id': 'b', 'raw_text': 'coles\nmilk $2.00'}),
+               receipt_storage.hot_item({'receipt_id': 'c', 'raw_text': 'starbucks\nlatte $5.00'})]
+    inline = {'receipt_id': 'd', 'raw_text': 'starbucks flat white'}
+    get_texts = MagicMock(return_value={'a': RAW_TEXT, 'c': 'starbucks\nlatte $5.00'})
+
+    matches = receipt_storage.match_keywords(compact + [inline], ['starbucks', 'flat white'], get_texts)
+
+    assert [item['receipt_id'] for item in matches] == ['a', 'd']
+    assert set(get_texts.call_args.args[0]) == {'a'}
+
+    # Compact receipts match whole tokens only, inline ones substrings
+    get_texts.reset_mock()
+    matches = receipt_storage.match_keywords(compact + [inline], ['star'], get_texts)
+    assert [item['receipt_id'] for item in matches] == ['d']
+
+# Test migration writes the texts, then replaces the items, and reports the sizes
+@patch('receipt_storage.iter_scan_pages')
+def test_migrate(mock_scan):
+    items = [{'receipt_id': f"r{i}", 'raw_text': RAW_TEXT * 20, 'merchant': 'starbucks'} for i in range(3)]
+    mock_scan.return_value = [items]
+    table, texts_table = MagicMock(), MagicMock()
+    texts_writer = texts_table.batch_writer.return_value.__enter__.return_value
+    receipts_writer = table.batch_writer.return_value.__enter__.return_value
+
+    stats = receipt_storage.migrate(table, texts_table, MagicMock(), log=MagicMock())
+
+    assert stats['receipts'] == 3
+    assert stats['after'] < stats['before'] / 3
+    assert texts_writer.put_item.call_count == 3
+    assert all('raw_text' not in call.kwargs['Item'] for call in receipts_writer.put_item.call_args_list)
+
+    table.reset_mock()
+    receipt_storage.migrate(table, texts_table, MagicMock(), dry_run=True)
+    table.batch_writer.assert_not_called()
+
+# Test item sizes follow DynamoDB's rules for names, strings, numbers and binaries
+def test_item_size():
+    assert receipt_storage.item_size({'receipt_id': 'abc'}) == 13
+    assert receipt_storage.item_size({'amount': 12345}) == 6 + 4
+    assert receipt_storage.item_size({'sig': b'\x00' * 128}) == 3 + 128
+    assert receipt_storage.scan_read_units([4096, 4096]) == 1
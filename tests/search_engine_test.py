@@ -0,0 +1,99 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from search_engine import BM25Index, SearchEngine
+
+RECEIPTS = [
+    {'receipt_id': 'r1', 'raw_text': 'starbucks\nlatte $5.50\nlatte $5.50\ntotal $11.00'},
+    {'receipt_id': 'r2', 'raw_text': 'starbucks\nmuffin $4.00\ntotal $4.00'},
+    {'receipt_id': 'r3', 'raw_text': 'woolworths\nmilk $3.10\nbread $4.20\ntotal $7.30'},
+]
+
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    for item in RECEIPTS:
+        index.add(dict(item))
+    return index
+
+def receipt_ids(results):
+    return [item['receipt_id'] for _, item in results]
+
+# Test receipts matching more (and rarer) query tokens rank first
+def test_search_ranks_by_bm25(index):
+    assert receipt_ids(index.search(['starbucks', 'latte'])) == ['r1', 'r2']
+    assert receipt_ids(index.search(['woolworths'])) == ['r3']
+
+# Test a keyword no receipt contains doesn't empty the results
+def test_search_tolerates_wrong_keyword(index):
+    assert sorted(receipt_ids(index.search(['starbucks', 'cappuccino']))) == ['r1', 'r2']
+    assert index.search(['cappuccino']) == []
+
+# Test only the top k results are returned
+def test_search_top_k(index):
+    assert len(index.search(['total'], k=2)) == 2
+
+# Test replacing a receipt reindexes its new text and removed receipts are no longer found
+def test_add_replaces_and_remove(index):
+    index.add({'receipt_id': 'r2', 'raw_text': 'coles\neggs $6.00'})
+    assert receipt_ids(index.search(['starbucks'])) == ['r1']
+    assert receipt_ids(index.search(['eggs'])) == ['r2']
+
+    assert index.remove('r3')
+    assert index.search(['woolworths']) == []
+    assert len(index) == 2
+    assert index.stats()['dead_documents'] == 2
+
+    index.compact()
+    assert index.stats()['dead_documents'] == 0
+    assert receipt_ids(index.search(['eggs'])) == ['r2']
+
+def make_table(items):
+    table = MagicMock()
+    table.scan.return_value = {'Items': items}
+    return table
+
+# Test the engine builds from a full scan and refreshes with ingest-time-index queries, never a scan
+@patch('search_engine.time.time', return_value=7300)
+def test_engine_build_and_refresh(mock_time):
+    table = make_table([dict(item, ingested_at=1000) for item in RECEIPTS])
+    engine = SearchEngine(lambda: table, total_segments=1)
+
+    engine.build()
+    # Watermark 7300 (the build): the refresh queries the buckets from 7180 (bucket 1) to now (bucket 2)
+    table.query.side_effect = [
+        {'Items': [{'receipt_id': 'r4', 'raw_text': 'bunnings drill', 'ingested_at': 7250}],
+         'LastEvaluatedKey': {'receipt_id': 'r4'}},
+        {'Items': []},
+        {'Items': [{'receipt_id': 'r5', 'raw_text': 'bunnings saw', 'ingested_at': 7290}]},
+    ]
+    assert engine.refresh() == 2
+
+    assert table.scan.call_count == 1
+    queries = [call.kwargs for call in table.query.call_args_list]
+    assert all(query['IndexName'] == 'ingest-time-index' for query in queries)
+    # (ingest_bucket, ingested_at lower bound) of each query
+    bounds = [tuple(condition.get_expression()['values'][1]
+                    for condition in query['KeyConditionExpression'].get_expression()['values'])
+              for query in queries]
+    assert bounds == [(1, 7180), (1, 7180), (2, 7180)]
+    assert queries[1]['ExclusiveStartKey'] == {'receipt_id': 'r4'}
+    assert sorted(item['receipt_id'] for item in engine.search(['bunnings'])) == ['r4', 'r5']
+
+# Test the first search starts a background build and falls back until it is ready
+def test_engine_search_before_build():
+    engine = SearchEngine(lambda: make_table(RECEIPTS), total_segments=1)
+
+    with patch('search_engine.threading.Thread') as mock_thread:
+        assert engine.search(['starbucks']) is None
+    mock_thread.return_value.start.assert_called_once()
+
+# Test search returns copies, so attaching image URLs doesn't change the index
+def test_engine_search_returns_copies():
+    engine = SearchEngine(lambda: make_table([dict(item) for item in RECEIPTS]), total_segments=1)
+    engine.build()
+
+    results = engine.search(['woolworths'])
+    results[0]['image_url'] = 'https://signed'
+
+    assert 'image_url' not in engine.search(['woolworths'])[0]
@@ -0,0 +1,54 @@
+import logging
+import pytest
+from unittest.mock import MagicMock
+from textract_parser import log_textract_response, parse_blocks, parse_response
+
+
+def line(text):
+    return {'BlockType': 'LINE', 'Text': text}
+
+# Test raw text, tokens and line offsets come out of one pass
+def test_parse_blocks():
+    blocks = [{'BlockType': 'PAGE'}, line('Starbucks'), {'BlockType': 'WORD', 'Text': 'Starbucks'},
+              line('Latte $5.50'), line('Latte again')]
+
+    parsed = parse_blocks(blocks)
+
+    assert parsed.raw_text == "starbucks\nlatte $5.50\nlatte again"
+    assert parsed.tokens == ['starbucks', 'latte', '5.50', 'again']
+    assert parsed.line_offsets == [0, 10, 22]
+    assert parsed.lines() == ['starbucks', 'latte $5.50', 'latte again']
+
+# Test surrounding whitespace is stripped like the original parser did
+def test_parse_blocks_strips():
+    parsed = parse_blocks([line('  Coles'), line('Milk  ')])
+
+    assert parsed.raw_text == "coles\nmilk"
+    assert parsed.lines() == ['coles', 'milk']
+
+# Test blank leading and trailing LINE blocks are dropped from the offsets, not collapsed onto the first line
+def test_parse_blocks_blank_lines():
+    parsed = parse_blocks([line(''), line('   '), line('  Coles'), line(''), line('Milk'), line(' '), line('')])
+
+    assert parsed.raw_text == "coles\n\nmilk"
+    assert parsed.line_offsets == [0, 6, 7]
+    assert parsed.lines() == ['coles', '', 'milk']
+
+    assert parse_blocks([line(' '), line('')]).line_offsets == []
+
+# Test an expense response is parsed from its nested blocks
+def test_parse_response_expense():
+    parsed = parse_response({'ExpenseDocuments': [{'Blocks': [line('Aldi')]}, {'Blocks': [line('Eggs')]}]})
+
+    assert parsed.raw_text == "aldi\neggs"
+
+# Test payloads are only serialized when DEBUG is enabled
+def test_log_textract_response_levels():
+    logger = MagicMock()
+    logger.isEnabledFor.side_effect = lambda level: level >= logging.INFO
+    response = {'Blocks': [line('x')] * 1000}
+
+    log_textract_response(logger, response)
+
+    logger.info.assert_called_once_with("Textract response received: %d blocks, %d lines", 1000, 1000)
+    logger.debug.assert_not_called()
@@ -0,0 +1,43 @@
+import io
+from unittest.mock import patch, MagicMock
+import pytest
+from PIL import Image
+from thumbnails import create_thumbnail, make_thumbnail
+
+
+def jpeg(width, height):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), (240, 240, 230)).save(output, format='JPEG')
+    return output.getvalue()
+
+# Test thumbnails are WebP, scaled to the thumbnail width and cropped when very long
+def test_make_thumbnail():
+    thumbnail = Image.open(io.BytesIO(make_thumbnail(jpeg(3000, 4000), width=400, max_height=1600)))
+    assert thumbnail.format == 'WEBP'
+    assert thumbnail.size == (400, 533)
+
+    long_receipt = Image.open(io.BytesIO(make_thumbnail(jpeg(1000, 8000), width=400, max_height=1600)))
+    assert long_receipt.size == (400, 1600)
+
+# Test unreadable data and decompression bombs raise the documented ValueError
+def test_make_thumbnail_unreadable():
+    with pytest.raises(ValueError):
+        make_thumbnail(b'not an image')
+    with pytest.raises(ValueError):
+        make_thumbnail(jpeg(800, 1000)[:200])
+    with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000), pytest.raises(ValueError):
+        make_thumbnail(jpeg(800, 1000))
+
+# Test the thumbnail is uploaded next to the receipt with long-lived caching
+def test_create_thumbnail():
+    s3 = MagicMock()
+    s3.get_object.return_value = {'Body': io.BytesIO(jpeg(800, 1000))}
+
+    key = create_thumbnail(s3, 'bucket', 'receipts/abc.jpg', 'abc')
+
+    assert key == 'thumbs/abc.webp'
+    s3.get_object.assert_called_once_with(Bucket='bucket', Key='receipts/abc.jpg')
+    kwargs = s3.put_object.call_args.kwargs
+    assert kwargs['Key'] == 'thumbs/abc.webp'
+    assert kwargs['ContentType'] == 'image/webp'
+    assert 'immutable' in kwargs['CacheControl']
@@ -0,0 +1,117 @@
+import datetime
+import pytest
+from unittest.mock import patch, MagicMock
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from url_signing import PresignedUrlCache, S3Presigner, bucket_region, credentials_expiry
+
+SIGNING_TIME = datetime.datetime(2024, 9, 1, 12, 0, 0)
+
+
+# Test URLs match the ones botocore's SigV4 presigner produces
+def test_presign_matches_botocore():
+    session = boto3.session.Session(
+        aws_access_key_id='AKIDEXAMPLE',
+        aws_secret_access_key='SECRET/KEY',
+        aws_session_token='session+token/=',
+        region_name='ap-southeast-2'
+    )
+    s3 = session.client('s3', config=Config(signature_version='s3v4', s3={'addressing_style': 'virtual'}))
+
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def utcnow(cls):
+            return SIGNING_TIME
+
+    with patch('botocore.auth.datetime.datetime', FrozenDatetime):
+        expected = s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': 'my-receipt-manager-bucket', 'Key': 'receipts/a b+c.jpg'},
+            ExpiresIn=3600
+        )
+
+    presigner = S3Presigner(session.get_credentials, 'my-receipt-manager-bucket', 'ap-southeast-2')
+    url = presigner.presign('receipts/a b+c.jpg', 3600, now=SIGNING_TIME.replace(tzinfo=datetime.timezone.utc))
+
+    assert url.split('X-Amz-Signature=')[1] == expected.split('X-Amz-Signature=')[1]
+
+# Test the signing key is derived once per day
+def test_presign_many_reuses_signing_key():
+    credentials = MagicMock()
+    credentials.get_frozen_credentials.return_value = MagicMock(access_key='AK', secret_key='SK', token=None)
+    presigner = S3Presigner(lambda: credentials, 'bucket', 'ap-southeast-2')
+
+    with patch('url_signing._hmac_sha256', wraps=__import__('url_signing')._hmac_sha256) as mock_hmac:
+        urls = presigner.presign_many(['a.jpg', 'b.jpg'], now=SIGNING_TIME)
+        presigner.presign_many(['c.jpg'], now=SIGNING_TIME)
+
+    assert mock_hmac.call_count == 4
+    assert set(urls) == {'a.jpg', 'b.jpg'}
+    assert 'X-Amz-Security-Token' not in urls['a.jpg']
+
+# Test URLs close to expiry are reissued
+def test_cache_refreshes_near_expiry():
+    cache = PresignedUrlCache(expires_in=3600, refresh_margin=300)
+    sign = MagicMock(side_effect=['url-1', 'url-2'])
+
+    with patch('url_signing.time.time', return_value=1000):
+        assert cache.get('key', sign) == 'url-1'
+    with patch('url_signing.time.time', return_value=1000 + 3200):
+        assert cache.get('key', sign) == 'url-1'
+    with patch('url_signing.time.time', return_value=1000 + 3400):
+        assert cache.get('key', sign) == 'url-2'
+
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+# Test the cache is bounded and evicts least recently used URLs
+def test_cache_lru_eviction():
+    cache = PresignedUrlCache(max_entries=2)
+    sign_many = lambda keys: {key: f"url-{key}" for key in keys}
+
+    cache.get_many(['a', 'b'], sign_many)
+    cache.get_many(['a'], sign_many)
+    cache.get_many(['c'], sign_many)
+
+    stats = cache.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+    assert cache.get_many(['a'], MagicMock()) == {'a': 'url-a'}
+
+# Test the signing region is the bucket's location, looked up once, with the configured region only as a fallback
+@patch.dict('url_signing._bucket_regions', clear=True)
+def test_bucket_region():
+    s3 = MagicMock()
+    s3.get_bucket_location.return_value = {'LocationConstraint': 'eu-west-1'}
+    assert bucket_region(s3, 'bucket', 'ap-southeast-2') == 'eu-west-1'
+    assert bucket_region(s3, 'bucket', 'ap-southeast-2') == 'eu-west-1'
+    s3.get_bucket_location.assert_called_once_with(Bucket='bucket')
+
+    s3.get_bucket_location.return_value = {'LocationConstraint': None}
+    assert bucket_region(s3, 'us-bucket') == 'us-east-1'
+
+    s3.get_bucket_location.side_effect = ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetBucketLocation')
+    assert bucket_region(s3, 'other-bucket', 'ap-southeast-2') == 'ap-southeast-2'
+    with pytest.raises(ValueError):
+        bucket_region(s3, 'another-bucket')
+    with pytest.raises(ValueError):
+        S3Presigner(lambda: None, 'bucket', None)
+
+# Test cached URLs expire with the temporary credentials that signed them
+def test_cache_capped_at_credentials_expiry():
+    cache = PresignedUrlCache(expires_in=3600, refresh_margin=300)
+    sign_many = MagicMock(side_effect=[{'key': 'url-1'}, {'key': 'url-2'}])
+
+    with patch('url_signing.time.time', return_value=1000):
+        assert cache.get_many(['key'], sign_many, lambda: 1000 + 900) == {'key': 'url-1'}
+    with patch('url_signing.time.time', return_value=1000 + 500):
+        assert cache.get_many(['key'], sign_many, lambda: None) == {'key': 'url-1'}
+    with patch('url_signing.time.time', return_value=1000 + 700):
+        assert cache.get_many(['key'], sign_many, lambda: None) == {'key': 'url-2'}
+
+    refreshable = MagicMock(_expiry_time=datetime.datetime(2024, 9, 1, 13, 0, tzinfo=datetime.timezone.utc))
+    assert credentials_expiry(refreshable) == refreshable._expiry_time.timestamp()
+    refreshable.get_frozen_credentials.assert_called_once()
+    assert credentials_expiry(MagicMock(_expiry_time=None)) is None
+    assert credentials_expiry(None) is None
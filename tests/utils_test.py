@@ -1,6 +1,9 @@
+import json
 import pytest
+from datetime import date
 from unittest.mock import patch, MagicMock, mock_open
 import utils
+from receipt_fields import relative_range
 
 
 # Fixture to set environment variables before tests
@@ -19,6 +22,16 @@ def set_env_vars(monkeypatch):
     }):
         yield
 
+def log_events(output):
+    # Every JSON log line printed by utils' logger
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+
+# Fixture to start every test with an empty presigned URL cache
+@pytest.fixture(autouse=True)
+def clear_url_cache():
+    utils.url_cache.clear()
+    yield
+
 # Test for upload_to_s3
 @patch('utils.s3.upload_fileobj')
 def test_upload_to_s3(mock_upload_fileobj):
@@ -91,8 +104,9 @@ def test_extract_keywords_with_openai(mock_chat_completion, capsys):
     expected_keywords = ["starbucks", "march"]
     assert keywords == expected_keywords
 
-    captured = capsys.readouterr()
-    assert "OpenAI Raw Response: [\"starbucks\", \"march\"]" in captured.out
+    events = log_events(capsys.readouterr().out)
+    assert events[0]['event'] == 'openai_response'
+    assert events[0]['raw_response'] == '["starbucks", "march"]'
 
 # Test for extract_keywords_with_openai with invalid JSON
 @patch('utils.openai.ChatCompletion.create')
@@ -118,9 +132,10 @@ def test_extract_keywords_with_openai_invalid_json(mock_chat_completion, capsys)
     mock_chat_completion.assert_called_once()
     assert keywords == []
 
-    captured = capsys.readouterr()
-    assert "Error: OpenAI response is not a valid JSON. Check the response format." in captured.out
-    assert "Response Content: starbucks, march" in captured.out
+    warning = log_events(capsys.readouterr().out)[-1]
+    assert warning['level'] == 'WARNING'
+    assert warning['message'] == "Error: OpenAI response is not a valid JSON. Check the response format."
+    assert warning['raw_response'] == "starbucks, march"
 
 # Test for extract_keywords_with_openai with API exception
 @patch('utils.openai.ChatCompletion.create', side_effect=Exception('API error'))
@@ -223,3 +238,274 @@ def test_query_receipts_no_items(mock_scan):
     assert mock_scan.call_count == 1
     assert receipts == []
 
+
+# Test for query_receipts_by_keywords following LastEvaluatedKey
+@patch('utils.table.scan')
+def test_query_receipts_by_keywords_paginated(mock_scan):
+    mock_scan.side_effect = [
+        {'Items': [{'receipt_id': '1'}], 'LastEvaluatedKey': {'receipt_id': '1'}},
+        {'Items': [{'receipt_id': '2'}]},
+    ]
+
+    # Call the function
+    items = utils.query_receipts_by_keywords(['starbucks'])
+
+    # Assertions
+    assert mock_scan.call_count == 2
+    assert mock_scan.call_args.kwargs['ExclusiveStartKey'] == {'receipt_id': '1'}
+    assert items == [{'receipt_id': '1'}, {'receipt_id': '2'}]
+
+# Test get_receipt_image_url reuses cached URLs
+@patch('utils.s3.generate_presigned_url')
+def test_get_receipt_image_url_cached(mock_generate_presigned_url):
+    mock_generate_presigned_url.return_value = 'https://fake_presigned_url.com'
+
+    # Call the function twice
+    first = utils.get_receipt_image_url('12345')
+    second = utils.get_receipt_image_url('12345')
+
+    # Assertions
+    mock_generate_presigned_url.assert_called_once()
+    assert first == second
+    assert utils.url_cache.stats()['hit_rate'] == 0.5
+
+# Test attach_image_urls signs all uncached receipts in one batch
+@patch('utils.presigner.presign_many')
+def test_attach_image_urls(mock_presign_many):
+    mock_presign_many.side_effect = lambda keys, expires_in: {key: f"https://signed/{key}" for key in keys}
+    receipts = [{'receipt_id': '1'}, {'receipt_id': '2'}, {'raw_text': 'no id'}]
+
+    # Call the function
+    utils.attach_image_urls(receipts)
+    utils.attach_image_urls([{'receipt_id': '1'}])
+
+    # Assertions
+    mock_presign_many.assert_called_once_with(['receipts/1.jpg', 'receipts/2.jpg'], utils.PRESIGNED_URL_EXPIRY)
+    assert receipts[0]['image_url'] == 'https://signed/receipts/1.jpg'
+    assert receipts[1]['image_url'] == 'https://signed/receipts/2.jpg'
+    assert receipts[2]['image_url'] is None
+
+# Test cursor tokens round-trip and reject tampering
+def test_cursor_round_trip():
+    cursor = utils.encode_cursor({'receipt_id': 'abc'})
+
+    assert utils.decode_cursor(cursor) == {'receipt_id': 'abc'}
+    assert utils.encode_cursor(None) is None
+    with pytest.raises(ValueError):
+        utils.decode_cursor(utils.encode_cursor({'receipt_id': 'abc', 'extra': 1}))
+    with pytest.raises(ValueError):
+        utils.decode_cursor('%%%')
+
+# Test query_receipts_page returns the next cursor
+@patch('utils.table.scan')
+def test_query_receipts_page(mock_scan):
+    mock_scan.return_value = {'Items': [{'receipt_id': '1'}], 'LastEvaluatedKey': {'receipt_id': '1'}}
+
+    # Call the function
+    receipts, next_cursor = utils.query_receipts_page(1)
+
+    # Assertions
+    mock_scan.assert_called_once_with(Limit=1)
+    assert receipts == [{'receipt_id': '1'}]
+    assert utils.decode_cursor(next_cursor) == {'receipt_id': '1'}
+
+# Test extract_keywords answers simple queries without calling OpenAI
+@patch('utils.openai.ChatCompletion.create')
+def test_extract_keywords_local(mock_chat_completion):
+    # Call the function
+    keywords = utils.extract_keywords("Woolworths milk")
+
+    # Assertions
+    mock_chat_completion.assert_not_called()
+    assert keywords == ['woolworths', 'milk']
+
+# Test merchant + month searches run key-condition queries on the merchant GSI, following pages
+@patch('utils.table.query')
+def test_search_receipts_structured(mock_query):
+    mock_query.side_effect = [
+        {'Items': [{'receipt_id': '2'}], 'LastEvaluatedKey': {'receipt_id': '2'}},
+        {'Items': [{'receipt_id': '1'}]},
+    ]
+    plan = utils.receipt_fields.QueryPlan('starbucks', [('2024-09-01', '2024-09-30')], ['latte'])
+
+    with patch('utils.receipt_fields.plan_query', return_value=plan):
+        result = utils.search_receipts(['starbucks', 'september', 'latte'])
+
+    assert result == [{'receipt_id': '2'}, {'receipt_id': '1'}]
+    first_call = mock_query.call_args_list[0].kwargs
+    assert first_call['IndexName'] == 'merchant-date-index'
+    assert first_call['FilterExpression'] is not None
+    assert mock_query.call_args_list[1].kwargs['ExclusiveStartKey'] == {'receipt_id': '2'}
+
+# Test merchant-only and empty GSI results are merged with the SEARCH_BACKEND results, without duplicates
+@patch('utils.search_receipts_by_backend', return_value=[{'receipt_id': '1'}, {'receipt_id': 'undated'}])
+@patch('utils.query_receipts_by_fields', return_value=[{'receipt_id': '1'}])
+def test_search_receipts_structured_fallback(mock_query_by_fields, mock_backend):
+    merchant_only = utils.receipt_fields.QueryPlan('starbucks', [], [])
+    with patch('utils.receipt_fields.plan_query', return_value=merchant_only):
+        assert utils.search_receipts(['starbucks']) == [{'receipt_id': '1'}, {'receipt_id': 'undated'}]
+    mock_backend.assert_called_once_with(['starbucks'])
+
+    dated = utils.receipt_fields.QueryPlan('starbucks', [('2024-09-01', '2024-09-30')], [])
+    with patch('utils.receipt_fields.plan_query', return_value=dated):
+        assert utils.search_receipts(['starbucks', 'september']) == [{'receipt_id': '1'}]
+        mock_query_by_fields.return_value = []
+        assert utils.search_receipts(['starbucks', 'september']) == [{'receipt_id': '1'}, {'receipt_id': 'undated'}]
+    assert mock_backend.call_count == 2
+
+# Test a date-only plan queries the month GSI once per month
+@patch('utils.table.query', return_value={'Items': []})
+def test_query_receipts_by_fields_months(mock_query):
+    plan = utils.receipt_fields.QueryPlan(None, [('2024-01-01', '2024-03-31')], [])
+
+    utils.query_receipts_by_fields(plan)
+
+    assert mock_query.call_count == 3
+    assert all(call.kwargs['IndexName'] == 'month-date-index' for call in mock_query.call_args_list)
+    assert 'FilterExpression' not in mock_query.call_args.kwargs
+
+# Test thumbnails are signed in the same batch and receipts without one fall back to the original
+@patch('utils.presigner.presign_many')
+def test_attach_image_urls_thumbnails(mock_presign_many):
+    mock_presign_many.side_effect = lambda keys, expires_in: {key: f"https://signed/{key}" for key in keys}
+    receipts = [{'receipt_id': '1', 'thumbnail_key': 'thumbs/1.webp'}, {'receipt_id': '2'}]
+
+    utils.attach_image_urls(receipts)
+
+    mock_presign_many.assert_called_once_with(
+        ['receipts/1.jpg', 'receipts/2.jpg', 'thumbs/1.webp'], utils.PRESIGNED_URL_EXPIRY)
+    assert receipts[0]['thumb_url'] == 'https://signed/thumbs/1.webp'
+    assert receipts[0]['image_url'] == 'https://signed/receipts/1.jpg'
+    assert receipts[1]['thumb_url'] == 'https://signed/receipts/2.jpg'
+
+# Test the lazy module attributes are the memoized clients the functions use
+def test_lazy_clients_are_memoized():
+    assert utils.s3 is utils.get_s3()
+    assert utils.table is utils.get_table()
+    assert utils.get_table().name == utils.TABLE_NAME
+    assert utils.get_keyword_index_table().meta.client is utils.get_dynamodb().meta.client
+
+# Test the bm25 backend answers from the in-memory index, and uses the keyword index until it is built
+@patch('utils.query_receipts_by_index', return_value=[{'receipt_id': 'r1'}])
+def test_search_receipts_bm25(mock_query_by_index):
+    with patch.object(utils, 'SEARCH_BACKEND', 'bm25'), patch.object(utils, 'STRUCTURED_SEARCH', False):
+        with patch.object(utils.text_index, 'search', return_value=None):
+            assert utils.search_receipts(['milk']) == [{'receipt_id': 'r1'}]
+        with patch.object(utils.text_index, 'search', return_value=[{'receipt_id': 'r2'}]):
+            assert utils.search_receipts(['milk']) == [{'receipt_id': 'r2'}]
+
+    mock_query_by_index.assert_called_once_with(['milk'])
+
+# Test the vector backend fetches the ranked receipts in rank order, and uses the keyword index until it is built
+@patch('utils.query_receipts_by_index', return_value=[{'receipt_id': 'r1'}])
+@patch('utils.keyword_index.batch_get_receipts', return_value=[{'receipt_id': 'a'}, {'receipt_id': 'b'}])
+def test_search_receipts_vector(mock_batch_get, mock_query_by_index):
+    vector_search = MagicMock()
+    with patch.object(utils, 'SEARCH_BACKEND', 'vector'), patch.object(utils, 'STRUCTURED_SEARCH', False), \
+            patch('utils.get_vector_search', return_value=vector_search), patch('utils.get_dynamodb'):
+        vector_search.search.return_value = None
+        assert utils.search_receipts(['milk']) == [{'receipt_id': 'r1'}]
+
+        vector_search.search.return_value = [('b', 0.9), ('a', 0.4)]
+        assert utils.search_receipts(['milk', 'bread']) == [{'receipt_id': 'b'}, {'receipt_id': 'a'}]
+
+    vector_search.search.assert_called_with('milk bread')
+    assert mock_batch_get.call_args.args[2] == ['b', 'a']
+    mock_query_by_index.assert_called_once_with(['milk'])
+
+# Test /list pages and keyword scans come from the receipt cache when it is fresh, from DynamoDB otherwise
+@patch('utils.get_table')
+def test_receipt_cache_reads(mock_get_table):
+    cache = MagicMock()
+    cache.page.return_value = ([{'receipt_id': 'a'}], {'receipt_id': 'a'})
+    cache.matching.return_value = [{'receipt_id': 'b'}]
+    with patch('utils.get_receipt_cache', return_value=cache):
+        receipts, cursor = utils.query_receipts_page(1)
+        assert receipts == [{'receipt_id': 'a'}]
+        assert utils.decode_cursor(cursor) == {'receipt_id': 'a'}
+        assert utils.query_receipts_by_keywords(['milk']) == [{'receipt_id': 'b'}]
+
+        cache.page.return_value = None
+        mock_get_table.return_value.scan.return_value = {'Items': [{'receipt_id': 'c'}]}
+        assert utils.query_receipts_page(1) == ([{'receipt_id': 'c'}], None)
+
+    mock_get_table.return_value.scan.assert_called_once_with(Limit=1)
+
+# Test the compact layout scans the hot projection and checks candidates' texts
+@patch('utils.receipt_storage.COMPACT_STORAGE', True)
+@patch('utils.get_receipt_texts', return_value={'a': 'coles\nmilk $2.00'})
+@patch('utils.iter_scan_pages')
+def test_query_receipts_by_keywords_compact(mock_scan, mock_texts):
+    mock_scan.return_value = [[
+        utils.receipt_storage.hot_item({'receipt_id': 'a', 'raw_text': 'coles\nmilk $2.00'}),
+        utils.receipt_storage.hot_item({'receipt_id': 'b', 'raw_text': 'coles\nbread $3.00'}),
+    ]]
+
+    assert [item['receipt_id'] for item in utils.query_receipts_by_keywords(['milk'])] == ['a']
+    assert 'FilterExpression' not in mock_scan.call_args.kwargs
+    assert 'raw_text' in mock_scan.call_args.kwargs['ProjectionExpression']
+    mock_texts.assert_called_once_with(['a'])
+
+# Test the detail text comes from the item when inline, and from ReceiptTexts when compact
+@patch('utils.get_receipt_texts', return_value={'b': 'coles'})
+@patch('utils.table.get_item')
+def test_get_receipt_text(mock_get_item, mock_texts):
+    mock_get_item.return_value = {'Item': {'receipt_id': 'a', 'raw_text': 'starbucks'}}
+    assert utils.get_receipt_text('a') == 'starbucks'
+
+    mock_get_item.return_value = {'Item': {'receipt_id': 'b', 'preview': 'co'}}
+    assert utils.get_receipt_text('b') == 'coles'
+
+    mock_get_item.return_value = {}
+    assert utils.get_receipt_text('c') is None
+
+# Test a stats question is read into a merchant and the most recent matching month
+@patch('utils.MERCHANTS', ['starbucks'])
+@patch('utils.receipt_stats.summarize', return_value={'spend': 9.5, 'receipts': 1, 'groups': []})
+def test_query_stats(mock_summarize):
+    stats = utils.query_stats('How much did I spend at Starbucks in September?')
+
+    table, ranges, merchant, group = mock_summarize.call_args.args
+    assert merchant == 'starbucks' and group == 'month'
+    assert len(ranges) == 1 and ranges[0][0].endswith('-09-01') and ranges[0][1].endswith('-09-30')
+    assert stats['spend'] == 9.5 and stats['merchant'] == 'starbucks'
+
+    utils.query_stats(merchant='Coles', first='2024-01', last='2024-03', group='merchant')
+    assert mock_summarize.call_args.args[1:] == ([('2024-01-01', '2024-03-31')], 'coles', 'merchant')
+
+# Test natural phrasings with relative dates are read instead of rejected
+@patch('utils.MERCHANTS', ['starbucks'])
+@patch('utils.receipt_stats.summarize', return_value={'spend': 9.5, 'receipts': 1, 'groups': []})
+def test_query_stats_relative_dates(mock_summarize):
+    today = date.today()
+
+    stats = utils.query_stats('How much have I spent this year?')
+    assert mock_summarize.call_args.args[1:3] == ([(f"{today.year}-01-01", f"{today.year}-12-31")], None)
+    assert stats['ranges'] == [{'from': f"{today.year}-01-01", 'to': f"{today.year}-12-31"}]
+
+    utils.query_stats('How much have I spent at Starbucks last month?')
+    assert mock_summarize.call_args.args[1:3] == ([relative_range('month', 1, today)], 'starbucks')
+
+# Test a word that is neither a known merchant nor a date is rejected instead of widening to every merchant
+@patch('utils.MERCHANTS', ['starbucks'])
+@patch('utils.receipt_stats.summarize')
+def test_query_stats_unmatched(mock_summarize):
+    with pytest.raises(ValueError, match='aldi'):
+        utils.query_stats('How much did I spend at Aldi in September?')
+    with pytest.raises(ValueError, match='latte'):
+        utils.query_stats('starbucks latte 2024')
+    mock_summarize.assert_not_called()
+
+# Test the index backend scans until the index is backfilled, rechecking at most once per interval
+@patch('utils.query_receipts_by_keywords', return_value=[{'receipt_id': 'scanned'}])
+@patch('utils.keyword_index.search', return_value=[{'receipt_id': 'indexed'}])
+@patch('utils.keyword_index.is_backfilled', return_value=False)
+def test_query_receipts_by_index_before_backfill(mock_backfilled, mock_search, mock_scan):
+    with patch.dict(utils.index_backfill, {'done': False, 'checked_at': None}):
+        assert utils.query_receipts_by_index(['coffee']) == [{'receipt_id': 'scanned'}]
+        assert utils.query_receipts_by_index(['coffee']) == [{'receipt_id': 'scanned'}]
+        assert mock_backfilled.call_count == 1
+
+        utils.index_backfill['checked_at'] -= utils.INDEX_BACKFILL_CHECK_INTERVAL
+        mock_backfilled.return_value = True
+        assert utils.query_receipts_by_index(['coffee']) == [{'receipt_id': 'indexed'}]
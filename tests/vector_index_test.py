@@ -0,0 +1,111 @@
+import numpy as np
+from unittest.mock import MagicMock, patch
+from embeddings import HashingEmbedder, embed_item
+from vector_index import FlatIndex, IVFIndex, VectorIndex, VectorSearch, build_base, load, save
+
+
+def unit_vectors(count, dimensions=16, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+# Test flat search returns the k most similar rows, best first
+def test_flat_index_top_k():
+    vectors = unit_vectors(100)
+    rows, scores = FlatIndex(vectors).search(vectors[7], 3)
+
+    assert rows[0] == 7
+    assert np.isclose(scores[0], 1.0)
+    assert list(scores) == sorted(scores, reverse=True)
+    assert list(rows) == list(np.argsort(-(vectors @ vectors[7]))[:3])
+
+# Test IVF search probing every cluster finds exactly what flat search finds
+def test_ivf_index_matches_flat_with_all_probes():
+    vectors = unit_vectors(500)
+    order, centroids, offsets = IVFIndex.train(vectors, clusters=10)
+    ivf = IVFIndex(vectors[order], centroids, offsets, probes=10)
+
+    rows, _ = ivf.search(vectors[3], 5)
+    expected, _ = FlatIndex(vectors).search(vectors[3], 5)
+
+    assert list(order[rows]) == list(expected)
+    assert offsets[-1] == len(vectors)
+
+# Test delta vectors replace base rows and new receipts are found
+def test_vector_index_delta_replaces_base():
+    vectors = unit_vectors(4)
+    index = VectorIndex(['a', 'b', 'c', 'd'], FlatIndex(vectors), 16)
+
+    index.add('a', vectors[1])
+    index.add('e', vectors[2])
+
+    assert len(index) == 5
+    results = dict(index.search(vectors[1], 5))
+    assert np.isclose(results['a'], 1.0)
+    assert np.isclose(results['e'], float(vectors[2] @ vectors[1]))
+    assert [receipt_id for receipt_id, _ in index.search(vectors[0], 5)].count('a') == 1
+
+# Test saved bases load back memory-mapped, with their metadata
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'vectors')
+    vectors = unit_vectors(10)
+    save(path, [str(i) for i in range(10)], vectors, {'model': 'hashing-16'})
+
+    matrix, meta = load(path)
+
+    assert isinstance(matrix, np.memmap)
+    assert np.array_equal(matrix, vectors)
+    assert meta['ids'][3] == '3' and meta['model'] == 'hashing-16'
+    assert load(str(tmp_path / 'missing')) is None
+
+# Test large corpora get an IVF base whose layout can be saved
+def test_build_base_switches_to_ivf():
+    vectors = unit_vectors(200)
+    ids, _, base, layout = build_base([str(i) for i in range(200)], vectors, ivf_min_vectors=100)
+
+    assert isinstance(base, IVFIndex)
+    assert sorted(ids) == sorted(str(i) for i in range(200))
+    assert len(layout['offsets']) == len(layout['centroids']) + 1
+
+def make_search(items, **kwargs):
+    table = MagicMock()
+    table.scan.return_value = {'Items': items}
+    return VectorSearch(lambda: table, embedder=HashingEmbedder(), total_segments=1, **kwargs)
+
+def embedded_receipts(embedder):
+    return [
+        embed_item({'receipt_id': 'r1', 'merchant': 'starbucks', 'receipt_month': '2024-09',
+                    'raw_text': 'starbucks\nlatte $5.50', 'ingested_at': 1000}, embedder),
+        embed_item({'receipt_id': 'r2', 'merchant': 'bunnings', 'receipt_month': '2024-03',
+                    'raw_text': 'bunnings\ndrill $99.00', 'ingested_at': 1000}, embedder),
+        # Embedded by another model: not comparable, so not indexed
+        {'receipt_id': 'r3', 'raw_text': 'coles', 'embedding': b'\0' * 16, 'embedding_model': 'other'},
+    ]
+
+# Test the index is built from the table's embeddings and ranks the matching receipt first
+def test_vector_search_build_and_search():
+    search = make_search(embedded_receipts(HashingEmbedder()))
+    search.build()
+
+    assert len(search.index) == 2
+    assert search.search('starbucks september')[0][0] == 'r1'
+    assert search.search('bunnings drill')[0][0] == 'r2'
+    assert search.search('nothing matches this', min_score=0.5) == []
+
+# Test a saved base is loaded instead of scanning the table again
+def test_vector_search_loads_saved_base(tmp_path):
+    path = str(tmp_path / 'vectors')
+    make_search(embedded_receipts(HashingEmbedder()), path=path).build()
+
+    search = make_search([], path=path)
+    search.build()
+
+    assert len(search.index) == 2
+    assert search.search('starbucks latte')[0][0] == 'r1'
+
+# Test the first search starts a background build and falls back until it is ready
+def test_vector_search_before_build():
+    search = make_search([])
+
+    with patch('search_engine.threading.Thread') as mock_thread:
+        assert search.search('starbucks') is None
+    mock_thread.return_value.start.assert_called_once()
@@ -0,0 +1,116 @@
+"""
+Single-pass parser for Textract responses.
+
+parse_blocks walks the Block list once and joins the LINE texts a single
+time, then derives the lowercased raw text, the distinct search tokens and
+the offset of every line from that one joined string. Logging helpers
+summarize responses instead of serializing them, and only dump (a bounded
+slice of) the payload when DEBUG logging is enabled.
+"""
+import json
+import logging
+from itertools import accumulate
+
+from textract_modes import response_blocks
+from tokenizer import MIN_TOKEN_LENGTH, TOKEN_PATTERN
+
+# Largest number of blocks dumped by log_textract_response at DEBUG level
+LOG_MAX_BLOCKS = 50
+# Largest number of characters of raw text logged at DEBUG level
+LOG_MAX_CHARS = 2000
+
+
+class ParsedText:
+    """
+    Result of parse_blocks.
+
+    Attributes:
+        raw_text (str): Lowercased LINE texts joined by newlines.
+        tokens (list): Distinct tokens in order of first appearance.
+        line_offsets (list): Start offset of each line within raw_text, leaving out blank
+            lines that strip() removed from its start and end.
+    """
+
+    __slots__ = ('raw_text', 'tokens', 'line_offsets')
+
+    def __init__(self, raw_text, tokens, line_offsets):
+        self.raw_text = raw_text
+        self.tokens = tokens
+        self.line_offsets = line_offsets
+
+    def lines(self):
+        """
+        Split raw_text back into lines using the recorded offsets.
+        """
+        ends = self.line_offsets[1:] + [len(self.raw_text) + 1]
+        return [self.raw_text[start:end - 1] for start, end in zip(self.line_offsets, ends)]
+
+
+def parse_blocks(blocks):
+    """
+    Parse Textract blocks in one pass.
+
+    Args:
+        blocks (iterable): Textract Block dicts; only LINE blocks are used.
+
+    Returns:
+        ParsedText: Raw text, tokens and line offsets.
+    """
+    # The only Python-level loop is this pass over the blocks; lowercasing, tokenizing
+    # and offset computation then run once over the joined text in C.
+    lines = [block['Text'] for block in blocks if block['BlockType'] == 'LINE']
+    raw_text = '\n'.join(lines).lower()
+
+    # lower() can change the length of some non-ASCII characters, lowercase per line then
+    if len(raw_text) != sum(map(len, lines)) + max(len(lines) - 1, 0):
+        lines = [line.lower() for line in lines]
+        raw_text = '\n'.join(lines)
+    line_offsets = [0] + list(accumulate(len(line) + 1 for line in lines[:-1])) if lines else []
+
+    tokens = list(dict.fromkeys(token for token in TOKEN_PATTERN.findall(raw_text)
+                                if len(token) >= MIN_TOKEN_LENGTH))
+
+    # Match the historical strip() of the joined text. Lines left entirely in the stripped
+    # prefix or suffix are gone; the others shift by the prefix, the first one to offset 0.
+    stripped = raw_text.strip()
+    if len(stripped) != len(raw_text):
+        leading = len(raw_text) - len(raw_text.lstrip())
+        end = leading + len(stripped)
+        line_offsets = [max(0, start - leading) for start, line in zip(line_offsets, lines)
+                        if start + len(line) > leading and start < end]
+        raw_text = stripped
+
+    return ParsedText(raw_text, tokens, line_offsets)
+
+
+def parse_response(textract_response):
+    """
+    Parse any supported Textract response (detect_document_text, analyze_document, analyze_expense).
+    """
+    return parse_blocks(response_blocks(textract_response))
+
+
+def log_textract_response(logger, textract_response):
+    """
+    Log a Textract response without serializing the whole payload.
+
+    INFO logs a one-line summary. DEBUG also dumps up to LOG_MAX_BLOCKS blocks.
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    blocks = response_blocks(textract_response)
+    line_count = sum(1 for block in blocks if block['BlockType'] == 'LINE')
+    logger.info("Textract response received: %d blocks, %d lines", len(blocks), line_count)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Textract blocks (first %d of %d): %s",
+                     min(len(blocks), LOG_MAX_BLOCKS), len(blocks), json.dumps(blocks[:LOG_MAX_BLOCKS]))
+
+
+def log_raw_text(logger, receipt_id, raw_text):
+    """
+    Log the extracted text length, and a bounded prefix of the text at DEBUG level.
+    """
+    logger.info("Extracted %d characters of raw text for %s", len(raw_text), receipt_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Raw text for %s: %s", receipt_id, raw_text[:LOG_MAX_CHARS])
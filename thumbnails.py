@@ -0,0 +1,155 @@
+"""
+Receipt thumbnails for the list and search result pages.
+
+The ingest Lambda stores a small WebP preview next to every receipt image:
+
+    receipts/{id}.jpg   original, linked from the preview
+    thumbs/{id}.webp    THUMBNAIL_WIDTH px wide, shown inline
+
+and records its key as `thumbnail_key` on the receipt item. Pillow is
+optional: without it thumbnails are skipped and pages fall back to the
+original image.
+"""
+import argparse
+import io
+import os
+
+import boto3
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+# Pages show previews 200px wide; twice that keeps them sharp on high-DPI screens
+THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', '400'))
+# Very long receipts are cropped in the preview rather than downloaded at full length
+THUMBNAIL_MAX_HEIGHT = int(os.getenv('THUMBNAIL_MAX_HEIGHT', '1600'))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '70'))
+# Thumbnails never change once written
+THUMBNAIL_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def thumbnail_key(receipt_id):
+    """
+    Get the S3 key of a receipt's thumbnail.
+    """
+    return f"thumbs/{receipt_id}.webp"
+
+
+def make_thumbnail(data, width=THUMBNAIL_WIDTH, max_height=THUMBNAIL_MAX_HEIGHT, quality=THUMBNAIL_QUALITY):
+    """
+    Render a WebP thumbnail of an image.
+
+    Args:
+        data (bytes): The receipt image.
+        width (int): Maximum thumbnail width.
+        max_height (int): Maximum thumbnail height, the top of longer receipts is kept.
+        quality (int): WebP quality.
+
+    Returns:
+        bytes: The WebP thumbnail.
+
+    Raises:
+        RuntimeError: If Pillow is not installed.
+        ValueError: If the data is not a readable image.
+    """
+    if not PILLOW_AVAILABLE:
+        raise RuntimeError("Pillow is required to generate thumbnails.")
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Let the JPEG decoder downscale by up to 8x while decoding, far cheaper than a full decode
+        image.draft(image.mode, (width, width))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('L' if image.mode in ('L', '1', 'I;16') else 'RGB')
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+    if image.width > width:
+        image = image.resize((width, max(1, image.height * width // image.width)), Image.LANCZOS)
+    if image.height > max_height:
+        image = image.crop((0, 0, image.width, max_height))
+
+    output = io.BytesIO()
+    image.save(output, format='WEBP', quality=quality, method=4)
+    return output.getvalue()
+
+
+def create_thumbnail(s3, bucket_name, object_key, receipt_id):
+    """
+    Download a receipt image, and upload its thumbnail next to it.
+
+    Args:
+        s3: An S3 client.
+        bucket_name (str): Bucket holding the image.
+        object_key (str): Key of the image.
+        receipt_id (str): Receipt ID, used for the thumbnail key.
+
+    Returns:
+        str: The thumbnail's S3 key.
+    """
+    data = s3.get_object(Bucket=bucket_name, Key=object_key)['Body'].read()
+    key = thumbnail_key(receipt_id)
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=make_thumbnail(data),
+        ContentType='image/webp',
+        CacheControl=THUMBNAIL_CACHE_CONTROL
+    )
+    return key
+
+
+def backfill(table, s3, bucket_name):
+    """
+    Create thumbnails for receipts stored before thumbnails were generated.
+
+    Args:
+        table: The DynamoDB Receipts table.
+        s3: An S3 client.
+        bucket_name (str): Bucket holding the receipt images.
+
+    Returns:
+        int: Number of thumbnails created.
+    """
+    from parallel_scan import iter_scan_pages
+
+    created = 0
+    for page in iter_scan_pages(table, ProjectionExpression='receipt_id, thumbnail_key'):
+        for item in page:
+            if 'thumbnail_key' in item:
+                continue
+            receipt_id = item['receipt_id']
+            try:
+                key = create_thumbnail(s3, bucket_name, f"receipts/{receipt_id}.jpg", receipt_id)
+            except Exception as e:
+                print(f"Skipping thumbnail for {receipt_id}: {e}")
+                continue
+            table.update_item(
+                Key={'receipt_id': receipt_id},
+                UpdateExpression='SET thumbnail_key = :key',
+                ExpressionAttributeValues={':key': key}
+            )
+            created += 1
+    return created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage receipt thumbnails.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill_parser = subparsers.add_parser('backfill', help="Create thumbnails for receipts without one.")
+    backfill_parser.add_argument('--table', default=os.getenv('DYNAMODB_TABLE', 'Receipts'))
+    backfill_parser.add_argument('--bucket', default=os.getenv('S3_BUCKET_NAME', 'my-receipt-manager-bucket'))
+    backfill_parser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+
+    args = parser.parse_args(argv)
+    dynamodb = boto3.resource('dynamodb', region_name=args.region)
+    s3 = boto3.client('s3', region_name=args.region)
+    count = backfill(dynamodb.Table(args.table), s3, args.bucket)
+    print(f"Created {count} thumbnails.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import re
+
+# Tokens are runs of letters/digits, optionally joined by a single ".", "'", "&" or "-"
+# so that prices ("4.50"), dates ("12-09-2024") and names ("mcdonald's") stay whole.
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.'&-][a-z0-9]+)*")
+
+# Tokens shorter than this carry almost no signal and would create huge posting lists
+MIN_TOKEN_LENGTH = 2
+
+
+def tokenize(text):
+    """
+    Split text into lowercase search tokens, in order of appearance.
+
+    Args:
+        text (str): Raw text from a receipt or a search keyword.
+
+    Returns:
+        list: The tokens found in the text (duplicates kept).
+    """
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def unique_tokens(text):
+    """
+    Return the distinct tokens of a text, preserving first-seen order.
+
+    Args:
+        text (str): Raw text to tokenize.
+
+    Returns:
+        list: Distinct tokens.
+    """
+    return list(dict.fromkeys(tokenize(text)))
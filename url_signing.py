@@ -0,0 +1,317 @@
+"""
+Presigned S3 URL generation for receipt images.
+
+S3Presigner signs GET URLs with SigV4 query authentication directly. It
+derives the SigV4 signing key once per day and credential set and reuses it
+for every URL, and signs a whole batch with a single timestamp, so a page of
+results costs one HMAC-SHA256 per URL instead of a full trip through
+botocore's request pipeline.
+
+PresignedUrlCache keeps issued URLs until they are close to expiry, so
+repeated /list and /search renders only sign receipts they have not seen
+recently. A URL stops working when the session token that signed it
+expires, so cached URLs never outlive their credentials.
+"""
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+SIGV4_ALGORITHM = 'AWS4-HMAC-SHA256'
+
+
+# Bucket name -> region, looked up once per process
+_bucket_regions = {}
+_bucket_regions_lock = threading.Lock()
+
+
+def bucket_region(s3, bucket, configured_region=None):
+    """
+    Find the region to sign a bucket's URLs for.
+
+    The bucket's location is looked up once and cached: a URL signed for any
+    other region (such as AWS_DEFAULT_REGION when the bucket lives elsewhere)
+    fails SigV4 verification.
+
+    Args:
+        s3: An S3 client, used to look the bucket's location up.
+        bucket (str): The bucket.
+        configured_region (str): The region configured for the app (AWS_DEFAULT_REGION or the profile),
+            used only if the lookup fails.
+
+    Returns:
+        str: The bucket's location, otherwise configured_region.
+
+    Raises:
+        ValueError: If neither is available.
+    """
+    with _bucket_regions_lock:
+        if bucket in _bucket_regions:
+            return _bucket_regions[bucket]
+    try:
+        location = s3.get_bucket_location(Bucket=bucket)
+    except (ClientError, BotoCoreError) as e:
+        if configured_region:
+            return configured_region
+        raise ValueError(f"No region configured and the location of bucket {bucket!r} is unavailable: {e}") from e
+    # Buckets in us-east-1 have no LocationConstraint
+    region = location.get('LocationConstraint') or 'us-east-1'
+    with _bucket_regions_lock:
+        _bucket_regions[bucket] = region
+    return region
+
+
+def credentials_expiry(credentials):
+    """
+    Find when the credentials that will sign the next URL expire.
+
+    Args:
+        credentials: botocore Credentials, or None.
+
+    Returns:
+        float: Expiry as a Unix timestamp, or None for long-lived credentials.
+    """
+    if credentials is None:
+        return None
+    # Refreshes the credentials if they are about to expire, so the expiry read below is theirs
+    credentials.get_frozen_credentials()
+    # RefreshableCredentials (ECS task role, STS, SSO) keep their expiry here; static keys have none
+    expiry = getattr(credentials, '_expiry_time', None)
+    return expiry.timestamp() if expiry else None
+
+
+def _hmac_sha256(key, message):
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+class S3Presigner:
+    """
+    Sign S3 GET object URLs with SigV4, reusing the derived signing key.
+
+    Args:
+        get_credentials (callable): Returns botocore Credentials (refreshable or not).
+        bucket (str): The bucket the objects live in.
+        region (str): The bucket's region (see bucket_region).
+
+    Raises:
+        ValueError: If region is empty: a URL scoped to another region than the bucket's doesn't verify.
+    """
+
+    def __init__(self, get_credentials, bucket, region):
+        if not region:
+            raise ValueError(f"No region for bucket {bucket!r}.")
+        self.get_credentials = get_credentials
+        self.bucket = bucket
+        self.region = region
+        # Buckets with dots in their name break virtual-hosted TLS, fall back to path-style
+        if '.' in bucket:
+            self.host = f"s3.{self.region}.amazonaws.com"
+            self.path_prefix = f"/{quote(bucket, safe='')}"
+        else:
+            self.host = f"{bucket}.s3.{self.region}.amazonaws.com"
+            self.path_prefix = ''
+        self._signing_key = None
+        self._signing_key_scope = None
+        self._lock = threading.Lock()
+
+    def _get_signing_key(self, secret_key, date_stamp):
+        # The derived key only depends on the secret, the date and the region/service scope
+        scope = (secret_key, date_stamp)
+        with self._lock:
+            if self._signing_key_scope != scope:
+                key = _hmac_sha256(f"AWS4{secret_key}".encode('utf-8'), date_stamp)
+                key = _hmac_sha256(key, self.region)
+                key = _hmac_sha256(key, 's3')
+                self._signing_key = _hmac_sha256(key, 'aws4_request')
+                self._signing_key_scope = scope
+            return self._signing_key
+
+    def presign_many(self, s3_keys, expires_in=3600, now=None):
+        """
+        Sign GET URLs for several objects with one timestamp and signing key.
+
+        Args:
+            s3_keys (iterable): Object keys to sign.
+            expires_in (int): URL lifetime in seconds.
+            now (datetime): Signing time, defaults to the current UTC time.
+
+        Returns:
+            dict: Object key -> presigned URL.
+        """
+        credentials = self.get_credentials()
+        if credentials is None:
+            raise RuntimeError("No AWS credentials available to presign S3 URLs.")
+        credentials = credentials.get_frozen_credentials()
+
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date_stamp = now.strftime('%Y%m%d')
+        credential_scope = f"{date_stamp}/{self.region}/s3/aws4_request"
+        signing_key = self._get_signing_key(credentials.secret_key, date_stamp)
+
+        # The query string is identical for every object in the batch
+        query_params = [
+            ('X-Amz-Algorithm', SIGV4_ALGORITHM),
+            ('X-Amz-Credential', f"{credentials.access_key}/{credential_scope}"),
+            ('X-Amz-Date', amz_date),
+            ('X-Amz-Expires', str(expires_in)),
+        ]
+        if credentials.token:
+            query_params.append(('X-Amz-Security-Token', credentials.token))
+        query_params.append(('X-Amz-SignedHeaders', 'host'))
+        canonical_query = '&'.join(f"{quote(name, safe='~')}={quote(value, safe='~')}"
+                                   for name, value in sorted(query_params))
+        string_to_sign_prefix = f"{SIGV4_ALGORITHM}\n{amz_date}\n{credential_scope}\n"
+        canonical_suffix = f"\n{canonical_query}\nhost:{self.host}\n\nhost\nUNSIGNED-PAYLOAD"
+
+        urls = {}
+        for s3_key in s3_keys:
+            path = f"{self.path_prefix}/{quote(s3_key, safe='/~')}"
+            canonical_request = f"GET\n{path}{canonical_suffix}"
+            string_to_sign = string_to_sign_prefix + hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+            signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+            urls[s3_key] = f"https://{self.host}{path}?{canonical_query}&X-Amz-Signature={signature}"
+        return urls
+
+    def presign(self, s3_key, expires_in=3600, now=None):
+        """
+        Sign a GET URL for a single object.
+        """
+        return self.presign_many([s3_key], expires_in, now)[s3_key]
+
+
+class PresignedUrlCache:
+    """
+    Bounded LRU cache of presigned URLs that reissues URLs close to expiry.
+
+    Args:
+        expires_in (int): Lifetime of the URLs being cached, in seconds.
+        refresh_margin (int): Reissue a URL once it has less than this many seconds left.
+        max_entries (int): Maximum number of cached URLs.
+    """
+
+    def __init__(self, expires_in=3600, refresh_margin=300, max_entries=10000):
+        self.expires_in = expires_in
+        self.refresh_margin = refresh_margin
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key, now):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        url, expires_at = entry
+        if expires_at - now <= self.refresh_margin:
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return url
+
+    def _store(self, key, url, expires_at):
+        # Caller holds the lock
+        self._entries[key] = (url, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _expires_at(self, now, credentials_expiry):
+        expires_at = now + self.expires_in
+        valid_until = credentials_expiry() if credentials_expiry else None
+        return min(expires_at, valid_until) if valid_until else expires_at
+
+    def get(self, key, sign, credentials_expiry=None):
+        """
+        Get a cached URL, signing a new one on a miss.
+
+        Args:
+            key (str): The object key.
+            sign (callable): sign(key) -> URL valid for `expires_in` seconds.
+            credentials_expiry (callable): Returns when the signing credentials expire (Unix time), or None.
+
+        Returns:
+            str: A URL with more than `refresh_margin` seconds left.
+        """
+        now = time.time()
+        with self._lock:
+            url = self._lookup(key, now)
+            if url is not None:
+                self.hits += 1
+                return url
+            self.misses += 1
+
+        # Read before signing: if the credentials refresh in between, the older expiry is the safe cap
+        expires_at = self._expires_at(now, credentials_expiry)
+        url = sign(key)
+        with self._lock:
+            self._store(key, url, expires_at)
+        return url
+
+    def get_many(self, keys, sign_many, credentials_expiry=None):
+        """
+        Get URLs for several keys, signing all misses in one call.
+
+        Args:
+            keys (iterable): Object keys.
+            sign_many (callable): sign_many(list_of_keys) -> {key: URL}.
+            credentials_expiry (callable): Returns when the signing credentials expire (Unix time), or None.
+
+        Returns:
+            dict: Object key -> URL.
+        """
+        now = time.time()
+        urls, missing = {}, []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                url = self._lookup(key, now)
+                if url is not None:
+                    self.hits += 1
+                    urls[key] = url
+                else:
+                    self.misses += 1
+                    missing.append(key)
+
+        if missing:
+            expires_at = self._expires_at(now, credentials_expiry)
+            signed = sign_many(missing)
+            with self._lock:
+                for key, url in signed.items():
+                    self._store(key, url, expires_at)
+            urls.update(signed)
+        return urls
+
+    def clear(self):
+        """
+        Drop every cached URL and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Report cache size, hit/miss counts and hit rate.
+
+        Returns:
+            dict: Cache statistics.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -1,35 +1,305 @@
 import boto3
 import os
-import openai
 import json
+import logging
+import base64
+import binascii
+import io
+import re
+import time
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
+import dedup
+import keyword_index
+from aws_clients import client_config, get_or_create
+from image_preprocess import OCR_MAX_DIMENSION, dhash, preprocess_in_pool
+from json_logging import get_logger, log_event
+import metrics
+import receipt_fields
+import receipt_stats
+import receipt_storage
+from keyword_cache import KeywordCache
+from keyword_extraction import STOPWORDS, CallableKeywordExtractor, KeywordExtractionPipeline, LocalKeywordExtractor
+from merchants import merchants_from_env, normalize_merchant
+from parallel_scan import iter_scan_pages
+from receipt_cache import RECEIPT_CACHE, ReceiptCache, create_store
+from search_engine import SearchEngine
+from url_signing import PresignedUrlCache, S3Presigner, bucket_region, credentials_expiry
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Sampled JSON logs on stdout, see json_logging
+logger = get_logger('receipt_manager')
+
 # Get credentials from environment
 aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
 aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
 region = os.getenv('AWS_DEFAULT_REGION')
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# Initialize S3 client using credentials
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    region_name=region
-)
+
 # The name of your S3 bucket
 BUCKET_NAME = 'my-receipt-manager-bucket'
 
-# Initialize the DynamoDB resource
-dynamodb = boto3.resource('dynamodb')
+# Browser uploads go straight to S3 with a presigned POST policy valid for 5 minutes
+UPLOAD_POLICY_EXPIRY = int(os.getenv('UPLOAD_POLICY_EXPIRY', '300'))
+# Textract's synchronous APIs accept images up to 10 MB
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_CONTENT_TYPES = ('image/jpeg', 'image/png')
+# Receipt IDs are generated as os.urandom(16).hex()
+RECEIPT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Normalize images uploaded through /upload before storing them; optionally keep the untouched original
+PREPROCESS_UPLOADS = os.getenv('PREPROCESS_UPLOADS', 'true').lower() in ('1', 'true', 'yes')
+KEEP_ORIGINAL_UPLOADS = os.getenv('KEEP_ORIGINAL_UPLOADS', 'false').lower() in ('1', 'true', 'yes')
+# Duplicate uploads caught by this process, by the hash that caught them (each one a Textract call avoided)
+duplicate_uploads = {'sha256': 0, 'dhash': 0, 'etag': 0}
+# Whether keyword_index.backfill has finished, and when it was last checked
+index_backfill = {'done': False, 'checked_at': None}
+
+# Presigned image URLs are valid for an hour and reissued when less than 5 minutes remain
+PRESIGNED_URL_EXPIRY = 3600
+url_cache = PresignedUrlCache(
+    expires_in=PRESIGNED_URL_EXPIRY,
+    refresh_margin=int(os.getenv('PRESIGNED_URL_REFRESH_MARGIN', '300')),
+    max_entries=int(os.getenv('PRESIGNED_URL_CACHE_SIZE', '10000'))
+)
+
 # Define your DynamoDB table
 TABLE_NAME = 'Receipts'
-table = dynamodb.Table(TABLE_NAME)
 
+# Cache of query -> OpenAI keywords, optionally persisted to a SQLite file
+keyword_cache = KeywordCache(
+    max_entries=int(os.getenv('KEYWORD_CACHE_SIZE', '1024')),
+    ttl=int(os.getenv('KEYWORD_CACHE_TTL', '86400')),
+    path=os.getenv('KEYWORD_CACHE_PATH')
+)
+
+# Extractors tried in order for /search queries; 'local' answers simple queries without calling OpenAI
+KEYWORD_EXTRACTORS = [name.strip() for name in os.getenv('KEYWORD_EXTRACTORS', 'local,openai').split(',')]
+
+# Default and maximum number of receipts per /list page
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '50'))
+MAX_LIST_PAGE_SIZE = 500
+
+# Which search path /search uses: 'index' (inverted keyword index, whole tokens), 'scan' (full table scan, substrings
+# for inline receipts, whole tokens for compact ones, see receipt_storage.match_keywords),
+# 'bm25' (ranked, from an in-memory index of the table, see search_engine)
+# or 'vector' (embedding similarity, see vector_index; needs EMBEDDINGS=true on the ingest Lambda)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'index')
+# Seconds between checks for a finished keyword index backfill; the index backend scans until then
+INDEX_BACKFILL_CHECK_INTERVAL = int(os.getenv('INDEX_BACKFILL_CHECK_INTERVAL', '300'))
+# Answer merchant/month/year queries from the structured field GSIs before falling back to SEARCH_BACKEND
+STRUCTURED_SEARCH = os.getenv('STRUCTURED_SEARCH', 'true').lower() in ('1', 'true', 'yes')
+# Words of a /stats question that aren't conditions; any other word must be a known merchant or a date
+STATS_QUESTION_WORDS = STOPWORDS | frozenset("""
+    altogether did do does during far had has have how much overall so spend spending spent this total ve was we
+""".split())
+# Run /search on the shared event loop, with concurrent OpenAI and DynamoDB calls (see async_search)
+ASYNC_SEARCH = os.getenv('ASYNC_SEARCH', 'false').lower() in ('1', 'true', 'yes')
+# Send per-dependency timings to browsers in a Server-Timing header (turn off if they shouldn't see them)
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+# Known merchants, recognized in queries and mapped to the merchant-date-index
+MERCHANTS = merchants_from_env()
+# Ranked in-memory index for the bm25 backend, built in the background on the first search
+text_index = SearchEngine(lambda: get_table(),
+                          get_texts=(lambda receipt_ids: get_receipt_texts(receipt_ids))
+                          if receipt_storage.COMPACT_STORAGE else None)
+
+
+# AWS clients and the OpenAI module are built on first use (see aws_clients), not at import
+def get_session():
+    """
+    Get the boto3 session holding the S3 credentials from the environment.
+    """
+    return get_or_create(globals(), 'session', lambda: boto3.session.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        region_name=region
+    ))
+
+def get_s3():
+    """
+    Get the S3 client.
+    """
+    return get_or_create(globals(), 's3', lambda: get_session().client('s3', config=client_config()))
+
+def get_presigner():
+    """
+    Get the bulk signer for result sets, which reuses the derived SigV4 signing key across URLs.
+    """
+    return get_or_create(globals(), 'presigner', lambda: S3Presigner(
+        get_session().get_credentials, BUCKET_NAME, bucket_region(get_s3(), BUCKET_NAME, get_session().region_name)
+    ))
+
+def get_dynamodb():
+    """
+    Get the DynamoDB resource.
+    """
+    return get_or_create(globals(), 'dynamodb', lambda: boto3.resource('dynamodb', config=client_config()))
+
+def get_table():
+    """
+    Get the Receipts table.
+    """
+    return get_or_create(globals(), 'table', lambda: get_dynamodb().Table(TABLE_NAME))
+
+def get_keyword_index_table():
+    """
+    Get the inverted keyword index written by the ingest Lambda (token -> receipt_id).
+    """
+    return get_or_create(globals(), 'keyword_index_table',
+                         lambda: get_dynamodb().Table(keyword_index.KEYWORD_INDEX_TABLE))
+
+def get_dynamodb_streams():
+    """
+    Get the DynamoDB Streams client the receipt cache follows the Receipts table with.
+    """
+    return get_or_create(globals(), 'dynamodb_streams', lambda: boto3.client('dynamodbstreams', config=client_config()))
+
+def get_hashes_table():
+    """
+    Get the ReceiptHashes table used to recognize duplicate uploads (see dedup).
+    """
+    return get_or_create(globals(), 'hashes_table', lambda: get_dynamodb().Table(dedup.RECEIPT_HASHES_TABLE))
+
+def get_texts_table():
+    """
+    Get the ReceiptTexts table holding full texts in the compact layout (see receipt_storage).
+    """
+    return get_or_create(globals(), 'texts_table', lambda: get_dynamodb().Table(receipt_storage.RECEIPT_TEXTS_TABLE))
+
+def get_stats_table():
+    """
+    Get the ReceiptStats table holding the spend rollups (see receipt_stats).
+    """
+    return get_or_create(globals(), 'stats_table', lambda: get_dynamodb().Table(receipt_stats.RECEIPT_STATS_TABLE))
+
+def get_receipt_cache():
+    """
+    Get the receipt metadata cache (see receipt_cache), or None when RECEIPT_CACHE is off.
+    """
+    if not RECEIPT_CACHE:
+        return None
+    return get_or_create(globals(), 'receipt_cache', lambda: ReceiptCache(
+        get_table, get_dynamodb_streams, store=create_store()
+    ))
+
+def get_vector_search():
+    """
+    Get the embedding index for the vector backend (imports numpy on first use).
+    """
+    def create():
+        import vector_index
+        # The compact layout keeps the embeddings in ReceiptTexts
+        return vector_index.VectorSearch(get_texts_table if receipt_storage.COMPACT_STORAGE else get_table)
+    return get_or_create(globals(), 'vector_search', create)
+
+def _load_openai():
+    # Importing openai takes about a third of a second, most of it aiohttp
+    import openai
+    if not openai.api_key:
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+def get_openai():
+    """
+    Get the openai module, configured with OPENAI_API_KEY.
+    """
+    return get_or_create(globals(), 'openai', _load_openai)
+
+_LAZY_ATTRIBUTES = {
+    'session': get_session,
+    's3': get_s3,
+    'presigner': get_presigner,
+    'dynamodb': get_dynamodb,
+    'table': get_table,
+    'keyword_index_table': get_keyword_index_table,
+    'openai': get_openai,
+    'vector_search': get_vector_search,
+    'dynamodb_streams': get_dynamodb_streams,
+    'receipt_cache': get_receipt_cache,
+    'hashes_table': get_hashes_table,
+    'texts_table': get_texts_table,
+    'stats_table': get_stats_table,
+}
+
+def __getattr__(name):
+    # utils.s3, utils.table, ... still work (and can be patched); they are built on first access
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def count_duplicate(hash_key):
+    """
+    Count a duplicate upload against the hash that caught it, here and in the ReceiptHashes table.
+    """
+    duplicate_uploads[hash_key.split('#', 1)[0]] += 1
+    with metrics.timed('dynamodb', 'update_item'):
+        dedup.record_duplicate(get_hashes_table(), hash_key)
+
+def find_duplicate_upload(file):
+    """
+    Look for an earlier upload of the same receipt before storing a new one.
+
+    The file is hashed in chunks and rewound. With PERCEPTUAL_DEDUP, an image
+    whose dHash is within DHASH_MAX_DISTANCE bits of an earlier one also counts.
+    Lookup errors are logged and the upload is treated as new.
+
+    Args:
+        file (File): The uploaded file object.
+
+    Returns:
+        tuple: (receipt_id of the earlier upload or None, 'exact' or 'similar' or None,
+        fingerprint to pass to record_upload_hashes or None when dedup is off).
+    """
+    if not dedup.DEDUP_UPLOADS:
+        return None, None, None
+    fingerprint = {'sha256': dedup.content_hash(file)}
+    try:
+        hash_key = dedup.sha256_key(fingerprint['sha256'])
+        with metrics.timed('dynamodb', 'get_item'):
+            existing = dedup.lookup(get_hashes_table(), hash_key)
+        if existing:
+            count_duplicate(hash_key)
+            return existing, 'exact', fingerprint
+
+        if dedup.PERCEPTUAL_DEDUP:
+            fingerprint['dhash'] = dhash(file.read())
+            file.seek(0)
+            with metrics.timed('dynamodb', 'batch_get'):
+                existing, hash_key = dedup.find_similar(get_dynamodb(), fingerprint['dhash'])
+            if existing:
+                count_duplicate(hash_key)
+                return existing, 'similar', fingerprint
+    except ValueError:
+        # Not an image; preprocessing rejects it
+        file.seek(0)
+    except Exception as e:
+        log_event(logger, logging.WARNING, 'dedup_failed', f"Duplicate check failed: {e}")
+    return None, None, fingerprint
+
+def record_upload_hashes(receipt_id, fingerprint):
+    """
+    Record a stored upload's hashes so later copies are recognized.
+
+    Args:
+        receipt_id (str): The new receipt.
+        fingerprint (dict): Returned by find_duplicate_upload.
+    """
+    if not fingerprint:
+        return
+    try:
+        # Losing the claim to a concurrent upload of the same file is fine: the Lambda skips ours by its ETag
+        with metrics.timed('dynamodb', 'put_item'):
+            dedup.claim(get_hashes_table(), dedup.sha256_key(fingerprint['sha256']), receipt_id)
+        if 'dhash' in fingerprint:
+            with metrics.timed('dynamodb', 'update_item'):
+                dedup.index_dhash(get_hashes_table(), fingerprint['dhash'], receipt_id)
+    except Exception as e:
+        log_event(logger, logging.WARNING, 'dedup_failed', f"Recording upload hashes failed: {e}",
+                  receipt_id=receipt_id)
 
 def upload_to_s3(receipt_id, file):
     """
@@ -46,49 +316,251 @@ def upload_to_s3(receipt_id, file):
     
     try:
         # Upload the file to the S3 bucket
-        s3.upload_fileobj(file, BUCKET_NAME, s3_key)
+        with metrics.timed('s3', 'upload'):
+            get_s3().upload_fileobj(file, BUCKET_NAME, s3_key)
         
         # Generate the S3 URL
         s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
         return s3_url
     except Exception as e:
-        print(f"Error uploading to S3: {str(e)}")
+        log_event(logger, logging.ERROR, 's3_upload_failed', f"Error uploading to S3: {str(e)}",
+                  receipt_id=receipt_id, s3_key=s3_key)
         raise
 
+def upload_original_to_s3(receipt_id, data, content_type=None):
+    """
+    Keep the untouched uploaded image under originals/.
+
+    The key has no .jpg suffix, so it doesn't trigger the ingest Lambda.
+
+    Args:
+        receipt_id (str): Unique identifier for the receipt.
+        data (bytes): The image as uploaded.
+        content_type (str): MIME type reported by the client.
+
+    Returns:
+        str: The S3 key of the original.
+    """
+    s3_key = f"originals/{receipt_id}"
+    extra_args = {'ContentType': content_type} if content_type else None
+    with metrics.timed('s3', 'upload'):
+        get_s3().upload_fileobj(io.BytesIO(data), BUCKET_NAME, s3_key, ExtraArgs=extra_args)
+    return s3_key
+
+def preprocess_upload(receipt_id, file):
+    """
+    Normalize an uploaded receipt image (orientation, grayscale, size, JPEG) in the process pool.
+
+    Args:
+        receipt_id (str): Unique identifier for the receipt.
+        file (File): The uploaded file object.
+
+    Returns:
+        File: A file object with the image to store under receipts/{receipt_id}.jpg.
+
+    Raises:
+        ValueError: If the upload is not a readable image.
+    """
+    if not PREPROCESS_UPLOADS:
+        return file
+
+    data = file.read()
+    processed, info = preprocess_in_pool(data)
+    log_event(logger, logging.INFO, 'upload_preprocessed',
+              f"Preprocessed receipt {receipt_id}: {info['original_bytes']} -> {info['bytes']} bytes "
+              f"({info['width']}x{info['height']})", receipt_id=receipt_id, **info)
+    if KEEP_ORIGINAL_UPLOADS:
+        upload_original_to_s3(receipt_id, data, getattr(file, 'mimetype', None))
+    return io.BytesIO(processed)
+
+def create_upload_post(receipt_id, content_type):
+    """
+    Create a presigned POST policy the browser uses to upload a receipt image straight to S3.
+
+    The policy pins the object key and Content-Type and limits the size to MAX_UPLOAD_BYTES,
+    so S3 rejects anything else without the upload passing through Flask.
+
+    Args:
+        receipt_id (str): Unique identifier for the receipt.
+        content_type (str): MIME type of the image, one of UPLOAD_CONTENT_TYPES.
+
+    Returns:
+        dict: The form 'url' and the 'fields' to post along with the file.
+
+    Raises:
+        ValueError: If the content type is not allowed.
+    """
+    if content_type not in UPLOAD_CONTENT_TYPES:
+        raise ValueError(f"Unsupported content type, expected one of {', '.join(UPLOAD_CONTENT_TYPES)}.")
+
+    with metrics.timed('s3', 'presign_post'):
+        return get_s3().generate_presigned_post(
+            Bucket=BUCKET_NAME,
+            Key=receipt_image_key(receipt_id),
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, MAX_UPLOAD_BYTES],
+            ],
+            ExpiresIn=UPLOAD_POLICY_EXPIRY
+        )
+
+def record_upload(receipt_id):
+    """
+    Record a receipt uploaded directly to S3 as pending until the ingest Lambda processes it.
+
+    The item is only written if the receipt doesn't exist yet, so a Lambda that
+    finished first is never overwritten. If another receipt already owns an
+    identical image (same ETag), the new object is deleted, the ingest Lambda
+    skips it, and the existing receipt is returned instead.
+
+    Args:
+        receipt_id (str): Unique identifier for the receipt.
+
+    Returns:
+        tuple: (receipt_id, which is the existing one for a duplicate, and the S3 URL of its image).
+
+    Raises:
+        ValueError: If the receipt ID is malformed or the image was not uploaded.
+    """
+    if not isinstance(receipt_id, str) or not RECEIPT_ID_PATTERN.match(receipt_id):
+        raise ValueError("Invalid receipt ID.")
+
+    s3_key = receipt_image_key(receipt_id)
+    try:
+        with metrics.timed('s3', 'head_object'):
+            head = get_s3().head_object(Bucket=BUCKET_NAME, Key=s3_key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            raise ValueError("Receipt image was not uploaded.")
+        raise
+
+    if dedup.DEDUP_UPLOADS and head.get('ETag'):
+        hash_key = dedup.etag_key(head['ETag'])
+        with metrics.timed('dynamodb', 'put_item'):
+            owner = dedup.claim(get_hashes_table(), hash_key, receipt_id)
+        if owner != receipt_id:
+            count_duplicate(hash_key)
+            with metrics.timed('s3', 'delete_object'):
+                get_s3().delete_object(Bucket=BUCKET_NAME, Key=s3_key)
+            return owner, f"https://{BUCKET_NAME}.s3.amazonaws.com/{receipt_image_key(owner)}"
+
+    s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
+    try:
+        with metrics.timed('dynamodb', 'put_item'):
+            get_table().put_item(
+                Item={'receipt_id': receipt_id, 's3_url': s3_url, 'upload_status': 'pending'},
+                ConditionExpression='attribute_not_exists(receipt_id)'
+            )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+    else:
+        cache = get_receipt_cache()
+        if cache is not None:
+            cache.put({'receipt_id': receipt_id, 's3_url': s3_url, 'upload_status': 'pending'})
+    return receipt_id, s3_url
+
+def receipt_image_key(receipt_id):
+    """
+    Get the S3 key of a receipt image.
+    """
+    return f"receipts/{receipt_id}.jpg"
+
 def get_receipt_image_url(receipt_id):
     """
     Get the S3 URL for a given receipt ID.
 
+    URLs are cached and only reissued when they are close to expiry.
+
     Args:
         receipt_id (str): The unique identifier for the receipt.
     
     Returns:
         str: The S3 URL of the receipt image.
     """
-    # Construct the S3 key for the receipt image
-    s3_key = f"receipts/{receipt_id}.jpg"
+    def sign(s3_key):
+        # Generate a presigned URL for accessing the image
+        with metrics.timed('s3', 'presign'):
+            return get_s3().generate_presigned_url(
+                'get_object',
+                Params={'Bucket': BUCKET_NAME, 'Key': s3_key},
+                ExpiresIn=PRESIGNED_URL_EXPIRY  # URL expires in 1 hour
+            )
 
-    # Generate a presigned URL for accessing the image
-    s3_url = s3.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': BUCKET_NAME, 'Key': s3_key},
-        ExpiresIn=3600  # URL expires in 1 hour
-    )
-    return s3_url
+    return url_cache.get(receipt_image_key(receipt_id), sign, signing_credentials_expiry)
 
+def signing_credentials_expiry():
+    """
+    Get when the credentials used to presign URLs expire, so cached URLs don't outlive them.
 
+    Returns:
+        float: Expiry as a Unix timestamp, or None for long-lived credentials.
+    """
+    return credentials_expiry(get_session().get_credentials())
 
-def extract_keywords_with_openai(query):
+def get_presigned_urls(s3_keys):
     """
-    Use OpenAI to extract keywords from the user's natural language query.
+    Get presigned GET URLs for S3 keys, signing every uncached key in one batch.
 
     Args:
-        query (str): The user's search query.
+        s3_keys (iterable): Object keys.
 
     Returns:
-        list: A list of keywords extracted from the query.
+        dict: S3 key -> presigned URL.
     """
-    messages = [
+    def sign_many(missing):
+        with metrics.timed('s3', 'presign'):
+            return get_presigner().presign_many(missing, PRESIGNED_URL_EXPIRY)
+
+    return url_cache.get_many(s3_keys, sign_many, signing_credentials_expiry)
+
+def get_receipt_image_urls(receipt_ids):
+    """
+    Get S3 URLs for a whole result set, signing every uncached receipt in one batch.
+
+    Args:
+        receipt_ids (iterable): Receipt IDs.
+
+    Returns:
+        dict: Receipt ID -> presigned URL.
+    """
+    s3_keys = {receipt_id: receipt_image_key(receipt_id) for receipt_id in receipt_ids}
+    urls = get_presigned_urls(s3_keys.values())
+    return {receipt_id: urls[s3_key] for receipt_id, s3_key in s3_keys.items()}
+
+def attach_image_urls(receipts):
+    """
+    Add an image_url (the original) and a thumb_url (the preview shown in pages) to every receipt,
+    signing them as one batch.
+
+    Args:
+        receipts (list): Receipt items; receipts without a receipt_id get image_url None, and receipts
+            without a thumbnail_key use the original as their thumb_url.
+
+    Returns:
+        list: The same receipts.
+    """
+    with_id = [receipt for receipt in receipts if receipt.get('receipt_id')]
+    s3_keys = [receipt_image_key(receipt['receipt_id']) for receipt in with_id]
+    s3_keys += [receipt['thumbnail_key'] for receipt in with_id if receipt.get('thumbnail_key')]
+    urls = get_presigned_urls(s3_keys)
+
+    for receipt in receipts:
+        receipt_id = receipt.get('receipt_id')
+        receipt['image_url'] = urls[receipt_image_key(receipt_id)] if receipt_id else None
+        receipt['thumb_url'] = urls.get(receipt.get('thumbnail_key')) or receipt['image_url']
+    return receipts
+
+
+
+OPENAI_MODEL = "gpt-3.5-turbo"
+
+def openai_keyword_messages(query):
+    """
+    Build the chat messages asking OpenAI for the keywords of a query.
+    """
+    return [
         {
             "role": "system",
             "content": "You are a helpful assistant that extracts keywords from user queries to search receipts."
@@ -100,73 +572,646 @@ def extract_keywords_with_openai(query):
         }
     ]
 
-    try:
-        # Call OpenAI's ChatCompletion API
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",  # Use the appropriate model
-            messages=messages,
-            temperature=0.0
-        )
+def parse_openai_keywords(raw_response):
+    """
+    Parse the JSON array of keywords returned by OpenAI.
 
-        # Extract and print the response content for debugging
-        raw_response = response['choices'][0]['message']['content'].strip().lower()
-        print(f"OpenAI Raw Response: {raw_response}")  # Debugging print
+    Args:
+        raw_response (str): The lowercased message content.
+
+    Returns:
+        list: The keywords, or an empty list if the response is not a JSON array of strings.
+    """
+    log_event(logger, logging.INFO, 'openai_response', "OpenAI Raw Response", raw_response=raw_response)
 
+    try:
         # Load the response as a JSON array
         keywords = json.loads(raw_response)
+    except json.JSONDecodeError:
+        log_event(logger, logging.WARNING, 'openai_invalid_response',
+                  "Error: OpenAI response is not a valid JSON. Check the response format.",
+                  raw_response=raw_response)
+        return []
 
-        # Ensure that the result is a list of strings
-        if isinstance(keywords, list) and all(isinstance(k, str) for k in keywords):
-            keywords = [keyword.lower() for keyword in keywords]
-            return keywords
-        else:
-            print("Error: OpenAI response is not a list of strings.")
-            return []
+    # Ensure that the result is a list of strings
+    if isinstance(keywords, list) and all(isinstance(k, str) for k in keywords):
+        return [keyword.lower() for keyword in keywords]
+    log_event(logger, logging.WARNING, 'openai_invalid_response',
+              "Error: OpenAI response is not a list of strings.", raw_response=raw_response)
+    return []
 
-    except json.JSONDecodeError:
-        print("Error: OpenAI response is not a valid JSON. Check the response format.")
-        print(f"Response Content: {raw_response}")  # Print the problematic response
+def extract_keywords_with_openai(query):
+    """
+    Use OpenAI to extract keywords from the user's natural language query.
+
+    Args:
+        query (str): The user's search query.
+
+    Returns:
+        list: A list of keywords extracted from the query.
+    """
+    try:
+        # Call OpenAI's ChatCompletion API
+        with metrics.timed('openai', 'chat_completion'):
+            response = get_openai().ChatCompletion.create(
+                model=OPENAI_MODEL,  # Use the appropriate model
+                messages=openai_keyword_messages(query),
+                temperature=0.0
+            )
+
+        # Extract the response content and parse it
+        raw_response = response['choices'][0]['message']['content'].strip().lower()
+        return parse_openai_keywords(raw_response)
+
+    except Exception as e:
+        log_event(logger, logging.ERROR, 'openai_error', f"Error calling OpenAI API: {str(e)}")
         return []
+
+# Pooled HTTP client for OpenAI calls made on the async event loop, created on first use
+_openai_http_client = None
+
+def get_openai_http_client():
+    """
+    Get the httpx client used by extract_keywords_with_openai_async.
+
+    Only call this from the async_runtime event loop, the client's connection pool belongs to it.
+    """
+    global _openai_http_client
+    if _openai_http_client is None:
+        import httpx
+        _openai_http_client = httpx.AsyncClient(
+            base_url=get_openai().api_base,
+            timeout=httpx.Timeout(float(os.getenv('OPENAI_TIMEOUT', '20'))),
+            limits=httpx.Limits(max_connections=int(os.getenv('OPENAI_MAX_CONNECTIONS', '20')),
+                                max_keepalive_connections=int(os.getenv('OPENAI_MAX_CONNECTIONS', '20')))
+        )
+    return _openai_http_client
+
+async def extract_keywords_with_openai_async(query):
+    """
+    Coroutine version of extract_keywords_with_openai, over a pooled httpx connection.
+
+    Args:
+        query (str): The user's search query.
+
+    Returns:
+        list: A list of keywords extracted from the query.
+    """
+    try:
+        with metrics.timed('openai', 'chat_completion'):
+            response = await get_openai_http_client().post(
+                '/chat/completions',
+                headers={'Authorization': f"Bearer {get_openai().api_key}"},
+                json={'model': OPENAI_MODEL, 'messages': openai_keyword_messages(query), 'temperature': 0.0}
+            )
+        response.raise_for_status()
+        raw_response = response.json()['choices'][0]['message']['content'].strip().lower()
+        return parse_openai_keywords(raw_response)
+
     except Exception as e:
-        print(f"Error calling OpenAI API: {str(e)}")
+        log_event(logger, logging.ERROR, 'openai_error', f"Error calling OpenAI API: {str(e)}")
         return []
-    
 
-def query_receipts_by_keywords(keywords):
-    # Build the filter expression
+def extract_keywords_cached(query):
+    """
+    Extract keywords with OpenAI, reusing cached results.
+
+    Identical concurrent queries share a single OpenAI call.
+
+    Args:
+        query (str): The user's search query.
+
+    Returns:
+        list: A list of keywords extracted from the query.
+    """
+    return keyword_cache.get_or_compute(query, extract_keywords_with_openai)
+
+async def extract_keywords_cached_async(query):
+    """
+    Coroutine version of extract_keywords_cached.
+    """
+    return await keyword_cache.get_or_compute_async(query, extract_keywords_with_openai_async)
+
+def build_keyword_pipeline(names):
+    """
+    Build the keyword extraction pipeline from extractor names ('local', 'openai').
+    """
+    available = {
+        'local': lambda: LocalKeywordExtractor(MERCHANTS),
+        'openai': lambda: CallableKeywordExtractor('openai', extract_keywords_cached, extract_keywords_cached_async),
+    }
+    return KeywordExtractionPipeline([available[name]() for name in names])
+
+keyword_pipeline = build_keyword_pipeline(KEYWORD_EXTRACTORS)
+
+def extract_keywords(query):
+    """
+    Extract keywords from a query with the configured extractors.
+
+    Simple queries are handled locally; the rest fall through to cached OpenAI extraction.
+
+    Args:
+        query (str): The user's search query.
+
+    Returns:
+        list: A list of keywords extracted from the query.
+    """
+    return keyword_pipeline.extract(query)
+
+def keyword_filter_expression(keywords):
+    """
+    Build a filter matching receipts whose raw_text contains every keyword.
+
+    Args:
+        keywords (list): Keywords to match.
+
+    Returns:
+        ConditionBase: The filter expression, or None if there are no keywords.
+    """
     filter_expression = None
     for keyword in keywords:
         condition = Attr('raw_text').contains(keyword)
         filter_expression = condition if filter_expression is None else filter_expression & condition
+    return filter_expression
+
+def get_receipt_texts(receipt_ids):
+    """
+    Fetch the full texts of compact receipts from ReceiptTexts (see receipt_storage).
+
+    Returns:
+        dict: receipt_id -> raw_text.
+    """
+    return receipt_storage.fetch_texts(get_dynamodb(), get_s3(), receipt_ids,
+                                       receipt_storage.RECEIPT_TEXTS_TABLE, BUCKET_NAME)
+
+def get_receipt_text(receipt_id):
+    """
+    Get the full text of one receipt, for the detail view.
+
+    Returns:
+        str: The raw text, or None if the receipt doesn't exist or has no text yet.
+    """
+    with metrics.timed('dynamodb', 'get_item'):
+        item = get_table().get_item(Key={'receipt_id': receipt_id}).get('Item')
+    if item is None:
+        return None
+    if 'raw_text' in item:
+        return item['raw_text']
+    return get_receipt_texts([receipt_id]).get(receipt_id)
+
+def match_receipt_texts(receipts, keywords):
+    """
+    Keep the compact receipts whose full text contains every keyword (see receipt_storage.match_keywords).
+    """
+    return receipt_storage.match_keywords(receipts, keywords, get_receipt_texts)
+
+def iter_receipts_by_keywords(keywords, total_segments=None):
+    """
+    Scan for receipts containing every keyword, yielding pages as they arrive.
+
+    In the compact layout the text isn't on the items: pages are matched on
+    their token signatures and the candidates' texts checked, so compact
+    receipts only match whole tokens ("star" doesn't find "starbucks").
+
+    Args:
+        keywords (list): Keywords to match.
+        total_segments (int): Parallel scan segments, defaults to SCAN_SEGMENTS.
 
+    Yields:
+        list: Matching receipts, one scan page at a time.
+    """
+    filter_expression = keyword_filter_expression(keywords)
     if filter_expression is None:
+        return
+
+    if receipt_storage.COMPACT_STORAGE:
+        # raw_text is still projected for receipts the migration hasn't reached
+        projection = receipt_storage.hot_projection()
+        projection['ProjectionExpression'] += ', raw_text'
+        pages = iter_scan_pages(get_table(), total_segments, **projection)
+    else:
+        pages = iter_scan_pages(get_table(), total_segments, FilterExpression=filter_expression)
+    for page in metrics.timed_pages('dynamodb', 'scan', pages):
+        if receipt_storage.COMPACT_STORAGE:
+            page = match_receipt_texts(page, keywords)
+        if page:
+            yield page
+
+def query_receipts_by_keywords(keywords):
+    """
+    Scan DynamoDB (or the receipt cache) for receipts whose raw_text contains every keyword.
+
+    Args:
+        keywords (list): Keywords to match.
+
+    Returns:
+        list: All matching receipts.
+    """
+    cache = get_receipt_cache()
+    if cache is not None:
+        receipts = cache.matching(keywords)
+        if receipts is not None:
+            # The cache matches compact receipts on their token signatures only
+            return match_receipt_texts(receipts, keywords) if receipt_storage.COMPACT_STORAGE else receipts
+    receipts = []
+    for page in iter_receipts_by_keywords(keywords):
+        receipts.extend(page)
+    return receipts
+
+def keyword_index_ready():
+    """
+    Check whether the keyword index covers every receipt (its backfill has finished).
+
+    A finished backfill is remembered; otherwise the index table is checked again
+    every INDEX_BACKFILL_CHECK_INTERVAL seconds.
+    """
+    now = time.time()
+    if not index_backfill['done'] and (index_backfill['checked_at'] is None or
+                                       now - index_backfill['checked_at'] >= INDEX_BACKFILL_CHECK_INTERVAL):
+        with metrics.timed('dynamodb', 'get_item'):
+            index_backfill['done'] = keyword_index.is_backfilled(get_keyword_index_table())
+        index_backfill['checked_at'] = now
+    return index_backfill['done']
+
+def query_receipts_by_index(keywords):
+    """
+    Find receipts containing every keyword using the inverted keyword index.
+
+    Tokens match whole (see keyword_index). Until the index is backfilled
+    this scans instead, which also finds the receipts it doesn't have yet.
+
+    Args:
+        keywords (list): Keywords extracted from the user's query.
+
+    Returns:
+        list: Matching receipt items.
+    """
+    if not keyword_index_ready():
+        return query_receipts_by_keywords(keywords)
+    return keyword_index.search(get_keyword_index_table(), get_dynamodb(), TABLE_NAME, keywords)
+
+def query_index_pages(**query_kwargs):
+    """
+    Run a DynamoDB query to completion, yielding pages as they arrive.
+    """
+    while True:
+        with metrics.timed('dynamodb', 'query'):
+            response = get_table().query(**query_kwargs)
+        yield response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def field_queries(plan):
+    """
+    Build the GSI query requests for a structured query plan.
+
+    A merchant is looked up in merchant-date-index with each date range as a
+    receipt_date condition; a date alone is looked up month by month in
+    month-date-index. Remaining keywords are matched against raw_text by a
+    filter expression on the query, or afterwards by filter_field_results
+    in the compact layout.
+
+    Args:
+        plan (QueryPlan): Plan returned by receipt_fields.plan_query.
+
+    Returns:
+        list: Keyword arguments for table.query, one dict per query.
+    """
+    filter_expression = None if receipt_storage.COMPACT_STORAGE else keyword_filter_expression(plan.keywords)
+    queries = []
+    if plan.merchant:
+        merchant_condition = Key('merchant').eq(plan.merchant)
+        for first, last in plan.date_ranges or [(None, None)]:
+            condition = merchant_condition
+            if first:
+                condition = condition & Key('receipt_date').between(first, last)
+            queries.append((receipt_fields.MERCHANT_DATE_INDEX, condition))
+    else:
+        for first, last in plan.date_ranges:
+            for month in receipt_fields.months_between(first, last):
+                condition = Key('receipt_month').eq(month) & Key('receipt_date').between(first, last)
+                queries.append((receipt_fields.MONTH_DATE_INDEX, condition))
+
+    requests = []
+    for index_name, condition in queries:
+        query_kwargs = {'IndexName': index_name, 'KeyConditionExpression': condition, 'ScanIndexForward': False}
+        if filter_expression is not None:
+            query_kwargs['FilterExpression'] = filter_expression
+        requests.append(query_kwargs)
+    return requests
+
+def run_query(query_kwargs):
+    """
+    Run one DynamoDB query to completion.
+
+    Returns:
+        list: Every item the query returned.
+    """
+    items = []
+    for page in query_index_pages(**query_kwargs):
+        items.extend(page)
+    return items
+
+def filter_field_results(receipts, plan):
+    """
+    Match the remaining keywords of a plan in the compact layout, where field_queries can't filter on raw_text.
+    """
+    if receipt_storage.COMPACT_STORAGE and plan.keywords:
+        return match_receipt_texts(receipts, plan.keywords)
+    return receipts
+
+def query_receipts_by_fields(plan):
+    """
+    Find receipts with key-condition queries on the structured field GSIs.
+
+    Args:
+        plan (QueryPlan): Plan returned by receipt_fields.plan_query.
+
+    Returns:
+        list: Matching receipts, newest first.
+    """
+    receipts = []
+    for query_kwargs in field_queries(plan):
+        receipts.extend(run_query(query_kwargs))
+    return filter_field_results(receipts, plan)
+
+def needs_backend_search(plan, receipts):
+    """
+    Whether a structured search should also run the SEARCH_BACKEND search.
+
+    The GSIs only hold receipts with a parsed receipt_date, stored or backfilled
+    since the structured fields were added. A merchant-only plan, or a plan the
+    GSIs found nothing for, is merged with the keyword search so those receipts
+    aren't lost.
+    """
+    return not receipts or not plan.date_ranges
+
+def merge_receipts(*results):
+    """
+    Concatenate result lists, keeping the first copy of each receipt.
+    """
+    merged = {}
+    for receipts in results:
+        for receipt in receipts:
+            merged.setdefault(receipt['receipt_id'], receipt)
+    return list(merged.values())
+
+def search_receipts(keywords):
+    """
+    Search receipts by keywords.
+
+    Queries naming a known merchant, a month or a year use the structured field
+    GSIs; a month without a year searches that month in each of the last two
+    years (receipt_fields.plan_query). Merchant-only queries and queries the GSIs
+    find nothing for are merged with the SEARCH_BACKEND search, which also sees
+    receipts without a parsed date. Other queries use SEARCH_BACKEND alone.
+
+    Args:
+        keywords (list): Keywords extracted from the user's query.
+
+    Returns:
+        list: Matching receipt items.
+    """
+    if STRUCTURED_SEARCH:
+        plan = receipt_fields.plan_query(keywords, MERCHANTS)
+        if plan.indexed:
+            receipts = query_receipts_by_fields(plan)
+            if not needs_backend_search(plan, receipts):
+                return receipts
+            return merge_receipts(receipts, search_receipts_by_backend(keywords))
+    return search_receipts_by_backend(keywords)
+
+def search_receipts_by_backend(keywords):
+    """
+    Search receipts with the configured SEARCH_BACKEND.
+
+    The bm25 and vector backends fall back to the keyword index while their
+    first build is running.
+
+    Args:
+        keywords (list): Keywords extracted from the user's query.
+
+    Returns:
+        list: Matching receipt items.
+    """
+    if SEARCH_BACKEND == 'scan':
+        return query_receipts_by_keywords(keywords)
+    if SEARCH_BACKEND == 'bm25':
+        results = text_index.search(keywords)
+        if results is not None:
+            return results
+    if SEARCH_BACKEND == 'vector':
+        results = query_receipts_by_vector(keywords)
+        if results is not None:
+            return results
+    return query_receipts_by_index(keywords)
+
+def query_receipts_by_vector(keywords):
+    """
+    Find the receipts whose embeddings are closest to the keywords', most similar first.
+
+    Args:
+        keywords (list): Keywords extracted from the user's query.
+
+    Returns:
+        list: Matching receipt items, or None while the vector index is being built.
+    """
+    ranked = get_vector_search().search(' '.join(keywords))
+    if ranked is None:
+        return None
+    if not ranked:
         return []
+    items = keyword_index.batch_get_receipts(get_dynamodb(), TABLE_NAME, [receipt_id for receipt_id, _ in ranked])
+    rank = {receipt_id: position for position, (receipt_id, _) in enumerate(ranked)}
+    items.sort(key=lambda item: rank[item['receipt_id']])
+    return items
 
-    response = table.scan(FilterExpression=filter_expression)
-    return response.get('Items', [])
+def iter_receipt_pages(total_segments=None, page_size=None):
+    """
+    Scan all receipts in parallel segments (or page through the receipt cache), yielding pages as they arrive.
+
+    Args:
+        total_segments (int): Parallel scan segments, defaults to SCAN_SEGMENTS.
+        page_size (int): Maximum items per scan request, None for DynamoDB's 1 MB pages.
+
+    Yields:
+        list: Receipts, one scan page at a time.
+    """
+    cache = get_receipt_cache()
+    pages = cache.iter_pages(page_size) if cache is not None else None
+    if pages is not None:
+        yield from pages
+        return
+    scan_kwargs = {'Limit': page_size} if page_size else {}
+    if receipt_storage.COMPACT_STORAGE:
+        scan_kwargs.update(receipt_storage.hot_projection())
+    yield from metrics.timed_pages('dynamodb', 'scan', iter_scan_pages(get_table(), total_segments, **scan_kwargs))
 
 def query_receipts():
     """
-    Query DynamoDB to retrieve all receipts.
+    Query DynamoDB (or the receipt cache) to retrieve all receipts.
 
     Returns:
         list: A list of all receipts.
     """
     receipts = []
-    last_evaluated_key = None
+    for page in iter_receipt_pages():
+        receipts.extend(page)
+    return receipts
 
-    while True:
-        if last_evaluated_key:
-            response = table.scan(ExclusiveStartKey=last_evaluated_key)
-        else:
-            response = table.scan()
+def encode_cursor(last_evaluated_key):
+    """
+    Turn a DynamoDB LastEvaluatedKey into an opaque, URL-safe cursor token.
+    """
+    if not last_evaluated_key:
+        return None
+    payload = json.dumps(last_evaluated_key, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor token back into an ExclusiveStartKey.
+
+    Raises:
+        ValueError: If the cursor was not produced by encode_cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(key, dict) or set(key) != {'receipt_id'} or not isinstance(key['receipt_id'], str):
+        raise ValueError("Invalid cursor.")
+    return key
 
-        items = response.get('Items', [])
-        receipts.extend(items)
+def query_receipts_page(page_size=LIST_PAGE_SIZE, cursor=None):
+    """
+    Retrieve one page of receipts, from the receipt cache when it is fresh.
+
+    Args:
+        page_size (int): Maximum number of receipts to return.
+        cursor (str): Cursor returned with the previous page, None for the first page.
+
+    Returns:
+        tuple: (list of receipts, cursor for the next page or None on the last page).
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    exclusive_start_key = decode_cursor(cursor)
+    cache = get_receipt_cache()
+    if cache is not None:
+        # Cached pages are in receipt_id order; a cursor from a scanned page continues in that order too
+        cached = cache.page(page_size, exclusive_start_key)
+        if cached is not None:
+            receipts, last_key = cached
+            return receipts, encode_cursor(last_key)
+
+    scan_kwargs = {'Limit': page_size}
+    if exclusive_start_key:
+        scan_kwargs['ExclusiveStartKey'] = exclusive_start_key
+    if receipt_storage.COMPACT_STORAGE:
+        # The page shows a preview; the full text is fetched when a receipt is opened
+        scan_kwargs.update(receipt_storage.hot_projection())
+
+    with metrics.timed('dynamodb', 'scan'):
+        response = get_table().scan(**scan_kwargs)
+    return response.get('Items', []), encode_cursor(response.get('LastEvaluatedKey'))
+
+def query_stats(query=None, merchant=None, first=None, last=None, group='month'):
+    """
+    Answer a spend question from the ReceiptStats rollups (see receipt_stats).
+
+    A question like "starbucks september" or "how much have I spent this year" is read by
+    receipt_fields.plan_query, without the keyword extractor; a month without a year means the most recent
+    one, and "this"/"last" week, month or year are resolved against today. An explicit merchant or dates
+    override it.
+    Words that are neither a known merchant, a date nor a question word (STATS_QUESTION_WORDS) are
+    rejected rather than ignored, so a merchant missing from MERCHANTS doesn't widen the question to
+    every merchant.
 
-        # Check if there are more items to retrieve
-        last_evaluated_key = response.get('LastEvaluatedKey')
-        if not last_evaluated_key:
-            break
+    Args:
+        query (str): The question, or None.
+        merchant (str): Merchant name, or None for all merchants.
+        first (str): First YYYY-MM month or ISO date, or None.
+        last (str): Last YYYY-MM month or ISO date, or None.
+        group (str): Break the totals down by 'month', 'day' or 'merchant'.
+
+    Returns:
+        dict: 'merchant', 'ranges' ({'from', 'to'} dates) and the 'spend', 'receipts' and 'groups' of
+            receipt_stats.summarize.
+
+    Raises:
+        ValueError: For an invalid date, a word the question can't be read by, or a question the
+            rollups can't answer.
+    """
+    ranges = [(None, None)]
+    if query:
+        plan = receipt_fields.plan_query(re.findall(r"[a-z0-9]+", query.lower()), MERCHANTS)
+        unmatched = [keyword for keyword in plan.keywords if keyword not in STATS_QUESTION_WORDS]
+        if unmatched:
+            raise ValueError(f"Not a known merchant or date: {', '.join(unmatched)}.")
+        merchant = merchant or plan.merchant
+        if plan.date_ranges:
+            # plan_query looks a month without a year up in each of the last years, newest first
+            newest = plan.date_ranges[0][0][:4]
+            ranges = [date_range for date_range in plan.date_ranges
+                      if re.search(r"\b(19|20)\d{2}\b", query) or date_range[0][:4] == newest]
+    if first or last:
+        ranges = [(receipt_stats.date_bound(first), receipt_stats.date_bound(last, end=True))]
+    merchant = normalize_merchant(merchant) if merchant else None
+
+    summary = receipt_stats.summarize(get_stats_table(), ranges, merchant, group)
+    return dict(summary, merchant=merchant, ranges=[{'from': start, 'to': end} for start, end in ranges])
+
+def cache_metric_lines():
+    """
+    Report the URL cache, keyword cache, keyword extractor, dedup and receipt cache counters for /metrics.
+
+    Returns:
+        list: Lines in the Prometheus text exposition format.
+    """
+    url_stats = url_cache.stats()
+    keyword_stats = keyword_cache.stats()
+    extractor_stats = {name: extractor_metrics.snapshot() for name, extractor_metrics in keyword_pipeline.metrics.items()}
 
-    return receipts
\ No newline at end of file
+    lines = []
+    lines += metrics.render_samples('receipt_manager_url_cache_lookups_total', 'counter',
+                                    'Presigned URL cache lookups by result.',
+                                    [({'result': 'hit'}, url_stats['hits']), ({'result': 'miss'}, url_stats['misses'])])
+    lines += metrics.render_samples('receipt_manager_url_cache_entries', 'gauge',
+                                    'Presigned URLs held in the cache.', [({}, url_stats['size'])])
+    lines += metrics.render_samples('receipt_manager_keyword_cache_lookups_total', 'counter',
+                                    'OpenAI keyword cache lookups by result.',
+                                    [({'result': result}, keyword_stats[key]) for result, key in (
+                                        ('hit', 'hits'), ('persistent_hit', 'persistent_hits'),
+                                        ('miss', 'misses'), ('coalesced', 'coalesced'))])
+    lines += metrics.render_samples('receipt_manager_keyword_cache_entries', 'gauge',
+                                    'Queries held in the keyword cache.', [({}, keyword_stats['size'])])
+    lines += metrics.render_samples('receipt_manager_keyword_extractor_calls_total', 'counter',
+                                    'Keyword extractor calls by extractor and outcome.',
+                                    [({'extractor': name, 'confident': 'true'}, stats['confident'])
+                                     for name, stats in extractor_stats.items()] +
+                                    [({'extractor': name, 'confident': 'false'}, stats['calls'] - stats['confident'])
+                                     for name, stats in extractor_stats.items()])
+    lines += metrics.render_samples('receipt_manager_keyword_extractor_seconds_total', 'counter',
+                                    'Time spent in each keyword extractor.',
+                                    [({'extractor': name}, stats['seconds_total']) for name, stats in extractor_stats.items()])
+    lines += metrics.render_samples('receipt_manager_duplicate_uploads_total', 'counter',
+                                    'Duplicate uploads not stored or sent to Textract, by the hash that caught them.',
+                                    [({'hash': kind}, count) for kind, count in duplicate_uploads.items()])
+    cache = get_receipt_cache()
+    if cache is not None:
+        cache_stats = cache.stats()
+        lines += metrics.render_samples('receipt_manager_receipt_cache_reads_total', 'counter',
+                                        'Receipt cache reads by result (miss: warming, stale or incomplete).',
+                                        [({'result': 'hit'}, cache_stats['hits']), ({'result': 'miss'}, cache_stats['misses'])])
+        lines += metrics.render_samples('receipt_manager_receipt_cache_entries', 'gauge',
+                                        'Receipts held in the receipt cache.', [({}, cache_stats['size'])])
+        lines += metrics.render_samples('receipt_manager_receipt_cache_stream_records_total', 'counter',
+                                        'DynamoDB Stream records applied to the receipt cache.',
+                                        [({}, cache_stats['stream_records'])])
+    return lines
@@ -0,0 +1,381 @@
+"""
+Cosine top-k search over receipt embeddings.
+
+Vectors are unit length (see embeddings), so cosine similarity is a dot
+product and a whole corpus is scored with one matrix-vector product:
+
+- FlatIndex scores every vector: exact, and fast enough for tens of
+  thousands of receipts.
+- IVFIndex (inverted file) clusters the vectors with k-means and only
+  scores the clusters whose centroids are nearest to the query
+  (IVF_PROBES of them). Rows are stored sorted by cluster, so a probe reads
+  one contiguous slice. It is used once a corpus reaches IVF_MIN_VECTORS;
+  benchmarks/vector_index_bench.py reports its recall against FlatIndex.
+
+VectorIndex combines a base matrix, loaded read-only from a memory-mapped
+.npy file when VECTOR_INDEX_PATH is set (so gunicorn workers share it
+through the page cache), with an in-memory delta of receipts added since
+the base was built. VectorSearch keeps it in sync with the Receipts table
+like search_engine.SearchEngine: background build, then incremental
+refreshes from `ingested_at`; a build writes the base files for the next
+start.
+
+    python vector_index.py build --path /var/cache/receipts/vectors
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from embeddings import from_bytes, get_embedder
+from search_engine import TableIndex
+
+# Base files <path>.npy (float32 matrix) and <path>.json (ids, model, watermark); in memory only when unset
+VECTOR_INDEX_PATH = os.getenv('VECTOR_INDEX_PATH')
+# Corpus size from which IVFIndex replaces the exact FlatIndex, and the clusters it scores per query
+IVF_MIN_VECTORS = int(os.getenv('IVF_MIN_VECTORS', '50000'))
+IVF_PROBES = int(os.getenv('IVF_PROBES', '16'))
+# Results returned per query, and the lowest cosine similarity still considered a match
+VECTOR_TOP_K = int(os.getenv('VECTOR_TOP_K', '20'))
+VECTOR_MIN_SCORE = float(os.getenv('VECTOR_MIN_SCORE', '0.1'))
+
+
+def top_k(scores, k):
+    """
+    Indices of the k highest scores, best first.
+    """
+    if len(scores) > k:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class FlatIndex:
+    """
+    Exact search: every vector is scored.
+
+    Args:
+        matrix (numpy.ndarray): Unit-length float32 vectors, one per row.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def search(self, query, k):
+        """
+        Find the rows most similar to a query vector.
+
+        Returns:
+            tuple: (row numbers, cosine similarities), best first.
+        """
+        if not len(self.matrix):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.matrix @ query
+        rows = top_k(scores, k)
+        return rows, scores[rows]
+
+
+class IVFIndex:
+    """
+    Approximate search over k-means clusters of the vectors.
+
+    The matrix rows must already be ordered by cluster; use IVFIndex.train
+    to cluster a matrix and get that order.
+
+    Args:
+        matrix (numpy.ndarray): Unit-length float32 vectors, sorted by cluster.
+        centroids (numpy.ndarray): Unit-length cluster centroids.
+        offsets (numpy.ndarray): Cluster c holds rows offsets[c] to offsets[c + 1].
+        probes (int): Clusters scored per query.
+    """
+
+    def __init__(self, matrix, centroids, offsets, probes=IVF_PROBES):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.offsets = offsets
+        self.probes = probes
+
+    @staticmethod
+    def train(matrix, clusters=None, iterations=10, sample_size=50000, seed=0):
+        """
+        Cluster vectors with spherical k-means.
+
+        Args:
+            matrix (numpy.ndarray): Unit-length float32 vectors.
+            clusters (int): Number of clusters, about sqrt(rows) by default.
+            iterations (int): k-means iterations, on a sample of at most sample_size rows.
+            seed (int): Seed for the initial centroids and the sample.
+
+        Returns:
+            tuple: (order, centroids, offsets); matrix[order] is the matrix sorted by cluster.
+        """
+        rng = np.random.default_rng(seed)
+        sample = matrix[rng.choice(len(matrix), min(len(matrix), sample_size), replace=False)]
+        clusters = min(clusters or max(1, int(np.sqrt(len(matrix)))), len(sample))
+        centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Clusters that lost every member keep their old centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+
+        assignments = np.concatenate([
+            np.argmax(matrix[start:start + 65536] @ centroids.T, axis=1) for start in range(0, len(matrix), 65536)
+        ])
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=clusters))])
+        return order, centroids, offsets
+
+    def search(self, query, k):
+        """
+        Find the rows most similar to a query vector among the nearest clusters.
+
+        Returns:
+            tuple: (row numbers, cosine similarities), best first.
+        """
+        probed = top_k(self.centroids @ query, self.probes)
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probed])
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        scores = self.matrix[rows] @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+
+def save(path, ids, matrix, meta):
+    """
+    Write a base matrix and its metadata; readers never see a half-written file.
+
+    Args:
+        path (str): Path prefix of the .npy and .json files.
+        ids (list): Receipt ID of each row.
+        matrix (numpy.ndarray): float32 vectors.
+        meta (dict): More metadata (model, watermark, IVF layout).
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary + '.npy', 'wb') as f:
+        np.save(f, matrix)
+    with open(temporary + '.json', 'w') as f:
+        json.dump(dict(meta, ids=list(ids)), f)
+    os.replace(temporary + '.npy', path + '.npy')
+    os.replace(temporary + '.json', path + '.json')
+
+
+def load(path):
+    """
+    Open a base matrix memory-mapped read-only.
+
+    Returns:
+        tuple: (matrix, metadata with 'ids'), or None if there is no base at path.
+    """
+    if not (os.path.exists(path + '.npy') and os.path.exists(path + '.json')):
+        return None
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    matrix = np.load(path + '.npy', mmap_mode='r')
+    if len(matrix) != len(meta['ids']):
+        return None
+    return matrix, meta
+
+
+class VectorIndex:
+    """
+    A base index (flat or IVF) plus an in-memory delta of later receipts.
+
+    Args:
+        ids (list): Receipt ID of each base row.
+        base: FlatIndex or IVFIndex over the base matrix.
+        dimensions (int): Vector size.
+    """
+
+    def __init__(self, ids, base, dimensions):
+        self.ids = list(ids)
+        self.base = base
+        self.dimensions = dimensions
+        self._base_rows = {receipt_id: row for row, receipt_id in enumerate(self.ids)}
+        # Base rows replaced by a delta vector
+        self._superseded = np.zeros(len(self.ids), dtype=bool)
+        self._delta_ids = []
+        self._delta_rows = {}
+        self._delta = np.empty((0, dimensions), dtype=np.float32)
+        self._delta_size = 0
+
+    def __len__(self):
+        return len(self.ids) + self._delta_size - int(self._superseded.sum())
+
+    def add(self, receipt_id, vector):
+        """
+        Add or replace a receipt's vector.
+        """
+        row = self._base_rows.get(receipt_id)
+        if row is not None:
+            self._superseded[row] = True
+        row = self._delta_rows.get(receipt_id)
+        if row is None:
+            if self._delta_size == len(self._delta):
+                grown = np.empty((max(64, 2 * len(self._delta)), self.dimensions), dtype=np.float32)
+                grown[:self._delta_size] = self._delta[:self._delta_size]
+                self._delta = grown
+            row = self._delta_rows[receipt_id] = self._delta_size
+            self._delta_ids.append(receipt_id)
+            self._delta_size += 1
+        self._delta[row] = vector
+
+    def search(self, query, k):
+        """
+        Find the receipts most similar to a query vector.
+
+        Returns:
+            list: (receipt ID, cosine similarity) pairs, best first.
+        """
+        # Ask the base for extra rows in case some of them were superseded
+        rows, scores = self.base.search(query, k + int(self._superseded.sum()))
+        keep = ~self._superseded[rows]
+        candidates = [(self.ids[row], float(score)) for row, score in zip(rows[keep], scores[keep])]
+
+        if self._delta_size:
+            delta_scores = self._delta[:self._delta_size] @ query
+            candidates += [(self._delta_ids[row], float(delta_scores[row]))
+                           for row in top_k(delta_scores, k)]
+        candidates.sort(key=lambda candidate: -candidate[1])
+        return candidates[:k]
+
+
+def build_base(ids, vectors, ivf_min_vectors=IVF_MIN_VECTORS):
+    """
+    Build the base index for a corpus: flat, or IVF from ivf_min_vectors on.
+
+    Args:
+        ids (list): Receipt IDs.
+        vectors (numpy.ndarray): Their float32 vectors.
+
+    Returns:
+        tuple: (ids and vectors reordered for the index, index, IVF metadata for save()).
+    """
+    if len(vectors) < ivf_min_vectors:
+        return ids, vectors, FlatIndex(vectors), {}
+    order, centroids, offsets = IVFIndex.train(vectors)
+    ids = [ids[row] for row in order]
+    vectors = vectors[order]
+    return ids, vectors, IVFIndex(vectors, centroids, offsets), {
+        'centroids': centroids.tolist(), 'offsets': offsets.tolist()
+    }
+
+
+class VectorSearch(TableIndex):
+    """
+    A VectorIndex of the receipt embeddings in the Receipts table.
+
+    Args:
+        get_table (callable): Returns the Receipts Table.
+        embedder: Embeds queries; only receipts embedded by the same model are indexed.
+        path (str): Base file prefix, VECTOR_INDEX_PATH by default (None keeps everything in memory).
+        **kwargs: Refresh settings, see search_engine.TableIndex.
+    """
+
+    name = 'vector-index'
+
+    def __init__(self, get_table, embedder=None, path=VECTOR_INDEX_PATH, **kwargs):
+        kwargs.setdefault('scan_kwargs', {
+            'ProjectionExpression': 'receipt_id, embedding, embedding_model, ingested_at'
+        })
+        super().__init__(get_table, **kwargs)
+        self.embedder = embedder or get_embedder()
+        self.path = path
+
+    def new_index(self):
+        return {'ids': [], 'vectors': []}
+
+    def add_item(self, index, item):
+        if item.get('embedding_model') != self.embedder.name or not item.get('embedding'):
+            return
+        vector = np.frombuffer(from_bytes(item['embedding']), dtype=np.float32)
+        if isinstance(index, VectorIndex):
+            index.add(item['receipt_id'], vector)
+        else:
+            index['ids'].append(item['receipt_id'])
+            index['vectors'].append(vector)
+
+    def finish_build(self, index, watermark):
+        if index['vectors']:
+            vectors = np.vstack(index['vectors'])
+        else:
+            vectors = np.empty((0, len(self.embedder.embed([''])[0])), dtype=np.float32)
+        ids, vectors, base, layout = build_base(index['ids'], vectors)
+        if self.path:
+            save(self.path, ids, vectors, dict(layout, model=self.embedder.name, built_at=time.time(),
+                                               watermark=watermark))
+        return VectorIndex(ids, base, vectors.shape[1])
+
+    def build(self):
+        """
+        Load the base files if they match the embedder, else build from a full scan.
+        """
+        if self.index is None and self.path and self._load():
+            return
+        super().build()
+
+    def _load(self):
+        loaded = load(self.path)
+        if loaded is None:
+            return False
+        matrix, meta = loaded
+        if meta.get('model') != self.embedder.name or time.time() - meta.get('built_at', 0) >= self.rebuild_interval:
+            return False
+        if 'centroids' in meta:
+            base = IVFIndex(matrix, np.asarray(meta['centroids'], dtype=np.float32), np.asarray(meta['offsets']))
+        else:
+            base = FlatIndex(matrix)
+        with self._lock:
+            self.index = VectorIndex(meta['ids'], base, matrix.shape[1])
+            self._watermark = meta.get('watermark', 0)
+            # Loaded bases are due for a refresh right away, and a rebuild when the file gets old
+            self.built_at = meta.get('built_at', time.time())
+            self.refreshed_at = None
+        return True
+
+    def search(self, text, k=VECTOR_TOP_K, min_score=VECTOR_MIN_SCORE):
+        """
+        Find the receipts whose embeddings are closest to a query's.
+
+        Args:
+            text (str): The query text.
+            k (int): Number of results to return.
+            min_score (float): Lowest cosine similarity returned.
+
+        Returns:
+            list: (receipt ID, cosine similarity) pairs, best first, or None while the first build is running.
+        """
+        self.maybe_update()
+        if self.index is None:
+            return None
+        query = np.frombuffer(self.embedder.embed([text])[0], dtype=np.float32)
+        with self._lock:
+            results = self.index.search(query, k)
+        return [(receipt_id, score) for receipt_id, score in results if score >= min_score]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the receipt vector index files.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Scan the Receipts table and write the base files.")
+    build_parser.add_argument('--path', default=VECTOR_INDEX_PATH, required=VECTOR_INDEX_PATH is None)
+    build_parser.add_argument('--table', default='Receipts')
+    build_parser.add_argument('--region', default=os.getenv('AWS_DEFAULT_REGION'))
+    args = parser.parse_args(argv)
+
+    import boto3
+    table = boto3.resource('dynamodb', region_name=args.region).Table(args.table)
+    search = VectorSearch(lambda: table, path=args.path)
+    search.build()
+    print(f"Indexed {len(search.index)} receipt embeddings into {args.path}.npy")
+
+
+if __name__ == "__main__":
+    main()